@@ -0,0 +1,90 @@
+import sys
+import threading
+from collections.abc import Iterator
+from types import TracebackType
+from typing import Any
+
+import pytest
+import structlog
+
+from benchmarks.results import (
+    BenchmarkMetrics,
+    find_regressions,
+    load_baseline,
+    record,
+    save_baseline,
+)
+from pnpq.events import Event
+from tests.logs import setup_log
+
+setup_log("benchmarks")
+log = structlog.get_logger()
+
+
+def excepthook(
+    exception_type: type[BaseException],
+    e: BaseException,
+    traceback: TracebackType | None,
+) -> Any:
+    log.error(event=Event.UNCAUGHT_EXCEPTION, exc_info=e)
+    return sys.__excepthook__(exception_type, e, traceback)
+
+
+sys.excepthook = excepthook
+
+
+original_threading_excepthook = threading.excepthook
+
+
+def threading_excepthook(args: Any) -> Any:
+    log.error(event=Event.UNCAUGHT_EXCEPTION, exc_info=args.exc_value)
+    return original_threading_excepthook(args)
+
+
+threading.excepthook = threading_excepthook
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    group = parser.getgroup("benchmarks")
+    group.addoption(
+        "--benchmark-threshold",
+        type=float,
+        default=0.5,
+        help="Fail a benchmark if a metric is worse than its baseline by more than this fraction (default: 0.5)",
+    )
+    group.addoption(
+        "--benchmark-save-baseline",
+        action="store_true",
+        help="Replace the saved baselines with the results of this run",
+    )
+
+
+@pytest.fixture
+def benchmark_metrics(request: pytest.FixtureRequest) -> Iterator[BenchmarkMetrics]:
+    """Collects the metrics of one benchmark. After the benchmark
+    finishes, the metrics are appended to its history and compared
+    with its baseline, which is created by the first run."""
+    module_name = request.node.module.__name__.rpartition(".")[2]
+    benchmark = f"{module_name}.{request.node.name}"
+    metrics = BenchmarkMetrics(benchmark=benchmark)
+    yield metrics
+    if not metrics.metrics:
+        return
+    record(
+        benchmark,
+        {name: metric.value for name, metric in metrics.metrics.items()},
+    )
+    baseline = load_baseline(benchmark)
+    if baseline is None or request.config.getoption("--benchmark-save-baseline"):
+        save_baseline(benchmark, metrics.metrics)
+        return
+    regressions = find_regressions(
+        baseline,
+        metrics.metrics,
+        request.config.getoption("--benchmark-threshold"),
+    )
+    if regressions:
+        pytest.fail(
+            f"Performance regression in {benchmark} against the baseline from revision {baseline['revision']}:\n"
+            + "\n".join(regressions)
+        )
@@ -0,0 +1,131 @@
+import dataclasses
+import json
+import platform
+import statistics
+import subprocess
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from tests.logs import find_project_dir
+
+
+def results_dir() -> Path:
+    path = find_project_dir(Path(__file__).resolve()).joinpath("target", "benchmarks")
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def git_revision() -> str | None:
+    try:
+        completed = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            cwd=Path(__file__).parent,
+            text=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return completed.stdout.strip()
+
+
+def record(benchmark: str, measurements: dict[str, Any]) -> Path:
+    """Append one run of ``benchmark`` to its history file.
+
+    Each line of ``target/benchmarks/<benchmark>.jsonl`` is one run,
+    so results can be compared across revisions and Python versions.
+    """
+    path = results_dir().joinpath(f"{benchmark}.jsonl")
+    entry = {
+        "timestamp": time.time(),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "measurements": measurements,
+    }
+    with path.open("a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, sort_keys=True) + "\n")
+    return path
+
+
+@dataclass(frozen=True, kw_only=True)
+class Metric:
+    value: float
+    unit: str
+    higher_is_better: bool = False
+
+    def regressed(self, baseline: float, threshold: float) -> bool:
+        """Whether this value is worse than ``baseline`` by more than
+        the fraction ``threshold``."""
+        if self.higher_is_better:
+            return self.value < baseline * (1 - threshold)
+        return self.value > baseline * (1 + threshold)
+
+
+@dataclass(frozen=True, kw_only=True)
+class BenchmarkMetrics:
+    benchmark: str
+    metrics: dict[str, Metric] = field(default_factory=dict)
+
+    def add(
+        self, name: str, value: float, unit: str, higher_is_better: bool = False
+    ) -> None:
+        self.metrics[name] = Metric(
+            value=value, unit=unit, higher_is_better=higher_is_better
+        )
+
+
+def baseline_path(benchmark: str) -> Path:
+    path = results_dir().joinpath("baselines")
+    path.mkdir(exist_ok=True)
+    return path.joinpath(f"{benchmark}.json")
+
+
+def load_baseline(benchmark: str) -> None | dict[str, Any]:
+    path = baseline_path(benchmark)
+    if not path.exists():
+        return None
+    with path.open(encoding="utf-8") as f:
+        baseline: dict[str, Any] = json.load(f)
+    return baseline
+
+
+def save_baseline(benchmark: str, metrics: dict[str, Metric]) -> Path:
+    path = baseline_path(benchmark)
+    baseline = {
+        "timestamp": time.time(),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "metrics": {
+            name: dataclasses.asdict(metric) for name, metric in metrics.items()
+        },
+    }
+    with path.open("w", encoding="utf-8") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write("\n")
+    return path
+
+
+def find_regressions(
+    baseline: dict[str, Any], metrics: dict[str, Metric], threshold: float
+) -> list[str]:
+    """Describe every metric that is worse than in ``baseline`` by
+    more than the fraction ``threshold``. Metrics missing from the
+    baseline are not compared."""
+    regressions = []
+    for name, metric in metrics.items():
+        baseline_metric = baseline["metrics"].get(name)
+        if baseline_metric is None:
+            continue
+        if metric.regressed(baseline_metric["value"], threshold):
+            regressions.append(
+                f"{name}: {metric.value:.6g} {metric.unit}, baseline {baseline_metric['value']:.6g} {metric.unit}"
+            )
+    return regressions
+
+
+def percentile(samples: list[float], percent: int) -> float:
+    """The ``percent``-th percentile of ``samples``, interpolated
+    between the nearest samples."""
+    return statistics.quantiles(samples, n=100, method="inclusive")[percent - 1]
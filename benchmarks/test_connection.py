@@ -0,0 +1,116 @@
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+
+import pytest
+
+from benchmarks.results import BenchmarkMetrics, percentile
+from pnpq.apt.connection import AptConnection
+from pnpq.apt.protocol import (
+    Address,
+    AptMessage_MGMSG_MOT_GET_USTATUSUPDATE,
+    AptMessage_MGMSG_MOT_REQ_USTATUSUPDATE,
+    ChanIdent,
+    UStatus,
+)
+from pnpq.apt.simulator import SimulatedMPC320
+from pnpq.transport import (
+    PtyTransport,
+    SerialTransport,
+    Transport,
+    loopback_transport_pair,
+)
+from pnpq.units import pnpq_ureg
+
+ROUND_TRIPS = 500
+STATUS_FRAMES = 20000
+
+
+@pytest.fixture(name="transports", params=["loopback", "pty"])
+def transports_fixture(
+    request: pytest.FixtureRequest,
+) -> tuple[Callable[[], Transport], Transport]:
+    """The device side transport, and a function that creates the host
+    side once the device side is open."""
+    if request.param == "loopback":
+        host, device = loopback_transport_pair()
+        return lambda: host, device
+    pty = PtyTransport()
+    return lambda: SerialTransport(port=pty.peer_path, startup_delay=0), pty
+
+
+@contextmanager
+def open_connection(host: Callable[[], Transport]) -> Iterator[AptConnection]:
+    connection = AptConnection(transport=host())
+    connection.open()
+    try:
+        yield connection
+    finally:
+        connection.close()
+
+
+def test_round_trip_latency(
+    benchmark_metrics: BenchmarkMetrics,
+    transports: tuple[Callable[[], Transport], Transport],
+) -> None:
+    host, device = transports
+    simulator = SimulatedMPC320(transport=device)
+    simulator.open()
+    samples = []
+    try:
+        with open_connection(host) as connection:
+            for _ in range(ROUND_TRIPS):
+                start = time.perf_counter()
+                connection.send_message_expect_reply(
+                    AptMessage_MGMSG_MOT_REQ_USTATUSUPDATE(
+                        chan_ident=ChanIdent.CHANNEL_1,
+                        destination=Address.GENERIC_USB,
+                        source=Address.HOST_CONTROLLER,
+                    ),
+                    lambda message: isinstance(
+                        message, AptMessage_MGMSG_MOT_GET_USTATUSUPDATE
+                    ),
+                )
+                samples.append((time.perf_counter() - start) * 1e6)
+    finally:
+        simulator.close()
+    benchmark_metrics.add("p50", percentile(samples, 50), "us")
+    benchmark_metrics.add("p99", percentile(samples, 99), "us")
+
+
+def test_status_throughput(
+    benchmark_metrics: BenchmarkMetrics,
+    transports: tuple[Callable[[], Transport], Transport],
+) -> None:
+    host, device = transports
+    device.open()
+    frame = AptMessage_MGMSG_MOT_GET_USTATUSUPDATE(
+        chan_ident=ChanIdent.CHANNEL_1,
+        position=100,
+        velocity=0,
+        motor_current=0 * pnpq_ureg.milliamp,
+        status=UStatus(CONNECTED=True, ENABLED=True),
+        destination=Address.HOST_CONTROLLER,
+        source=Address.GENERIC_USB,
+    ).to_bytes()
+    chunk = frame * 100
+
+    def write_frames() -> None:
+        for _ in range(STATUS_FRAMES // 100):
+            device.write(chunk)
+
+    try:
+        with open_connection(host) as connection, connection.rx_subscribe() as queue:
+            writer = threading.Thread(target=write_frames)
+            start = time.perf_counter()
+            writer.start()
+            for _ in range(STATUS_FRAMES):
+                queue.get(timeout=10)
+            elapsed = time.perf_counter() - start
+            writer.join()
+    finally:
+        device.close()
+    benchmark_metrics.add(
+        "status_frames", STATUS_FRAMES / elapsed, "frames/s", higher_is_better=True
+    )
@@ -0,0 +1,102 @@
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+
+import pytest
+
+from benchmarks.results import BenchmarkMetrics, percentile
+from pnpq.apt.connection import AptConnection
+from pnpq.apt.protocol import ChanIdent
+from pnpq.apt.simulator import SimulatedAptDevice, SimulatedK10CR1, SimulatedMPC320
+from pnpq.devices.polarization_controller_thorlabs_mpc import (
+    PolarizationControllerThorlabsMPC320,
+)
+from pnpq.devices.refactored_waveplate_thorlabs_k10cr1 import WaveplateThorlabsK10CR1
+from pnpq.transport import loopback_transport_pair
+from pnpq.units import pnpq_ureg
+
+MOVES = 10
+STATUS_REQUESTS = 200
+
+# Make simulated motion so fast that the benchmarks measure the
+# library rather than the motors
+SPEEDUP = 1000
+
+
+@contextmanager
+def simulated_connection(
+    simulator_class: type[SimulatedAptDevice],
+) -> Iterator[AptConnection]:
+    host, device = loopback_transport_pair()
+    simulator = simulator_class(transport=device, speedup=SPEEDUP)
+    simulator.open()
+    try:
+        connection = AptConnection(transport=host)
+        connection.open()
+        try:
+            yield connection
+        finally:
+            connection.close()
+    finally:
+        simulator.close()
+
+
+@pytest.fixture(name="mpc320")
+def mpc320_fixture() -> Iterator[PolarizationControllerThorlabsMPC320]:
+    with simulated_connection(SimulatedMPC320) as connection:
+        yield PolarizationControllerThorlabsMPC320(connection=connection)
+
+
+@pytest.fixture(name="k10cr1")
+def k10cr1_fixture() -> Iterator[WaveplateThorlabsK10CR1]:
+    with simulated_connection(SimulatedK10CR1) as connection:
+        yield WaveplateThorlabsK10CR1(connection=connection)
+
+
+def latencies_ms(operation: Callable[[int], object], count: int) -> list[float]:
+    samples = []
+    for i in range(count):
+        start = time.perf_counter()
+        operation(i)
+        samples.append((time.perf_counter() - start) * 1e3)
+    return samples
+
+
+def add_latencies(
+    benchmark_metrics: BenchmarkMetrics, name: str, samples: list[float]
+) -> None:
+    benchmark_metrics.add(f"{name}.p50", percentile(samples, 50), "ms")
+    benchmark_metrics.add(f"{name}.p99", percentile(samples, 99), "ms")
+
+
+def test_mpc320(
+    benchmark_metrics: BenchmarkMetrics, mpc320: PolarizationControllerThorlabsMPC320
+) -> None:
+    add_latencies(
+        benchmark_metrics,
+        "move_absolute",
+        latencies_ms(
+            lambda i: mpc320.move_absolute(
+                ChanIdent.CHANNEL_1, (i % 2) * 100 * pnpq_ureg.degree
+            ),
+            MOVES,
+        ),
+    )
+    add_latencies(
+        benchmark_metrics,
+        "get_status",
+        latencies_ms(lambda _: mpc320.get_status(ChanIdent.CHANNEL_1), STATUS_REQUESTS),
+    )
+
+
+def test_k10cr1(
+    benchmark_metrics: BenchmarkMetrics, k10cr1: WaveplateThorlabsK10CR1
+) -> None:
+    add_latencies(
+        benchmark_metrics,
+        "move_absolute",
+        latencies_ms(
+            lambda i: k10cr1.move_absolute((i % 2) * 100 * pnpq_ureg.degree),
+            MOVES,
+        ),
+    )
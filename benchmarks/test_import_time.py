@@ -0,0 +1,50 @@
+import pkgutil
+import re
+import statistics
+import subprocess
+import sys
+
+import pnpq.devices
+from benchmarks.results import BenchmarkMetrics
+
+RUNS = 7
+
+MODULES = [
+    "pnpq",
+    "pnpq.apt.connection",
+    *(
+        f"pnpq.devices.{module.name}"
+        for module in pkgutil.iter_modules(pnpq.devices.__path__)
+    ),
+]
+
+# "import time:       123 |       4567 | pnpq.units"
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def import_time_us(module: str) -> int:
+    """Total microseconds spent importing ``module`` in a fresh interpreter.
+
+    This is the sum of the cumulative times of the top-level imports
+    reported by ``python -X importtime``, which includes interpreter
+    startup modules such as ``encodings`` and ``site``. That overhead
+    is the same for every module, so the numbers remain comparable.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    total = 0
+    for line in completed.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match is not None and match.group(3) == " ":
+            total += int(match.group(2))
+    return total
+
+
+def test_import_time(benchmark_metrics: BenchmarkMetrics) -> None:
+    for module in MODULES:
+        samples = [import_time_us(module) for _ in range(RUNS)]
+        benchmark_metrics.add(f"{module}.median", statistics.median(samples), "us")
@@ -0,0 +1,82 @@
+import time
+from collections.abc import Iterator
+
+import pytest
+
+from benchmarks.results import BenchmarkMetrics, percentile
+from pnpq.devices.odl_ozoptics_650ml import OdlOzOptics
+from pnpq.ozoptics.simulator import SimulatedOdlOzOptics
+from pnpq.transport import PtyTransport, SerialTransport
+
+QUERIES = 500
+SCAN_POINTS = 100
+# Distance between the points of a delay scan, in millimeters
+SCAN_STEP = 0.01
+
+# Make simulated motion so fast that the benchmarks measure the
+# library and the serial line rather than the motor
+SPEEDUP = 1000
+
+
+def simulated_odl(baudrate: None | int) -> Iterator[OdlOzOptics]:
+    pty = PtyTransport()
+    simulator = SimulatedOdlOzOptics(transport=pty, speedup=SPEEDUP, baudrate=baudrate)
+    simulator.open()
+    odl = OdlOzOptics(
+        transport=SerialTransport(
+            port=pty.peer_path, baudrate=9600, rtscts=False, startup_delay=0
+        )
+    )
+    odl.home()
+    yield odl
+    odl.serial_close()
+    simulator.close()
+
+
+@pytest.fixture(name="odl")
+def odl_fixture() -> Iterator[OdlOzOptics]:
+    # Without pacing, latency is the time spent in the library
+    yield from simulated_odl(None)
+
+
+@pytest.fixture(name="paced_odl")
+def paced_odl_fixture() -> Iterator[OdlOzOptics]:
+    yield from simulated_odl(9600)
+
+
+def test_command_latency(benchmark_metrics: BenchmarkMetrics, odl: OdlOzOptics) -> None:
+    samples = []
+    for _ in range(QUERIES):
+        start = time.perf_counter()
+        odl.get_step()
+        samples.append((time.perf_counter() - start) * 1e6)
+    benchmark_metrics.add("get_step.p50", percentile(samples, 50), "us")
+    benchmark_metrics.add("get_step.p99", percentile(samples, 99), "us")
+
+
+def test_delay_scan(
+    benchmark_metrics: BenchmarkMetrics, paced_odl: OdlOzOptics
+) -> None:
+    """Step through a delay scan, reading back the position at each
+    point, over a 9600 baud line."""
+    start = time.perf_counter()
+    for i in range(SCAN_POINTS):
+        paced_odl.move(i * SCAN_STEP)
+        paced_odl.get_step()
+    sequential = SCAN_POINTS / (time.perf_counter() - start)
+
+    # The position query is sent while the move is still in progress,
+    # and the ODL answers it as soon as the move is done
+    start = time.perf_counter()
+    for i in range(SCAN_POINTS):
+        move = paced_odl.move_async(i * SCAN_STEP)
+        paced_odl.get_step()
+        move.result()
+    pipelined = SCAN_POINTS / (time.perf_counter() - start)
+
+    benchmark_metrics.add(
+        "sequential.points_per_second", sequential, "1/s", higher_is_better=True
+    )
+    benchmark_metrics.add(
+        "pipelined.points_per_second", pipelined, "1/s", higher_is_better=True
+    )
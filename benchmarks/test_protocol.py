@@ -0,0 +1,81 @@
+import struct
+import timeit
+from collections.abc import Callable
+
+import pytest
+
+from benchmarks.results import BenchmarkMetrics
+from pnpq.apt.protocol import (
+    Address,
+    AptMessage,
+    AptMessage_MGMSG_MOT_SET_EEPROMPARAMS,
+    AptMessageId,
+    AptMessageWithData,
+)
+
+
+def concrete_message_classes() -> list[type[AptMessage]]:
+    classes = []
+    pending = AptMessage.__subclasses__()
+    while pending:
+        cls = pending.pop()
+        pending.extend(cls.__subclasses__())
+        if "message_id" in cls.__dict__ and cls not in classes:
+            classes.append(cls)
+    return sorted(classes, key=lambda cls: cls.__name__)
+
+
+def sample_frame(cls: type[AptMessage]) -> bytes:
+    """A valid frame for ``cls``, with every field set to 1."""
+    if not issubclass(cls, AptMessageWithData):
+        return struct.pack(
+            "<HBBBB", cls.message_id, 1, 1, Address.GENERIC_USB, Address.HOST_CONTROLLER
+        )
+    header = struct.pack(
+        "<HHBB",
+        cls.message_id,
+        cls.data_length,
+        Address.GENERIC_USB | 0x80,
+        Address.HOST_CONTROLLER,
+    )
+    if cls is AptMessage_MGMSG_MOT_SET_EEPROMPARAMS:
+        return header + struct.pack("<HH", 1, AptMessageId.MGMSG_POL_SET_PARAMS)
+    data = b"".join(
+        (1).to_bytes(struct.calcsize(f"<{field.format}"), "little")
+        for field in cls.layout
+    )
+    return header + data
+
+
+def operations_per_second(operation: Callable[[], object]) -> float:
+    """Best of several short runs, each long enough to make timer
+    resolution irrelevant."""
+    timer = timeit.Timer(operation)
+    number = 1
+    while timer.timeit(number) < 0.05:
+        number *= 2
+    return number / min(timer.repeat(repeat=7, number=number))
+
+
+@pytest.mark.parametrize(
+    "message_class", concrete_message_classes(), ids=lambda cls: cls.__name__
+)
+def test_codec_throughput(
+    benchmark_metrics: BenchmarkMetrics, message_class: type[AptMessage]
+) -> None:
+    raw = sample_frame(message_class)
+    message = message_class.from_bytes(raw)
+    assert message.to_bytes() == raw
+
+    benchmark_metrics.add(
+        "decode",
+        operations_per_second(lambda: message_class.from_bytes(raw)),
+        "messages/s",
+        higher_is_better=True,
+    )
+    benchmark_metrics.add(
+        "encode",
+        operations_per_second(message.to_bytes),
+        "messages/s",
+        higher_is_better=True,
+    )
@@ -44,13 +44,13 @@ stdmsg "Checking Python type hints with mypy..."
 mypy
 
 stdmsg "Running pylint..."
-pylint src/ tests/ hardware_tests/
+pylint src/ tests/ hardware_tests/ benchmarks/
 
 stdmsg "Checking import formatting with isort..."
 isort . --check --diff
 
 stdmsg "Checking Python code formatting with black..."
-black --check --diff src tests hardware_tests
+black --check --diff src tests hardware_tests benchmarks
 
 # Run shellcheck
 # Recursively loop through all files and find all files with .sh extension and run shellcheck
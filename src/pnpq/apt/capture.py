@@ -0,0 +1,348 @@
+"""Recording and replaying the raw traffic of APT connections.
+
+A capture file starts with ``CAPTURE_MAGIC`` and is followed by one
+record per frame, in the order the frames were sent or received::
+
+    timestamp_ns  u64  time.monotonic_ns() when the frame was sent or received
+    connection    u16  ID of the connection, from CaptureWriter.add_connection
+    direction     u8   Direction.TX or Direction.RX
+    length        u32  number of bytes in the frame
+    frame              the frame, exactly as written to or read from the transport
+
+All integers are little-endian. Records are only ever appended, so a
+capture cut short by a crash can still be read up to its last
+complete record.
+
+Pass a ``CaptureWriter`` to ``AptConnection`` to record its traffic,
+and pass a ``ReplayTransport`` instead of a real transport to play a
+capture back to a new connection.
+"""
+
+import enum
+import itertools
+import math
+import struct
+import threading
+import time
+from collections import deque
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from pathlib import Path
+from queue import SimpleQueue
+from typing import BinaryIO
+
+import structlog
+
+from ..errors import TransportClosedError
+from ..events import Event
+from ..transport import Transport
+from .protocol import AptMessageId
+
+CAPTURE_MAGIC = b"PNPQCAP\x01"
+
+RECORD_HEADER = struct.Struct("<QHBI")
+
+# Messages that the host sends on timers, so how many of them it sends,
+# and where they fall among its other frames, depends on timing
+UNORDERED_MESSAGE_IDS: frozenset[int] = frozenset(
+    {
+        AptMessageId.MGMSG_MOT_ACK_USTATUSUPDATE,
+        AptMessageId.MGMSG_MOT_REQ_USTATUSUPDATE,
+    }
+)
+
+
+def frame_message_id(frame: bytes) -> int:
+    return int.from_bytes(frame[:2], "little")
+
+
+class Direction(enum.IntEnum):
+    TX = 0  # Sent by the host
+    RX = 1  # Received by the host
+
+
+@dataclass(frozen=True, kw_only=True)
+class CaptureRecord:
+    timestamp_ns: int
+    connection_id: int
+    direction: Direction
+    frame: bytes
+
+
+@dataclass(frozen=True, kw_only=True)
+class CaptureWriter:
+    """Appends frames to a capture file from a background thread.
+
+    ``record`` only timestamps the frame and puts it on a queue, so it
+    is safe to call from a connection's dispatcher thread without
+    slowing it down.
+    """
+
+    path: Path | str
+
+    file: BinaryIO = field(init=False)
+    queue: SimpleQueue[None | tuple[int, int, Direction, bytes]] = field(
+        default_factory=SimpleQueue
+    )
+    writer_thread: threading.Thread = field(init=False)
+
+    connection_ids: Iterator[int] = field(default_factory=lambda: itertools.count(1))
+    connection_ids_lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def open(self) -> None:
+        # The file stays open until close()
+        file = open(self.path, "wb")  # noqa: SIM115  # pylint: disable=R1732
+        object.__setattr__(self, "file", file)
+        self.file.write(CAPTURE_MAGIC)
+        object.__setattr__(
+            self,
+            "writer_thread",
+            threading.Thread(target=self.write_records, daemon=True),
+        )
+        self.writer_thread.start()
+
+    def close(self) -> None:
+        """Write every frame recorded so far and close the file."""
+        self.queue.put(None)
+        self.writer_thread.join()
+        self.file.close()
+
+    def add_connection(self) -> int:
+        """Allocate an ID that distinguishes one connection's frames
+        from those of other connections sharing this capture."""
+        with self.connection_ids_lock:
+            return next(self.connection_ids)
+
+    def record(self, connection_id: int, direction: Direction, frame: bytes) -> None:
+        self.queue.put((time.monotonic_ns(), connection_id, direction, frame))
+
+    def write_records(self) -> None:
+        while True:
+            item = self.queue.get()
+            # Write everything that has queued up before flushing, so
+            # that bursts of frames cost a single flush.
+            while item is not None:
+                timestamp_ns, connection_id, direction, frame = item
+                self.file.write(
+                    RECORD_HEADER.pack(
+                        timestamp_ns, connection_id, direction, len(frame)
+                    )
+                )
+                self.file.write(frame)
+                if self.queue.empty():
+                    break
+                item = self.queue.get()
+            self.file.flush()
+            if item is None:
+                return
+
+
+def read_capture(path: Path | str) -> Iterator[CaptureRecord]:
+    """Read the records of a capture file, stopping at the last
+    complete record."""
+    with open(path, "rb") as f:
+        if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError(f"{path} is not a pnpq capture file.")
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            timestamp_ns, connection_id, direction, length = RECORD_HEADER.unpack(
+                header
+            )
+            frame = f.read(length)
+            if len(frame) < length:
+                return
+            yield CaptureRecord(
+                timestamp_ns=timestamp_ns,
+                connection_id=connection_id,
+                direction=Direction(direction),
+                frame=frame,
+            )
+
+
+@dataclass(frozen=True, kw_only=True)
+class ReplayTransport(Transport):
+    """Plays back the received frames of one connection in a capture.
+
+    Received frames are delivered with the same spacing as when they
+    were recorded, divided by ``speedup``; an infinite ``speedup``
+    delivers them as fast as they can be read. If ``match_tx`` is set,
+    playback also waits at each captured sent frame until the host
+    writes it, so replies never arrive before the requests they
+    answer, however slow or fast the host is.
+
+    Written frames are matched to captured ones by content, and every
+    difference is logged as ``Event.REPLAY_TX_MISMATCH``: a status
+    poll or keepalive that does not match is an extra one, which is
+    skipped while playback keeps waiting. A frame found among the next
+    ``tx_lookahead`` captured frames instead means that the host did
+    not send the ones before it, and playback moves on to it. Any
+    other frame takes the place of the captured one. Frames written
+    once every captured frame has been matched are dropped.
+
+    ``finished`` is set once every frame has been played back.
+    """
+
+    path: Path | str
+    # Which connection to play back; by default, the first in the capture
+    connection_id: None | int = None
+    speedup: float = 1
+    match_tx: bool = True
+    tx_lookahead: int = 8
+
+    records: list[CaptureRecord] = field(init=False)
+    buffer: bytearray = field(default_factory=bytearray)
+    written: deque[bytes] = field(default_factory=deque)
+    # Captured sent frames that are left to match
+    tx_remaining: int = field(init=False)
+    condition: threading.Condition = field(default_factory=threading.Condition)
+    closed: threading.Event = field(default_factory=threading.Event)
+    finished: threading.Event = field(default_factory=threading.Event)
+    replay_thread: threading.Thread = field(init=False)
+
+    log = structlog.get_logger()
+
+    def open(self) -> None:
+        records = list(read_capture(self.path))
+        connection_id = self.connection_id
+        if connection_id is None and records:
+            connection_id = records[0].connection_id
+        object.__setattr__(
+            self,
+            "records",
+            [record for record in records if record.connection_id == connection_id],
+        )
+        object.__setattr__(
+            self,
+            "tx_remaining",
+            sum(1 for record in self.records if record.direction == Direction.TX),
+        )
+        object.__setattr__(
+            self,
+            "replay_thread",
+            threading.Thread(target=self.replay, daemon=True),
+        )
+        self.replay_thread.start()
+
+    def replay(self) -> None:
+        # Delivery times are measured from the last point where the
+        # host and the capture were in step: the start of playback, or
+        # the last sent frame the host matched.
+        anchor = time.monotonic()
+        anchor_ns = self.records[0].timestamp_ns if self.records else 0
+        tx_records = [
+            record for record in self.records if record.direction == Direction.TX
+        ]
+        # Captured sent frames reached so far, and how many of them
+        # have been matched or skipped
+        tx_seen = 0
+        tx_done = 0
+        for record in self.records:
+            if record.direction == Direction.TX:
+                tx_seen += 1
+                if not self.match_tx or tx_seen <= tx_done:
+                    continue
+                matched = self.match_written(tx_records, tx_done)
+                if matched is None:
+                    return
+                for skipped in tx_records[tx_done:matched]:
+                    self.log.warning(
+                        event=Event.REPLAY_TX_MISMATCH,
+                        expected=skipped.frame,
+                        written=None,
+                    )
+                tx_done = matched + 1
+                with self.condition:
+                    object.__setattr__(self, "tx_remaining", len(tx_records) - tx_done)
+                    extra: list[bytes] = []
+                    if self.tx_remaining == 0:
+                        # Nothing is left to match these against
+                        extra.extend(self.written)
+                        self.written.clear()
+                for written in extra:
+                    self.log.warning(
+                        event=Event.REPLAY_TX_MISMATCH, expected=None, written=written
+                    )
+                anchor = time.monotonic()
+                anchor_ns = tx_records[matched].timestamp_ns
+                continue
+            if not math.isinf(self.speedup):
+                delay = (record.timestamp_ns - anchor_ns) / 1e9 / self.speedup
+                if self.closed.wait(anchor + delay - time.monotonic()):
+                    return
+            with self.condition:
+                self.buffer.extend(record.frame)
+                self.condition.notify_all()
+        self.finished.set()
+
+    def match_written(self, tx_records: list[CaptureRecord], index: int) -> None | int:
+        """Wait for the host to write the captured sent frame at
+        ``index`` in ``tx_records``, and return the index of the one
+        it wrote, which is later if the host skipped some. Returns
+        ``None`` if the transport is closed first."""
+        expected = tx_records[index].frame
+        while True:
+            with self.condition:
+                self.condition.wait_for(
+                    lambda: self.closed.is_set() or bool(self.written)
+                )
+                if self.closed.is_set():
+                    return None
+                written = self.written.popleft()
+            if written == expected:
+                return index
+            if frame_message_id(written) in UNORDERED_MESSAGE_IDS:
+                self.log.warning(
+                    event=Event.REPLAY_TX_MISMATCH, expected=None, written=written
+                )
+                continue
+            for later in range(
+                index + 1, min(index + 1 + self.tx_lookahead, len(tx_records))
+            ):
+                if tx_records[later].frame == written:
+                    return later
+            self.log.warning(
+                event=Event.REPLAY_TX_MISMATCH, expected=expected, written=written
+            )
+            return index
+
+    def close(self) -> None:
+        self.closed.set()
+        with self.condition:
+            self.condition.notify_all()
+        self.replay_thread.join()
+
+    def read(self, size: int) -> bytes:
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.closed.is_set() or len(self.buffer) >= size
+            )
+            if self.closed.is_set():
+                raise TransportClosedError("Transport is closed.")
+            data = bytes(self.buffer[:size])
+            del self.buffer[:size]
+            return data
+
+    def write(self, data: bytes) -> None:
+        if self.closed.is_set():
+            raise TransportClosedError("Transport is closed.")
+        if not self.match_tx:
+            return
+        with self.condition:
+            # Keep written from growing once there is nothing left in
+            # the capture to match it against
+            expected = self.tx_remaining > 0
+            if expected:
+                self.written.append(bytes(data))
+                self.condition.notify_all()
+        if not expected:
+            self.log.warning(
+                event=Event.REPLAY_TX_MISMATCH, expected=None, written=bytes(data)
+            )
+
+    def reset_input_buffer(self) -> None:
+        # Frames are only played back once the host has sent what
+        # preceded them in the capture, so nothing delivered here is
+        # left over from before the host connected.
+        pass
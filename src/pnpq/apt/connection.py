@@ -1,31 +1,216 @@
+# pylint: disable=C0302
+import enum
+import itertools
 import threading
 import time
-from contextlib import contextmanager
+import weakref
+from contextlib import contextmanager, nullcontext
 from dataclasses import dataclass, field
-from queue import Queue, ShutDown
+from enum import IntEnum
+from queue import Empty, PriorityQueue, Queue, ShutDown
 from typing import Callable, Iterator, Optional, Tuple
 
-import serial.tools.list_ports
+import serial
 import structlog
-from serial import Serial
 
-import pnpq.apt
-
-from ..devices.utils import timeout
+from ..devices.utils import TimeoutException
+from ..errors import DeviceDisconnectedError, RequestCancelledError
 from ..events import Event
+from ..metrics import Counter, Gauge, Histogram, MetricsRegistry, default_registry
+from ..transport import SerialTransport, Transport
+from .capture import CaptureWriter, Direction
 from .protocol import (
+    APT_MESSAGE_CLASSES,
     Address,
     AptMessage,
     AptMessage_MGMSG_HW_REQ_INFO,
     AptMessage_MGMSG_HW_STOP_UPDATEMSGS,
+    AptMessage_MGMSG_MOT_MOVE_ABSOLUTE,
+    AptMessage_MGMSG_MOT_MOVE_HOME,
+    AptMessage_MGMSG_MOT_MOVE_JOG,
+    AptMessage_MGMSG_MOT_MOVE_RELATIVE,
+    AptMessage_MGMSG_MOT_MOVE_STOP,
     AptMessageForStreamParsing,
-    AptMessageId,
+    ChanIdent,
+)
+from .retry import (
+    RetransmissionSchedule,
+    RetransmitReason,
+    RetryPolicy,
+    RoundTripEstimator,
+)
+from .session import RecoveryReport, SessionState, recover
+from .settle import SettlePolicy, SettleRule, wait_for_confirmation
+from .subscription import MessageFilter, OverflowPolicy, SubscriberQueue
+from .tracing import RequestTrace
+
+# Seconds to wait for the reply to a request that is not retried,
+# unless the request sets its own reply_timeout
+REPLY_TIMEOUT = 10
+
+# Default names for connections in metrics
+connection_numbers = itertools.count(1)
+
+# Connections that are open, by id, for fleet-wide operations such as
+# pnpq.apt.fleet.emergency_stop. Connections are unhashable, so they
+# cannot be kept in a WeakSet.
+open_connections: "weakref.WeakValueDictionary[int, AptConnection]" = (
+    weakref.WeakValueDictionary()
+)
+
+
+@enum.unique
+class Priority(IntEnum):
+    """Lanes of the ordered sender. Messages are sent in order within
+    a lane, and a lane is only served when every lane above it is
+    empty.
+
+    EMERGENCY messages sent without a reply, such as stops, do not
+    wait in a lane at all: they are written as soon as the connection
+    lock is free. See ``AptConnection.send_message_no_reply``.
+    """
+
+    EMERGENCY = 0
+    # Commands that move or otherwise change the state of a device,
+    # including parameters that later moves depend on
+    CONTROL = 1
+    # Parameter and status requests, identification and other
+    # housekeeping that no later command depends on
+    BACKGROUND = 2
+
+
+# Messages that start a motion whose completion a request may be
+# waiting for
+MOTION_MESSAGE_TYPES: frozenset[type[AptMessage]] = frozenset(
+    {
+        AptMessage_MGMSG_MOT_MOVE_ABSOLUTE,
+        AptMessage_MGMSG_MOT_MOVE_HOME,
+        AptMessage_MGMSG_MOT_MOVE_JOG,
+        AptMessage_MGMSG_MOT_MOVE_RELATIVE,
+    }
 )
 
 
+def makes_obsolete(message: AptMessage, request: AptMessage) -> bool:
+    """Whether sending ``message`` means that the reply to
+    ``request`` will never arrive. A stop makes moves of the channels
+    it stops obsolete."""
+    return (
+        isinstance(message, AptMessage_MGMSG_MOT_MOVE_STOP)
+        and type(request) in MOTION_MESSAGE_TYPES
+        and bool(getattr(request, "chan_ident", ChanIdent(0)) & message.chan_ident)
+    )
+
+
+# A message for the ordered sender, with, if it expects a reply, how
+# to recognize the reply, where to put it and how many seconds to wait
+# for it, and its trace, if any
+OrderedRequest = Tuple[
+    AptMessage,
+    None | Callable[[AptMessage], bool],
+    None | MessageFilter,
+    None | Queue[AptMessage | Exception],
+    float,
+    None | RequestTrace,
+]
+
+
+@dataclass(kw_only=True)
+class InFlightRequest:
+    """The request the ordered sender is waiting for a reply to."""
+
+    message: AptMessage
+    receive_queue: SubscriberQueue
+    cancelled_by: None | AptMessage = None
+    error: None | Exception = None
+
+    def cancel(self, message: AptMessage) -> None:
+        self.cancelled_by = message
+        # Wake the sender thread if it is waiting for a message
+        self.receive_queue.offer(message)
+
+    def fail(self, error: Exception) -> None:
+        self.error = error
+        # Wake the sender thread if it is waiting for a message; its
+        # get raises ShutDown
+        self.receive_queue.shutdown(immediate=True)
+
+
+@dataclass(frozen=True, kw_only=True)
+class AptConnectionMetrics:
+    tx_messages: Counter
+    tx_bytes: Counter
+    rx_messages: Counter
+    rx_unknown_messages: Counter
+    rx_bytes: Counter
+    tx_queue_depth: Gauge
+    rx_subscriber_backlog: Gauge
+    rx_subscriber_dropped: Counter
+    request_duration: Histogram
+    request_timeouts: Counter
+    request_retransmissions: Counter
+    settle_duration: Histogram
+    connected: Gauge
+    reconnects: Counter
+
+    @classmethod
+    def register(cls, registry: MetricsRegistry) -> "AptConnectionMetrics":
+        return cls(
+            tx_messages=registry.counter(
+                "pnpq_apt_tx_messages_total", "APT messages sent, by message type"
+            ),
+            tx_bytes=registry.counter("pnpq_apt_tx_bytes_total", "Bytes sent"),
+            rx_messages=registry.counter(
+                "pnpq_apt_rx_messages_total", "APT messages received, by message type"
+            ),
+            rx_unknown_messages=registry.counter(
+                "pnpq_apt_rx_unknown_messages_total",
+                "Received APT messages of an unknown type, which are discarded",
+            ),
+            rx_bytes=registry.counter("pnpq_apt_rx_bytes_total", "Bytes received"),
+            tx_queue_depth=registry.gauge(
+                "pnpq_apt_tx_queue_depth",
+                "Messages waiting to be sent in order",
+            ),
+            rx_subscriber_backlog=registry.gauge(
+                "pnpq_apt_rx_subscriber_backlog",
+                "Received messages waiting to be taken from the fullest subscriber queue",
+            ),
+            rx_subscriber_dropped=registry.counter(
+                "pnpq_apt_rx_subscriber_dropped_total",
+                "Received messages discarded because a subscriber queue was full, by overflow policy",
+            ),
+            request_duration=registry.histogram(
+                "pnpq_apt_request_duration_seconds",
+                "Time from sending a message until its reply is received, by message type",
+            ),
+            request_timeouts=registry.counter(
+                "pnpq_apt_request_timeouts_total",
+                "Messages whose reply was not received in time, by message type",
+            ),
+            request_retransmissions=registry.counter(
+                "pnpq_apt_request_retransmissions_total",
+                "Requests sent again while waiting for their reply, by message type and reason",
+            ),
+            settle_duration=registry.histogram(
+                "pnpq_apt_settle_duration_seconds",
+                "Time the connection is held after a message that gets no reply, by message type and whether its effect was confirmed",
+            ),
+            connected=registry.gauge(
+                "pnpq_apt_connected",
+                "1 while the device is connected, and 0 after it is lost until it is reconnected",
+            ),
+            reconnects=registry.counter(
+                "pnpq_apt_reconnects_total",
+                "Times the transport was reopened after the device was lost",
+            ),
+        )
+
+
 @dataclass(frozen=True, kw_only=True)
 class AptConnection:
-    # Serial connection parameters
+    # Serial connection parameters, used when the connection is
+    # located by serial_number rather than given a transport
     baudrate: int = 115200
     bytesize: int = serial.EIGHTBITS
     exclusive: bool = True
@@ -36,13 +221,11 @@ class AptConnection:
         None  # None means wait forever, until the requested number of bytes are received
     )
 
-    connection: Serial = field(init=False)
+    connection: Transport = field(init=False)
 
     rx_dispatcher_thread: threading.Thread = field(init=False)
     rx_dispatcher_thread_lock: threading.Lock = field(default_factory=threading.Lock)
-    rx_dispatcher_subscribers: dict[int, Queue[AptMessage]] = field(
-        default_factory=dict
-    )
+    rx_dispatcher_subscribers: dict[int, SubscriberQueue] = field(default_factory=dict)
     rx_dispatcher_subscribers_lock: threading.Lock = field(
         default_factory=threading.Lock
     )
@@ -52,19 +235,17 @@ class AptConnection:
     tx_ordered_sender_awaiting_reply: threading.Event = field(
         default_factory=threading.Event
     )
-    tx_ordered_sender_queue: Queue[
-        Tuple[
-            AptMessage,
-            None
-            | Callable[
-                [
-                    AptMessage,
-                ],
-                bool,
-            ],
-            None | Queue[AptMessage],
-        ]
-    ] = field(default_factory=Queue)
+    # Ordered by priority, and then by the order messages were queued
+    tx_ordered_sender_queue: PriorityQueue[tuple[Priority, int, OrderedRequest]] = (
+        field(default_factory=PriorityQueue)
+    )
+    tx_ordered_sender_sequence: Iterator[int] = field(default_factory=itertools.count)
+    tx_ordered_sender_in_flight: None | InFlightRequest = field(
+        init=False, default=None
+    )
+    # Set while an emergency message is waiting for the connection
+    # lock, to cut short the pause after no-reply messages
+    tx_emergency_pending: threading.Event = field(default_factory=threading.Event)
     tx_ordered_sender_thread: threading.Thread = field(init=False)
     tx_ordered_sender_thread_lock: threading.Lock = field(
         default_factory=threading.Lock
@@ -72,14 +253,119 @@ class AptConnection:
 
     log = structlog.get_logger()
 
-    stop_event = threading.Event()
+    stop_event: threading.Event = field(default_factory=threading.Event)
+
+    # Exactly one of serial_number or transport must be given. A
+    # serial_number is the USB serial number of a device to open with
+    # the serial parameters above.
+    serial_number: None | str = None
+    transport: None | Transport = None
+
+    # Records every frame sent and received, if given
+    capture: None | CaptureWriter = None
+    capture_connection_id: int = field(init=False, default=0)
 
-    # Required inputs are defined below.
+    # Where to record metrics, and the value of the "connection" label
+    # that identifies this connection's series. The name defaults to
+    # the serial number, if given, or else a number unique within
+    # this process.
+    metrics: MetricsRegistry = field(default_factory=lambda: default_registry)
+    name: None | str = None
+    label: str = field(init=False)
+    connection_metrics: AptConnectionMetrics = field(init=False)
 
-    serial_number: str
+    # Called with the trace of every message sent in order, once it
+    # has been written or, if it expects a reply, once the reply has
+    # been received. Runs on the sender thread, so it should be quick.
+    trace_exporter: None | Callable[[RequestTrace], None] = None
+
+    # The number of received messages each rx_subscribe queue holds,
+    # and what happens to new messages when one is full. These are
+    # the defaults; rx_subscribe can override them.
+    rx_subscriber_queue_size: int = 1000
+    rx_subscriber_overflow_policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST
+
+    # Motor channels of the devices on this connection, added by
+    # their drivers, for fleet-wide operations such as
+    # pnpq.apt.fleet.emergency_stop
+    motor_channels: set[ChanIdent] = field(default_factory=set)
+
+    # Set while the transport is open and the device has not been
+    # lost, for example by being unplugged
+    connected: threading.Event = field(default_factory=threading.Event)
+    connected_lock: threading.Lock = field(default_factory=threading.Lock)
+
+    # Whether to reopen the transport after the device is lost. This
+    # requires a transport that can be opened again after it is
+    # closed, and defaults to True for connections located by
+    # serial_number, whose port is looked up again on every attempt.
+    reconnect: None | bool = None
+    # Seconds to wait after a failed attempt to reopen the transport,
+    # doubling after each failure up to reconnect_max_delay
+    reconnect_delay: float = 0.1
+    reconnect_max_delay: float = 5
+    reconnect_thread: None | threading.Thread = field(init=False, default=None)
+    # Set while the dispatcher thread is waiting for a reconnection,
+    # and so no longer reading from the lost transport
+    rx_dispatcher_paused: threading.Event = field(default_factory=threading.Event)
+
+    # Settings to send again after reconnecting
+    session: SessionState = field(default_factory=SessionState)
+    # The most recent recovery, if any, which is also passed to
+    # recovery_exporter, if given
+    last_recovery: None | RecoveryReport = field(init=False, default=None)
+    recovery_exporter: None | Callable[[RecoveryReport], None] = None
+
+    # How requests that only ask for information are sent again if
+    # their reply is lost, or None to never send them again. See
+    # pnpq.apt.retry.
+    retry_policy: None | RetryPolicy = field(default_factory=RetryPolicy)
+    round_trip_estimator: None | RoundTripEstimator = field(init=False)
+
+    # How long to hold the connection after each type of message that
+    # gets no reply, which drivers fill in for their device. See
+    # pnpq.apt.settle.
+    settle_policy: SettlePolicy = field(default_factory=SettlePolicy)
 
     def __post_init__(self) -> None:
-        pass
+        if (self.serial_number is None) == (self.transport is None):
+            raise ValueError("Exactly one of serial_number or transport must be given.")
+        if self.reconnect is None:
+            object.__setattr__(self, "reconnect", self.serial_number is not None)
+        transport = self.transport
+        if transport is None:
+            transport = SerialTransport(
+                serial_number=self.serial_number,
+                baudrate=self.baudrate,
+                bytesize=self.bytesize,
+                exclusive=self.exclusive,
+                parity=self.parity,
+                rtscts=self.rtscts,
+                stopbits=self.stopbits,
+                timeout=self.timeout,
+            )
+        object.__setattr__(self, "connection", transport)
+        object.__setattr__(
+            self,
+            "label",
+            self.name or self.serial_number or str(next(connection_numbers)),
+        )
+        object.__setattr__(
+            self, "connection_metrics", AptConnectionMetrics.register(self.metrics)
+        )
+        object.__setattr__(
+            self,
+            "round_trip_estimator",
+            (
+                None
+                if self.retry_policy is None
+                else RoundTripEstimator(policy=self.retry_policy)
+            ),
+        )
+        if self.capture is not None:
+            object.__setattr__(
+                self, "capture_connection_id", self.capture.add_connection()
+            )
 
     # TODO from a multi-threading point of view, it might be much
     # easier to assume that, for the lifetime of a program, a
@@ -100,40 +386,8 @@ class AptConnection:
     def open(self) -> None:
         self.log.debug("Starting connection post-init...")
 
-        # These devices tend to take a few seconds to start up, and
-        # this library tends to be used as part of services that start
-        # automatically on computer boot. For safety, wait here before
-        # continuing initialization.
-        time.sleep(1)
-
-        port_found = False
-        port = None
-        for port in serial.tools.list_ports.comports():
-            if port.serial_number == self.serial_number:
-                port_found = True
-                break
-        if not port_found:
-            raise ValueError(
-                f"Serial number {self.serial_number} could not be found, failing intialization."
-            )
-
-        # Initializing the connection by passing a port to the Serial
-        # constructor immediately opens the connection. It is not
-        # necessary to call open() separately.
-        object.__setattr__(
-            self,
-            "connection",
-            Serial(
-                baudrate=self.baudrate,
-                bytesize=self.bytesize,
-                exclusive=self.exclusive,
-                parity=self.parity,
-                port=port.device,
-                rtscts=self.rtscts,
-                stopbits=self.stopbits,
-                timeout=self.timeout,
-            ),
-        )
+        self.connection.open()
+        self.set_connected(True)
 
         self.send_message_no_reply(
             AptMessage_MGMSG_HW_STOP_UPDATEMSGS(
@@ -167,6 +421,8 @@ class AptConnection:
         )
         self.tx_ordered_sender_thread.start()
 
+        open_connections[id(self)] = self
+
         self.send_message_no_reply(
             AptMessage_MGMSG_HW_REQ_INFO(
                 destination=Address.GENERIC_USB,
@@ -177,6 +433,7 @@ class AptConnection:
         self.log.debug("Finishing connection post-init...")
 
     def close(self) -> None:
+        open_connections.pop(id(self), None)
 
         self.send_message_unordered(
             AptMessage_MGMSG_HW_STOP_UPDATEMSGS(
@@ -188,14 +445,38 @@ class AptConnection:
 
         self.tx_ordered_sender_queue.shutdown()
         self.tx_ordered_sender_thread.join()
+        self.fail_queued_requests()
 
-        self.connection.flush()
-        self.connection.close()
+        # Device status pollers may still be running; holding the
+        # lock keeps them from writing to a closed transport.
+        with self.tx_connection_lock:
+            if self.connected.is_set():
+                self.connection.flush()
+            self.connection.close()
 
         self.rx_dispatcher_thread.join()
+        if self.reconnect_thread is not None:
+            self.reconnect_thread.join()
 
         self.log.debug("Successfully closed the APTConnection.")
 
+    def fail_queued_requests(self) -> None:
+        """Release callers still waiting for requests that the closed
+        sender thread will never send."""
+        while True:
+            try:
+                _, _, (message, _, _, reply_queue, _, _) = (
+                    self.tx_ordered_sender_queue.get_nowait()
+                )
+            except (Empty, ShutDown):
+                return
+            if reply_queue is not None:
+                reply_queue.put(
+                    DeviceDisconnectedError(
+                        f"The connection was closed before sending {message.message_id.name}."
+                    )
+                )
+
     def rx_dispatch(self) -> None:
         with self.rx_dispatcher_thread_lock:
             while not self.stop_event.is_set():
@@ -204,8 +485,12 @@ class AptConnection:
 
                 try:
                     message_bytes = self.connection.read(6)
-                # Serial bus not connected error
+                # The connection was closed, or the device was lost
                 except Exception as e:  # pylint: disable=W0718
+                    if not self.stop_event.is_set():
+                        self.connection_lost(e)
+                    if self.reconnect and self.rx_wait_for_reconnection():
+                        continue
                     self.log.debug(
                         event="Shutting down rx dispatcher. Received expected error.",
                         exc_info=e,
@@ -215,26 +500,55 @@ class AptConnection:
                     partial_message = AptMessageForStreamParsing.from_bytes(
                         message_bytes
                     )
-                    message_id = partial_message.message_id
                     if partial_message.data_length != 0:
                         message_bytes = message_bytes + self.connection.read(
                             partial_message.data_length
                         )
 
-                    if partial_message.message_id in AptMessageId:
-                        message_id = AptMessageId(partial_message.message_id)
-                        full_message = getattr(
-                            pnpq.apt.protocol, f"AptMessage_{message_id.name}"
-                        ).from_bytes(message_bytes)
-                        assert isinstance(full_message, AptMessage)
+                    if self.capture is not None:
+                        self.capture.record(
+                            self.capture_connection_id, Direction.RX, message_bytes
+                        )
+
+                    self.connection_metrics.rx_bytes.inc(
+                        len(message_bytes), connection=self.label
+                    )
+
+                    message_class = APT_MESSAGE_CLASSES.get(partial_message.message_id)
+                    if message_class is not None:
+                        full_message = message_class.from_bytes(message_bytes)
                         self.log.debug(
                             event=Event.RX_MESSAGE_KNOWN,
                             message=full_message,
                         )
+                        self.connection_metrics.rx_messages.inc(
+                            connection=self.label,
+                            message=full_message.message_id.name,
+                        )
+                        # Offer messages without holding the lock, so
+                        # that a subscriber whose queue blocks the
+                        # dispatcher can still unsubscribe
                         with self.rx_dispatcher_subscribers_lock:
-                            for queue in self.rx_dispatcher_subscribers.values():
-                                queue.put(full_message)
+                            queues = list(self.rx_dispatcher_subscribers.values())
+                        backlog = 0
+                        for queue in queues:
+                            if (
+                                queue.message_filter is not None
+                                and not queue.message_filter.matches(full_message)
+                            ):
+                                continue
+                            if queue.offer(full_message):
+                                self.connection_metrics.rx_subscriber_dropped.inc(
+                                    connection=self.label, policy=queue.policy
+                                )
+                            backlog = max(backlog, queue.qsize())
+                        self.connection_metrics.rx_subscriber_backlog.set(
+                            backlog, connection=self.label
+                        )
                     else:
+                        self.connection_metrics.rx_unknown_messages.inc(
+                            connection=self.label
+                        )
                         # Log and discard unknown messages
                         self.log.debug(
                             event=Event.RX_MESSAGE_UNKNOWN,
@@ -250,82 +564,400 @@ class AptConnection:
                         full_message=full_message,
                     )
 
+    def rx_wait_for_reconnection(self) -> bool:
+        """Wait until the transport is reopened, returning True, or
+        until the connection is closed, returning False."""
+        self.rx_dispatcher_paused.set()
+        try:
+            while not self.stop_event.is_set():
+                if self.connected.wait(0.1):
+                    return True
+            return False
+        finally:
+            self.rx_dispatcher_paused.clear()
+
+    def set_connected(self, connected: bool) -> None:
+        if connected:
+            self.connected.set()
+        else:
+            self.connected.clear()
+        self.connection_metrics.connected.set(int(connected), connection=self.label)
+
+    def connection_lost(self, error: Exception) -> None:
+        """Mark the device as lost, fail the request waiting for a
+        reply, if any, and start reconnecting, if enabled. Requests
+        sent until the device is reconnected fail with
+        DeviceDisconnectedError."""
+        with self.connected_lock:
+            if not self.connected.is_set() or self.stop_event.is_set():
+                return
+            self.set_connected(False)
+        lost = time.perf_counter()
+        self.log.warning(event=Event.CONNECTION_LOST, exc_info=error)
+        in_flight = self.tx_ordered_sender_in_flight
+        if in_flight is not None:
+            in_flight.fail(
+                DeviceDisconnectedError(
+                    f"The device was lost while waiting for the reply to {in_flight.message.message_id.name}."
+                )
+            )
+        if self.reconnect:
+            object.__setattr__(
+                self,
+                "reconnect_thread",
+                threading.Thread(target=recover, args=(self, error, lost), daemon=True),
+            )
+            assert self.reconnect_thread is not None
+            self.reconnect_thread.start()
+
     @contextmanager
-    def rx_subscribe(self) -> Iterator[Queue[AptMessage]]:
-        thread_id = threading.get_ident()
-        queue: Queue[AptMessage] = Queue()
+    def rx_subscribe(
+        self,
+        maxsize: None | int = None,
+        overflow_policy: None | OverflowPolicy = None,
+        message_filter: None | MessageFilter = None,
+    ) -> Iterator[SubscriberQueue]:
+        """Receive every message received until the ``with`` block
+        exits, or only those matching ``message_filter``, in a queue of
+        at most ``maxsize`` messages that applies ``overflow_policy``
+        when full. Both default to the connection's settings."""
+        queue = SubscriberQueue(
+            maxsize=self.rx_subscriber_queue_size if maxsize is None else maxsize,
+            policy=(
+                self.rx_subscriber_overflow_policy
+                if overflow_policy is None
+                else overflow_policy
+            ),
+            message_filter=message_filter,
+        )
         with self.rx_dispatcher_subscribers_lock:
-            self.rx_dispatcher_subscribers[thread_id] = queue
+            self.rx_dispatcher_subscribers[id(queue)] = queue
         try:
             yield queue
         finally:
             with self.rx_dispatcher_subscribers_lock:
-                self.rx_dispatcher_subscribers.pop(thread_id)
+                self.rx_dispatcher_subscribers.pop(id(queue))
+            queue.close()
+            if queue.dropped:
+                self.log.warning(
+                    event=Event.RX_SUBSCRIBER_OVERFLOW,
+                    dropped=queue.dropped,
+                    policy=queue.policy,
+                )
 
     def tx_ordered_send(self) -> None:
         # TODO wrap in exception handler
         with self.tx_ordered_sender_thread_lock:
             while not self.stop_event.is_set():
                 try:
-                    message, match_reply, reply_queue = (
-                        self.tx_ordered_sender_queue.get()
-                    )
+                    (
+                        _,
+                        _,
+                        (
+                            message,
+                            match_reply,
+                            reply_filter,
+                            reply_queue,
+                            reply_timeout,
+                            trace,
+                        ),
+                    ) = self.tx_ordered_sender_queue.get()
                 except ShutDown as _:
                     break
+                if trace is not None:
+                    trace.dequeued = time.perf_counter()
+                self.connection_metrics.tx_queue_depth.set(
+                    self.tx_ordered_sender_queue.qsize(), connection=self.label
+                )
                 self.log.debug(
                     event=Event.TX_MESSAGE_ORDERED,
                     message=message,
                 )
                 if match_reply is None:
-                    with self.tx_connection_lock:
-                        self.connection.write(message.to_bytes())
-                        # Some no-reply commands take time to
-                        # complete. Sending other messages while this
-                        # is happening could cause the device's
-                        # internal software to fail until a hard reset
-                        # is peformed.
-                        #
-                        # This behavior has been observed with the
-                        # MGMSG_MOD_SET_CHANENABLESTATE message on the
-                        # MPC320, where rapidly toggling a channel off
-                        # and then on again seems to cause the device
-                        # to stop responding to commands.
-                        #
-                        # Unlike with reply-expected commands, below,
-                        # this also blocks any users of
-                        # send_message_unordered.
-                        #
-                        # The sleep time set here is just a reasonable
-                        # guess based on observation of device
-                        # behavior. It is not based on information
-                        # from the APT specification.
-                        time.sleep(0.2)
-                    continue
-                assert reply_queue is not None
-                # TODO We are subscribing to incoming messages just
-                # *before* sending our message. Ideally we should
-                # subscribe immediately *after* sending the
-                # message. This is a little tricky to coordinate in
-                # the current architecture.
-                with timeout(10) as check_timeout, self.rx_subscribe() as receive_queue:
-                    with self.tx_connection_lock:
-                        self.connection.write(message.to_bytes())
-                    # It doesn't seem to cause harm to let the sort of
-                    # messages we typically poll for using
-                    # send_message_unordered (REQ_USTATUSUPDATE,
-                    # ACK_USTATUSUPDATE) continue to be sent while we
-                    # wait for replies to messages, so we release the
-                    # connection lock here. Compare this to no-reply
-                    # messages above, where we block the sending of
-                    # all messages for a short period of time out of
-                    # an abundance of caution.
-                    self.tx_ordered_sender_awaiting_reply.set()
-                    while check_timeout():
-                        message = receive_queue.get(timeout=10)
-                        if match_reply(message):
-                            self.tx_ordered_sender_awaiting_reply.clear()
-                            reply_queue.put(message)
-                            break
+                    self.send_ordered_no_reply(message, trace)
+                else:
+                    assert reply_queue is not None
+                    self.send_ordered_expect_reply(
+                        message,
+                        match_reply,
+                        reply_filter,
+                        reply_queue,
+                        reply_timeout,
+                        trace,
+                    )
+
+    def send_ordered_no_reply(
+        self, message: AptMessage, trace: None | RequestTrace
+    ) -> None:
+        rule = self.settle_policy.rule(message)
+        with (
+            self.tx_connection_lock,
+            (
+                self.rx_subscribe(message_filter=rule.confirm_filter)
+                if rule.confirm is not None
+                else nullcontext(None)
+            ) as confirm_queue,
+        ):
+            if trace is not None:
+                trace.lock_acquired = time.perf_counter()
+            try:
+                self.write_message(message)
+                written = time.perf_counter()
+                if trace is not None:
+                    trace.written = written
+                # Some no-reply commands take time to
+                # complete. Sending other messages while this
+                # is happening could cause the device's
+                # internal software to fail until a hard reset
+                # is peformed.
+                #
+                # This behavior has been observed with the
+                # MGMSG_MOD_SET_CHANENABLESTATE message on the
+                # MPC320, where rapidly toggling a channel off
+                # and then on again seems to cause the device
+                # to stop responding to commands.
+                #
+                # Unlike with reply-expected commands, below,
+                # this also blocks any users of
+                # send_message_unordered.
+                #
+                # How long to wait is set by the message's
+                # settle rule (see pnpq.apt.settle). An
+                # emergency message, such as a stop, cuts the
+                # pause short.
+                self.settle(message, rule, confirm_queue, written)
+                if trace is not None:
+                    trace.settled = time.perf_counter()
+            except DeviceDisconnectedError:
+                # There is no caller waiting to be told
+                self.log.debug(event=Event.TX_MESSAGE_DROPPED, message=message)
+                return
+        self.export_trace(trace)
+
+    def settle(
+        self,
+        message: AptMessage,
+        rule: SettleRule,
+        confirm_queue: None | SubscriberQueue,
+        written: float,
+    ) -> None:
+        """Hold the bus, with the connection lock held, after writing
+        ``message`` at ``written``, until its settle rule says it has
+        taken effect."""
+        confirmed = None
+        if confirm_queue is None:
+            self.tx_emergency_pending.wait(rule.delay)
+        else:
+            confirmed = wait_for_confirmation(
+                self, message, rule, confirm_queue, written
+            )
+            remaining = written + rule.minimum - time.perf_counter()
+            if remaining > 0:
+                self.tx_emergency_pending.wait(remaining)
+        self.connection_metrics.settle_duration.observe(
+            time.perf_counter() - written,
+            connection=self.label,
+            message=message.message_id.name,
+            confirmed=str(confirmed is not None).lower(),
+        )
+
+    def send_ordered_expect_reply(
+        self,
+        message: AptMessage,
+        match_reply: Callable[[AptMessage], bool],
+        reply_filter: None | MessageFilter,
+        reply_queue: Queue[AptMessage | Exception],
+        reply_timeout: float,
+        trace: None | RequestTrace,
+    ) -> None:
+        # TODO We are subscribing to incoming messages just
+        # *before* sending our message. Ideally we should
+        # subscribe immediately *after* sending the
+        # message. This is a little tricky to coordinate in
+        # the current architecture.
+        request = message
+        with (
+            self.rx_subscribe(message_filter=reply_filter) as receive_queue,
+            self.track_in_flight(request, receive_queue) as in_flight,
+        ):
+            with self.tx_connection_lock:
+                if trace is not None:
+                    trace.lock_acquired = time.perf_counter()
+                # An emergency message may have made the request
+                # obsolete while waiting for the lock
+                if in_flight.cancelled_by is not None:
+                    self.cancel_request(request, in_flight, reply_queue)
+                    self.export_trace(trace)
+                    return
+                try:
+                    self.write_message(request)
+                except DeviceDisconnectedError as e:
+                    reply_queue.put(e)
+                    return
+            sent = time.perf_counter()
+            if trace is not None:
+                trace.written = sent
+            # It doesn't seem to cause harm to let the sort of
+            # messages we typically poll for using
+            # send_message_unordered (REQ_USTATUSUPDATE,
+            # ACK_USTATUSUPDATE) continue to be sent while we
+            # wait for replies to messages, so we release the
+            # connection lock here. Compare this to no-reply
+            # messages above, where we block the sending of
+            # all messages for a short period of time out of
+            # an abundance of caution.
+            self.tx_ordered_sender_awaiting_reply.set()
+            reply: None | AptMessage | Exception
+            try:
+                reply = self.await_reply(
+                    request,
+                    match_reply,
+                    receive_queue,
+                    in_flight,
+                    sent,
+                    reply_timeout,
+                    trace,
+                )
+            # The device was lost
+            except ShutDown:
+                assert in_flight.error is not None
+                reply = in_flight.error
+            # Fail the request, rather than the sender thread
+            except (DeviceDisconnectedError, TimeoutException) as e:
+                if isinstance(e, TimeoutException):
+                    self.connection_metrics.request_timeouts.inc(
+                        connection=self.label, message=request.message_id.name
+                    )
+                reply = e
+            finally:
+                self.tx_ordered_sender_awaiting_reply.clear()
+            if reply is None:
+                self.cancel_request(request, in_flight, reply_queue)
+                self.export_trace(trace)
+                return
+            reply_queue.put(reply)
+            if not isinstance(reply, Exception):
+                self.export_trace(trace)
+
+    def await_reply(
+        self,
+        request: AptMessage,
+        match_reply: Callable[[AptMessage], bool],
+        receive_queue: SubscriberQueue,
+        in_flight: InFlightRequest,
+        sent: float,
+        reply_timeout: float,
+        trace: None | RequestTrace,
+    ) -> None | AptMessage:
+        """Wait for the reply to a request written at ``sent``, sending
+        the request again if it is retried and its reply is late. A
+        request that is not retried is given ``reply_timeout`` seconds.
+
+        Returns None if the request was cancelled. Raises ShutDown if
+        the device was lost, and TimeoutException if the reply did not
+        arrive in time.
+        """
+        schedule = RetransmissionSchedule.start(
+            request, sent, self.round_trip_estimator, reply_timeout
+        )
+        while True:
+            now = time.perf_counter()
+            if now >= schedule.deadline:
+                raise TimeoutException()
+            reason = schedule.due(now)
+            if reason is not None:
+                self.retransmit(request, reason)
+                schedule.retransmitted(now, reason)
+            try:
+                message = receive_queue.get(timeout=schedule.wait_time(now))
+            except Empty:
+                continue
+            received = time.perf_counter()
+            if in_flight.error is not None:
+                raise ShutDown
+            if in_flight.cancelled_by is not None:
+                return None
+            if match_reply(message):
+                self.connection_metrics.request_duration.observe(
+                    received - sent,
+                    connection=self.label,
+                    message=request.message_id.name,
+                )
+                # A reply to a request sent more than once may be to
+                # any of its copies, so it is not a round-trip sample
+                if (
+                    self.round_trip_estimator is not None
+                    and not schedule.retransmissions
+                ):
+                    self.round_trip_estimator.observe(
+                        request.message_id, received - sent
+                    )
+                if trace is not None:
+                    trace.replied = received
+                    trace.reply = message
+                return message
+            if trace is not None:
+                trace.last_unmatched = received
+
+    def retransmit(self, request: AptMessage, reason: RetransmitReason) -> None:
+        """Send a request again while waiting for its reply. Raises
+        DeviceDisconnectedError if the device was lost."""
+        self.log.debug(
+            event=Event.TX_REQUEST_RETRANSMITTED, message=request, reason=reason
+        )
+        self.connection_metrics.request_retransmissions.inc(
+            connection=self.label, message=request.message_id.name, reason=reason
+        )
+        with self.tx_connection_lock:
+            self.write_message(request)
+
+    @contextmanager
+    def track_in_flight(
+        self, request: AptMessage, receive_queue: SubscriberQueue
+    ) -> Iterator[InFlightRequest]:
+        in_flight = InFlightRequest(message=request, receive_queue=receive_queue)
+        object.__setattr__(self, "tx_ordered_sender_in_flight", in_flight)
+        try:
+            yield in_flight
+        finally:
+            object.__setattr__(self, "tx_ordered_sender_in_flight", None)
+
+    def cancel_request(
+        self,
+        request: AptMessage,
+        in_flight: InFlightRequest,
+        reply_queue: Queue[AptMessage | Exception],
+    ) -> None:
+        self.log.debug(
+            event=Event.TX_REQUEST_CANCELLED,
+            message=request,
+            cancelled_by=in_flight.cancelled_by,
+        )
+        reply_queue.put(
+            RequestCancelledError(
+                f"{request.message_id.name} was made obsolete by"
+                f" {type(in_flight.cancelled_by).__name__}."
+            )
+        )
+
+    def send_message_emergency(self, message: AptMessage) -> None:
+        self.log.debug(event=Event.TX_MESSAGE_EMERGENCY, message=message)
+        if not self.connected.is_set():
+            raise DeviceDisconnectedError(
+                f"Cannot send {message.message_id.name}: the device was lost."
+            )
+        self.tx_emergency_pending.set()
+        try:
+            with self.tx_connection_lock:
+                self.write_message(message)
+                # Cancel while holding the lock, so that an obsolete
+                # request waiting for the lock is never written
+                # after this message
+                in_flight = self.tx_ordered_sender_in_flight
+                if in_flight is not None and makes_obsolete(message, in_flight.message):
+                    in_flight.cancel(message)
+        finally:
+            self.tx_emergency_pending.clear()
 
     def send_message_unordered(self, message: AptMessage) -> None:
         """Send a message as soon as the connection lock will allow,
@@ -333,13 +965,72 @@ class AptConnection:
         messages while the main message thread is blocked waiting for
         a reply.
         """
+        # Check before taking the lock, which is held while a lost
+        # device is reconnected
+        if self.stop_event.is_set() or not self.connected.is_set():
+            # The connection is closing or closed, or the device was lost
+            self.log.debug(event=Event.TX_MESSAGE_DROPPED, message=message)
+            return
         with self.tx_connection_lock:
             self.log.debug(event=Event.TX_MESSAGE_UNORDERED, message=message)
-            self.connection.write(message.to_bytes())
+            try:
+                self.write_message(message)
+            except DeviceDisconnectedError:
+                self.log.debug(event=Event.TX_MESSAGE_DROPPED, message=message)
+
+    def write_message(self, message: AptMessage) -> None:
+        """Write a message to the transport. The caller must hold
+        tx_connection_lock.
+
+        Raises DeviceDisconnectedError if the device was lost, either
+        before or while writing."""
+        if not self.connected.is_set():
+            raise DeviceDisconnectedError(
+                f"Cannot send {message.message_id.name}: the device was lost."
+            )
+        frame = message.to_bytes()
+        try:
+            self.connection.write(frame)
+        except Exception as e:
+            self.connection_lost(e)
+            raise DeviceDisconnectedError(
+                f"Failed to send {message.message_id.name}: the device was lost."
+            ) from e
+        self.session.record(message)
+        self.connection_metrics.tx_messages.inc(
+            connection=self.label, message=message.message_id.name
+        )
+        self.connection_metrics.tx_bytes.inc(len(frame), connection=self.label)
+        if self.capture is not None:
+            self.capture.record(self.capture_connection_id, Direction.TX, frame)
+
+    def export_trace(self, trace: None | RequestTrace) -> None:
+        if trace is None or self.trace_exporter is None:
+            return
+        try:
+            self.trace_exporter(trace)
+        # Keep a broken exporter from stopping the sender thread
+        except Exception as e:  # pylint: disable=W0718
+            self.log.error(event=Event.UNCAUGHT_EXCEPTION, exc_info=e)
+
+    def send_message_no_reply(
+        self, message: AptMessage, priority: Priority = Priority.CONTROL
+    ) -> None:
+        """Send a message and return immediately, without waiting for any reply.
 
-    def send_message_no_reply(self, message: AptMessage) -> None:
-        """Send a message and return immediately, without waiting for any reply."""
-        self.tx_ordered_sender_queue.put((message, None, None))
+        An EMERGENCY message is written before this returns, ahead of
+        everything queued, without waiting for the reply to a request
+        already sent. If it makes that request obsolete, as a stop does
+        a move of the same channel, the request is cancelled and its
+        caller gets a RequestCancelledError.
+        """
+        if priority == Priority.EMERGENCY:
+            self.send_message_emergency(message)
+            return
+        trace = None
+        if self.trace_exporter is not None:
+            trace = RequestTrace(message=message, expects_reply=False)
+        self.queue_ordered(priority, (message, None, None, None, REPLY_TIMEOUT, trace))
 
     def send_message_expect_reply(
         self,
@@ -350,6 +1041,9 @@ class AptConnection:
             ],
             bool,
         ],
+        reply_filter: None | MessageFilter = None,
+        priority: Priority = Priority.CONTROL,
+        reply_timeout: float = REPLY_TIMEOUT,
     ) -> AptMessage:
         """Send a message and block until an expected reply is
         received.
@@ -359,12 +1053,85 @@ class AptConnection:
         match_reply: Callable - A function that returns True if a
         received message should be recognized as a reply to this
         message, and False otherwise.
+
+        reply_filter: MessageFilter - If given, match_reply is only
+        called for received messages that this filter matches. The
+        filter is checked by the dispatcher thread, so messages it
+        rejects never reach the sender thread.
+
+        priority: Priority - The lane to send the message in. An
+        EMERGENCY message that expects a reply is sent next, but after
+        the reply to any request already sent.
+
+        reply_timeout: float - Seconds to wait for the reply, from when
+        the message is sent, before raising TimeoutException. Requests
+        for motions that may take longer than REPLY_TIMEOUT, such as
+        homing, set their own. A request retried by the connection's
+        retry_policy has the policy's deadline instead.
+
+        Raises RequestCancelledError if an emergency message makes the
+        request obsolete before its reply arrives.
         """
+        trace = None
+        if self.trace_exporter is not None:
+            trace = RequestTrace(message=message, expects_reply=True)
+        return self.queue_request(
+            message, match_reply, reply_filter, priority, trace, reply_timeout
+        )
 
+    def send_message_expect_reply_traced(
+        self,
+        message: AptMessage,
+        match_reply: Callable[
+            [
+                AptMessage,
+            ],
+            bool,
+        ],
+        reply_filter: None | MessageFilter = None,
+        priority: Priority = Priority.CONTROL,
+        reply_timeout: float = REPLY_TIMEOUT,
+    ) -> tuple[AptMessage, RequestTrace]:
+        """Like send_message_expect_reply, but also return the trace
+        of the request, whether or not there is a trace_exporter."""
+        trace = RequestTrace(message=message, expects_reply=True)
+        reply = self.queue_request(
+            message, match_reply, reply_filter, priority, trace, reply_timeout
+        )
+        return reply, trace
+
+    def queue_request(
+        self,
+        message: AptMessage,
+        match_reply: Callable[
+            [
+                AptMessage,
+            ],
+            bool,
+        ],
+        reply_filter: None | MessageFilter,
+        priority: Priority,
+        trace: None | RequestTrace,
+        reply_timeout: float = REPLY_TIMEOUT,
+    ) -> AptMessage:
         # There's probably a way to pool queues for re-use, creating
         # one per thread, rather than creating a new queue for every
         # request. However, considering that we send very few
         # commands, this is probably fine.
-        reply_queue: Queue[AptMessage] = Queue()
-        self.tx_ordered_sender_queue.put((message, match_reply, reply_queue))
-        return reply_queue.get()
+        reply_queue: Queue[AptMessage | Exception] = Queue()
+        self.queue_ordered(
+            priority,
+            (message, match_reply, reply_filter, reply_queue, reply_timeout, trace),
+        )
+        reply = reply_queue.get()
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def queue_ordered(self, priority: Priority, request: OrderedRequest) -> None:
+        self.tx_ordered_sender_queue.put(
+            (priority, next(self.tx_ordered_sender_sequence), request)
+        )
+        self.connection_metrics.tx_queue_depth.set(
+            self.tx_ordered_sender_queue.qsize(), connection=self.label
+        )
@@ -0,0 +1,215 @@
+"""Operations on every open ``AptConnection`` at once.
+
+``emergency_stop`` halts every motor on the bench. It stops every
+channel of every open connection in parallel, one thread per
+connection, with emergency-priority stops that skip the ordered
+queues, and then waits for each channel to confirm that it has stopped.
+"""
+
+import threading
+import time
+from collections.abc import Iterable
+from dataclasses import dataclass
+from queue import Empty
+from typing import TypeGuard
+
+import structlog
+
+from ..events import Event
+from .connection import AptConnection, Priority, open_connections
+from .protocol import (
+    Address,
+    AptMessage,
+    AptMessage_MGMSG_MOT_GET_STATUSUPDATE,
+    AptMessage_MGMSG_MOT_GET_USTATUSUPDATE,
+    AptMessage_MGMSG_MOT_MOVE_STOP,
+    AptMessage_MGMSG_MOT_MOVE_STOPPED,
+    AptMessage_MGMSG_MOT_REQ_USTATUSUPDATE,
+    ChanIdent,
+    StopMode,
+)
+from .subscription import MessageFilter
+
+log = structlog.get_logger()
+
+# Seconds between requests for the status of channels that have not
+# yet confirmed that they stopped, for example while decelerating
+# after a controlled stop
+STATUS_REQUEST_INTERVAL = 0.1
+
+
+@dataclass(frozen=True, kw_only=True)
+class ConnectionStopResult:
+    # The connection's metrics label
+    connection: str
+    confirmed: frozenset[ChanIdent]
+    unconfirmed: frozenset[ChanIdent]
+    # Seconds from the start of the fleet stop until every channel
+    # confirmed, or until the timeout or an error
+    elapsed: float
+    error: None | Exception = None
+
+
+@dataclass(frozen=True, kw_only=True)
+class FleetStopResult:
+    connections: tuple[ConnectionStopResult, ...]
+    # Seconds from the start of the fleet stop until every connection
+    # finished
+    elapsed: float
+
+    @property
+    def confirmed(self) -> bool:
+        """Whether every channel of every connection confirmed that it
+        stopped."""
+        return all(
+            not result.unconfirmed and result.error is None
+            for result in self.connections
+        )
+
+
+# Messages that can confirm that a channel stopped
+StopConfirmation = (
+    AptMessage_MGMSG_MOT_MOVE_STOPPED
+    | AptMessage_MGMSG_MOT_GET_USTATUSUPDATE
+    | AptMessage_MGMSG_MOT_GET_STATUSUPDATE
+)
+
+
+def confirms_stop(message: AptMessage) -> TypeGuard[StopConfirmation]:
+    if isinstance(message, AptMessage_MGMSG_MOT_MOVE_STOPPED):
+        return True
+    if isinstance(
+        message,
+        (AptMessage_MGMSG_MOT_GET_USTATUSUPDATE, AptMessage_MGMSG_MOT_GET_STATUSUPDATE),
+    ):
+        status = message.status
+        return not (
+            status.INMOTIONCW
+            or status.INMOTIONCCW
+            or status.JOGGINGCW
+            or status.JOGGINGCCW
+            or status.HOMING
+        )
+    return False
+
+
+def stop_connection(
+    connection: AptConnection, stop_mode: StopMode, start: float, deadline: float
+) -> ConnectionStopResult:
+    # Connections without a motor driver are assumed to have a
+    # single channel, like most APT controllers
+    channels = frozenset(connection.motor_channels) or frozenset({ChanIdent.CHANNEL_1})
+    confirmed: set[ChanIdent] = set()
+    error = None
+    try:
+        with connection.rx_subscribe(
+            message_filter=MessageFilter(
+                message_types={
+                    AptMessage_MGMSG_MOT_MOVE_STOPPED,
+                    AptMessage_MGMSG_MOT_GET_USTATUSUPDATE,
+                    AptMessage_MGMSG_MOT_GET_STATUSUPDATE,
+                },
+                chan_idents=channels,
+            )
+        ) as queue:
+            for chan_ident in channels:
+                connection.send_message_no_reply(
+                    AptMessage_MGMSG_MOT_MOVE_STOP(
+                        chan_ident=chan_ident,
+                        stop_mode=stop_mode,
+                        destination=Address.GENERIC_USB,
+                        source=Address.HOST_CONTROLLER,
+                    ),
+                    priority=Priority.EMERGENCY,
+                )
+            next_status_request = time.perf_counter()
+            while confirmed != channels:
+                now = time.perf_counter()
+                if now >= deadline:
+                    break
+                if now >= next_status_request:
+                    # A channel that was not moving does not report
+                    # MOVE_STOPPED, so ask for its status
+                    for chan_ident in channels - confirmed:
+                        connection.send_message_unordered(
+                            AptMessage_MGMSG_MOT_REQ_USTATUSUPDATE(
+                                chan_ident=chan_ident,
+                                destination=Address.GENERIC_USB,
+                                source=Address.HOST_CONTROLLER,
+                            )
+                        )
+                    next_status_request = now + STATUS_REQUEST_INTERVAL
+                try:
+                    message = queue.get(
+                        timeout=min(deadline, next_status_request) - now
+                    )
+                except Empty:
+                    continue
+                if confirms_stop(message):
+                    confirmed.add(message.chan_ident)
+    # Stop the remaining connections even if this one fails
+    except Exception as e:  # noqa: BLE001  # pylint: disable=W0718
+        error = e
+    return ConnectionStopResult(
+        connection=connection.label,
+        confirmed=frozenset(confirmed),
+        unconfirmed=channels - confirmed,
+        elapsed=time.perf_counter() - start,
+        error=error,
+    )
+
+
+def emergency_stop(
+    stop_mode: StopMode = StopMode.IMMEDIATE,
+    timeout: float = 1.0,
+    connections: None | Iterable[AptConnection] = None,
+) -> FleetStopResult:
+    """Stop every motor channel of every open connection, or of
+    ``connections`` if given, and wait up to ``timeout`` seconds for
+    each channel to confirm that it stopped, either with
+    MGMSG_MOT_MOVE_STOPPED or with a status showing no motion.
+
+    The channels of a connection are those of the motor drivers
+    created on it. Moves waiting for completion on a stopped channel
+    raise :py:class:`pnpq.errors.RequestCancelledError`.
+    """
+    if connections is None:
+        connections = list(open_connections.values())
+    start = time.perf_counter()
+    deadline = start + timeout
+    results: dict[int, ConnectionStopResult] = {}
+
+    def stop(index: int, connection: AptConnection) -> None:
+        results[index] = stop_connection(connection, stop_mode, start, deadline)
+
+    threads = [
+        threading.Thread(target=stop, args=(index, connection), daemon=True)
+        for index, connection in enumerate(connections)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result = FleetStopResult(
+        connections=tuple(results[index] for index in range(len(threads))),
+        elapsed=time.perf_counter() - start,
+    )
+    event = {
+        "event": Event.FLEET_STOP,
+        "stop_mode": stop_mode,
+        "elapsed": result.elapsed,
+        "connections": len(result.connections),
+    }
+    if result.confirmed:
+        log.info(**event)
+    else:
+        log.error(
+            **event,
+            unconfirmed={
+                r.connection: sorted(r.unconfirmed)
+                for r in result.connections
+                if r.unconfirmed
+            },
+            errors={r.connection: r.error for r in result.connections if r.error},
+        )
+    return result
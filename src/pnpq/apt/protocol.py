@@ -1,16 +1,21 @@
 # pylint: disable=C0103, C0302
 
+from __future__ import annotations
+
 import dataclasses
 import enum
+import functools
 from abc import ABC, abstractmethod
+from collections.abc import Callable
 from dataclasses import dataclass
 from enum import STRICT, Enum, IntFlag, StrEnum
 from struct import Struct
-from typing import ClassVar, Self
+from typing import TYPE_CHECKING, Any, ClassVar, NoReturn, Self, cast
 
-from pint import Quantity
+from .. import units
 
-from ..units import pnpq_ureg
+if TYPE_CHECKING:
+    from pint import Quantity, Unit
 
 
 @enum.unique
@@ -38,6 +43,11 @@ class AptMessageId(int, Enum):
     MGMSG_MOT_GET_USTATUSUPDATE = 0x0491
     MGMSG_MOT_REQ_USTATUSUPDATE = 0x0490
 
+    MGMSG_MOT_SET_HOMEPARAMS = 0x0440
+    MGMSG_MOT_REQ_HOMEPARAMS = 0x0441
+    MGMSG_MOT_GET_HOMEPARAMS = 0x0442
+
+    MGMSG_MOT_MOVE_RELATIVE = 0x0448
     MGMSG_MOT_MOVE_ABSOLUTE = 0x0453
     MGMSG_MOT_MOVE_COMPLETED = 0x0464
     MGMSG_MOT_MOVE_HOME = 0x0443
@@ -112,7 +122,7 @@ class ChanIdent(IntFlag, boundary=STRICT):
     CHANNEL_4 = 0x08
 
     @classmethod
-    def from_linear(cls, linear: int) -> "ChanIdent":
+    def from_linear(cls, linear: int) -> ChanIdent:
         if linear < 1 or linear > 4:
             raise ValueError("Channel identifier must be between 1 and 4.")
         return cls(1 << (linear - 1))
@@ -129,7 +139,7 @@ class EnableState(int, Enum):
         return self.value == 0x01
 
     @classmethod
-    def from_bool(cls, toggle: bool) -> "EnableState":
+    def from_bool(cls, toggle: bool) -> EnableState:
         if toggle:
             return cls.CHANNEL_ENABLED
         return cls.CHANNEL_DISABLED
@@ -151,6 +161,23 @@ class JogDirection(int, Enum):
     REVERSE = 0x02
 
 
+@enum.unique
+class HomeDirection(int, Enum):
+    """Used in MGMSG_MOT_SET_HOMEPARAMS."""
+
+    FORWARD = 0x01
+    REVERSE = 0x02
+
+
+@enum.unique
+class LimitSwitch(int, Enum):
+    """The limit switch that ends homing. Used in
+    MGMSG_MOT_SET_HOMEPARAMS."""
+
+    HARDWARE_REVERSE = 0x01
+    HARDWARE_FORWARD = 0x04
+
+
 @enum.unique
 class UStatusBits(IntFlag):
     """Bitmask used in MGMSG_MOT_GET_USTATUSUPDATE to indicate motor
@@ -326,16 +353,124 @@ class ATS(StrEnum):
     U_BYTE = "B"  # Unsigned 8-bit integer
 
 
+@dataclass(frozen=True, kw_only=True)
+class AptField:
+    """One entry in the declarative layout of an APT message.
+
+    A layout lists, in wire order, the fields that follow the message
+    ID (for header-only messages, the two parameter bytes) or the
+    6-byte header (for messages with data). The encoder and decoder
+    for every concrete message class are generated from its layout.
+
+    :param name: Name of the dataclass field this entry maps to.
+    :param format: Struct format built from :py:class:`ATS` codes. It
+        may unpack into several values, for example ``4B``.
+    :param decode: Converts the unpacked value or values into the
+        field's Python value. If ``None``, the value is used as-is.
+    :param encode: Converts the field's Python value into the value
+        to pack, or into a tuple of values if ``format`` unpacks into
+        several values. If ``None``, the value is packed as-is.
+    """
+
+    name: str
+    format: str
+    decode: None | Callable[..., Any] = None
+    encode: None | Callable[[Any], Any] = None
+
+    @property
+    def width(self) -> int:
+        """The number of values that ``format`` unpacks into."""
+        field_struct = Struct(f"<{self.format}")
+        return len(field_struct.unpack(bytes(field_struct.size)))
+
+
+def _chan_ident_field(ats: ATS) -> AptField:
+    return AptField(name="chan_ident", format=ats, decode=ChanIdent)
+
+
+def _firmware_version_from_wire(
+    minor_revision: int, interim_revision: int, major_revision: int, unused: int
+) -> FirmwareVersion:
+    return FirmwareVersion(
+        major_revision=major_revision,
+        interim_revision=interim_revision,
+        minor_revision=minor_revision,
+        unused=unused,
+    )
+
+
+def _firmware_version_to_wire(
+    firmware_version: FirmwareVersion,
+) -> tuple[int, int, int, int]:
+    return (
+        firmware_version.minor_revision,
+        firmware_version.interim_revision,
+        firmware_version.major_revision,
+        firmware_version.unused,
+    )
+
+
+# Status words repeat constantly in the status stream, and building
+# the dataclass bit by bit is by far the most expensive part of
+# decoding a status message. Both dataclasses are frozen, so the
+# decoded instances can be shared.
+
+
+@functools.lru_cache(maxsize=256)
+def _ustatus_from_wire(status_flag: int) -> UStatus:
+    return UStatus.from_bits(UStatusBits(status_flag))
+
+
+@functools.lru_cache(maxsize=256)
+def _status_from_wire(status_flag: int) -> Status:
+    return Status.from_bits(StatusBits(status_flag))
+
+
+@functools.cache
+def _milliamp() -> Unit:
+    # Resolved on first use so that importing this module does not
+    # build the unit registry.
+    milliamp: Unit = units.pnpq_ureg.milliamp
+    return milliamp
+
+
+def _milliamp_from_wire(motor_current: int) -> Quantity:
+    return units.pnpq_ureg.Quantity(motor_current, _milliamp())
+
+
+def _milliamp_to_wire(motor_current: Quantity) -> int:
+    return cast(int, round(motor_current.to(_milliamp()).magnitude))
+
+
 # Abstract and partial parent classes for building concrete message
 # classes
 
 
 @dataclass(frozen=True, kw_only=True)
 class AptMessage(ABC):
+    """Base class for all APT messages.
+
+    Concrete message classes set ``message_id`` and describe their
+    wire format with ``layout``. :py:meth:`from_bytes` and
+    :py:meth:`to_bytes` are generated from the layout the first time
+    they are used, so importing this module stays cheap and each
+    message class only pays for the codec it actually needs.
+    """
+
     destination: Address
     source: Address
 
     message_id: ClassVar[AptMessageId]
+    layout: ClassVar[tuple[AptField, ...]] = ()
+
+    # Derived from ``layout`` when a concrete message class is created.
+    data_length: ClassVar[int]
+    message_struct: ClassVar[Struct]
+
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        super().__init_subclass__(**kwargs)
+        if "message_id" in cls.__dict__:
+            _prepare_message_class(cls)
 
     @property
     @abstractmethod
@@ -343,13 +478,13 @@ class AptMessage(ABC):
         pass
 
     @classmethod
-    @abstractmethod
     def from_bytes(cls, raw: bytes) -> Self:
-        pass
+        _compile_codec(cls)
+        return cls.from_bytes(raw)
 
-    @abstractmethod
     def to_bytes(self) -> bytes:
-        pass
+        _compile_codec(type(self))
+        return self.to_bytes()
 
 
 @dataclass(frozen=True, kw_only=True)
@@ -377,6 +512,9 @@ class AptMessageForStreamParsing:
 
 @dataclass(frozen=True, kw_only=True)
 class AptMessageHeaderOnly(AptMessage):
+    """Messages made of the 6-byte header alone. ``layout`` must
+    describe exactly the two parameter bytes."""
+
     @property
     def destination_serialization(self) -> int:
         return self.destination
@@ -384,36 +522,21 @@ class AptMessageHeaderOnly(AptMessage):
 
 @dataclass(frozen=True, kw_only=True)
 class AptMessageHeaderOnlyNoParams(AptMessageHeaderOnly):
-    message_struct: ClassVar[Struct] = Struct(f"<{ATS.WORD}2{ATS.CHAR}2{ATS.U_BYTE}")
+    layout: ClassVar[tuple[AptField, ...]] = (
+        AptField(name="param1", format=ATS.CHAR),
+        AptField(name="param2", format=ATS.CHAR),
+    )
+
     param1: bytes = bytes(1)
     param2: bytes = bytes(1)
 
-    @classmethod
-    def from_bytes(cls, raw: bytes) -> Self:
-        message_id, param1, param2, destination, source = cls.message_struct.unpack(raw)
-        if message_id != cls.message_id:
-            raise ValueError(
-                f"Expected message ID {cls.message_id.value}, but received {message_id} instead. Full raw message was {raw!r}"
-            )
-        return cls(
-            param1=param1,
-            param2=param2,
-            destination=Address(destination),
-            source=Address(source),
-        )
-
-    def to_bytes(self) -> bytes:
-        return self.message_struct.pack(
-            self.message_id,
-            self.param1,
-            self.param2,
-            self.destination_serialization,
-            self.source,
-        )
-
 
 @dataclass(frozen=True, kw_only=True)
 class AptMessageWithData(AptMessage):
+    """Messages with a data packet following the header. ``layout``
+    describes the data packet, and ``data_length`` is derived from
+    it."""
+
     header_struct_str: ClassVar[str] = f"<{ATS.WORD}{ATS.WORD}2{ATS.U_BYTE}"
 
     @property
@@ -423,135 +546,60 @@ class AptMessageWithData(AptMessage):
 
 @dataclass(frozen=True, kw_only=True)
 class AptMessageHeaderOnlyChanIdent(AptMessageHeaderOnly):
-    message_struct: ClassVar[Struct] = Struct(
-        f"<{ATS.WORD}{ATS.U_BYTE}{ATS.CHAR}2{ATS.U_BYTE}"
+    layout: ClassVar[tuple[AptField, ...]] = (
+        _chan_ident_field(ATS.U_BYTE),
+        AptField(name="param2", format=ATS.CHAR),
     )
 
     chan_ident: ChanIdent
     param2: bytes = bytes(1)
 
-    @classmethod
-    def from_bytes(cls, raw: bytes) -> Self:
-        message_id, chan_ident, param2, destination, source = cls.message_struct.unpack(
-            raw
-        )
-        if message_id != cls.message_id:
-            raise ValueError(
-                f"Expected message ID {cls.message_id.value}, but received {message_id} instead. Full raw message was {raw!r}"
-            )
-        return cls(
-            chan_ident=ChanIdent(chan_ident),
-            destination=Address(destination),
-            param2=param2,
-            source=Address(source),
-        )
-
-    def to_bytes(self) -> bytes:
-        return self.message_struct.pack(
-            self.message_id,
-            self.chan_ident,
-            self.param2,
-            self.destination_serialization,
-            self.source,
-        )
-
 
 @dataclass(frozen=True, kw_only=True)
 class AptMessageHeaderOnlyChanEnableState(AptMessageHeaderOnly):
-    message_struct: ClassVar[Struct] = Struct(f"<{ATS.WORD}2{ATS.U_BYTE}2{ATS.U_BYTE}")
+    layout: ClassVar[tuple[AptField, ...]] = (
+        _chan_ident_field(ATS.U_BYTE),
+        AptField(name="enable_state", format=ATS.U_BYTE, decode=EnableState),
+    )
 
     chan_ident: ChanIdent
     enable_state: EnableState
 
-    @classmethod
-    def from_bytes(cls, raw: bytes) -> Self:
-        message_id, chan_ident, enable_state, destination, source = (
-            cls.message_struct.unpack(raw)
-        )
-        if message_id != cls.message_id:
-            raise ValueError(
-                f"Expected message ID {cls.message_id.value}, but received {message_id} instead. Full raw message was {raw!r}"
-            )
-        return cls(
-            chan_ident=ChanIdent(chan_ident),
-            destination=Address(destination),
-            enable_state=EnableState(enable_state),
-            source=Address(source),
-        )
-
-    def to_bytes(self) -> bytes:
-        return self.message_struct.pack(
-            self.message_id,
-            self.chan_ident,
-            self.enable_state,
-            self.destination_serialization,
-            self.source,
-        )
-
 
 @dataclass(frozen=True, kw_only=True)
 class AptMessageWithDataPosition(AptMessageWithData):
-    data_length: ClassVar[int] = 6
-    message_struct: ClassVar[Struct] = Struct(
-        f"{AptMessageWithData.header_struct_str}{ATS.WORD}{ATS.LONG}"
+    layout: ClassVar[tuple[AptField, ...]] = (
+        _chan_ident_field(ATS.WORD),
+        AptField(name="position", format=ATS.LONG),
     )
 
     chan_ident: ChanIdent
     position: int
 
-    @classmethod
-    def from_bytes(cls, raw: bytes) -> Self:
-        (
-            message_id,
-            data_length,
-            destination,
-            source,
-            chan_ident,
-            position,
-        ) = cls.message_struct.unpack(raw)
-
-        if message_id != cls.message_id:
-            raise ValueError(
-                f"Expected message ID {cls.message_id.value}, but received {message_id} instead. Full raw data was {raw!r}"
-            )
-        if data_length != cls.data_length:
-            raise ValueError(
-                f"Expected data packet length {cls.data_length}, but received {data_length} instead. Full raw data was {raw!r}"
-            )
-        if destination & 0x80 != 0x80:
-            raise ValueError(
-                f"Expected the destination's highest bit to be 1, indicating that a data packet follows, but it was 0. Full raw data was {raw!r}"
-            )
-
-        return cls(
-            destination=Address(destination & 0x7F),
-            source=Address(source),
-            chan_ident=ChanIdent(chan_ident),
-            position=position,
-        )
-
-    def to_bytes(self) -> bytes:
-        return self.message_struct.pack(
-            self.message_id,
-            self.data_length,
-            self.destination_serialization,
-            self.source,
-            self.chan_ident,
-            self.position,
-        )
-
 
 @dataclass(frozen=True, kw_only=True)
 class AptMessageWithDataMotorStatus(AptMessageWithData):
-    data_length: ClassVar[int] = 14
-
     # The official documentation for this struct does not follow the
     # official vocabulary established at the beginning of the manual
     # to indicate which fields are signed and which are unsigned. The
     # below is a best guess, assuming that position and velocity can
     # possibly be negative. Motor current can clearly be negative.
-    message_struct: ClassVar[Struct] = Struct(
-        f"{AptMessageWithData.header_struct_str}{ATS.WORD}{ATS.LONG}{ATS.SHORT}{ATS.SHORT}{ATS.DWORD}"
+    layout: ClassVar[tuple[AptField, ...]] = (
+        _chan_ident_field(ATS.WORD),
+        AptField(name="position", format=ATS.LONG),
+        AptField(name="velocity", format=ATS.SHORT),
+        AptField(
+            name="motor_current",
+            format=ATS.SHORT,
+            decode=_milliamp_from_wire,
+            encode=_milliamp_to_wire,
+        ),
+        AptField(
+            name="status",
+            format=ATS.DWORD,
+            decode=_ustatus_from_wire,
+            encode=UStatus.to_bits,
+        ),
     )
 
     chan_ident: ChanIdent
@@ -563,65 +611,18 @@ class AptMessageWithDataMotorStatus(AptMessageWithData):
     def __post_init__(self) -> None:
         # Ensure that a unit of current was passed in by attempting to
         # convert it to milliamps.
-        self.motor_current.to(pnpq_ureg.milliamp)
-
-    @classmethod
-    def from_bytes(cls, raw: bytes) -> Self:
-        (
-            message_id,
-            data_length,
-            destination,
-            source,
-            chan_ident,
-            position,
-            velocity,
-            motor_current,
-            status_flag,
-        ) = cls.message_struct.unpack(raw)
-
-        if message_id != cls.message_id:
-            raise ValueError(
-                f"Expected message ID {cls.message_id.value}, but received {message_id} instead. Full raw data was {raw!r}"
-            )
-        if data_length != cls.data_length:
-            raise ValueError(
-                f"Expected data packet length {cls.data_length}, but received {data_length} instead. Full raw data was {raw!r}"
-            )
-        if destination & 0x80 != 0x80:
-            raise ValueError(
-                f"Expected the destination's highest bit to be 1, indicating that a data packet follows, but it was 0. Full raw data was {raw!r}"
-            )
-
-        return cls(
-            destination=Address(destination & 0x7F),
-            source=Address(source),
-            chan_ident=ChanIdent(chan_ident),
-            position=position,
-            velocity=velocity,
-            motor_current=(motor_current * pnpq_ureg.milliamp),
-            status=UStatus.from_bits(UStatusBits(status_flag)),
-        )
-
-    def to_bytes(self) -> bytes:
-        return self.message_struct.pack(
-            self.message_id,
-            self.data_length,
-            self.destination_serialization,
-            self.source,
-            self.chan_ident,
-            self.position,
-            self.velocity,
-            round(self.motor_current.to(pnpq_ureg.milliamp).magnitude),
-            self.status.to_bits(),
-        )
+        self.motor_current.to(_milliamp())
 
 
 @dataclass(frozen=True, kw_only=True)
 class AptMessageWithDataPolParams(AptMessageWithData):
-    data_length: ClassVar[int] = 12
-
-    message_struct: ClassVar[Struct] = Struct(
-        f"{AptMessageWithData.header_struct_str}6{ATS.WORD}"
+    layout: ClassVar[tuple[AptField, ...]] = (
+        AptField(name="unused", format=ATS.WORD),
+        AptField(name="velocity", format=ATS.WORD),
+        AptField(name="home_position", format=ATS.WORD),
+        AptField(name="jog_step_1", format=ATS.WORD),
+        AptField(name="jog_step_2", format=ATS.WORD),
+        AptField(name="jog_step_3", format=ATS.WORD),
     )
 
     unused: int = 0
@@ -631,58 +632,162 @@ class AptMessageWithDataPolParams(AptMessageWithData):
     jog_step_2: int
     jog_step_3: int
 
-    @classmethod
-    def from_bytes(cls, raw: bytes) -> Self:
-        (
-            message_id,
-            data_length,
-            destination,
-            source,
-            unused,
-            velocity,
-            home_position,
-            jog_step_1,
-            jog_step_2,
-            jog_step_3,
-        ) = cls.message_struct.unpack(raw)
-
-        if message_id != cls.message_id:
-            raise ValueError(
-                f"Expected message ID {cls.message_id.value}, but received {message_id} instead. Full raw data was {raw!r}"
-            )
-        if data_length != cls.data_length:
-            raise ValueError(
-                f"Expected data packet length {cls.data_length}, but received {data_length} instead. Full raw data was {raw!r}"
-            )
-        if destination & 0x80 != 0x80:
-            raise ValueError(
-                f"Expected the destination's highest bit to be 1, indicating that a data packet follows, but it was 0. Full raw data was {raw!r}"
-            )
 
-        return cls(
-            destination=Address(destination & 0x7F),
-            source=Address(source),
-            unused=unused,
-            velocity=velocity,
-            home_position=home_position,
-            jog_step_1=jog_step_1,
-            jog_step_2=jog_step_2,
-            jog_step_3=jog_step_3,
+@dataclass(frozen=True, kw_only=True)
+class AptMessageWithDataHomeParams(AptMessageWithData):
+    layout: ClassVar[tuple[AptField, ...]] = (
+        _chan_ident_field(ATS.WORD),
+        AptField(name="home_direction", format=ATS.WORD, decode=HomeDirection),
+        AptField(name="limit_switch", format=ATS.WORD, decode=LimitSwitch),
+        AptField(name="home_velocity", format=ATS.LONG),
+        AptField(name="offset_distance", format=ATS.LONG),
+    )
+
+    chan_ident: ChanIdent
+    home_direction: HomeDirection
+    limit_switch: LimitSwitch
+    home_velocity: int
+    offset_distance: int
+
+
+# Codec generation
+
+
+_HEADER_STRUCT = Struct(f"<{ATS.WORD}{ATS.WORD}2{ATS.U_BYTE}")
+
+
+def _prepare_message_class(cls: type[AptMessage]) -> None:
+    """Derive the message struct and data length of a concrete
+    message class from its layout."""
+    layout_format = "".join(field.format for field in cls.layout)
+    if issubclass(cls, AptMessageWithData):
+        cls.message_struct = Struct(f"{cls.header_struct_str}{layout_format}")
+        cls.data_length = cls.message_struct.size - _HEADER_STRUCT.size
+    elif issubclass(cls, AptMessageHeaderOnly):
+        cls.message_struct = Struct(f"<{ATS.WORD}{layout_format}2{ATS.U_BYTE}")
+        cls.data_length = 0
+        if cls.message_struct.size != _HEADER_STRUCT.size:
+            raise TypeError(
+                f"The layout of header-only message {cls.__name__} must describe exactly 2 bytes."
+            )
+    else:
+        raise TypeError(
+            f"{cls.__name__} must inherit from AptMessageHeaderOnly or AptMessageWithData."
         )
+    # Install the lazy codec entry points on the class itself, so that
+    # they take precedence over anything else in the MRO (see
+    # AptMessage_MGMSG_MOT_MOVE_COMPLETED).
+    for name in ("from_bytes", "to_bytes"):
+        setattr(cls, name, AptMessage.__dict__[name])
+
+
+def _raise_invalid_header(cls: type[AptMessage], raw: bytes) -> NoReturn:
+    """Called by generated decoders once a header check has failed.
+    Formatting the error is deferred to here to keep it off the
+    success path."""
+    message_id, data_length, destination, _ = _HEADER_STRUCT.unpack_from(raw)
+    if message_id != cls.message_id:
+        raise ValueError(
+            f"Expected message ID {cls.message_id.value}, but received {message_id} instead. Full raw data was {raw!r}"
+        )
+    if data_length != cls.data_length:
+        raise ValueError(
+            f"Expected data packet length {cls.data_length}, but received {data_length} instead. Full raw data was {raw!r}"
+        )
+    raise ValueError(
+        f"Expected the destination's highest bit to be 1, indicating that a data packet follows, but it was {destination >> 7}. Full raw data was {raw!r}"
+    )
 
-    def to_bytes(self) -> bytes:
-        return self.message_struct.pack(
-            self.message_id,
-            self.data_length,
-            self.destination_serialization,
-            self.source,
-            self.unused,
-            self.velocity,
-            self.home_position,
-            self.jog_step_1,
-            self.jog_step_2,
-            self.jog_step_3,
+
+def _compile_codec(cls: type[AptMessage]) -> None:
+    """Generate ``from_bytes`` and ``to_bytes`` for the concrete
+    message class that ``cls`` is, or inherits from, and install them
+    on that class, replacing the lazy entry points.
+
+    The generated functions unpack the whole message with the single
+    precompiled ``message_struct`` and check the header inline, in the
+    same way the ``dataclasses`` module generates ``__init__``.
+    """
+    for mro_cls in cls.__mro__:
+        if "message_id" in mro_cls.__dict__:
+            message_cls = cast(type[AptMessage], mro_cls)
+            break
+    else:
+        raise TypeError(f"{cls.__name__} is not a concrete APT message class.")
+
+    namespace: dict[str, Any] = {
+        "Address": Address,
+        "raise_invalid_header": _raise_invalid_header,
+        "pack": message_cls.message_struct.pack,
+        "unpack": message_cls.message_struct.unpack,
+    }
+    unpacked: list[str] = []
+    decoded: list[str] = []
+    packed: list[str] = []
+    for index, field in enumerate(message_cls.layout):
+        values = [f"value_{index}_{n}" for n in range(field.width)]
+        unpacked.extend(values)
+        if field.decode is None:
+            assert len(values) == 1
+            decoded.append(f"{field.name}={values[0]}")
+        else:
+            namespace[f"decode_{index}"] = field.decode
+            decoded.append(f"{field.name}=decode_{index}({', '.join(values)})")
+        if field.encode is None:
+            packed.append(f"self.{field.name}")
+        else:
+            namespace[f"encode_{index}"] = field.encode
+            splat = "*" if len(values) > 1 else ""
+            packed.append(f"{splat}encode_{index}(self.{field.name})")
+
+    message_id = int(message_cls.message_id)
+    if issubclass(message_cls, AptMessageWithData):
+        unpack_target = ["message_id", "data_length", "destination", "source"]
+        unpack_target += unpacked
+        check = (
+            f"message_id != {message_id}"
+            f" or data_length != {message_cls.data_length}"
+            " or not destination & 0x80"
         )
+        destination = "Address(destination & 0x7F)"
+        pack_args = [
+            str(message_id),
+            str(message_cls.data_length),
+            "self.destination | 0x80",
+            "self.source",
+            *packed,
+        ]
+    else:
+        unpack_target = ["message_id", *unpacked, "destination", "source"]
+        check = f"message_id != {message_id}"
+        destination = "Address(destination)"
+        pack_args = [str(message_id), *packed, "self.destination", "self.source"]
+
+    source = "\n".join(
+        [
+            "def from_bytes(cls, raw):",
+            f"    {', '.join(unpack_target)} = unpack(raw)",
+            f"    if {check}:",
+            "        raise_invalid_header(cls, raw)",
+            "    return cls(",
+            f"        destination={destination},",
+            "        source=Address(source),",
+            *(f"        {argument}," for argument in decoded),
+            "    )",
+            "",
+            "def to_bytes(self):",
+            f"    return pack({', '.join(pack_args)})",
+        ]
+    )
+    exec(  # noqa: S102  # pylint: disable=W0122
+        compile(source, f"<codec {message_cls.__name__}>", "exec"), namespace
+    )
+    for name, method in (
+        ("from_bytes", classmethod(namespace["from_bytes"])),
+        ("to_bytes", namespace["to_bytes"]),
+    ):
+        namespace[name].__qualname__ = f"{message_cls.__qualname__}.{name}"
+        setattr(message_cls, name, method)
 
 
 # Concrete message implementation classes
@@ -695,10 +800,26 @@ class AptMessage_MGMSG_HW_DISCONNECT(AptMessageHeaderOnlyNoParams):
 
 @dataclass(frozen=True, kw_only=True)
 class AptMessage_MGMSG_HW_GET_INFO(AptMessageWithData):
-    data_length: ClassVar[int] = 84
     message_id: ClassVar[AptMessageId] = AptMessageId.MGMSG_HW_GET_INFO
-    message_struct: ClassVar[Struct] = Struct(
-        f"{AptMessageWithData.header_struct_str}{ATS.LONG}8{ATS.CHAR_N}{ATS.WORD}4{ATS.U_BYTE}60{ATS.CHAR_N}3{ATS.WORD}"
+    layout: ClassVar[tuple[AptField, ...]] = (
+        AptField(name="serial_number", format=ATS.LONG),
+        AptField(
+            name="model_number",
+            format=f"8{ATS.CHAR_N}",
+            decode=lambda raw: raw.decode("latin_1").rstrip("\x00"),
+            encode=lambda model_number: model_number.encode("latin_1"),
+        ),
+        AptField(name="hardware_type", format=ATS.WORD, decode=HardwareType),
+        AptField(
+            name="firmware_version",
+            format=f"4{ATS.U_BYTE}",
+            decode=_firmware_version_from_wire,
+            encode=_firmware_version_to_wire,
+        ),
+        AptField(name="internal_use", format=f"60{ATS.CHAR_N}"),
+        AptField(name="hardware_version", format=ATS.WORD),
+        AptField(name="modification_state", format=ATS.WORD),
+        AptField(name="number_of_channels", format=ATS.WORD),
     )
 
     firmware_version: FirmwareVersion
@@ -710,76 +831,6 @@ class AptMessage_MGMSG_HW_GET_INFO(AptMessageWithData):
     number_of_channels: int  # Labeled "nchs" in the documentation
     serial_number: int
 
-    @classmethod
-    def from_bytes(cls, raw: bytes) -> "AptMessage_MGMSG_HW_GET_INFO":
-        (
-            message_id,
-            data_length,
-            destination,
-            source,
-            serial_number,
-            model_number,
-            hardware_type,
-            minor_revision,
-            interim_revision,
-            major_revision,
-            unused_revision,
-            internal_use,
-            hardware_version,
-            modification_state,
-            number_of_channels,
-        ) = cls.message_struct.unpack(raw)
-
-        if message_id != cls.message_id:
-            raise ValueError(
-                f"Expected message ID {cls.message_id.value}, but received {message_id} instead. Full raw data was {raw!r}"
-            )
-        if data_length != cls.data_length:
-            raise ValueError(
-                f"Expected data packet length {cls.data_length}, but received {data_length} instead. Full raw data was {raw!r}"
-            )
-        if destination & 0x80 != 0x80:
-            raise ValueError(
-                f"Expected the destination's highest bit to be 1, indicating that a data packet follows, but it was 0. Full raw data was {raw!r}"
-            )
-
-        return AptMessage_MGMSG_HW_GET_INFO(
-            destination=Address(destination & 0x7F),
-            firmware_version=FirmwareVersion(
-                interim_revision=interim_revision,
-                major_revision=major_revision,
-                minor_revision=minor_revision,
-                unused=unused_revision,
-            ),
-            hardware_type=HardwareType(hardware_type),
-            hardware_version=hardware_version,
-            internal_use=internal_use,
-            model_number=model_number.decode("latin_1").rstrip("\x00"),
-            modification_state=modification_state,
-            number_of_channels=number_of_channels,
-            serial_number=serial_number,
-            source=Address(source),
-        )
-
-    def to_bytes(self) -> bytes:
-        return self.message_struct.pack(
-            self.message_id,
-            self.data_length,
-            self.destination_serialization,
-            self.source,
-            self.serial_number,
-            self.model_number.encode("latin_1"),
-            self.hardware_type,
-            self.firmware_version.minor_revision,
-            self.firmware_version.interim_revision,
-            self.firmware_version.major_revision,
-            self.firmware_version.unused,
-            self.internal_use,
-            self.hardware_version,
-            self.modification_state,
-            self.number_of_channels,
-        )
-
 
 @dataclass(frozen=True, kw_only=True)
 class AptMessage_MGMSG_HW_REQ_INFO(AptMessageHeaderOnlyNoParams):
@@ -853,14 +904,20 @@ class AptMessage_MGMSG_MOT_REQ_POSCOUNTER(AptMessageHeaderOnlyChanIdent):
 class AptMessage_MGMSG_MOT_GET_STATUSUPDATE(AptMessageWithData):
     message_id = AptMessageId.MGMSG_MOT_GET_STATUSUPDATE
 
-    data_length: ClassVar[int] = 14
-
     # In the official documentation, it says that the message is 34 bytes long
     # With these additional fields reserved for future use:
     # (WORD - channel 2 identifier, LONG, LONG, LONG)
     # However, for the model of waveplate we are using, the message is only 20 bytes long
-    message_struct: ClassVar[Struct] = Struct(
-        f"{AptMessageWithData.header_struct_str}{ATS.WORD}{ATS.LONG}{ATS.LONG}{ATS.DWORD}"
+    layout: ClassVar[tuple[AptField, ...]] = (
+        _chan_ident_field(ATS.WORD),
+        AptField(name="position", format=ATS.LONG),
+        AptField(name="enc_count", format=ATS.LONG),
+        AptField(
+            name="status",
+            format=ATS.DWORD,
+            decode=_status_from_wire,
+            encode=Status.to_bits,
+        ),
     )
 
     chan_ident: ChanIdent
@@ -868,53 +925,6 @@ class AptMessage_MGMSG_MOT_GET_STATUSUPDATE(AptMessageWithData):
     enc_count: int
     status: Status
 
-    @classmethod
-    def from_bytes(cls, raw: bytes) -> Self:
-        (
-            message_id,
-            data_length,
-            destination,
-            source,
-            chan_ident,
-            position,
-            enc_count,
-            status_flag,
-        ) = cls.message_struct.unpack(raw)
-
-        if message_id != cls.message_id:
-            raise ValueError(
-                f"Expected message ID {cls.message_id.value}, but received {message_id} instead. Full raw data was {raw!r}"
-            )
-        if data_length != cls.data_length:
-            raise ValueError(
-                f"Expected data packet length {cls.data_length}, but received {data_length} instead. Full raw data was {raw!r}"
-            )
-        if destination & 0x80 != 0x80:
-            raise ValueError(
-                f"Expected the destination's highest bit to be 1, indicating that a data packet follows, but it was 0. Full raw data was {raw!r}"
-            )
-
-        return cls(
-            destination=Address(destination & 0x7F),
-            source=Address(source),
-            chan_ident=ChanIdent(chan_ident),
-            position=position,
-            enc_count=enc_count,
-            status=Status.from_bits(StatusBits(status_flag)),
-        )
-
-    def to_bytes(self) -> bytes:
-        return self.message_struct.pack(
-            self.message_id,
-            self.data_length,
-            self.destination_serialization,
-            self.source,
-            self.chan_ident,
-            self.position,
-            self.enc_count,
-            self.status.to_bits(),
-        )
-
 
 @dataclass(frozen=True, kw_only=True)
 class AptMessage_MGMSG_MOT_REQ_STATUSUPDATE(AptMessageHeaderOnlyChanIdent):
@@ -937,56 +947,42 @@ class AptMessage_MGMSG_MOT_REQ_USTATUSUPDATE(AptMessageHeaderOnlyChanIdent):
 
 
 @dataclass(frozen=True, kw_only=True)
-class AptMessage_MGMSG_MOT_MOVE_ABSOLUTE(AptMessageWithData):
-    data_length: ClassVar[int] = 6
-    message_id: ClassVar[AptMessageId] = AptMessageId.MGMSG_MOT_MOVE_ABSOLUTE
-    message_struct: ClassVar[Struct] = Struct(
-        f"{AptMessageWithData.header_struct_str}{ATS.WORD}{ATS.LONG}"
+class AptMessage_MGMSG_MOT_SET_HOMEPARAMS(AptMessageWithDataHomeParams):
+    message_id = AptMessageId.MGMSG_MOT_SET_HOMEPARAMS
+
+
+@dataclass(frozen=True, kw_only=True)
+class AptMessage_MGMSG_MOT_REQ_HOMEPARAMS(AptMessageHeaderOnlyChanIdent):
+    message_id = AptMessageId.MGMSG_MOT_REQ_HOMEPARAMS
+
+
+@dataclass(frozen=True, kw_only=True)
+class AptMessage_MGMSG_MOT_GET_HOMEPARAMS(AptMessageWithDataHomeParams):
+    message_id = AptMessageId.MGMSG_MOT_GET_HOMEPARAMS
+
+
+@dataclass(frozen=True, kw_only=True)
+class AptMessage_MGMSG_MOT_MOVE_RELATIVE(AptMessageWithData):
+    message_id: ClassVar[AptMessageId] = AptMessageId.MGMSG_MOT_MOVE_RELATIVE
+    layout: ClassVar[tuple[AptField, ...]] = (
+        _chan_ident_field(ATS.WORD),
+        AptField(name="relative_distance", format=ATS.LONG),
     )
 
     chan_ident: ChanIdent
-    absolute_distance: int
+    relative_distance: int
 
-    @classmethod
-    def from_bytes(cls, raw: bytes) -> "AptMessage_MGMSG_MOT_MOVE_ABSOLUTE":
-        (
-            message_id,
-            data_length,
-            destination,
-            source,
-            chan_ident,
-            absolute_distance,
-        ) = cls.message_struct.unpack(raw)
-
-        if message_id != cls.message_id:
-            raise ValueError(
-                f"Expected message ID {cls.message_id.value}, but received {message_id} instead. Full raw data was {raw!r}"
-            )
-        if data_length != cls.data_length:
-            raise ValueError(
-                f"Expected data packet length {cls.data_length}, but received {data_length} instead. Full raw data was {raw!r}"
-            )
-        if destination & 0x80 != 0x80:
-            raise ValueError(
-                f"Expected the destination's highest bit to be 1, indicating that a data packet follows, but it was 0. Full raw data was {raw!r}"
-            )
 
-        return AptMessage_MGMSG_MOT_MOVE_ABSOLUTE(
-            destination=Address(destination & 0x7F),
-            source=Address(source),
-            chan_ident=ChanIdent(chan_ident),
-            absolute_distance=absolute_distance,
-        )
+@dataclass(frozen=True, kw_only=True)
+class AptMessage_MGMSG_MOT_MOVE_ABSOLUTE(AptMessageWithData):
+    message_id: ClassVar[AptMessageId] = AptMessageId.MGMSG_MOT_MOVE_ABSOLUTE
+    layout: ClassVar[tuple[AptField, ...]] = (
+        _chan_ident_field(ATS.WORD),
+        AptField(name="absolute_distance", format=ATS.LONG),
+    )
 
-    def to_bytes(self) -> bytes:
-        return self.message_struct.pack(
-            self.message_id,
-            self.data_length,
-            self.destination_serialization,
-            self.source,
-            self.chan_ident,
-            self.absolute_distance,
-        )
+    chan_ident: ChanIdent
+    absolute_distance: int
 
 
 @dataclass(frozen=True, kw_only=True)
@@ -1000,12 +996,18 @@ class AptMessage_MGMSG_MOT_MOVE_COMPLETED(AptMessage):
     data_length: ClassVar[int]
 
     @classmethod
-    def from_bytes(cls, raw: bytes) -> "AptMessage_MGMSG_MOT_MOVE_COMPLETED":
+    def from_bytes(cls, raw: bytes) -> Self:
+        # Only ever called on this class itself; both subclasses have
+        # their own generated decoders.
         length = len(raw)
         if length == 6:
-            return AptMessage_MGMSG_MOT_MOVE_COMPLETED_6_BYTES.from_bytes(raw)
+            return cast(
+                Self, AptMessage_MGMSG_MOT_MOVE_COMPLETED_6_BYTES.from_bytes(raw)
+            )
         if length == 20:
-            return AptMessage_MGMSG_MOT_MOVE_COMPLETED_20_BYTES.from_bytes(raw)
+            return cast(
+                Self, AptMessage_MGMSG_MOT_MOVE_COMPLETED_20_BYTES.from_bytes(raw)
+            )
         raise ValueError(
             f"Expected data packet length 6 or 20, but received {length} instead. Full raw data was {raw!r}"
         )
@@ -1020,11 +1022,6 @@ class AptMessage_MGMSG_MOT_MOVE_COMPLETED_6_BYTES(
     """
 
     message_id: ClassVar[AptMessageId] = AptMessageId.MGMSG_MOT_MOVE_COMPLETED
-    data_length: ClassVar[int] = 0
-
-    @classmethod
-    def from_bytes(cls, raw: bytes) -> Self:
-        return super().from_bytes(raw)
 
 
 @dataclass(frozen=True, kw_only=True)
@@ -1036,11 +1033,6 @@ class AptMessage_MGMSG_MOT_MOVE_COMPLETED_20_BYTES(
     """
 
     message_id: ClassVar[AptMessageId] = AptMessageId.MGMSG_MOT_MOVE_COMPLETED
-    data_length: ClassVar[int] = 14
-
-    @classmethod
-    def from_bytes(cls, raw: bytes) -> Self:
-        return super().from_bytes(raw)
 
 
 @dataclass(frozen=True, kw_only=True)
@@ -1075,69 +1067,27 @@ class AptMessage_MGMSG_POL_SET_PARAMS(AptMessageWithDataPolParams):
 
 @dataclass(frozen=True, kw_only=True)
 class AptMessage_MGMSG_MOT_MOVE_STOP(AptMessageHeaderOnly):
-    message_struct: ClassVar[Struct] = Struct(f"<{ATS.WORD}2{ATS.U_BYTE}2{ATS.U_BYTE}")
     message_id: ClassVar[AptMessageId] = AptMessageId.MGMSG_MOT_MOVE_STOP
+    layout: ClassVar[tuple[AptField, ...]] = (
+        _chan_ident_field(ATS.U_BYTE),
+        AptField(name="stop_mode", format=ATS.U_BYTE, decode=StopMode),
+    )
+
     chan_ident: ChanIdent
     stop_mode: StopMode
 
-    @classmethod
-    def from_bytes(cls, raw: bytes) -> "AptMessage_MGMSG_MOT_MOVE_STOP":
-        message_id, chan_ident, stop_mode, destination, source = (
-            cls.message_struct.unpack(raw)
-        )
-        if message_id != cls.message_id:
-            raise ValueError(
-                f"Expected message ID {cls.message_id.value}, but received {message_id} instead. Full raw message was {raw!r}"
-            )
-        return AptMessage_MGMSG_MOT_MOVE_STOP(
-            chan_ident=ChanIdent(chan_ident),
-            destination=Address(destination),
-            stop_mode=StopMode(stop_mode),
-            source=Address(source),
-        )
-
-    def to_bytes(self) -> bytes:
-        return self.message_struct.pack(
-            self.message_id,
-            self.chan_ident,
-            self.stop_mode,
-            self.destination_serialization,
-            self.source,
-        )
-
 
 @dataclass(frozen=True, kw_only=True)
 class AptMessage_MGMSG_MOT_MOVE_JOG(AptMessageHeaderOnly):
-    message_struct: ClassVar[Struct] = Struct(f"<{ATS.WORD}2{ATS.U_BYTE}2{ATS.U_BYTE}")
     message_id: ClassVar[AptMessageId] = AptMessageId.MGMSG_MOT_MOVE_JOG
+    layout: ClassVar[tuple[AptField, ...]] = (
+        _chan_ident_field(ATS.U_BYTE),
+        AptField(name="jog_direction", format=ATS.U_BYTE, decode=JogDirection),
+    )
+
     chan_ident: ChanIdent
     jog_direction: JogDirection
 
-    @classmethod
-    def from_bytes(cls, raw: bytes) -> "AptMessage_MGMSG_MOT_MOVE_JOG":
-        message_id, chan_ident, jog_direction, destination, source = (
-            cls.message_struct.unpack(raw)
-        )
-        if message_id != cls.message_id:
-            raise ValueError(
-                f"Expected message ID {cls.message_id.value}, but received {message_id} instead. Full raw message was {raw!r}"
-            )
-        return AptMessage_MGMSG_MOT_MOVE_JOG(
-            chan_ident=ChanIdent(chan_ident),
-            destination=Address(destination),
-            jog_direction=JogDirection(jog_direction),
-            source=Address(source),
-        )
-
-    def to_bytes(self) -> bytes:
-        return self.message_struct.pack(
-            self.message_id,
-            self.chan_ident,
-            self.jog_direction,
-            self.destination_serialization,
-            self.source,
-        )
-
 
 @dataclass(frozen=True, kw_only=True)
 class AptMessage_MGMSG_MOT_MOVE_STOPPED(AptMessageHeaderOnlyChanIdent):
@@ -1155,52 +1105,18 @@ class AptMessage_MGMSG_RESTOREFACTORYSETTINGS(AptMessageHeaderOnlyNoParams):
 
 @dataclass(frozen=True, kw_only=True)
 class AptMessage_MGMSG_MOT_SET_EEPROMPARAMS(AptMessageWithData):
-    data_length: ClassVar[int] = 4
     message_id = AptMessageId.MGMSG_MOT_SET_EEPROMPARAMS
-    message_struct: ClassVar[Struct] = Struct(
-        f"{AptMessageWithData.header_struct_str}{ATS.WORD}{ATS.WORD}"
+    layout: ClassVar[tuple[AptField, ...]] = (
+        _chan_ident_field(ATS.WORD),
+        AptField(name="message_id_to_save", format=ATS.WORD, decode=AptMessageId),
     )
 
     chan_ident: ChanIdent
     message_id_to_save: AptMessageId
 
-    @classmethod
-    def from_bytes(cls, raw: bytes) -> "AptMessage_MGMSG_MOT_SET_EEPROMPARAMS":
-        (
-            message_id,
-            data_length,
-            destination,
-            source,
-            chan_ident,
-            message_id_to_save,
-        ) = cls.message_struct.unpack(raw)
-
-        if message_id != cls.message_id:
-            raise ValueError(
-                f"Expected message ID {cls.message_id.value}, but received {message_id} instead. Full raw data was {raw!r}"
-            )
-        if data_length != cls.data_length:
-            raise ValueError(
-                f"Expected data packet length {cls.data_length}, but received {data_length} instead. Full raw data was {raw!r}"
-            )
-        if destination & 0x80 != 0x80:
-            raise ValueError(
-                f"Expected the destination's highest bit to be 1, indicating that a data packet follows, but it was 0. Full raw data was {raw!r}"
-            )
-
-        return AptMessage_MGMSG_MOT_SET_EEPROMPARAMS(
-            destination=Address(destination & 0x7F),
-            source=Address(source),
-            chan_ident=ChanIdent(chan_ident),
-            message_id_to_save=AptMessageId(message_id_to_save),
-        )
 
-    def to_bytes(self) -> bytes:
-        return self.message_struct.pack(
-            self.message_id,
-            self.data_length,
-            self.destination_serialization,
-            self.source,
-            self.chan_ident,
-            self.message_id_to_save,
-        )
+#: Maps every known message ID to the class used to decode it.
+APT_MESSAGE_CLASSES: dict[int, type[AptMessage]] = {
+    message_id: globals()[f"AptMessage_{message_id.name}"]
+    for message_id in AptMessageId
+}
@@ -0,0 +1,157 @@
+"""Retransmission of requests whose reply may have been lost.
+
+A dropped frame, such as a lost status update, would otherwise leave a
+request waiting for its reply until it times out. Requests that can
+safely be sent more than once, which are those that only ask the
+device for information (``MGMSG_*_REQ_*``), are instead sent again if
+no reply arrives within a timeout adapted to the round-trip times seen
+for that type of request, doubling after every retransmission, until
+the deadline of the ``RetryPolicy``.
+
+The timeout is estimated as in RFC 6298, from a smoothed round-trip
+time and its mean deviation. Only replies to requests that were sent
+once are used as samples, since a reply to a request that was sent
+again cannot be matched to one of its copies.
+
+With ``hedge``, a request is also sent a second time, once, if its
+reply is later than usual, which cuts the latency of a lost reply to
+about twice the round-trip time.
+"""
+
+import enum
+import math
+from dataclasses import dataclass, field
+from enum import StrEnum, auto
+
+from .protocol import AptMessage, AptMessageId
+
+
+def is_idempotent(message: AptMessage) -> bool:
+    """Whether sending ``message`` more than once has the same effect
+    as sending it once."""
+    return "_REQ_" in message.message_id.name
+
+
+@dataclass(frozen=True, kw_only=True)
+class RetryPolicy:
+    # Seconds from sending a request until giving up on its reply
+    deadline: float = 10
+    # Seconds to wait for the reply to a type of request that has no
+    # round-trip samples yet
+    initial_timeout: float = 1
+    # Bounds of the timeout before sending a request again
+    min_timeout: float = 0.1
+    max_timeout: float = 2
+    # Whether to send a second copy of a request whose reply takes
+    # longer than the smoothed round-trip time plus its deviation
+    hedge: bool = False
+
+
+@enum.unique
+class RetransmitReason(StrEnum):
+    TIMEOUT = auto()
+    HEDGE = auto()
+
+
+@dataclass(kw_only=True)
+class RoundTripEstimate:
+    smoothed: float
+    deviation: float
+
+    def observe(self, sample: float) -> None:
+        self.deviation = 0.75 * self.deviation + 0.25 * abs(self.smoothed - sample)
+        self.smoothed = 0.875 * self.smoothed + 0.125 * sample
+
+
+@dataclass(frozen=True, kw_only=True)
+class RoundTripEstimator:
+    """Round-trip times of each type of request. Used only by the
+    connection's sender thread."""
+
+    policy: RetryPolicy
+    estimates: dict[AptMessageId, RoundTripEstimate] = field(default_factory=dict)
+
+    def observe(self, message_id: AptMessageId, sample: float) -> None:
+        estimate = self.estimates.get(message_id)
+        if estimate is None:
+            self.estimates[message_id] = RoundTripEstimate(
+                smoothed=sample, deviation=sample / 2
+            )
+        else:
+            estimate.observe(sample)
+
+    def timeout(self, message_id: AptMessageId) -> float:
+        estimate = self.estimates.get(message_id)
+        if estimate is None:
+            return self.policy.initial_timeout
+        timeout = estimate.smoothed + 4 * estimate.deviation
+        return min(max(timeout, self.policy.min_timeout), self.policy.max_timeout)
+
+    def hedge_delay(self, message_id: AptMessageId) -> float:
+        """Seconds after which a reply is later than usual, or
+        infinity if there are no samples to tell."""
+        estimate = self.estimates.get(message_id)
+        if estimate is None:
+            return math.inf
+        return estimate.smoothed + estimate.deviation
+
+
+@dataclass(kw_only=True)
+class RetransmissionSchedule:
+    """When a request waiting for its reply is next sent again, and
+    when to give up on it. Times are from ``time.perf_counter``."""
+
+    deadline: float
+    timeout: float = math.inf
+    max_timeout: float = math.inf
+    retransmit_at: float = math.inf
+    hedge_at: float = math.inf
+    retransmissions: int = 0
+
+    @classmethod
+    def start(
+        cls,
+        request: AptMessage,
+        sent: float,
+        estimator: None | RoundTripEstimator,
+        deadline: float,
+    ) -> "RetransmissionSchedule":
+        """The schedule of a request sent at ``sent``, which is never
+        sent again unless it is idempotent and there is an
+        ``estimator`` of round-trip times."""
+        if estimator is None or not is_idempotent(request):
+            return cls(deadline=sent + deadline)
+        policy = estimator.policy
+        timeout = estimator.timeout(request.message_id)
+        hedge_at = math.inf
+        if policy.hedge:
+            hedge_delay = estimator.hedge_delay(request.message_id)
+            if hedge_delay < timeout:
+                hedge_at = sent + hedge_delay
+        return cls(
+            deadline=sent + policy.deadline,
+            timeout=timeout,
+            max_timeout=policy.max_timeout,
+            retransmit_at=sent + timeout,
+            hedge_at=hedge_at,
+        )
+
+    def wait_time(self, now: float) -> float:
+        """Seconds to wait for the reply before the next retransmission
+        or the deadline."""
+        return max(0, min(self.deadline, self.retransmit_at, self.hedge_at) - now)
+
+    def due(self, now: float) -> None | RetransmitReason:
+        if now >= self.retransmit_at:
+            return RetransmitReason.TIMEOUT
+        if now >= self.hedge_at:
+            return RetransmitReason.HEDGE
+        return None
+
+    def retransmitted(self, now: float, reason: RetransmitReason) -> None:
+        self.retransmissions += 1
+        # Hedge at most once
+        self.hedge_at = math.inf
+        if reason == RetransmitReason.TIMEOUT:
+            self.timeout = min(self.timeout * 2, self.max_timeout)
+            self.retransmit_at = now + self.timeout
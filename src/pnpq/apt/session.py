@@ -0,0 +1,213 @@
+"""State of a device session that is lost when the device is unplugged
+or power cycled, and the report of its recovery.
+
+Some settings are held only in a controller's volatile memory: whether
+it sends status update messages, which channels are enabled, and
+parameters such as the MPC's velocity and jog steps or the K10CR1's
+home parameters. ``SessionState`` remembers the last message sent that
+set each of them, so that ``AptConnection`` can send them again, in
+the order they were first sent, after reconnecting to a device it
+lost.
+
+``recover`` does so: it reopens the transport, retrying with backoff,
+sends the session messages, and reports the recovered state once the
+device replies to a request for its information. If the device does
+not reply, the failure is logged and nothing is reported.
+"""
+
+from __future__ import annotations
+
+import itertools
+import threading
+import time
+from collections.abc import Hashable
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+import structlog
+
+from ..devices.utils import TimeoutException
+from ..errors import DeviceDisconnectedError, RequestCancelledError
+from ..events import Event
+from .protocol import (
+    Address,
+    AptMessage,
+    AptMessage_MGMSG_HW_GET_INFO,
+    AptMessage_MGMSG_HW_REQ_INFO,
+    AptMessage_MGMSG_HW_START_UPDATEMSGS,
+    AptMessage_MGMSG_HW_STOP_UPDATEMSGS,
+    AptMessage_MGMSG_MOD_SET_CHANENABLESTATE,
+    AptMessage_MGMSG_MOT_SET_HOMEPARAMS,
+    AptMessage_MGMSG_POL_SET_PARAMS,
+)
+from .subscription import MessageFilter
+
+if TYPE_CHECKING:
+    from .connection import AptConnection
+
+log = structlog.get_logger()
+
+
+def session_key(message: AptMessage) -> None | Hashable:
+    """The setting that ``message`` changes, or None if it does not
+    change session state. Messages with the same key replace each
+    other."""
+    if isinstance(
+        message,
+        (AptMessage_MGMSG_HW_START_UPDATEMSGS, AptMessage_MGMSG_HW_STOP_UPDATEMSGS),
+    ):
+        return "update_messages"
+    # Channel enable states are a bitmask of every enabled channel,
+    # so the latest message describes all channels
+    if isinstance(
+        message,
+        (AptMessage_MGMSG_MOD_SET_CHANENABLESTATE, AptMessage_MGMSG_POL_SET_PARAMS),
+    ):
+        return message.message_id
+    if isinstance(message, AptMessage_MGMSG_MOT_SET_HOMEPARAMS):
+        return (message.message_id, message.chan_ident)
+    return None
+
+
+@dataclass(frozen=True, kw_only=True)
+class SessionState:
+    messages: dict[Hashable, AptMessage] = field(default_factory=dict)
+    messages_lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def record(self, message: AptMessage) -> None:
+        key = session_key(message)
+        if key is None:
+            return
+        with self.messages_lock:
+            # Keep the messages in the order they were last sent
+            self.messages.pop(key, None)
+            self.messages[key] = message
+
+    def snapshot(self) -> tuple[AptMessage, ...]:
+        with self.messages_lock:
+            return tuple(self.messages.values())
+
+
+@dataclass(frozen=True, kw_only=True)
+class RecoveryReport:
+    # The connection's metrics label
+    connection: str
+    # What lost the device, such as the error from reading the port
+    error: Exception
+    # Attempts to reopen the transport, including the one that worked
+    attempts: int
+    # Messages sent again to restore the session, in order
+    restored: tuple[AptMessage, ...]
+    # The device's reply to MGMSG_HW_REQ_INFO, sent after restoring
+    # the session
+    info: AptMessage_MGMSG_HW_GET_INFO
+    # Seconds from losing the device until it replied with its info
+    downtime: float
+
+
+def reopen(connection: AptConnection) -> None | int:
+    """Close the lost transport of ``connection`` and open it again,
+    retrying with backoff. Returns the number of attempts, or None if
+    the connection was closed first."""
+    with connection.tx_connection_lock:
+        try:
+            connection.connection.close()
+        # The port may already be gone
+        except Exception as e:  # pylint: disable=W0718
+            log.debug(event="Failed to close the lost transport", exc_info=e)
+    # Let the dispatcher stop reading from the old transport
+    # before opening a new one
+    while not connection.rx_dispatcher_paused.wait(0.1):
+        if connection.stop_event.is_set():
+            return None
+    delay = connection.reconnect_delay
+    for attempt in itertools.count(1):
+        with connection.tx_connection_lock:
+            # close() holds the lock while closing the transport,
+            # so it is never reopened after that
+            if connection.stop_event.is_set():
+                return None
+            try:
+                connection.connection.open()
+                connection.connection.reset_input_buffer()
+                connection.set_connected(True)
+                return attempt
+            # Any error from a port that is not back yet
+            except Exception as e:  # noqa: BLE001  # pylint: disable=W0718
+                log.info(
+                    event=Event.CONNECTION_RECONNECT_FAILED,
+                    attempt=attempt,
+                    retry_in=delay,
+                    error=repr(e),
+                )
+        if connection.stop_event.wait(delay):
+            return None
+        delay = min(delay * 2, connection.reconnect_max_delay)
+    raise AssertionError("unreachable")
+
+
+def recover(connection: AptConnection, error: Exception, lost: float) -> None:
+    """Reconnect ``connection`` to its lost device and restore the
+    session. Runs in a thread started by
+    ``AptConnection.connection_lost``."""
+    # Imported here, as the connection module imports this one
+    from .connection import REPLY_TIMEOUT, Priority  # pylint: disable=C0415
+
+    attempts = reopen(connection)
+    if attempts is None:
+        return
+    connection.connection_metrics.reconnects.inc(connection=connection.label)
+    # The emergency lane is served before requests queued by
+    # callers since the reconnection, and in order, so the info
+    # request confirms that the session was restored
+    restored = connection.session.snapshot()
+    for message in restored:
+        connection.queue_ordered(
+            Priority.EMERGENCY, (message, None, None, None, REPLY_TIMEOUT, None)
+        )
+    try:
+        info = connection.queue_request(
+            AptMessage_MGMSG_HW_REQ_INFO(
+                destination=Address.GENERIC_USB,
+                source=Address.HOST_CONTROLLER,
+            ),
+            lambda message: isinstance(message, AptMessage_MGMSG_HW_GET_INFO),
+            MessageFilter(message_types={AptMessage_MGMSG_HW_GET_INFO}),
+            Priority.EMERGENCY,
+            None,
+        )
+    # Lost again, or closed; a new recovery starts if needed
+    except DeviceDisconnectedError as e:
+        log.debug(event="Failed to restore the session", exc_info=e)
+        return
+    # The port is back, but the device does not answer
+    except (TimeoutException, RequestCancelledError) as e:
+        log.warning(
+            event=Event.CONNECTION_RECOVERY_FAILED,
+            attempts=attempts,
+            restored=[message.message_id.name for message in restored],
+            error=repr(e),
+        )
+        return
+    assert isinstance(info, AptMessage_MGMSG_HW_GET_INFO)
+    report = RecoveryReport(
+        connection=connection.label,
+        error=error,
+        attempts=attempts,
+        restored=restored,
+        info=info,
+        downtime=time.perf_counter() - lost,
+    )
+    log.info(
+        event=Event.CONNECTION_RECOVERED,
+        attempts=attempts,
+        downtime=report.downtime,
+        restored=[message.message_id.name for message in restored],
+        serial_number=info.serial_number,
+    )
+    if connection.recovery_exporter is not None:
+        try:
+            connection.recovery_exporter(report)
+        except Exception as e:  # pylint: disable=W0718
+            log.error(event=Event.UNCAUGHT_EXCEPTION, exc_info=e)
+    object.__setattr__(connection, "last_recovery", report)
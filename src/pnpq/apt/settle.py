@@ -0,0 +1,184 @@
+"""How long to hold the bus after sending a message that gets no reply.
+
+Some commands that get no reply take time to take effect, and a
+controller sent other messages in the meantime may fail until it is
+reset: the MPC320 has been seen to stop responding after a channel was
+disabled and enabled again in quick succession. The ordered sender
+therefore holds the connection lock for a while after such a message,
+which also holds up status polls.
+
+A ``SettleRule`` says for how long. By default, this is a fixed delay.
+Where the device reports the effect of a command in its status, as
+the ENABLED bit of MGMSG_MOT_GET_USTATUSUPDATE reports a channel
+enable state, the rule can instead request the status and end the
+pause as soon as it confirms the command, after at least a minimum
+delay, falling back to the full delay if it never does.
+
+Each connection has a ``SettlePolicy`` with the rules for the message
+types of its device, which drivers fill in. ``calibrate`` measures how
+long a device takes to confirm a command, to choose the delay of a
+rule that does not wait for confirmation.
+"""
+
+from __future__ import annotations
+
+import math
+import time
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass, field
+from queue import Empty
+from typing import TYPE_CHECKING
+
+from .protocol import (
+    AptMessage,
+    AptMessage_MGMSG_MOD_SET_CHANENABLESTATE,
+    AptMessage_MGMSG_MOT_GET_USTATUSUPDATE,
+    AptMessage_MGMSG_MOT_SET_POSCOUNTER,
+    EnableState,
+)
+from .subscription import MessageFilter, SubscriberQueue
+
+if TYPE_CHECKING:
+    from .connection import AptConnection
+
+
+@dataclass(frozen=True, kw_only=True)
+class SettleRule:
+    # Seconds to hold the bus after the message. With confirm, this is
+    # the longest to wait for confirmation.
+    delay: float = 0.2
+    # With confirm, seconds to hold the bus even if the message is
+    # confirmed sooner
+    minimum: float = 0
+    # Whether a received message, given with the sent message,
+    # confirms that the sent message has taken effect
+    confirm: None | Callable[[AptMessage, AptMessage], bool] = None
+    # The received messages that may confirm, checked by the
+    # dispatcher thread
+    confirm_filter: None | MessageFilter = None
+    # Builds a request for the status that confirms the sent message.
+    # It is sent right after the message, and then every
+    # poll_interval seconds until confirmation.
+    status_request: None | Callable[[AptMessage], AptMessage] = None
+    poll_interval: float = 0.02
+
+
+@dataclass(frozen=True, kw_only=True)
+class SettlePolicy:
+    """Settle rules by message type, and the rule for other messages."""
+
+    rules: dict[type[AptMessage], SettleRule] = field(default_factory=dict)
+    default: SettleRule = SettleRule()
+
+    def rule(self, message: AptMessage) -> SettleRule:
+        return self.rules.get(type(message), self.default)
+
+
+def channel_enable_confirmed(message: AptMessage, received: AptMessage) -> bool:
+    """Whether ``received`` shows the enable state that ``message``, a
+    MGMSG_MOD_SET_CHANENABLESTATE, sets for the channel of
+    ``received``."""
+    assert isinstance(message, AptMessage_MGMSG_MOD_SET_CHANENABLESTATE)
+    if not isinstance(received, AptMessage_MGMSG_MOT_GET_USTATUSUPDATE):
+        return False
+    # chan_ident is a bitmask: enabling enables the channels in it and
+    # disables the others, while disabling only affects the channels
+    # in it
+    if message.enable_state == EnableState.CHANNEL_ENABLED:
+        enabled = received.chan_ident in message.chan_ident
+    elif received.chan_ident in message.chan_ident:
+        enabled = False
+    else:
+        return False
+    return received.status.ENABLED == enabled
+
+
+def position_counter_confirmed(message: AptMessage, received: AptMessage) -> bool:
+    """Whether ``received`` shows the position that ``message``, a
+    MGMSG_MOT_SET_POSCOUNTER, sets."""
+    assert isinstance(message, AptMessage_MGMSG_MOT_SET_POSCOUNTER)
+    return (
+        isinstance(received, AptMessage_MGMSG_MOT_GET_USTATUSUPDATE)
+        and received.chan_ident == message.chan_ident
+        and received.position == message.position
+    )
+
+
+@dataclass(frozen=True, kw_only=True)
+class SettleCalibration:
+    # Seconds from sending each message until the device confirmed it
+    samples: tuple[float, ...]
+    # The longest sample, multiplied by the safety margin
+    minimum: float
+
+    def fixed_rule(self) -> SettleRule:
+        """A rule that holds the bus for the calibrated time, without
+        waiting for confirmation."""
+        return SettleRule(delay=self.minimum)
+
+
+def wait_for_confirmation(
+    connection: AptConnection,
+    message: AptMessage,
+    rule: SettleRule,
+    queue: SubscriberQueue,
+    sent: float,
+) -> None | float:
+    """Poll for the status that confirms ``message``, sent at ``sent``
+    by ``time.perf_counter``, taking the status from ``queue``, a
+    subscription with the rule's ``confirm_filter``. The connection
+    lock must be held. Returns the seconds from sending until
+    confirmation, or None if the rule's ``delay`` passed or an
+    emergency message is waiting first."""
+    assert rule.confirm is not None
+    deadline = sent + rule.delay
+    next_poll = sent if rule.status_request is not None else math.inf
+    while not connection.tx_emergency_pending.is_set():
+        now = time.perf_counter()
+        if now >= deadline:
+            return None
+        if rule.status_request is not None and now >= next_poll:
+            connection.write_message(rule.status_request(message))
+            next_poll = now + rule.poll_interval
+        try:
+            received = queue.get(timeout=min(deadline, next_poll) - now)
+        except Empty:
+            continue
+        if rule.confirm(message, received):
+            return time.perf_counter() - sent
+    return None
+
+
+def calibrate(
+    connection: AptConnection,
+    messages: Sequence[AptMessage],
+    rule: SettleRule,
+    repetitions: int = 5,
+    margin: float = 2,
+) -> SettleCalibration:
+    """Measure how long the device on ``connection`` takes to confirm
+    each of ``messages`` according to ``rule``, which must have
+    ``confirm`` and ``status_request``, sending them in turn
+    ``repetitions`` times. For example, to calibrate channel enable
+    states, pass messages that enable and then disable a channel.
+
+    Holds the connection lock throughout, so other messages wait.
+    Raises TimeoutError if a message is not confirmed within the
+    rule's ``delay``.
+    """
+    assert rule.confirm is not None and rule.status_request is not None
+    samples = []
+    with connection.rx_subscribe(message_filter=rule.confirm_filter) as queue:
+        with connection.tx_connection_lock:
+            for _ in range(repetitions):
+                for message in messages:
+                    connection.write_message(message)
+                    sample = wait_for_confirmation(
+                        connection, message, rule, queue, time.perf_counter()
+                    )
+                    if sample is None:
+                        raise TimeoutError(
+                            f"{message.message_id.name} was not confirmed within {rule.delay} seconds."
+                        )
+                    samples.append(sample)
+    return SettleCalibration(samples=tuple(samples), minimum=max(samples) * margin)
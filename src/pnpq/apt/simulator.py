@@ -0,0 +1,834 @@
+"""Simulated APT devices.
+
+A simulator speaks the APT wire protocol on the device side of a
+:py:class:`~pnpq.transport.Transport`, so the real drivers, including
+``AptConnection``'s dispatcher and sender threads, can be exercised
+without hardware. For example, with an in-memory transport::
+
+    host, device = loopback_transport_pair()
+    simulator = SimulatedMPC320(transport=device)
+    simulator.open()
+    connection = AptConnection(transport=host)
+    connection.open()
+    controller = PolarizationControllerThorlabsMPC320(connection=connection)
+
+To present the simulated device as a serial port that other processes
+can open, give the simulator a :py:class:`~pnpq.transport.PtyTransport`
+and open its ``peer_path`` with a
+:py:class:`~pnpq.transport.SerialTransport`.
+
+Motion is modelled with a maximum velocity and, optionally, a constant
+acceleration. Each simulator runs two threads, and any number of
+simulators can run in the same process.
+"""
+
+from __future__ import annotations
+
+import enum
+import heapq
+import itertools
+import math
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import TYPE_CHECKING, ClassVar
+
+import structlog
+
+from .. import units
+from ..events import Event
+from .protocol import (
+    APT_MESSAGE_CLASSES,
+    Address,
+    AptMessage,
+    AptMessage_MGMSG_HW_GET_INFO,
+    AptMessage_MGMSG_HW_REQ_INFO,
+    AptMessage_MGMSG_HW_START_UPDATEMSGS,
+    AptMessage_MGMSG_HW_STOP_UPDATEMSGS,
+    AptMessage_MGMSG_MOD_GET_CHANENABLESTATE,
+    AptMessage_MGMSG_MOD_IDENTIFY,
+    AptMessage_MGMSG_MOD_REQ_CHANENABLESTATE,
+    AptMessage_MGMSG_MOD_SET_CHANENABLESTATE,
+    AptMessage_MGMSG_MOT_ACK_USTATUSUPDATE,
+    AptMessage_MGMSG_MOT_GET_HOMEPARAMS,
+    AptMessage_MGMSG_MOT_GET_POSCOUNTER,
+    AptMessage_MGMSG_MOT_GET_STATUSUPDATE,
+    AptMessage_MGMSG_MOT_GET_USTATUSUPDATE,
+    AptMessage_MGMSG_MOT_MOVE_ABSOLUTE,
+    AptMessage_MGMSG_MOT_MOVE_COMPLETED_6_BYTES,
+    AptMessage_MGMSG_MOT_MOVE_COMPLETED_20_BYTES,
+    AptMessage_MGMSG_MOT_MOVE_HOME,
+    AptMessage_MGMSG_MOT_MOVE_HOMED,
+    AptMessage_MGMSG_MOT_MOVE_JOG,
+    AptMessage_MGMSG_MOT_MOVE_RELATIVE,
+    AptMessage_MGMSG_MOT_MOVE_STOP,
+    AptMessage_MGMSG_MOT_MOVE_STOPPED,
+    AptMessage_MGMSG_MOT_REQ_HOMEPARAMS,
+    AptMessage_MGMSG_MOT_REQ_POSCOUNTER,
+    AptMessage_MGMSG_MOT_REQ_STATUSUPDATE,
+    AptMessage_MGMSG_MOT_REQ_USTATUSUPDATE,
+    AptMessage_MGMSG_MOT_SET_HOMEPARAMS,
+    AptMessage_MGMSG_MOT_SET_POSCOUNTER,
+    AptMessage_MGMSG_POL_GET_PARAMS,
+    AptMessage_MGMSG_POL_REQ_PARAMS,
+    AptMessage_MGMSG_POL_SET_PARAMS,
+    AptMessage_MGMSG_RESTOREFACTORYSETTINGS,
+    AptMessageForStreamParsing,
+    ChanIdent,
+    EnableState,
+    FirmwareVersion,
+    HardwareType,
+    HomeDirection,
+    JogDirection,
+    LimitSwitch,
+    Status,
+    UStatus,
+)
+
+if TYPE_CHECKING:
+    from ..transport import Transport
+
+
+@dataclass(frozen=True, kw_only=True)
+class SimulatorFaults:
+    """Faults injected into the frames a simulator sends.
+
+    :param latency: Seconds added before every frame is sent.
+    :param latency_jitter: Upper bound of a uniformly distributed
+        number of seconds added on top of ``latency``. Frames are never
+        reordered.
+    :param drop_probability: Probability that a frame is never sent.
+    :param duplicate_probability: Probability that a frame is sent
+        twice.
+    :param unknown_message_probability: Probability that a well-formed
+        frame with an unknown message ID is sent before a frame.
+    :param stall_moves: If ``True``, moves and homing start but never
+        make progress or complete.
+    :param seed: Seed for the random number generator that decides
+        which faults occur, for reproducible runs.
+    """
+
+    latency: float = 0
+    latency_jitter: float = 0
+    drop_probability: float = 0
+    duplicate_probability: float = 0
+    unknown_message_probability: float = 0
+    stall_moves: bool = False
+    seed: None | int = None
+
+
+# Message ID that no device uses, sent when injecting unknown messages
+UNKNOWN_MESSAGE_FRAME = bytes([0xFF, 0x7F, 0x00, 0x00, 0x01, 0x50])
+
+
+@enum.unique
+class MoveKind(Enum):
+    ABSOLUTE = enum.auto()
+    RELATIVE = enum.auto()
+    JOG = enum.auto()
+    HOME = enum.auto()
+
+
+@dataclass(frozen=True, kw_only=True)
+class SimulatedMove:
+    kind: MoveKind
+    start_time: float
+    start_position: float
+    target: float
+    velocity: float  # Steps per second
+    acceleration: None | float  # Steps per second squared, None for instantaneous
+
+    @property
+    def distance(self) -> float:
+        return abs(self.target - self.start_position)
+
+    @property
+    def duration(self) -> float:
+        """Seconds from the start of the move until the target is reached."""
+        if self.velocity <= 0:
+            return math.inf
+        if self.acceleration is None:
+            return self.distance / self.velocity
+        # Trapezoidal profile; triangular if the move is too short to
+        # reach full velocity
+        if self.distance >= self.velocity**2 / self.acceleration:
+            return self.distance / self.velocity + self.velocity / self.acceleration
+        return 2 * math.sqrt(self.distance / self.acceleration)
+
+    def position(self, now: float) -> float:
+        elapsed = now - self.start_time
+        duration = self.duration
+        if elapsed >= duration:
+            return self.target
+        if self.acceleration is None:
+            travelled = self.velocity * elapsed
+        else:
+            peak_time = min(self.velocity / self.acceleration, duration / 2)
+            peak_velocity = self.acceleration * peak_time
+            if elapsed <= peak_time:
+                travelled = self.acceleration * elapsed**2 / 2
+            elif elapsed <= duration - peak_time:
+                travelled = peak_velocity * (elapsed - peak_time / 2)
+            else:
+                remaining = duration - elapsed
+                travelled = self.distance - self.acceleration * remaining**2 / 2
+        return self.start_position + math.copysign(
+            travelled, self.target - self.start_position
+        )
+
+
+@dataclass(kw_only=True)
+class SimulatedChannel:
+    chan_ident: ChanIdent
+    position: float = 0
+    enabled: bool = False
+    homed: bool = False
+    move: None | SimulatedMove = None
+    # Set by MGMSG_MOT_SET_HOMEPARAMS, and reported back, but homing
+    # always ends at the home position
+    home_direction: HomeDirection = HomeDirection.REVERSE
+    limit_switch: LimitSwitch = LimitSwitch.HARDWARE_REVERSE
+    home_velocity: int = 0
+    offset_distance: int = 0
+    # Incremented whenever a move starts or stops, so that a scheduled
+    # completion of a superseded move can be recognized and ignored
+    generation: int = 0
+
+
+@dataclass(frozen=True, kw_only=True)
+class SimulatedAptDevice(ABC):
+    """Device side of an APT connection.
+
+    Subclasses describe a device model. Positions are kept in the
+    device's native step units.
+    """
+
+    transport: Transport
+    faults: SimulatorFaults = SimulatorFaults()
+    serial_number: int = 0
+    #: Multiplies every velocity and acceleration, to shorten test runs
+    speedup: float = 1
+    #: Seconds between status updates after MGMSG_HW_START_UPDATEMSGS
+    update_interval: float = 0.1
+
+    # Device model, set by subclasses
+    model_number: ClassVar[str]
+    hardware_type: ClassVar[HardwareType] = HardwareType.BRUSHLESS_DC_CONTROLLER
+    channel_idents: ClassVar[tuple[ChanIdent, ...]]
+    #: Limits of travel in steps, or None for continuous rotation
+    position_limits: ClassVar[None | tuple[int, int]] = None
+    #: Steps per second squared, or None to reach full velocity instantly
+    acceleration: ClassVar[None | float] = None
+    moving_current_milliamps: ClassVar[int] = 0
+
+    log = structlog.get_logger()
+
+    channels: dict[ChanIdent, SimulatedChannel] = field(init=False)
+    state_lock: threading.RLock = field(default_factory=threading.RLock)
+    tx_lock: threading.Lock = field(default_factory=threading.Lock)
+    closed: threading.Event = field(default_factory=threading.Event)
+    updates_enabled: threading.Event = field(default_factory=threading.Event)
+
+    # Timed actions, run in order by the scheduler thread
+    schedule: list[tuple[float, int, Callable[[], None]]] = field(default_factory=list)
+    schedule_condition: threading.Condition = field(default_factory=threading.Condition)
+    schedule_counter: itertools.count[int] = field(default_factory=itertools.count)
+    last_send_time: float = 0
+    rng: random.Random = field(init=False)
+
+    rx_thread: threading.Thread = field(init=False)
+    scheduler_thread: threading.Thread = field(init=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(
+            self,
+            "channels",
+            {
+                chan_ident: SimulatedChannel(chan_ident=chan_ident)
+                for chan_ident in self.channel_idents
+            },
+        )
+        object.__setattr__(self, "rng", random.Random(self.faults.seed))
+
+    def open(self) -> None:
+        self.transport.open()
+        object.__setattr__(
+            self,
+            "rx_thread",
+            threading.Thread(target=self.rx_handle, daemon=True),
+        )
+        object.__setattr__(
+            self,
+            "scheduler_thread",
+            threading.Thread(target=self.run_schedule, daemon=True),
+        )
+        self.rx_thread.start()
+        self.scheduler_thread.start()
+
+    def close(self) -> None:
+        self.closed.set()
+        with self.schedule_condition:
+            self.schedule_condition.notify_all()
+        self.transport.close()
+        self.rx_thread.join()
+        self.scheduler_thread.join()
+
+    def set_faults(self, faults: SimulatorFaults) -> None:
+        """Replace the injected faults while the simulator is running."""
+        object.__setattr__(self, "faults", faults)
+        object.__setattr__(self, "rng", random.Random(faults.seed))
+
+    def position(self, chan_ident: ChanIdent) -> float:
+        """The current position of a channel, in steps."""
+        with self.state_lock:
+            return self.current_position(self.channels[chan_ident], time.monotonic())
+
+    # Scheduling
+
+    def call_at(self, when: float, action: Callable[[], None]) -> None:
+        with self.schedule_condition:
+            heapq.heappush(self.schedule, (when, next(self.schedule_counter), action))
+            self.schedule_condition.notify()
+
+    def run_schedule(self) -> None:
+        while not self.closed.is_set():
+            with self.schedule_condition:
+                if not self.schedule:
+                    self.schedule_condition.wait()
+                    continue
+                when, _, action = self.schedule[0]
+                delay = when - time.monotonic()
+                if delay > 0:
+                    self.schedule_condition.wait(delay)
+                    continue
+                heapq.heappop(self.schedule)
+            try:
+                action()
+            except Exception as e:  # pylint: disable=W0718
+                if self.closed.is_set():
+                    break
+                self.log.error(event=Event.UNCAUGHT_EXCEPTION, exc_info=e)
+
+    # Sending
+
+    def send(self, message: AptMessage) -> None:
+        """Send a message to the host, subject to the injected faults."""
+        faults = self.faults
+        if self.rng.random() < faults.drop_probability:
+            self.log.debug(event=Event.SIMULATOR_FAULT_INJECTED, dropped=message)
+            return
+        frames = [message.to_bytes()]
+        if self.rng.random() < faults.duplicate_probability:
+            frames.append(frames[0])
+        if self.rng.random() < faults.unknown_message_probability:
+            frames.insert(0, UNKNOWN_MESSAGE_FRAME)
+        if len(frames) > 1:
+            self.log.debug(event=Event.SIMULATOR_FAULT_INJECTED, frames=frames)
+        delay = faults.latency + self.rng.uniform(0, faults.latency_jitter)
+        if delay <= 0:
+            self.write(message, b"".join(frames))
+            return
+        with self.schedule_condition:
+            # Frames on a serial line are never reordered
+            when = max(time.monotonic() + delay, self.last_send_time)
+            object.__setattr__(self, "last_send_time", when)
+        self.call_at(when, lambda: self.write(message, b"".join(frames)))
+
+    def write(self, message: AptMessage, data: bytes) -> None:
+        self.log.debug(event=Event.SIMULATOR_TX_MESSAGE, message=message)
+        with self.tx_lock:
+            self.transport.write(data)
+
+    # Receiving
+
+    def rx_handle(self) -> None:
+        while not self.closed.is_set():
+            try:
+                message_bytes = self.transport.read(6)
+                partial_message = AptMessageForStreamParsing.from_bytes(message_bytes)
+                if partial_message.data_length != 0:
+                    message_bytes += self.transport.read(partial_message.data_length)
+            except Exception as e:  # pylint: disable=W0718
+                self.log.debug(
+                    event="Shutting down simulator. Received expected error.",
+                    exc_info=e,
+                )
+                break
+            message_class = APT_MESSAGE_CLASSES.get(partial_message.message_id)
+            if message_class is None:
+                self.log.debug(
+                    event=Event.RX_MESSAGE_UNKNOWN,
+                    message=partial_message,
+                    bytes=message_bytes,
+                )
+                continue
+            try:
+                message = message_class.from_bytes(message_bytes)
+                self.log.debug(event=Event.SIMULATOR_RX_MESSAGE, message=message)
+                with self.state_lock:
+                    self.handle_message(message)
+            except Exception as e:  # pylint: disable=W0718
+                self.log.error(event=Event.UNCAUGHT_EXCEPTION, exc_info=e)
+
+    def handle_message(  # pylint: disable=R0912, R0915
+        self, message: AptMessage
+    ) -> None:
+        """Respond to a message from the host. Called with
+        ``state_lock`` held. Subclasses extend this for
+        device-specific messages."""
+        now = time.monotonic()
+        if isinstance(message, AptMessage_MGMSG_HW_REQ_INFO):
+            self.send(self.info_message())
+        elif isinstance(message, AptMessage_MGMSG_HW_START_UPDATEMSGS):
+            if not self.updates_enabled.is_set():
+                self.updates_enabled.set()
+                self.call_at(now, self.send_status_updates)
+        elif isinstance(message, AptMessage_MGMSG_HW_STOP_UPDATEMSGS):
+            self.updates_enabled.clear()
+        elif isinstance(message, AptMessage_MGMSG_MOD_SET_CHANENABLESTATE):
+            for channel in self.channels.values():
+                if message.enable_state == EnableState.CHANNEL_ENABLED:
+                    # On these devices, chan_ident is a bitmask of the
+                    # channels that should be enabled
+                    channel.enabled = channel.chan_ident in message.chan_ident
+                elif channel.chan_ident in message.chan_ident:
+                    channel.enabled = False
+        elif isinstance(message, AptMessage_MGMSG_MOD_REQ_CHANENABLESTATE):
+            channel = self.channels[message.chan_ident]
+            self.send(
+                AptMessage_MGMSG_MOD_GET_CHANENABLESTATE(
+                    chan_ident=channel.chan_ident,
+                    enable_state=EnableState.from_bool(channel.enabled),
+                    destination=Address.HOST_CONTROLLER,
+                    source=Address.GENERIC_USB,
+                )
+            )
+        elif isinstance(message, AptMessage_MGMSG_MOD_IDENTIFY):
+            self.log.debug(event=Event.DEVICE_IDENTIFY, chan_ident=message.chan_ident)
+        elif isinstance(message, AptMessage_MGMSG_MOT_REQ_USTATUSUPDATE):
+            self.send(self.ustatus_message(self.channels[message.chan_ident], now))
+        elif isinstance(message, AptMessage_MGMSG_MOT_REQ_STATUSUPDATE):
+            self.send(self.status_message(self.channels[message.chan_ident], now))
+        elif isinstance(message, AptMessage_MGMSG_MOT_REQ_POSCOUNTER):
+            channel = self.channels[message.chan_ident]
+            self.send(
+                AptMessage_MGMSG_MOT_GET_POSCOUNTER(
+                    chan_ident=channel.chan_ident,
+                    position=round(self.current_position(channel, now)),
+                    destination=Address.HOST_CONTROLLER,
+                    source=Address.GENERIC_USB,
+                )
+            )
+        elif isinstance(message, AptMessage_MGMSG_MOT_SET_POSCOUNTER):
+            channel = self.channels[message.chan_ident]
+            if channel.move is None:
+                channel.position = message.position
+        elif isinstance(message, AptMessage_MGMSG_MOT_MOVE_ABSOLUTE):
+            channel = self.channels[message.chan_ident]
+            target = self.clamp(message.absolute_distance)
+            self.start_move(channel, MoveKind.ABSOLUTE, target, now)
+        elif isinstance(message, AptMessage_MGMSG_MOT_MOVE_RELATIVE):
+            channel = self.channels[message.chan_ident]
+            target = self.clamp(
+                self.current_position(channel, now) + message.relative_distance
+            )
+            self.start_move(channel, MoveKind.RELATIVE, target, now)
+        elif isinstance(message, AptMessage_MGMSG_MOT_SET_HOMEPARAMS):
+            channel = self.channels[message.chan_ident]
+            channel.home_direction = message.home_direction
+            channel.limit_switch = message.limit_switch
+            channel.home_velocity = message.home_velocity
+            channel.offset_distance = message.offset_distance
+        elif isinstance(message, AptMessage_MGMSG_MOT_REQ_HOMEPARAMS):
+            channel = self.channels[message.chan_ident]
+            self.send(
+                AptMessage_MGMSG_MOT_GET_HOMEPARAMS(
+                    chan_ident=channel.chan_ident,
+                    home_direction=channel.home_direction,
+                    limit_switch=channel.limit_switch,
+                    home_velocity=channel.home_velocity,
+                    offset_distance=channel.offset_distance,
+                    destination=Address.HOST_CONTROLLER,
+                    source=Address.GENERIC_USB,
+                )
+            )
+        elif isinstance(message, AptMessage_MGMSG_MOT_MOVE_JOG):
+            channel = self.channels[message.chan_ident]
+            distance = self.jog_distance(channel.chan_ident)
+            if message.jog_direction == JogDirection.REVERSE:
+                distance = -distance
+            target = self.clamp(self.current_position(channel, now) + distance)
+            self.start_move(channel, MoveKind.JOG, target, now)
+        elif isinstance(message, AptMessage_MGMSG_MOT_MOVE_HOME):
+            channel = self.channels[message.chan_ident]
+            channel.homed = False
+            target = self.clamp(self.home_position(channel.chan_ident))
+            self.start_move(channel, MoveKind.HOME, target, now)
+        elif isinstance(message, AptMessage_MGMSG_MOT_MOVE_STOP):
+            for channel in self.channels.values():
+                if channel.chan_ident in message.chan_ident:
+                    self.stop_move(channel, now)
+        elif isinstance(message, AptMessage_MGMSG_MOT_ACK_USTATUSUPDATE):
+            pass
+        else:
+            self.log.debug(event="Simulator ignored message", message=message)
+
+    # Motion
+
+    def clamp(self, position: float) -> float:
+        if self.position_limits is None:
+            return position
+        low, high = self.position_limits
+        return min(max(position, low), high)
+
+    def current_position(self, channel: SimulatedChannel, now: float) -> float:
+        if channel.move is None:
+            return channel.position
+        return channel.move.position(now)
+
+    def start_move(
+        self, channel: SimulatedChannel, kind: MoveKind, target: float, now: float
+    ) -> None:
+        if not channel.enabled:
+            self.log.debug(
+                event="Simulator ignored move on disabled channel",
+                chan_ident=channel.chan_ident,
+            )
+            return
+        start_position = self.current_position(channel, now)
+        velocity = (
+            0.0 if self.faults.stall_moves else self.velocity(channel) * self.speedup
+        )
+        acceleration = self.acceleration
+        if acceleration is not None:
+            acceleration *= self.speedup**2
+        move = SimulatedMove(
+            kind=kind,
+            start_time=now,
+            start_position=start_position,
+            target=target,
+            velocity=velocity,
+            acceleration=acceleration,
+        )
+        channel.position = start_position
+        channel.move = move
+        channel.generation += 1
+        generation = channel.generation
+        if move.duration != math.inf:
+            self.call_at(
+                now + move.duration,
+                lambda: self.complete_move(channel, generation),
+            )
+
+    def complete_move(self, channel: SimulatedChannel, generation: int) -> None:
+        with self.state_lock:
+            move = channel.move
+            if move is None or channel.generation != generation:
+                return
+            channel.position = move.target
+            channel.move = None
+            if move.kind == MoveKind.HOME:
+                channel.homed = True
+                self.send(
+                    AptMessage_MGMSG_MOT_MOVE_HOMED(
+                        chan_ident=channel.chan_ident,
+                        destination=Address.HOST_CONTROLLER,
+                        source=Address.GENERIC_USB,
+                    )
+                )
+            else:
+                self.send(self.move_completed_message(channel, time.monotonic()))
+
+    def stop_move(self, channel: SimulatedChannel, now: float) -> None:
+        if channel.move is None:
+            return
+        channel.position = self.current_position(channel, now)
+        channel.move = None
+        channel.generation += 1
+        self.send(
+            AptMessage_MGMSG_MOT_MOVE_STOPPED(
+                chan_ident=channel.chan_ident,
+                destination=Address.HOST_CONTROLLER,
+                source=Address.GENERIC_USB,
+            )
+        )
+
+    # Status
+
+    def send_status_updates(self) -> None:
+        if self.closed.is_set() or not self.updates_enabled.is_set():
+            return
+        now = time.monotonic()
+        with self.state_lock:
+            for channel in self.channels.values():
+                self.send(self.ustatus_message(channel, now))
+        self.call_at(now + self.update_interval, self.send_status_updates)
+
+    def ustatus(self, channel: SimulatedChannel) -> UStatus:
+        move = channel.move
+        moving = move is not None
+        forward = move is not None and move.target >= move.start_position
+        return UStatus(
+            INMOTIONCW=moving and forward,
+            INMOTIONCCW=moving and not forward,
+            CONNECTED=True,
+            HOMING=move is not None and move.kind == MoveKind.HOME,
+            HOMED=channel.homed,
+            SETTLED=not moving,
+            POWEROK=True,
+            ACTIVE=moving,
+            ENABLED=channel.enabled,
+        )
+
+    def ustatus_message(
+        self, channel: SimulatedChannel, now: float
+    ) -> AptMessage_MGMSG_MOT_GET_USTATUSUPDATE:
+        moving = channel.move is not None
+        return AptMessage_MGMSG_MOT_GET_USTATUSUPDATE(
+            chan_ident=channel.chan_ident,
+            position=round(self.current_position(channel, now)),
+            velocity=self.status_velocity(channel) if moving else 0,
+            motor_current=units.pnpq_ureg.Quantity(
+                self.moving_current_milliamps if moving else 0, "milliamp"
+            ),
+            status=self.ustatus(channel),
+            destination=Address.HOST_CONTROLLER,
+            source=Address.GENERIC_USB,
+        )
+
+    def status_message(
+        self, channel: SimulatedChannel, now: float
+    ) -> AptMessage_MGMSG_MOT_GET_STATUSUPDATE:
+        ustatus = self.ustatus(channel)
+        position = round(self.current_position(channel, now))
+        return AptMessage_MGMSG_MOT_GET_STATUSUPDATE(
+            chan_ident=channel.chan_ident,
+            position=position,
+            enc_count=position,
+            status=Status(
+                INMOTIONCW=ustatus.INMOTIONCW,
+                INMOTIONCCW=ustatus.INMOTIONCCW,
+                CONNECTED=ustatus.CONNECTED,
+                HOMING=ustatus.HOMING,
+                HOMED=ustatus.HOMED,
+            ),
+            destination=Address.HOST_CONTROLLER,
+            source=Address.GENERIC_USB,
+        )
+
+    def info_message(self) -> AptMessage_MGMSG_HW_GET_INFO:
+        return AptMessage_MGMSG_HW_GET_INFO(
+            firmware_version=FirmwareVersion(
+                major_revision=1, interim_revision=0, minor_revision=0
+            ),
+            hardware_type=self.hardware_type,
+            hardware_version=1,
+            internal_use=bytes(60),
+            model_number=self.model_number,
+            modification_state=0,
+            number_of_channels=len(self.channel_idents),
+            serial_number=self.serial_number,
+            destination=Address.HOST_CONTROLLER,
+            source=Address.GENERIC_USB,
+        )
+
+    # Device model
+
+    @abstractmethod
+    def velocity(self, channel: SimulatedChannel) -> float:
+        """Maximum velocity of a move, in steps per second, before
+        ``speedup`` is applied."""
+
+    def status_velocity(self, channel: SimulatedChannel) -> int:
+        """Velocity reported in status updates while moving."""
+        return min(round(self.velocity(channel)), 0x7FFF)
+
+    @abstractmethod
+    def jog_distance(self, chan_ident: ChanIdent) -> float:
+        """Steps moved by one jog."""
+
+    @abstractmethod
+    def home_position(self, chan_ident: ChanIdent) -> float:
+        """Position, in steps, that homing moves to."""
+
+    @abstractmethod
+    def move_completed_message(
+        self, channel: SimulatedChannel, now: float
+    ) -> AptMessage:
+        """Message sent when an absolute move or jog finishes."""
+
+
+@dataclass(frozen=True, kw_only=True)
+class SimulatedMPC(SimulatedAptDevice):
+    """Motorized paddle polarization controller. Velocity is a
+    percentage of 400 degrees per second, and a paddle travels 170
+    degrees (1370 steps)."""
+
+    velocity_percent: int = 50
+    home_steps: int = 685
+    jog_step_1: int = 25
+    jog_step_2: int = 25
+    jog_step_3: int = 25
+
+    position_limits: ClassVar[None | tuple[int, int]] = (0, 1370)
+    moving_current_milliamps: ClassVar[int] = 3
+
+    # Changed by MGMSG_POL_SET_PARAMS
+    params: dict[str, int] = field(init=False)
+
+    def __post_init__(self) -> None:
+        super().__post_init__()
+        object.__setattr__(self, "params", self.default_params())
+
+    def default_params(self) -> dict[str, int]:
+        return {
+            "velocity": self.velocity_percent,
+            "home_position": self.home_steps,
+            "jog_step_1": self.jog_step_1,
+            "jog_step_2": self.jog_step_2,
+            "jog_step_3": self.jog_step_3,
+        }
+
+    def handle_message(self, message: AptMessage) -> None:
+        if isinstance(message, AptMessage_MGMSG_POL_REQ_PARAMS):
+            self.send(
+                AptMessage_MGMSG_POL_GET_PARAMS(
+                    destination=Address.HOST_CONTROLLER,
+                    source=Address.GENERIC_USB,
+                    **self.params,
+                )
+            )
+        elif isinstance(message, AptMessage_MGMSG_POL_SET_PARAMS):
+            self.params.update(
+                velocity=message.velocity,
+                home_position=message.home_position,
+                jog_step_1=message.jog_step_1,
+                jog_step_2=message.jog_step_2,
+                jog_step_3=message.jog_step_3,
+            )
+        elif isinstance(message, AptMessage_MGMSG_RESTOREFACTORYSETTINGS):
+            self.params.update(self.default_params())
+        else:
+            super().handle_message(message)
+
+    def velocity(self, channel: SimulatedChannel) -> float:
+        degrees_per_second = 400 * self.params["velocity"] / 100
+        return degrees_per_second * 1370 / 170
+
+    def status_velocity(self, channel: SimulatedChannel) -> int:
+        return self.params["velocity"]
+
+    def jog_distance(self, chan_ident: ChanIdent) -> float:
+        index = self.channel_idents.index(chan_ident) + 1
+        return self.params[f"jog_step_{index}"]
+
+    def home_position(self, chan_ident: ChanIdent) -> float:
+        return self.params["home_position"]
+
+    def move_completed_message(
+        self, channel: SimulatedChannel, now: float
+    ) -> AptMessage:
+        return AptMessage_MGMSG_MOT_MOVE_COMPLETED_6_BYTES(
+            chan_ident=channel.chan_ident,
+            destination=Address.HOST_CONTROLLER,
+            source=Address.GENERIC_USB,
+        )
+
+
+@dataclass(frozen=True, kw_only=True)
+class SimulatedMPC320(SimulatedMPC):
+    model_number: ClassVar[str] = "MPC320"
+    channel_idents: ClassVar[tuple[ChanIdent, ...]] = (
+        ChanIdent.CHANNEL_1,
+        ChanIdent.CHANNEL_2,
+        ChanIdent.CHANNEL_3,
+    )
+
+
+@dataclass(frozen=True, kw_only=True)
+class SimulatedMPC220(SimulatedMPC):
+    model_number: ClassVar[str] = "MPC220"
+    channel_idents: ClassVar[tuple[ChanIdent, ...]] = (
+        ChanIdent.CHANNEL_1,
+        ChanIdent.CHANNEL_2,
+    )
+
+
+@dataclass(frozen=True, kw_only=True)
+class SimulatedK10CR1(SimulatedAptDevice):
+    """Motorized rotation mount with continuous rotation, 49152000
+    steps per revolution, and a trapezoidal velocity profile."""
+
+    velocity_degrees_per_second: float = 10
+    jog_degrees: float = 5
+
+    model_number: ClassVar[str] = "K10CR1"
+    channel_idents: ClassVar[tuple[ChanIdent, ...]] = (ChanIdent.CHANNEL_1,)
+    acceleration: ClassVar[None | float] = 10 * units.K10CR1_STEPS_PER_DEGREE
+    moving_current_milliamps: ClassVar[int] = 250
+
+    def velocity(self, channel: SimulatedChannel) -> float:
+        return self.velocity_degrees_per_second * units.K10CR1_STEPS_PER_DEGREE
+
+    def jog_distance(self, chan_ident: ChanIdent) -> float:
+        return round(self.jog_degrees * units.K10CR1_STEPS_PER_DEGREE)
+
+    def home_position(self, chan_ident: ChanIdent) -> float:
+        return 0
+
+    def move_completed_message(
+        self, channel: SimulatedChannel, now: float
+    ) -> AptMessage:
+        ustatus = self.ustatus_message(channel, now)
+        return AptMessage_MGMSG_MOT_MOVE_COMPLETED_20_BYTES(
+            chan_ident=ustatus.chan_ident,
+            position=ustatus.position,
+            velocity=ustatus.velocity,
+            motor_current=ustatus.motor_current,
+            status=ustatus.status,
+            destination=Address.HOST_CONTROLLER,
+            source=Address.GENERIC_USB,
+        )
+
+
+@dataclass(frozen=True, kw_only=True)
+class SimulatedKBD101(SimulatedAptDevice):
+    """Brushless motor controller driving a DDS100 delay line stage,
+    with 100 millimeters of travel, 2000 steps per millimeter, and a
+    trapezoidal velocity profile."""
+
+    velocity_mm_per_second: float = 100
+    jog_mm: float = 1
+
+    model_number: ClassVar[str] = "KBD101"
+    channel_idents: ClassVar[tuple[ChanIdent, ...]] = (ChanIdent.CHANNEL_1,)
+    position_limits: ClassVar[None | tuple[int, int]] = (0, 100 * 2000)
+    acceleration: ClassVar[None | float] = 1000 * 2000
+    moving_current_milliamps: ClassVar[int] = 500
+
+    def velocity(self, channel: SimulatedChannel) -> float:
+        return self.velocity_mm_per_second * 2000
+
+    def jog_distance(self, chan_ident: ChanIdent) -> float:
+        return self.jog_mm * 2000
+
+    def home_position(self, chan_ident: ChanIdent) -> float:
+        return 0
+
+    def move_completed_message(
+        self, channel: SimulatedChannel, now: float
+    ) -> AptMessage:
+        ustatus = self.ustatus_message(channel, now)
+        return AptMessage_MGMSG_MOT_MOVE_COMPLETED_20_BYTES(
+            chan_ident=ustatus.chan_ident,
+            position=ustatus.position,
+            velocity=ustatus.velocity,
+            motor_current=ustatus.motor_current,
+            status=ustatus.status,
+            destination=Address.HOST_CONTROLLER,
+            source=Address.GENERIC_USB,
+        )
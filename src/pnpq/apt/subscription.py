@@ -0,0 +1,141 @@
+"""Bounded queues for subscribers to messages received by an
+``AptConnection``.
+
+The connection's dispatcher thread gives every received message to
+every subscriber. A subscriber that stops taking messages, or takes
+them more slowly than a device streams status updates, would
+otherwise make its queue grow without limit. A ``SubscriberQueue``
+holds at most ``maxsize`` messages, and its ``OverflowPolicy`` decides
+what happens to a message that arrives when it is full.
+
+A subscriber interested in only some messages can give a
+``MessageFilter``, which the dispatcher checks before queueing, so
+that the subscriber is not woken for the others.
+"""
+
+import enum
+from collections.abc import Callable, Hashable
+from collections.abc import Set as AbstractSet
+from dataclasses import dataclass
+from enum import StrEnum, auto
+from queue import Queue
+
+from .protocol import Address, AptMessage, ChanIdent
+
+
+@enum.unique
+class OverflowPolicy(StrEnum):
+    # Discard the oldest queued message to make room
+    DROP_OLDEST = auto()
+    # Discard the new message
+    DROP_NEWEST = auto()
+    # Discard the oldest queued message with the same key as the new
+    # message, or, if there is none, the oldest queued message. When
+    # keyed by message type and channel, as by default, a slow
+    # subscriber keeps the latest status of each channel.
+    KEEP_LATEST = auto()
+    # Wait for the subscriber to make room. This holds up the
+    # dispatcher, and so every other subscriber, until it does.
+    BLOCK = auto()
+
+
+@dataclass(frozen=True, kw_only=True)
+class MessageFilter:
+    """Matches messages of any of ``message_types``, for any of
+    ``chan_idents`` and from any of ``sources``. A criterion that is
+    None matches every message; messages without a channel never match
+    ``chan_idents``."""
+
+    message_types: None | AbstractSet[type[AptMessage]] = None
+    chan_idents: None | AbstractSet[ChanIdent] = None
+    sources: None | AbstractSet[Address] = None
+
+    def __post_init__(self) -> None:
+        for name in ("message_types", "chan_idents", "sources"):
+            value = getattr(self, name)
+            if value is not None:
+                object.__setattr__(self, name, frozenset(value))
+
+    def matches(self, message: AptMessage) -> bool:
+        return (
+            (self.message_types is None or type(message) in self.message_types)
+            and (
+                self.chan_idents is None
+                or getattr(message, "chan_ident", None) in self.chan_idents
+            )
+            and (self.sources is None or message.source in self.sources)
+        )
+
+
+def message_key(message: AptMessage) -> Hashable:
+    return (message.message_id, getattr(message, "chan_ident", None))
+
+
+class SubscriberQueue(Queue[AptMessage]):
+    """A queue of received messages that applies ``policy`` when the
+    dispatcher offers a message while it holds ``maxsize`` messages.
+    If ``message_filter`` is given, the dispatcher only offers messages
+    that it matches.
+
+    The number of messages discarded is available as ``dropped``.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+        key: Callable[[AptMessage], Hashable] = message_key,
+        message_filter: None | MessageFilter = None,
+    ) -> None:
+        if maxsize <= 0:
+            raise ValueError("Subscriber queues must have a maxsize of at least 1.")
+        super().__init__(maxsize=maxsize)
+        self.policy = policy
+        self.key = key
+        self.message_filter = message_filter
+        self.dropped = 0
+        self.closed = False
+
+    def offer(self, message: AptMessage) -> bool:
+        """Add ``message`` according to the overflow policy. Returns
+        whether a message was discarded to do so."""
+        with self.not_full:
+            if self.closed:
+                return False
+            dropped = False
+            if self._qsize() >= self.maxsize:
+                if self.policy == OverflowPolicy.BLOCK:
+                    while self._qsize() >= self.maxsize and not self.closed:
+                        self.not_full.wait()
+                    if self.closed:
+                        return False
+                elif self.policy == OverflowPolicy.DROP_NEWEST:
+                    self.dropped += 1
+                    return True
+                else:
+                    self.discard_for(message)
+                    self.dropped += 1
+                    dropped = True
+            self._put(message)
+            self.unfinished_tasks += 1  # pylint: disable=E1101
+            self.not_empty.notify()
+            return dropped
+
+    def discard_for(self, message: AptMessage) -> None:
+        # Called with the mutex held
+        index = 0
+        if self.policy == OverflowPolicy.KEEP_LATEST:
+            key = self.key(message)
+            index = next(
+                (i for i, queued in enumerate(self.queue) if self.key(queued) == key),
+                0,
+            )
+        del self.queue[index]
+        self.unfinished_tasks -= 1  # pylint: disable=E1101
+
+    def close(self) -> None:
+        """Stop accepting messages, releasing the dispatcher if it is
+        waiting for room."""
+        with self.mutex:
+            self.closed = True
+            self.not_full.notify_all()
@@ -0,0 +1,86 @@
+"""Timing of the stages of requests sent through an ``AptConnection``.
+
+A ``RequestTrace`` records when a message passed through each stage
+of sending and, for messages that expect a reply, when the reply was
+received, or, for the others, when the connection was released after
+the message settled (see ``pnpq.apt.settle``). Get one per request from
+``AptConnection.send_message_expect_reply_traced``, or every one from
+the connection's ``trace_exporter``.
+
+For a request that completes when the device reports that it has
+finished some work, such as a move, the time from the write until
+the reply is split at the last received message that was not the
+reply. Before it, the device was known to be still working; after it,
+the time is part device work and part waiting for the device to
+report, for example, until the next status poll.
+"""
+
+import time
+from dataclasses import dataclass, field
+
+import structlog
+
+from ..events import Event
+from .protocol import AptMessage
+
+log = structlog.get_logger()
+
+
+@dataclass(kw_only=True)
+class RequestTrace:
+    message: AptMessage
+    expects_reply: bool
+
+    # time.time() when the request was queued, to place the other
+    # times, which are from time.perf_counter(), on the wall clock
+    wall_time: float = field(default_factory=time.time)
+
+    queued: float = field(default_factory=time.perf_counter)
+    # Taken off the queue by the sender thread
+    dequeued: None | float = None
+    # The connection lock was acquired for writing
+    lock_acquired: None | float = None
+    written: None | float = None
+    # A message that gets no reply has taken effect, and the
+    # connection is released
+    settled: None | float = None
+    # The last received message that was not the reply
+    last_unmatched: None | float = None
+    replied: None | float = None
+    reply: None | AptMessage = None
+
+    def spans(self) -> list[tuple[str, float, float]]:
+        """The stages the request has completed, as (name, start, end)
+        in seconds on the time.perf_counter() clock."""
+        stages = [
+            ("queue", self.queued, self.dequeued),
+            ("lock", self.dequeued, self.lock_acquired),
+            ("write", self.lock_acquired, self.written),
+        ]
+        if not self.expects_reply:
+            stages.append(("settle", self.written, self.settled))
+        elif self.replied is not None and self.last_unmatched is not None:
+            stages.append(("device", self.written, self.last_unmatched))
+            stages.append(("confirmation", self.last_unmatched, self.replied))
+        else:
+            stages.append(("reply", self.written, self.replied))
+        spans = []
+        for name, start, end in stages:
+            if start is None or end is None:
+                break
+            spans.append((name, start, end))
+        return spans
+
+    def to_wall_time(self, timestamp: float) -> float:
+        """Convert a time.perf_counter() time of this trace to time.time()."""
+        return self.wall_time + (timestamp - self.queued)
+
+
+def log_trace(trace: RequestTrace) -> None:
+    """A trace exporter that logs the duration of each stage of a
+    request, in seconds, as ``Event.REQUEST_TRACE``."""
+    log.debug(
+        event=Event.REQUEST_TRACE,
+        message=trace.message,
+        **{f"{name}_duration": end - start for name, start, end in trace.spans()},
+    )
@@ -0,0 +1,84 @@
+"""Device drivers.
+
+Driver modules are imported on first use, so that ``import
+pnpq.devices`` stays cheap and a program that only drives one kind of
+device does not pay for loading the others. Both
+``pnpq.devices.PolarizationControllerThorlabsMPC320`` and
+``from pnpq.devices import WaveplateThorlabsK10CR1`` trigger the import
+of the defining module.
+"""
+
+from __future__ import annotations
+
+import importlib
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from .odl_ozoptics_650ml import OdlOzOptics
+    from .odl_thorlabs_kbd101 import OdlThorlabs
+    from .optical_delay_line import OpticalDelayLine
+    from .polarization_controller_thorlabs_mpc import (
+        PolarizationControllerParams,
+        PolarizationControllerThorlabsMPC,
+        PolarizationControllerThorlabsMPC220,
+        PolarizationControllerThorlabsMPC320,
+    )
+    from .refactored_odl_thorlabs_kbd101 import OpticalDelayLineThorlabsKBD101
+    from .refactored_waveplate_thorlabs_k10cr1 import WaveplateThorlabsK10CR1
+    from .waveplate_stub import WaveplateStub
+    from .waveplate_thorlabs_kb10crm import Waveplate
+
+# Public name -> submodule that defines it
+_LAZY_ATTRIBUTES: dict[str, str] = {
+    "OdlOzOptics": "odl_ozoptics_650ml",
+    "OdlThorlabs": "odl_thorlabs_kbd101",
+    "OpticalDelayLine": "optical_delay_line",
+    "OpticalDelayLineThorlabsKBD101": "refactored_odl_thorlabs_kbd101",
+    "PolarizationControllerParams": "polarization_controller_thorlabs_mpc",
+    "PolarizationControllerThorlabsMPC": "polarization_controller_thorlabs_mpc",
+    "PolarizationControllerThorlabsMPC220": "polarization_controller_thorlabs_mpc",
+    "PolarizationControllerThorlabsMPC320": "polarization_controller_thorlabs_mpc",
+    "WaveplateThorlabsK10CR1": "refactored_waveplate_thorlabs_k10cr1",
+    "WaveplateStub": "waveplate_stub",
+    "Waveplate": "waveplate_thorlabs_kb10crm",
+}
+
+__all__ = [
+    "OdlOzOptics",
+    "OdlThorlabs",
+    "OpticalDelayLine",
+    "OpticalDelayLineThorlabsKBD101",
+    "PolarizationControllerParams",
+    "PolarizationControllerThorlabsMPC",
+    "PolarizationControllerThorlabsMPC220",
+    "PolarizationControllerThorlabsMPC320",
+    "Waveplate",
+    "WaveplateStub",
+    "WaveplateThorlabsK10CR1",
+]
+
+
+def __getattr__(name: str) -> Any:
+    module_name = _LAZY_ATTRIBUTES.get(name)
+    if module_name is not None:
+        value = getattr(importlib.import_module(f".{module_name}", __name__), name)
+    elif name.startswith("_"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    else:
+        # Also resolve submodules, e.g. ``pnpq.devices.utils`` after a
+        # bare ``import pnpq.devices``
+        try:
+            value = importlib.import_module(f".{name}", __name__)
+        except ModuleNotFoundError as e:
+            if e.name != f"{__name__}.{name}":
+                raise
+            raise AttributeError(
+                f"module {__name__!r} has no attribute {name!r}"
+            ) from None
+    # Cache on the package so later lookups skip this function
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
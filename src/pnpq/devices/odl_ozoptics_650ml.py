@@ -2,51 +2,113 @@
 
 import logging
 import time
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import Future
 
 from pnpq.devices.optical_delay_line import OpticalDelayLine
-from pnpq.errors import OdlGetPosNotCompleted
+from pnpq.errors import OdlCommandUnknownError, OdlGetPosNotCompleted
+
+from ..ozoptics.connection import OzOpticsConnection, OzOpticsResponse
+from ..transport import SerialTransport, Transport
 
 
 class OdlOzOptics(OpticalDelayLine):
+    """OzOptics ODL-650 optical delay line.
+
+    Commands are sent through an
+    :py:class:`~pnpq.ozoptics.connection.OzOpticsConnection`, so
+    several may be in flight at once: :py:func:`move_async` starts a
+    move and returns without waiting for it, and position queries
+    from other threads are answered in turn.
+    """
+
+    connection: OzOpticsConnection
+    # Creates a transport to the ODL when connecting again after
+    # serial_close, or None if the transport was given
+    new_transport: None | Callable[[], Transport]
+
     def __init__(
         self,
         serial_port: str | None = None,
         serial_number: str | None = None,
+        transport: None | Transport = None,
     ):
-        super().__init__(serial_port, serial_number)
-        self.conn.baudrate = 9600
-        """Basic Communication BaudRate"""
+        # A given transport already reaches the device
+        super().__init__(serial_port, serial_number, find_port=transport is None)
+        if transport is None:
+            port = self.conn.port
+            self.new_transport = lambda: SerialTransport(
+                port=port,
+                # Basic Communication BaudRate
+                baudrate=9600,
+                rtscts=False,
+                startup_delay=0,
+            )
+            transport = self.new_transport()
+        else:
+            self.new_transport = None
         self.resolution = 32768 / 5.08
         """32768 steps per motor revolution(5.08 mm = 2xDistance Travel or mirror travel per pitch 0.1 inch)"""
-        self.conn.timeout = 10
+        self.timeout = 10
 
         self.command_terminate = "\r\n"
 
         self.logger = logging.getLogger(f"{self}")
-        self.conn.open()
+        self.connection = OzOpticsConnection(transport=transport, timeout=self.timeout)
+        self.connection.open()
+        self.is_open = True
+        # Responses to commands written by serial_send, for serial_read
+        self.sent_commands: deque[Future[OzOpticsResponse]] = deque()
 
     def connect(self) -> None:
-        if self.conn.is_open == 0:
-            self.conn.open()
+        """Connect again after :py:func:`serial_close`. A closed
+        transport cannot be reopened, so this is only possible when
+        the ODL was found by port or serial number, and a new
+        transport is created."""
+        if self.is_open:
+            return
+        if self.new_transport is None:
+            raise RuntimeError(
+                "Cannot reconnect an ODL created with a transport: create a new OdlOzOptics with a new transport."
+            )
+        self.connection = OzOpticsConnection(
+            transport=self.new_transport(), timeout=self.timeout
+        )
+        self.connection.open()
+        self.is_open = True
 
-    def move(self, dist: float) -> None:
-        if not self.conn.is_open:
+    def ensure_valid_move(self, dist: float) -> None:
+        if not self.is_open:
             raise RuntimeError("Moving ODL failed: can not connect to ODL device")
         if dist > 200 or dist < 0:
             raise ValueError("Invalid Move Parameter")
+
+    def move(self, dist: float) -> None:
+        self.ensure_valid_move(dist)
         self.set_step(int(dist * self.resolution))
 
+    def move_async(self, dist: float) -> Future[OzOpticsResponse]:
+        """Start moving to ``dist`` millimeters and return without
+        waiting. The returned future completes when the ODL reports
+        that the move is done. Commands sent in the meantime, such as
+        :py:func:`get_step`, are answered in the order they were
+        sent."""
+        self.ensure_valid_move(dist)
+        return self.connection.send("S" + str(int(dist * self.resolution)))
+
     def set_step(self, value: int) -> str:
         cmd = "S" + str(value)
         response = self.serial_command(cmd)
         return response
 
     def get_step(self) -> int:
-        response = self.serial_command("S?")
-        if "UNKNOWN" in response:
+        try:
+            response = self.serial_command("S?")
+        except OdlCommandUnknownError as e:
             raise OdlGetPosNotCompleted(
                 f"Unknown position for ODL({self}): run find_home() first and then change or get the position"
-            )
+            ) from e
         step = response.split("Done")[0].split(":")[1]
         return int(step)
 
@@ -136,48 +198,57 @@ class OdlOzOptics(OpticalDelayLine):
         return response
 
     def serial_close(self) -> None:
-        self.conn.close()
+        self.connection.close()
+        self.is_open = False
 
     def serial_send(self, serial_cmd: str) -> None:
-        # Encode and send the command to the serial device.
-        self.conn.reset_input_buffer()  # flush input buffer, discarding all its contents
-        self.conn.reset_output_buffer()  # flush output buffer, aborting current output and discard all that is in buffer
-        self.conn.write(serial_cmd.encode())
+        # Responses are matched to commands in order, so nothing
+        # received needs to be flushed first
+        self.sent_commands.append(
+            self.connection.send(serial_cmd.removesuffix(self.command_terminate))
+        )
 
     def serial_read(self) -> str:
-        device_output = (self.conn.read_until(expected=bytearray(b"Done"))).decode(
-            "iso-8859-1"
-        )
+        try:
+            device_output = self.sent_commands.popleft().result(self.timeout).text
+        except (IndexError, TimeoutError) as e:
+            raise RuntimeError("Reading from the device failed (Timeout)!") from e
         self.logger.debug("Device read successful: %s", device_output)
-        if "Done" not in device_output:
-            raise RuntimeError("Reading from the device failed (Timeout)!")
         return device_output
 
     def serial_command(self, serial_cmd: str) -> str:
-        self.serial_send(serial_cmd + self.command_terminate)
-        device_output = self.serial_read()
-        return device_output
+        try:
+            response = self.connection.command(serial_cmd)
+        except TimeoutError as e:
+            raise RuntimeError("Reading from the device failed (Timeout)!") from e
+        self.logger.debug("Device read successful: %s", response.text)
+        return response.text
 
     def read_key(self, key: str, retries: int = 5) -> str:
-        device_output = ""
-        got_ok = False
-        while self.conn.in_waiting > 0 or (got_ok is False and retries > 0):
-            device_output += (self.conn.read(self.conn.in_waiting)).decode("iso-8859-1")
+        """Read output that is not the response to a command, until it
+        includes ``key`` or ``retries`` times 50 ms have passed."""
+        expected = key.encode("iso-8859-1")
+        device_output = bytearray()
+        deadline = time.monotonic() + retries * 0.05
+        while True:
+            # Only the new output, and the end of the output before it
+            # that a split key could start in, needs to be searched
+            search_start = max(0, len(device_output) - len(expected) + 1)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            device_output += self.connection.read_unsolicited(remaining)
             # command output is complete.
-            if device_output.find(key) >= 0:
-                got_ok = True
-            time.sleep(0.05)
-            retries -= 1
-        return device_output
+            if device_output.find(expected, search_start) >= 0:
+                break
+        return device_output.decode("iso-8859-1")
 
     def readall(self) -> tuple[bool, str]:
-        ok = False
-        read_bytes = self.conn.read(1)
-        while self.conn.in_waiting > 0:
-            read_bytes += self.conn.read(1)
+        """Read the output that is not the response to a command,
+        waiting for some if there is none."""
+        read_bytes = self.connection.read_unsolicited(self.timeout)
         msg = read_bytes.decode("UTF-8")
-        ok = True
-        return ok, msg
+        return bool(read_bytes), msg
 
 
 if __name__ == "__main__":
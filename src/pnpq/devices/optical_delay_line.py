@@ -19,8 +19,12 @@ class OpticalDelayLine:
         self,
         port: str | None = None,
         serial_number: str | None = None,
+        find_port: bool = True,
     ):
-        if serial_number is None and port is None:
+        """Find the serial port of the ODL by ``serial_number`` or
+        ``port``, unless ``find_port`` is False because the subclass
+        is given another way to reach the device."""
+        if find_port and serial_number is None and port is None:
             raise RuntimeError("Not port name nor serial_number are specified!")
 
         self.name = "Optical Delay Line"
@@ -28,6 +32,8 @@ class OpticalDelayLine:
         self.device_sn = serial_number
         self.port = port
         self.conn = Serial()
+        if not find_port:
+            return
 
         available_ports = serial.tools.list_ports.comports()
         for ports in available_ports:
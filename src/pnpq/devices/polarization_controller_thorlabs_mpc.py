@@ -1,12 +1,14 @@
+from __future__ import annotations
+
 import threading
 import time
 from dataclasses import dataclass, field
-from typing import TypedDict, cast
+from typing import TYPE_CHECKING, TypedDict, cast
 
 import structlog
-from pint import Quantity
 
-from ..apt.connection import AptConnection
+from .. import units
+from ..apt.connection import AptConnection, Priority
 from ..apt.protocol import (
     Address,
     AptMessage_MGMSG_MOD_IDENTIFY,
@@ -18,6 +20,7 @@ from ..apt.protocol import (
     AptMessage_MGMSG_MOT_MOVE_HOME,
     AptMessage_MGMSG_MOT_MOVE_HOMED,
     AptMessage_MGMSG_MOT_MOVE_JOG,
+    AptMessage_MGMSG_MOT_MOVE_STOP,
     AptMessage_MGMSG_MOT_REQ_USTATUSUPDATE,
     AptMessage_MGMSG_POL_GET_PARAMS,
     AptMessage_MGMSG_POL_REQ_PARAMS,
@@ -25,8 +28,13 @@ from ..apt.protocol import (
     ChanIdent,
     EnableState,
     JogDirection,
+    StopMode,
 )
-from ..units import pnpq_ureg
+from ..apt.subscription import MessageFilter
+from .utils import DeviceOperations
+
+if TYPE_CHECKING:
+    from pint import Quantity
 
 
 class PolarizationControllerParams(TypedDict):
@@ -55,7 +63,20 @@ class PolarizationControllerThorlabsMPC:
     # Setup channels for the device
     available_channels: frozenset[ChanIdent] = frozenset([])
 
+    operations: DeviceOperations = field(init=False)
+
     def __post_init__(self) -> None:
+        self.connection.motor_channels.update(self.available_channels)
+        object.__setattr__(
+            self,
+            "operations",
+            DeviceOperations(
+                device=type(self).__name__,
+                connection=self.connection.label,
+                metrics=self.connection.metrics,
+            ),
+        )
+
         # Start polling thread
         object.__setattr__(
             self,
@@ -113,17 +134,27 @@ class PolarizationControllerThorlabsMPC:
     def get_status(
         self, chan_ident: ChanIdent
     ) -> AptMessage_MGMSG_MOT_GET_USTATUSUPDATE:
-        msg = self.connection.send_message_expect_reply(
-            AptMessage_MGMSG_MOT_REQ_USTATUSUPDATE(
-                chan_ident=chan_ident,
-                destination=Address.GENERIC_USB,
-                source=Address.HOST_CONTROLLER,
-            ),
-            lambda message: (
-                isinstance(message, AptMessage_MGMSG_MOT_GET_USTATUSUPDATE)
-                and message.chan_ident == chan_ident
-                and message.destination == Address.HOST_CONTROLLER
-                and message.source == Address.GENERIC_USB
+        # Concurrent readers share one request and its reply
+        msg = self.operations.coalesce(
+            "get_status",
+            chan_ident,
+            lambda: self.connection.send_message_expect_reply(
+                AptMessage_MGMSG_MOT_REQ_USTATUSUPDATE(
+                    chan_ident=chan_ident,
+                    destination=Address.GENERIC_USB,
+                    source=Address.HOST_CONTROLLER,
+                ),
+                lambda message: (
+                    isinstance(message, AptMessage_MGMSG_MOT_GET_USTATUSUPDATE)
+                    and message.chan_ident == chan_ident
+                    and message.destination == Address.HOST_CONTROLLER
+                    and message.source == Address.GENERIC_USB
+                ),
+                reply_filter=MessageFilter(
+                    message_types={AptMessage_MGMSG_MOT_GET_USTATUSUPDATE},
+                    chan_idents={chan_ident},
+                    sources={Address.GENERIC_USB},
+                ),
             ),
         )
         return cast(AptMessage_MGMSG_MOT_GET_USTATUSUPDATE, msg)
@@ -143,9 +174,15 @@ class PolarizationControllerThorlabsMPC:
                 and message.destination == Address.HOST_CONTROLLER
                 and message.source == Address.GENERIC_USB
             ),
+            reply_filter=MessageFilter(
+                message_types={AptMessage_MGMSG_MOT_MOVE_HOMED},
+                chan_idents={chan_ident},
+                sources={Address.GENERIC_USB},
+            ),
         )
         elapsed_time = time.perf_counter() - start_time
         self.log.debug("home command finished", elapsed_time=elapsed_time)
+        self.operations.observe("home", elapsed_time)
         self.set_channel_enabled(chan_ident, False)
 
     def identify(self, chan_ident: ChanIdent) -> None:
@@ -154,7 +191,8 @@ class PolarizationControllerThorlabsMPC:
                 chan_ident=chan_ident,
                 destination=Address.GENERIC_USB,
                 source=Address.HOST_CONTROLLER,
-            )
+            ),
+            priority=Priority.BACKGROUND,
         )
 
     def jog(self, chan_ident: ChanIdent, jog_direction: JogDirection) -> None:
@@ -171,6 +209,7 @@ class PolarizationControllerThorlabsMPC:
         """
 
         self.set_channel_enabled(chan_ident, True)
+        start_time = time.perf_counter()
         self.connection.send_message_expect_reply(
             AptMessage_MGMSG_MOT_MOVE_JOG(
                 chan_ident=chan_ident,
@@ -184,7 +223,13 @@ class PolarizationControllerThorlabsMPC:
                 and message.destination == Address.HOST_CONTROLLER
                 and message.source == Address.GENERIC_USB
             ),
+            reply_filter=MessageFilter(
+                message_types={AptMessage_MGMSG_MOT_MOVE_COMPLETED_6_BYTES},
+                chan_idents={chan_ident},
+                sources={Address.GENERIC_USB},
+            ),
         )
+        self.operations.observe("jog", time.perf_counter() - start_time)
         self.set_channel_enabled(chan_ident, False)
 
     def move_absolute(self, chan_ident: ChanIdent, position: Quantity) -> None:
@@ -195,6 +240,15 @@ class PolarizationControllerThorlabsMPC:
             raise ValueError(
                 f"Absolute position must be between 0 and 170 degrees (or equivalent). Value given was {absolute_degree} degrees."
             )
+        # A second request for the same move while it is in progress
+        # waits for it, rather than sending it again
+        self.operations.coalesce(
+            "move_absolute",
+            (chan_ident, absolute_distance),
+            lambda: self.send_move_absolute(chan_ident, absolute_distance),
+        )
+
+    def send_move_absolute(self, chan_ident: ChanIdent, absolute_distance: int) -> None:
         self.set_channel_enabled(chan_ident, True)
         self.log.debug("Sending move_absolute command...")
         start_time = time.perf_counter()
@@ -212,20 +266,40 @@ class PolarizationControllerThorlabsMPC:
                 and message.destination == Address.HOST_CONTROLLER
                 and message.source == Address.GENERIC_USB
             ),
+            # MOVE_COMPLETED is not the reply, but passing it through
+            # lets request traces tell when the move itself finished
+            reply_filter=MessageFilter(
+                message_types={
+                    AptMessage_MGMSG_MOT_GET_USTATUSUPDATE,
+                    AptMessage_MGMSG_MOT_MOVE_COMPLETED_6_BYTES,
+                },
+                chan_idents={chan_ident},
+                sources={Address.GENERIC_USB},
+            ),
         )
         elapsed_time = time.perf_counter() - start_time
         self.log.debug("move_absolute command finished", elapsed_time=elapsed_time)
+        self.operations.observe("move_absolute", elapsed_time)
         self.set_channel_enabled(chan_ident, False)
 
     def get_params(self) -> PolarizationControllerParams:
-        params = self.connection.send_message_expect_reply(
-            AptMessage_MGMSG_POL_REQ_PARAMS(
-                destination=Address.GENERIC_USB,
-                source=Address.HOST_CONTROLLER,
+        params = self.operations.coalesce(
+            "get_params",
+            None,
+            lambda: self.connection.send_message_expect_reply(
+                AptMessage_MGMSG_POL_REQ_PARAMS(
+                    destination=Address.GENERIC_USB,
+                    source=Address.HOST_CONTROLLER,
+                ),
+                lambda message: (isinstance(message, AptMessage_MGMSG_POL_GET_PARAMS)),
+                reply_filter=MessageFilter(
+                    message_types={AptMessage_MGMSG_POL_GET_PARAMS}
+                ),
+                priority=Priority.BACKGROUND,
             ),
-            lambda message: (isinstance(message, AptMessage_MGMSG_POL_GET_PARAMS)),
         )
         assert isinstance(params, AptMessage_MGMSG_POL_GET_PARAMS)
+        pnpq_ureg = units.pnpq_ureg
         result: PolarizationControllerParams = {
             "velocity": params.velocity * pnpq_ureg.mpc320_velocity,
             "home_position": params.home_position * pnpq_ureg.mpc320_step,
@@ -254,6 +328,11 @@ class PolarizationControllerThorlabsMPC:
                 and message.destination == Address.HOST_CONTROLLER
                 and message.source == Address.GENERIC_USB
             ),
+            reply_filter=MessageFilter(
+                message_types={AptMessage_MGMSG_MOT_GET_USTATUSUPDATE},
+                chan_idents={chan_ident},
+                sources={Address.GENERIC_USB},
+            ),
         )
 
     def set_params(
@@ -269,15 +348,15 @@ class PolarizationControllerThorlabsMPC:
         params = self.get_params()
         # Replace params that need to be changed
         if velocity is not None:
-            params["velocity"] = cast(Quantity, velocity.to("mpc320_velocity"))
+            params["velocity"] = velocity.to("mpc320_velocity")
         if home_position is not None:
-            params["home_position"] = cast(Quantity, home_position.to("mpc320_step"))
+            params["home_position"] = home_position.to("mpc320_step")
         if jog_step_1 is not None:
-            params["jog_step_1"] = cast(Quantity, jog_step_1.to("mpc320_step"))
+            params["jog_step_1"] = jog_step_1.to("mpc320_step")
         if jog_step_2 is not None:
-            params["jog_step_2"] = cast(Quantity, jog_step_2.to("mpc320_step"))
+            params["jog_step_2"] = jog_step_2.to("mpc320_step")
         if jog_step_3 is not None:
-            params["jog_step_3"] = cast(Quantity, jog_step_3.to("mpc320_step"))
+            params["jog_step_3"] = jog_step_3.to("mpc320_step")
         # Send params to device
         self.connection.send_message_no_reply(
             AptMessage_MGMSG_POL_SET_PARAMS(
@@ -288,7 +367,24 @@ class PolarizationControllerThorlabsMPC:
                 jog_step_1=round(params["jog_step_1"].magnitude),
                 jog_step_2=round(params["jog_step_2"].magnitude),
                 jog_step_3=round(params["jog_step_3"].magnitude),
-            )
+            ),
+        )
+
+    def stop(self, chan_ident: ChanIdent) -> None:
+        """Stops the paddle immediately, ahead of any other queued
+        commands. A home, jog or move of the channel that is in
+        progress raises :py:class:`pnpq.errors.RequestCancelledError`.
+
+        :param chan_ident: The motor channel to stop.
+        """
+        self.connection.send_message_no_reply(
+            AptMessage_MGMSG_MOT_MOVE_STOP(
+                chan_ident=chan_ident,
+                stop_mode=StopMode.IMMEDIATE,
+                destination=Address.GENERIC_USB,
+                source=Address.HOST_CONTROLLER,
+            ),
+            priority=Priority.EMERGENCY,
         )
 
 
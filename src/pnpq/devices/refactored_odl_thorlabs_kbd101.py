@@ -0,0 +1,272 @@
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, cast
+
+import structlog
+
+from .. import units
+from ..apt.connection import AptConnection, Priority
+from ..apt.protocol import (
+    Address,
+    AptMessage,
+    AptMessage_MGMSG_MOD_IDENTIFY,
+    AptMessage_MGMSG_MOD_SET_CHANENABLESTATE,
+    AptMessage_MGMSG_MOT_GET_USTATUSUPDATE,
+    AptMessage_MGMSG_MOT_MOVE_ABSOLUTE,
+    AptMessage_MGMSG_MOT_MOVE_COMPLETED_20_BYTES,
+    AptMessage_MGMSG_MOT_MOVE_HOME,
+    AptMessage_MGMSG_MOT_MOVE_HOMED,
+    AptMessage_MGMSG_MOT_MOVE_RELATIVE,
+    AptMessage_MGMSG_MOT_MOVE_STOP,
+    AptMessage_MGMSG_MOT_REQ_USTATUSUPDATE,
+    ChanIdent,
+    EnableState,
+    StopMode,
+)
+from ..apt.settle import SettleRule, channel_enable_confirmed
+from ..apt.subscription import MessageFilter
+from ..errors import OdlMoveOutofRangeError
+from .utils import DeviceOperations
+
+if TYPE_CHECKING:
+    from pint import Quantity
+
+
+@dataclass(frozen=True, kw_only=True)
+class OpticalDelayLineThorlabsKBD101:
+    """A DDS100 delay line stage driven by a KBD101 brushless motor
+    controller.
+
+    Positions and distances may be given as lengths, as picoseconds
+    of delay, or in ``kbd101_step``. See :py:mod:`pnpq.units` for how
+    delay is converted to distance.
+    """
+
+    connection: AptConnection
+
+    log = structlog.get_logger()
+
+    # Setup channels for the device
+    available_channels: frozenset[ChanIdent] = frozenset([ChanIdent.CHANNEL_1])
+
+    _chan_ident = ChanIdent.CHANNEL_1
+
+    # Limits of travel of the stage, in kbd101_step
+    min_position: int = 0
+    max_position: int = 100 * units.KBD101_STEPS_PER_MM
+    # Seconds to wait for a move to complete. Homing, or travelling
+    # the full length of the stage, may take longer than other
+    # requests.
+    motion_timeout: float = 60
+
+    operations: DeviceOperations = field(init=False)
+    # Held from reading the position for a relative move until the move
+    # is done
+    motion_lock: threading.RLock = field(default_factory=threading.RLock)
+
+    def __post_init__(self) -> None:
+        self.connection.motor_channels.update(self.available_channels)
+        # The channel enable state takes effect once the status
+        # reports it, rather than after a fixed delay
+        self.connection.settle_policy.rules[
+            AptMessage_MGMSG_MOD_SET_CHANENABLESTATE
+        ] = SettleRule(
+            confirm=channel_enable_confirmed,
+            confirm_filter=MessageFilter(
+                message_types={AptMessage_MGMSG_MOT_GET_USTATUSUPDATE},
+                chan_idents={self._chan_ident},
+                sources={Address.GENERIC_USB},
+            ),
+            status_request=lambda _: AptMessage_MGMSG_MOT_REQ_USTATUSUPDATE(
+                chan_ident=self._chan_ident,
+                destination=Address.GENERIC_USB,
+                source=Address.HOST_CONTROLLER,
+            ),
+        )
+        object.__setattr__(
+            self,
+            "operations",
+            DeviceOperations(
+                device=type(self).__name__,
+                connection=self.connection.label,
+                metrics=self.connection.metrics,
+            ),
+        )
+
+        # The stage only holds its position while the motor is
+        # enabled, so the channel stays enabled
+        self.connection.send_message_no_reply(
+            AptMessage_MGMSG_MOD_SET_CHANENABLESTATE(
+                chan_ident=self._chan_ident,
+                enable_state=EnableState.CHANNEL_ENABLED,
+                destination=Address.GENERIC_USB,
+                source=Address.HOST_CONTROLLER,
+            )
+        )
+
+    def get_status(self) -> AptMessage_MGMSG_MOT_GET_USTATUSUPDATE:
+        # Concurrent readers share one request and its reply
+        msg = self.operations.coalesce(
+            "get_status",
+            None,
+            lambda: self.connection.send_message_expect_reply(
+                AptMessage_MGMSG_MOT_REQ_USTATUSUPDATE(
+                    chan_ident=self._chan_ident,
+                    destination=Address.GENERIC_USB,
+                    source=Address.HOST_CONTROLLER,
+                ),
+                lambda message: (
+                    isinstance(message, AptMessage_MGMSG_MOT_GET_USTATUSUPDATE)
+                    and message.chan_ident == self._chan_ident
+                    and message.destination == Address.HOST_CONTROLLER
+                    and message.source == Address.GENERIC_USB
+                ),
+                reply_filter=MessageFilter(
+                    message_types={AptMessage_MGMSG_MOT_GET_USTATUSUPDATE},
+                    chan_idents={self._chan_ident},
+                    sources={Address.GENERIC_USB},
+                ),
+            ),
+        )
+        return cast(AptMessage_MGMSG_MOT_GET_USTATUSUPDATE, msg)
+
+    def get_position(self) -> Quantity:
+        """The position of the stage, in millimeters. Convert it to
+        picoseconds for the delay."""
+        position = self.get_status().position
+        return (position * units.pnpq_ureg.kbd101_step).to("millimeter")
+
+    def home(self) -> None:
+        """Moves the stage to its home position, at the start of its
+        travel, and resets its position to zero there."""
+        self.operations.coalesce("home", None, self.send_home)
+
+    def send_home(self) -> None:
+        with self.motion_lock:
+            start_time = time.perf_counter()
+            self.connection.send_message_expect_reply(
+                AptMessage_MGMSG_MOT_MOVE_HOME(
+                    chan_ident=self._chan_ident,
+                    destination=Address.GENERIC_USB,
+                    source=Address.HOST_CONTROLLER,
+                ),
+                lambda message: (
+                    isinstance(message, AptMessage_MGMSG_MOT_MOVE_HOMED)
+                    and message.chan_ident == self._chan_ident
+                    and message.destination == Address.HOST_CONTROLLER
+                    and message.source == Address.GENERIC_USB
+                ),
+                reply_filter=MessageFilter(
+                    message_types={AptMessage_MGMSG_MOT_MOVE_HOMED},
+                    chan_idents={self._chan_ident},
+                    sources={Address.GENERIC_USB},
+                ),
+                reply_timeout=self.motion_timeout,
+            )
+            elapsed_time = time.perf_counter() - start_time
+            self.log.debug("home command finished", elapsed_time=elapsed_time)
+            self.operations.observe("home", elapsed_time)
+
+    def move_absolute(self, position: Quantity) -> None:
+        """Moves the stage to a position.
+
+        :param position: The position to move to, as a distance from
+            home or the delay added at that distance.
+        """
+        absolute_distance = round(position.to("kbd101_step").magnitude)
+        self.check_in_range(absolute_distance)
+        # A second request for the same move while it is in progress
+        # waits for it, rather than sending it again
+        self.operations.coalesce(
+            "move_absolute",
+            absolute_distance,
+            lambda: self.send_move(
+                "move_absolute",
+                AptMessage_MGMSG_MOT_MOVE_ABSOLUTE(
+                    chan_ident=self._chan_ident,
+                    absolute_distance=absolute_distance,
+                    destination=Address.GENERIC_USB,
+                    source=Address.HOST_CONTROLLER,
+                ),
+            ),
+        )
+
+    def move_relative(self, distance: Quantity) -> None:
+        """Moves the stage by a distance from its current position.
+        Unlike absolute moves, two identical relative moves requested
+        at the same time are both made.
+
+        :param distance: The distance, or change in delay, to move by,
+            negative to move towards home.
+        """
+        relative_distance = round(distance.to("kbd101_step").magnitude)
+        with self.motion_lock:
+            self.check_in_range(self.get_status().position + relative_distance)
+            self.send_move(
+                "move_relative",
+                AptMessage_MGMSG_MOT_MOVE_RELATIVE(
+                    chan_ident=self._chan_ident,
+                    relative_distance=relative_distance,
+                    destination=Address.GENERIC_USB,
+                    source=Address.HOST_CONTROLLER,
+                ),
+            )
+
+    def send_move(self, operation: str, message: AptMessage) -> None:
+        with self.motion_lock:
+            start_time = time.perf_counter()
+            self.connection.send_message_expect_reply(
+                message,
+                lambda reply: (
+                    isinstance(reply, AptMessage_MGMSG_MOT_MOVE_COMPLETED_20_BYTES)
+                    and reply.chan_ident == self._chan_ident
+                    and reply.destination == Address.HOST_CONTROLLER
+                    and reply.source == Address.GENERIC_USB
+                ),
+                reply_filter=MessageFilter(
+                    message_types={AptMessage_MGMSG_MOT_MOVE_COMPLETED_20_BYTES},
+                    chan_idents={self._chan_ident},
+                    sources={Address.GENERIC_USB},
+                ),
+                reply_timeout=self.motion_timeout,
+            )
+            elapsed_time = time.perf_counter() - start_time
+            self.log.debug(
+                "move command finished", operation=operation, elapsed_time=elapsed_time
+            )
+            self.operations.observe(operation, elapsed_time)
+
+    def check_in_range(self, position: int) -> None:
+        if self.min_position <= position <= self.max_position:
+            return
+        raise OdlMoveOutofRangeError(
+            f"Position {position} kbd101_step is out of range [{self.min_position}, {self.max_position}]."
+        )
+
+    def identify(self) -> None:
+        """Flashes the LED on the front of the controller."""
+        self.connection.send_message_no_reply(
+            AptMessage_MGMSG_MOD_IDENTIFY(
+                chan_ident=self._chan_ident,
+                destination=Address.GENERIC_USB,
+                source=Address.HOST_CONTROLLER,
+            ),
+            priority=Priority.BACKGROUND,
+        )
+
+    def stop(self) -> None:
+        """Stops the stage immediately, ahead of any other queued
+        commands. A home or move that is in progress raises
+        :py:class:`pnpq.errors.RequestCancelledError`."""
+        self.connection.send_message_no_reply(
+            AptMessage_MGMSG_MOT_MOVE_STOP(
+                chan_ident=self._chan_ident,
+                stop_mode=StopMode.IMMEDIATE,
+                destination=Address.GENERIC_USB,
+                source=Address.HOST_CONTROLLER,
+            ),
+            priority=Priority.EMERGENCY,
+        )
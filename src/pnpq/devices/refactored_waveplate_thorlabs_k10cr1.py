@@ -1,21 +1,64 @@
+from __future__ import annotations
+
 import threading
 import time
 from dataclasses import dataclass, field
+from queue import Empty, ShutDown
+from typing import TYPE_CHECKING, TypedDict, cast
 
 import structlog
-from pint import Quantity
 
-from ..apt.connection import AptConnection
+from .. import units
+from ..apt.connection import AptConnection, Priority
 from ..apt.protocol import (
     Address,
+    AptMessage,
     AptMessage_MGMSG_HW_START_UPDATEMSGS,
+    AptMessage_MGMSG_MOD_IDENTIFY,
     AptMessage_MGMSG_MOD_SET_CHANENABLESTATE,
     AptMessage_MGMSG_MOT_ACK_USTATUSUPDATE,
+    AptMessage_MGMSG_MOT_GET_HOMEPARAMS,
+    AptMessage_MGMSG_MOT_GET_USTATUSUPDATE,
     AptMessage_MGMSG_MOT_MOVE_ABSOLUTE,
     AptMessage_MGMSG_MOT_MOVE_COMPLETED_20_BYTES,
+    AptMessage_MGMSG_MOT_MOVE_HOME,
+    AptMessage_MGMSG_MOT_MOVE_HOMED,
+    AptMessage_MGMSG_MOT_MOVE_JOG,
+    AptMessage_MGMSG_MOT_MOVE_RELATIVE,
+    AptMessage_MGMSG_MOT_MOVE_STOP,
+    AptMessage_MGMSG_MOT_REQ_HOMEPARAMS,
+    AptMessage_MGMSG_MOT_REQ_USTATUSUPDATE,
+    AptMessage_MGMSG_MOT_SET_HOMEPARAMS,
+    AptMessage_MGMSG_MOT_SET_POSCOUNTER,
+    AptMessageWithDataMotorStatus,
     ChanIdent,
     EnableState,
+    HomeDirection,
+    JogDirection,
+    LimitSwitch,
+    StopMode,
+)
+from ..apt.settle import (
+    SettleRule,
+    channel_enable_confirmed,
+    position_counter_confirmed,
 )
+from ..apt.subscription import MessageFilter
+from .utils import DeviceOperations, nearest_equivalent
+
+if TYPE_CHECKING:
+    from pint import Quantity
+
+
+class WaveplateHomeParams(TypedDict):
+    home_direction: HomeDirection
+    #: The limit switch at which homing stops
+    limit_switch: LimitSwitch
+    #: Dimensionality must be ([angle] / [time]) or k10cr1_velocity
+    home_velocity: Quantity
+    #: Distance from the limit switch to the home position.
+    #: Dimensionality must be [angle] or k10cr1_step
+    offset_distance: Quantity
 
 
 @dataclass(frozen=True, kw_only=True)
@@ -33,7 +76,68 @@ class WaveplateThorlabsK10CR1:
 
     _chan_ident = ChanIdent.CHANNEL_1
 
+    operations: DeviceOperations = field(init=False)
+    # Held from reading the position for a move until the move, and
+    # any reset of the position counter after it, is done
+    motion_lock: threading.RLock = field(default_factory=threading.RLock)
+
+    # The latest status from the update stream that the device sends
+    # after MGMSG_HW_START_UPDATEMSGS, with the time.monotonic() time
+    # it was received, kept by the status thread
+    rx_status_thread: threading.Thread = field(init=False)
+    last_status: None | tuple[float, AptMessageWithDataMotorStatus] = field(
+        init=False, default=None
+    )
+    last_status_lock: threading.Lock = field(default_factory=threading.Lock)
+    # Seconds after which the latest status is too old to be used, and
+    # the status is requested from the device instead
+    status_max_age: float = 0.5
+    # Seconds to wait for a move to complete. Homing may take the
+    # mount most of a turn at its homing velocity.
+    motion_timeout: float = 60
+    # Whether moves enable the channel before they start and disable
+    # it once they are done. If not, the channel stays as it was last
+    # set by set_channel_enabled.
+    enable_channel_for_moves: bool = True
+
     def __post_init__(self) -> None:
+        self.connection.motor_channels.update(self.available_channels)
+        # The channel enable state and position counter take effect
+        # once the status reports them, rather than after a fixed delay
+        status_filter = MessageFilter(
+            message_types={AptMessage_MGMSG_MOT_GET_USTATUSUPDATE},
+            chan_idents={self._chan_ident},
+            sources={Address.GENERIC_USB},
+        )
+
+        def status_request(_: AptMessage) -> AptMessage:
+            return AptMessage_MGMSG_MOT_REQ_USTATUSUPDATE(
+                chan_ident=self._chan_ident,
+                destination=Address.GENERIC_USB,
+                source=Address.HOST_CONTROLLER,
+            )
+
+        rules = self.connection.settle_policy.rules
+        rules[AptMessage_MGMSG_MOD_SET_CHANENABLESTATE] = SettleRule(
+            confirm=channel_enable_confirmed,
+            confirm_filter=status_filter,
+            status_request=status_request,
+        )
+        rules[AptMessage_MGMSG_MOT_SET_POSCOUNTER] = SettleRule(
+            confirm=position_counter_confirmed,
+            confirm_filter=status_filter,
+            status_request=status_request,
+        )
+        object.__setattr__(
+            self,
+            "operations",
+            DeviceOperations(
+                device=type(self).__name__,
+                connection=self.connection.label,
+                metrics=self.connection.metrics,
+            ),
+        )
+
         # Start polling thread
         object.__setattr__(
             self,
@@ -43,6 +147,13 @@ class WaveplateThorlabsK10CR1:
 
         self.tx_poller_thread.start()
 
+        object.__setattr__(
+            self,
+            "rx_status_thread",
+            threading.Thread(target=self.rx_track_status, daemon=True),
+        )
+        self.rx_status_thread.start()
+
         # Send autoupdate
         self.connection.send_message_no_reply(
             AptMessage_MGMSG_HW_START_UPDATEMSGS(
@@ -54,7 +165,7 @@ class WaveplateThorlabsK10CR1:
     # Polling thread for sending status update requests
     def tx_poll(self) -> None:
         with self.tx_poller_thread_lock:
-            while True:
+            while not self.connection.stop_event.is_set():
                 self.connection.send_message_unordered(
                     AptMessage_MGMSG_MOT_ACK_USTATUSUPDATE(
                         destination=Address.GENERIC_USB,
@@ -82,6 +193,30 @@ class WaveplateThorlabsK10CR1:
                     # should decrease this interval.
                     self.connection.tx_ordered_sender_awaiting_reply.wait(0.9)
 
+    def rx_track_status(self) -> None:
+        """Keep the latest status of the channel, from status updates
+        and the status that follows a completed move."""
+        with self.connection.rx_subscribe(
+            message_filter=MessageFilter(
+                message_types={
+                    AptMessage_MGMSG_MOT_GET_USTATUSUPDATE,
+                    AptMessage_MGMSG_MOT_MOVE_COMPLETED_20_BYTES,
+                },
+                chan_idents={self._chan_ident},
+                sources={Address.GENERIC_USB},
+            )
+        ) as queue:
+            while not self.connection.stop_event.is_set():
+                try:
+                    message = queue.get(timeout=0.5)
+                except Empty:
+                    continue
+                except ShutDown:
+                    return
+                assert isinstance(message, AptMessageWithDataMotorStatus)
+                with self.last_status_lock:
+                    object.__setattr__(self, "last_status", (time.monotonic(), message))
+
     def set_channel_enabled(self, enabled: bool) -> None:
         if enabled:
             chan_bitmask = self._chan_ident
@@ -97,32 +232,348 @@ class WaveplateThorlabsK10CR1:
             ),
         )
 
-    def move_absolute(self, position: Quantity) -> None:
+    def set_channel_enabled_for_move(self, enabled: bool) -> None:
+        if self.enable_channel_for_moves:
+            self.set_channel_enabled(enabled)
+
+    def get_status(self) -> AptMessage_MGMSG_MOT_GET_USTATUSUPDATE:
+        # Concurrent readers share one request and its reply
+        msg = self.operations.coalesce(
+            "get_status",
+            None,
+            lambda: self.connection.send_message_expect_reply(
+                AptMessage_MGMSG_MOT_REQ_USTATUSUPDATE(
+                    chan_ident=self._chan_ident,
+                    destination=Address.GENERIC_USB,
+                    source=Address.HOST_CONTROLLER,
+                ),
+                lambda message: (
+                    isinstance(message, AptMessage_MGMSG_MOT_GET_USTATUSUPDATE)
+                    and message.chan_ident == self._chan_ident
+                    and message.destination == Address.HOST_CONTROLLER
+                    and message.source == Address.GENERIC_USB
+                ),
+                reply_filter=MessageFilter(
+                    message_types={AptMessage_MGMSG_MOT_GET_USTATUSUPDATE},
+                    chan_idents={self._chan_ident},
+                    sources={Address.GENERIC_USB},
+                ),
+            ),
+        )
+        return cast(AptMessage_MGMSG_MOT_GET_USTATUSUPDATE, msg)
+
+    def move_absolute(
+        self,
+        position: Quantity,
+        period: None | Quantity = None,
+        shortest_path: bool = True,
+    ) -> None:
         """Moves the waveplate to a certain angle.
 
+        The waveplate moves the shortest way to an angle equivalent to
+        ``position``, rather than to ``position`` itself, and its
+        position counter is kept within one turn.
+
         :param position: The angle to move to.
+        :param period: The angle after which the effect of the
+            waveplate repeats, such as 180 degrees for a half-wave
+            plate. Defaults to a full turn.
+        :param shortest_path: If ``False``, ``position`` is instead an
+            absolute position of the counter, and the waveplate turns
+            all the way to it.
         """
 
         absolute_distance = round(position.to("k10cr1_step").magnitude)
-        self.set_channel_enabled(True)
-        self.log.debug("Sending move_absolute command...")
-        start_time = time.perf_counter()
-        self.connection.send_message_expect_reply(
-            AptMessage_MGMSG_MOT_MOVE_ABSOLUTE(
+        if not shortest_path:
+            if period is not None:
+                raise ValueError("A period only applies to shortest path moves.")
+            # A second request for the same move while it is in
+            # progress waits for it, rather than sending it again
+            self.operations.coalesce(
+                "move_absolute",
+                absolute_distance,
+                lambda: self.send_move_absolute(absolute_distance),
+            )
+            return
+        period_steps = (
+            units.K10CR1_STEPS_PER_REVOLUTION
+            if period is None
+            else round(period.to("k10cr1_step").magnitude)
+        )
+        self.operations.coalesce(
+            "move_absolute",
+            (absolute_distance, period_steps),
+            lambda: self.send_move_nearest(absolute_distance, period_steps),
+        )
+
+    def send_move_nearest(self, absolute_distance: int, period: int) -> None:
+        turn = units.K10CR1_STEPS_PER_REVOLUTION
+        with self.motion_lock:
+            current = self.get_status().position
+            target = nearest_equivalent(current, absolute_distance, period)
+            self.log.debug(
+                event="Planned shortest move",
+                current=current,
+                requested=absolute_distance,
+                target=target,
+            )
+            if target != current:
+                self.send_move_absolute(target)
+            # Moving the shortest way may leave the position outside
+            # the first turn, so bring the counter back to keep it
+            # from growing as the mount keeps turning one way
+            if not 0 <= target < turn:
+                self.connection.send_message_no_reply(
+                    AptMessage_MGMSG_MOT_SET_POSCOUNTER(
+                        chan_ident=self._chan_ident,
+                        position=target % turn,
+                        destination=Address.GENERIC_USB,
+                        source=Address.HOST_CONTROLLER,
+                    )
+                )
+
+    def send_move_absolute(self, absolute_distance: int) -> None:
+        with self.motion_lock:
+            self.set_channel_enabled_for_move(True)
+            try:
+                self.log.debug("Sending move_absolute command...")
+                start_time = time.perf_counter()
+                self.connection.send_message_expect_reply(
+                    AptMessage_MGMSG_MOT_MOVE_ABSOLUTE(
+                        chan_ident=self._chan_ident,
+                        absolute_distance=absolute_distance,
+                        destination=Address.GENERIC_USB,
+                        source=Address.HOST_CONTROLLER,
+                    ),
+                    lambda message: (
+                        isinstance(
+                            message, AptMessage_MGMSG_MOT_MOVE_COMPLETED_20_BYTES
+                        )
+                        and message.chan_ident == self._chan_ident
+                        and message.position == absolute_distance
+                        and message.destination == Address.HOST_CONTROLLER
+                        and message.source == Address.GENERIC_USB
+                    ),
+                    reply_filter=MessageFilter(
+                        message_types={AptMessage_MGMSG_MOT_MOVE_COMPLETED_20_BYTES},
+                        chan_idents={self._chan_ident},
+                        sources={Address.GENERIC_USB},
+                    ),
+                    reply_timeout=self.motion_timeout,
+                )
+                elapsed_time = time.perf_counter() - start_time
+                self.log.debug(
+                    "move_absolute command finished", elapsed_time=elapsed_time
+                )
+                self.operations.observe("move_absolute", elapsed_time)
+            finally:
+                self.set_channel_enabled_for_move(False)
+
+    def move_relative(self, distance: Quantity) -> None:
+        """Turns the waveplate by an angle from its current position.
+        Unlike absolute moves, two identical relative moves requested
+        at the same time are both made.
+
+        :param distance: The angle to turn by, negative to turn
+            backwards.
+        """
+        relative_distance = round(distance.to("k10cr1_step").magnitude)
+        with self.motion_lock:
+            self.set_channel_enabled_for_move(True)
+            try:
+                start_time = time.perf_counter()
+                self.connection.send_message_expect_reply(
+                    AptMessage_MGMSG_MOT_MOVE_RELATIVE(
+                        chan_ident=self._chan_ident,
+                        relative_distance=relative_distance,
+                        destination=Address.GENERIC_USB,
+                        source=Address.HOST_CONTROLLER,
+                    ),
+                    self.is_move_completed,
+                    reply_filter=self.move_completed_filter,
+                    reply_timeout=self.motion_timeout,
+                )
+                self.operations.observe(
+                    "move_relative", time.perf_counter() - start_time
+                )
+            finally:
+                self.set_channel_enabled_for_move(False)
+
+    def jog(self, jog_direction: JogDirection) -> None:
+        """Turns the waveplate forward or backward by one jog step.
+
+        :param jog_direction: The direction to turn in.
+        """
+        with self.motion_lock:
+            self.set_channel_enabled_for_move(True)
+            try:
+                start_time = time.perf_counter()
+                self.connection.send_message_expect_reply(
+                    AptMessage_MGMSG_MOT_MOVE_JOG(
+                        chan_ident=self._chan_ident,
+                        jog_direction=jog_direction,
+                        destination=Address.GENERIC_USB,
+                        source=Address.HOST_CONTROLLER,
+                    ),
+                    self.is_move_completed,
+                    reply_filter=self.move_completed_filter,
+                    reply_timeout=self.motion_timeout,
+                )
+                self.operations.observe("jog", time.perf_counter() - start_time)
+            finally:
+                self.set_channel_enabled_for_move(False)
+
+    def home(self) -> None:
+        """Moves the waveplate to its home position, as set by
+        :py:func:`set_home_params`, and resets its position to zero
+        there."""
+        self.operations.coalesce("home", None, self.send_home)
+
+    def send_home(self) -> None:
+        with self.motion_lock:
+            self.set_channel_enabled_for_move(True)
+            try:
+                start_time = time.perf_counter()
+                self.connection.send_message_expect_reply(
+                    AptMessage_MGMSG_MOT_MOVE_HOME(
+                        chan_ident=self._chan_ident,
+                        destination=Address.GENERIC_USB,
+                        source=Address.HOST_CONTROLLER,
+                    ),
+                    lambda message: (
+                        isinstance(message, AptMessage_MGMSG_MOT_MOVE_HOMED)
+                        and message.chan_ident == self._chan_ident
+                        and message.destination == Address.HOST_CONTROLLER
+                        and message.source == Address.GENERIC_USB
+                    ),
+                    reply_filter=MessageFilter(
+                        message_types={AptMessage_MGMSG_MOT_MOVE_HOMED},
+                        chan_idents={self._chan_ident},
+                        sources={Address.GENERIC_USB},
+                    ),
+                    reply_timeout=self.motion_timeout,
+                )
+                elapsed_time = time.perf_counter() - start_time
+                self.log.debug("home command finished", elapsed_time=elapsed_time)
+                self.operations.observe("home", elapsed_time)
+            finally:
+                self.set_channel_enabled_for_move(False)
+
+    def identify(self) -> None:
+        """Flashes the LED on the front of the controller."""
+        self.connection.send_message_no_reply(
+            AptMessage_MGMSG_MOD_IDENTIFY(
                 chan_ident=self._chan_ident,
-                absolute_distance=absolute_distance,
                 destination=Address.GENERIC_USB,
                 source=Address.HOST_CONTROLLER,
             ),
-            lambda message: (
-                isinstance(message, AptMessage_MGMSG_MOT_MOVE_COMPLETED_20_BYTES)
-                and message.chan_ident == self._chan_ident
-                and message.position == absolute_distance
-                and message.destination == Address.HOST_CONTROLLER
-                and message.source == Address.GENERIC_USB
+            priority=Priority.BACKGROUND,
+        )
+
+    def get_position(self) -> Quantity:
+        """The angle of the waveplate, in degrees. This is the latest
+        position that the device reported on its own, if it did so
+        within the last ``status_max_age`` seconds, and is requested
+        from the device otherwise."""
+        with self.last_status_lock:
+            last_status = self.last_status
+        if (
+            last_status is not None
+            and time.monotonic() - last_status[0] <= self.status_max_age
+        ):
+            position = last_status[1].position
+        else:
+            position = self.get_status().position
+        return (position * units.pnpq_ureg.k10cr1_step).to("degree")
+
+    def get_home_params(self) -> WaveplateHomeParams:
+        params = self.operations.coalesce(
+            "get_home_params",
+            None,
+            lambda: self.connection.send_message_expect_reply(
+                AptMessage_MGMSG_MOT_REQ_HOMEPARAMS(
+                    chan_ident=self._chan_ident,
+                    destination=Address.GENERIC_USB,
+                    source=Address.HOST_CONTROLLER,
+                ),
+                lambda message: (
+                    isinstance(message, AptMessage_MGMSG_MOT_GET_HOMEPARAMS)
+                    and message.chan_ident == self._chan_ident
+                ),
+                reply_filter=MessageFilter(
+                    message_types={AptMessage_MGMSG_MOT_GET_HOMEPARAMS},
+                    chan_idents={self._chan_ident},
+                ),
+                priority=Priority.BACKGROUND,
+            ),
+        )
+        assert isinstance(params, AptMessage_MGMSG_MOT_GET_HOMEPARAMS)
+        pnpq_ureg = units.pnpq_ureg
+        result: WaveplateHomeParams = {
+            "home_direction": params.home_direction,
+            "limit_switch": params.limit_switch,
+            "home_velocity": params.home_velocity * pnpq_ureg.k10cr1_velocity,
+            "offset_distance": params.offset_distance * pnpq_ureg.k10cr1_step,
+        }
+        return result
+
+    def set_home_params(
+        self,
+        home_direction: None | HomeDirection = None,
+        limit_switch: None | LimitSwitch = None,
+        home_velocity: None | Quantity = None,
+        offset_distance: None | Quantity = None,
+    ) -> None:
+        # First load existing params
+        params = self.get_home_params()
+        # Replace params that need to be changed
+        if home_direction is not None:
+            params["home_direction"] = home_direction
+        if limit_switch is not None:
+            params["limit_switch"] = limit_switch
+        if home_velocity is not None:
+            params["home_velocity"] = home_velocity.to("k10cr1_velocity")
+        if offset_distance is not None:
+            params["offset_distance"] = offset_distance.to("k10cr1_step")
+        # Send params to device
+        self.connection.send_message_no_reply(
+            AptMessage_MGMSG_MOT_SET_HOMEPARAMS(
+                chan_ident=self._chan_ident,
+                home_direction=params["home_direction"],
+                limit_switch=params["limit_switch"],
+                home_velocity=round(params["home_velocity"].magnitude),
+                offset_distance=round(params["offset_distance"].magnitude),
+                destination=Address.GENERIC_USB,
+                source=Address.HOST_CONTROLLER,
             ),
         )
-        elapsed_time = time.perf_counter() - start_time
-        self.log.debug("move_absolute command finished", elapsed_time=elapsed_time)
 
-        self.set_channel_enabled(False)
+    def is_move_completed(self, message: AptMessage) -> bool:
+        return (
+            isinstance(message, AptMessage_MGMSG_MOT_MOVE_COMPLETED_20_BYTES)
+            and message.chan_ident == self._chan_ident
+            and message.destination == Address.HOST_CONTROLLER
+            and message.source == Address.GENERIC_USB
+        )
+
+    @property
+    def move_completed_filter(self) -> MessageFilter:
+        return MessageFilter(
+            message_types={AptMessage_MGMSG_MOT_MOVE_COMPLETED_20_BYTES},
+            chan_idents={self._chan_ident},
+            sources={Address.GENERIC_USB},
+        )
+
+    def stop(self) -> None:
+        """Stops the waveplate immediately, ahead of any other queued
+        commands. A move that is in progress raises
+        :py:class:`pnpq.errors.RequestCancelledError`."""
+        self.connection.send_message_no_reply(
+            AptMessage_MGMSG_MOT_MOVE_STOP(
+                chan_ident=self._chan_ident,
+                stop_mode=StopMode.IMMEDIATE,
+                destination=Address.GENERIC_USB,
+                source=Address.HOST_CONTROLLER,
+            ),
+            priority=Priority.EMERGENCY,
+        )
@@ -1,12 +1,22 @@
 import logging
+import threading
 import time
+from collections.abc import Hashable
 from contextlib import contextmanager
-from typing import Callable, Iterator
+from dataclasses import dataclass, field
+from typing import Any, Callable, Generic, Iterator, TypeVar, cast
 
+import structlog
 from serial.tools.list_ports import comports as list_comports
 
+from ..events import Event
+from ..metrics import Counter, Histogram, MetricsRegistry
+
 logger = logging.getLogger("utils")
 
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
 
 AVAILABLE_USB_HUBS: list[tuple[str, str]] = [
     ("2109", "0817"),  # USB3.0 HUB
@@ -55,3 +65,136 @@ def timeout(timeout_seconds: float) -> Iterator[Callable[[], bool]]:
         raise TimeoutException()
 
     yield check_timeout
+
+
+@dataclass(kw_only=True)
+class SingleFlightCall(Generic[V]):
+    done: threading.Event = field(default_factory=threading.Event)
+    result: None | V = None
+    error: None | Exception = None
+
+
+@dataclass(frozen=True, kw_only=True)
+class SingleFlight(Generic[K, V]):
+    """Coalesces concurrent calls with the same key into one.
+
+    While a call made through ``do`` is running, later calls with the
+    same key do not run their function; they wait for the running call
+    and return its result, or raise its exception.
+    """
+
+    calls: dict[K, SingleFlightCall[V]] = field(default_factory=dict)
+    calls_lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def do(
+        self,
+        key: K,
+        function: Callable[[], V],
+        on_wait: None | Callable[[], None] = None,
+    ) -> tuple[V, bool]:
+        """Return the result of ``function``, or of the call with the
+        same key that was already running, and whether it was the
+        latter. ``on_wait`` is called before waiting for a running
+        call, which is useful for counting calls that were coalesced
+        but failed."""
+        with self.calls_lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if call is None:
+                call = SingleFlightCall()
+                self.calls[key] = call
+        if not leader:
+            if on_wait is not None:
+                on_wait()
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return cast(V, call.result), True
+        try:
+            call.result = function()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.calls_lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result, False
+
+
+@dataclass(frozen=True, kw_only=True)
+class DeviceOperations:
+    """The operations of one device driver: coalesces identical
+    operations running at the same time in several threads, and
+    records their metrics, labeled with the ``device`` class name and
+    the ``connection`` label."""
+
+    device: str
+    connection: str
+    metrics: MetricsRegistry
+
+    log = structlog.get_logger()
+
+    duration: Histogram = field(init=False)
+    coalesced: Counter = field(init=False)
+    calls: SingleFlight[Hashable, Any] = field(default_factory=SingleFlight)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(
+            self,
+            "duration",
+            self.metrics.histogram(
+                "pnpq_device_operation_duration_seconds",
+                "Time taken by device operations, such as moves",
+            ),
+        )
+        object.__setattr__(
+            self,
+            "coalesced",
+            self.metrics.counter(
+                "pnpq_device_coalesced_operations_total",
+                "Device operations that waited for an identical operation already in progress instead of sending their own messages",
+            ),
+        )
+
+    def coalesce(
+        self, operation: str, arguments: Hashable, function: Callable[[], V]
+    ) -> V:
+        """Run ``function``, or, if the same operation with the same
+        arguments is already running in another thread, wait for it
+        and share its result."""
+
+        def on_wait() -> None:
+            self.coalesced.inc(
+                connection=self.connection,
+                device=self.device,
+                operation=operation,
+            )
+            self.log.debug(
+                event=Event.DEVICE_OPERATION_COALESCED,
+                operation=operation,
+                arguments=arguments,
+            )
+
+        result, _ = self.calls.do((operation, arguments), function, on_wait)
+        return cast(V, result)
+
+    def observe(self, operation: str, elapsed_time: float) -> None:
+        """Record that ``operation`` took ``elapsed_time`` seconds."""
+        self.duration.observe(
+            elapsed_time,
+            connection=self.connection,
+            device=self.device,
+            operation=operation,
+        )
+
+
+def nearest_equivalent(current: int, target: int, period: int) -> int:
+    """The position equivalent to ``target`` modulo ``period`` that is
+    closest to ``current``, for a rotator whose effect repeats every
+    ``period`` steps. Of two equally close positions, returns the one
+    ahead of ``current``."""
+    offset = (target - current) % period
+    if offset > period / 2:
+        offset -= period
+    return current + offset
@@ -52,3 +52,15 @@ class OdlMoveOutofRangeError(Exception):
 
 class OdlGetPosNotCompleted(Exception):
     """Raised when no response has been received for GetPos command"""
+
+
+class OdlCommandUnknownError(Exception):
+    """Raised when the OzOptics ODL answers a command with UNKNOWN"""
+
+
+class TransportClosedError(Exception):
+    """Raised when reading from or writing to a transport that has been closed"""
+
+
+class RequestCancelledError(Exception):
+    """Raised when a request is abandoned because a later message, such as a stop, made its reply obsolete"""
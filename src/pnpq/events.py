@@ -6,19 +6,45 @@ from enum import StrEnum, auto
 class Event(StrEnum):
     RX_MESSAGE_KNOWN = auto()
     RX_MESSAGE_UNKNOWN = auto()
+    RX_SUBSCRIBER_OVERFLOW = auto()
     TX_MESSAGE_ORDERED = auto()
     TX_MESSAGE_UNORDERED = auto()
+    TX_MESSAGE_DROPPED = auto()
+    TX_MESSAGE_EMERGENCY = auto()
+    TX_REQUEST_CANCELLED = auto()
+    TX_REQUEST_RETRANSMITTED = auto()
+    FLEET_STOP = auto()
+    CONNECTION_LOST = auto()
+    CONNECTION_RECONNECT_FAILED = auto()
+    CONNECTION_RECOVERED = auto()
+    CONNECTION_RECOVERY_FAILED = auto()
+    REQUEST_TRACE = auto()
     UNCAUGHT_EXCEPTION = auto()
+    LOG_EVENTS_DROPPED = auto()
+
+    # Simulated APT devices
+    SIMULATOR_RX_MESSAGE = auto()
+    SIMULATOR_TX_MESSAGE = auto()
+    SIMULATOR_FAULT_INJECTED = auto()
+
+    # Capture replay
+    REPLAY_TX_MISMATCH = auto()
 
     # Common events used by most device types
     DEVICE_CONNECTED = auto()
     DEVICE_NOT_CONNECTED = auto()
     DEVICE_IDENTIFY = auto()
+    DEVICE_OPERATION_COALESCED = auto()
 
     # Optical Switch Events
     SWITCH_BAR_STATE = auto()
     SWITCH_CROSS_STATE = auto()
 
+    # Optical Delay Line Events
+    ODL_COMMAND_SENT = auto()
+    ODL_RESPONSE_RECEIVED = auto()
+    ODL_UNSOLICITED_OUTPUT = auto()
+
     # Waveplate Events
     WAVEPLATE_HOME = auto()
     WAVEPLATE_ROTATE = auto()
@@ -0,0 +1,271 @@
+"""Logging setup that keeps log output off the device threads.
+
+pnpq logs with structlog, and by default structlog formats and writes
+each event on the thread that logged it. For the connection's
+dispatcher and sender threads, which log every message sent and
+received, that would put JSON rendering and file I/O between the
+device and the code waiting on it.
+
+``setup_logging`` configures structlog so that events below the chosen
+level are discarded without any processing, and hands the remaining
+events to a ``QueueingHandler``, which renders and writes them on a
+background thread. If the queue fills up, new events are dropped and
+counted rather than blocking the thread that logged them.
+
+Devices are polled for their status about once a second, and logging
+every poll and reply would make up nearly all of the log. A
+``StatusEventSampler`` collapses that traffic: see its documentation.
+"""
+
+import logging
+import threading
+import time
+from collections.abc import Hashable
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
+from queue import Full, Queue
+from typing import Any
+
+import structlog
+from structlog.typing import EventDict, WrappedLogger
+
+from .apt.protocol import AptMessageId
+from .events import Event
+
+
+def add_timestamp(  # pylint: disable=W0613
+    logger: WrappedLogger, method_name: str, event_dict: EventDict
+) -> EventDict:
+    """Add the time the event was logged, in ISO format and UTC.
+
+    Formatting runs on the ``QueueingHandler``'s worker thread, possibly
+    long after the event, so the time is taken from when the record was
+    created on the thread that logged it rather than from the clock.
+    """
+    record: None | logging.LogRecord = event_dict.get("_record")
+    created = time.time() if record is None else record.created
+    event_dict["timestamp"] = (
+        datetime.fromtimestamp(created, tz=UTC).isoformat().replace("+00:00", "Z")
+    )
+    return event_dict
+
+
+def json_formatter() -> structlog.stdlib.ProcessorFormatter:
+    """A formatter that renders structlog events as JSON lines."""
+    return structlog.stdlib.ProcessorFormatter(
+        processors=[
+            structlog.processors.add_log_level,
+            structlog.processors.StackInfoRenderer(),
+            structlog.dev.set_exc_info,
+            structlog.processors.dict_tracebacks,
+            add_timestamp,
+            structlog.stdlib.ProcessorFormatter.remove_processors_meta,
+            structlog.processors.JSONRenderer(),
+        ]
+    )
+
+
+class QueueingHandler(logging.Handler):
+    """Passes records to ``handler`` on a background thread.
+
+    ``emit`` never blocks: when more than ``max_queue_size`` records are
+    waiting, new records are dropped. The number dropped is available
+    as ``dropped``, and is also logged through ``handler`` as
+    ``Event.LOG_EVENTS_DROPPED`` once the queue has room again.
+    """
+
+    def __init__(self, handler: logging.Handler, max_queue_size: int = 10000) -> None:
+        super().__init__()
+        self.handler = handler
+        self.queue: Queue[None | logging.LogRecord] = Queue(maxsize=max_queue_size)
+        self.dropped = 0
+        self.dropped_lock = threading.Lock()
+        self.reported_dropped = 0
+        self.closed = False
+        self.worker_thread = threading.Thread(target=self.work, daemon=True)
+        self.worker_thread.start()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # Unlike logging.handlers.QueueHandler, do not format the
+        # record here; that is the expensive part.
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            with self.dropped_lock:
+                self.dropped += 1
+
+    def work(self) -> None:
+        while True:
+            record = self.queue.get()
+            try:
+                if record is None:
+                    return
+                self.report_dropped()
+                self.handler.handle(record)
+            finally:
+                self.queue.task_done()
+
+    def report_dropped(self) -> None:
+        with self.dropped_lock:
+            dropped = self.dropped
+        if dropped == self.reported_dropped:
+            return
+        self.handler.handle(
+            logging.makeLogRecord(
+                {
+                    "name": __name__,
+                    "levelno": logging.WARNING,
+                    "levelname": "WARNING",
+                    "msg": {
+                        "event": Event.LOG_EVENTS_DROPPED,
+                        "dropped": dropped - self.reported_dropped,
+                        "total_dropped": dropped,
+                    },
+                    # Make the record look like it came from
+                    # structlog.stdlib.ProcessorFormatter.wrap_for_formatter
+                    "_logger": None,
+                    "_name": "warning",
+                }
+            )
+        )
+        self.reported_dropped = dropped
+
+    def flush(self) -> None:
+        """Wait until every record queued so far has been written."""
+        if not self.closed:
+            self.queue.join()
+        self.handler.flush()
+
+    def close(self) -> None:
+        # logging.shutdown closes every handler at exit, so records
+        # still in the queue are written rather than lost.
+        if not self.closed:
+            self.closed = True
+            self.queue.put(None)
+            self.worker_thread.join()
+            self.report_dropped()
+            self.handler.close()
+        super().close()
+
+
+# Messages that are sent and received periodically while devices are
+# polled for their status
+STATUS_MESSAGE_IDS = frozenset(
+    {
+        AptMessageId.MGMSG_MOT_REQ_USTATUSUPDATE,
+        AptMessageId.MGMSG_MOT_GET_USTATUSUPDATE,
+        AptMessageId.MGMSG_MOT_ACK_USTATUSUPDATE,
+        AptMessageId.MGMSG_MOT_REQ_STATUSUPDATE,
+        AptMessageId.MGMSG_MOT_GET_STATUSUPDATE,
+    }
+)
+
+
+@dataclass(kw_only=True)
+class StatusSummary:
+    """Status messages suppressed since the last one that was logged."""
+
+    start: float
+    state: Any
+    count: int = 0
+    min_position: None | int = None
+    max_position: None | int = None
+
+
+@dataclass(frozen=True, kw_only=True)
+class StatusEventSampler:
+    """A structlog processor that logs status polling traffic in
+    summary.
+
+    Applies to events listed in ``intervals`` whose ``message`` is a
+    status request, acknowledgement or update. Messages are grouped by
+    event, message type and channel. Within a group, a message whose
+    status flags differ from those of the previous message is a state
+    change and is always logged. Other messages are dropped, except
+    for one every ``intervals[event]`` seconds.
+
+    Each logged message carries the number of messages dropped in its
+    group since the last one logged as ``suppressed``, along with the
+    lowest and highest position they reported, if any, as
+    ``suppressed_min_position`` and ``suppressed_max_position``.
+    """
+
+    intervals: dict[str, float] = field(
+        default_factory=lambda: {
+            Event.RX_MESSAGE_KNOWN: 60,
+            Event.TX_MESSAGE_ORDERED: 60,
+            Event.TX_MESSAGE_UNORDERED: 60,
+        }
+    )
+
+    summaries: dict[Hashable, StatusSummary] = field(default_factory=dict)
+    summaries_lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def __call__(
+        self, logger: WrappedLogger, method_name: str, event_dict: EventDict
+    ) -> EventDict:
+        event = event_dict.get("event")
+        interval = self.intervals.get(event)  # type: ignore[arg-type]
+        message = event_dict.get("message")
+        message_id = getattr(message, "message_id", None)
+        if interval is None or message_id not in STATUS_MESSAGE_IDS:
+            return event_dict
+        key = (event, message_id, getattr(message, "chan_ident", None))
+        state = getattr(message, "status", None)
+        position = getattr(message, "position", None)
+        now = time.monotonic()
+        with self.summaries_lock:
+            summary = self.summaries.get(key)
+            if (
+                summary is not None
+                and summary.state == state
+                and now - summary.start < interval
+            ):
+                summary.count += 1
+                if position is not None:
+                    if summary.min_position is None or position < summary.min_position:
+                        summary.min_position = position
+                    if summary.max_position is None or position > summary.max_position:
+                        summary.max_position = position
+                raise structlog.DropEvent
+            self.summaries[key] = StatusSummary(start=now, state=state)
+        if summary is not None and summary.count:
+            event_dict["suppressed"] = summary.count
+            if summary.min_position is not None:
+                event_dict["suppressed_min_position"] = summary.min_position
+                event_dict["suppressed_max_position"] = summary.max_position
+        return event_dict
+
+
+def setup_logging(
+    handler: logging.Handler,
+    level: int = logging.INFO,
+    max_queue_size: int = 10000,
+    sampler: None | StatusEventSampler = None,
+) -> QueueingHandler:
+    """Send pnpq's structlog events at ``level`` and above to
+    ``handler``, through a ``QueueingHandler``.
+
+    ``handler`` is given ``json_formatter`` unless it already has a
+    formatter. If ``sampler`` is given, status polling traffic is
+    summarized by it before it reaches the queue. Returns the
+    ``QueueingHandler`` added to the root logger.
+    """
+    structlog.configure(
+        processors=[
+            *([sampler] if sampler is not None else []),
+            structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
+        ],
+        logger_factory=structlog.stdlib.LoggerFactory(),
+        # Calls below level are replaced with functions that do
+        # nothing, so disabled debug logging costs almost nothing.
+        wrapper_class=structlog.make_filtering_bound_logger(level),
+        cache_logger_on_first_use=True,
+    )
+    if handler.formatter is None:
+        handler.setFormatter(json_formatter())
+    queueing_handler = QueueingHandler(handler, max_queue_size=max_queue_size)
+    root = logging.getLogger()
+    root.addHandler(queueing_handler)
+    root.setLevel(level)
+    return queueing_handler
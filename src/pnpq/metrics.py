@@ -0,0 +1,278 @@
+"""In-process metrics for connections and devices.
+
+Connections and device drivers record counters, gauges and latency
+histograms in a ``MetricsRegistry``; by default, the shared
+``default_registry``. Read a registry in-process with ``snapshot``, or
+export it in the Prometheus text exposition format with
+``to_prometheus``, ``write_prometheus`` (for example, for the
+node_exporter textfile collector) or ``serve_prometheus``.
+
+Every metric is labeled. Labels are passed as keyword arguments, and
+each distinct combination of label values is a separate series.
+"""
+
+import bisect
+import math
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, ClassVar, TypeVar
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+# Label names and values of one series, sorted by name
+Labels = tuple[tuple[str, str], ...]
+
+# Upper bounds, in seconds, of the default histogram buckets. These
+# cover everything from a single message round trip to a long move.
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+)
+
+
+def to_labels(labels: dict[str, str]) -> Labels:
+    return tuple(sorted(labels.items()))
+
+
+@dataclass(frozen=True, kw_only=True)
+class Metric(ABC):
+    name: str
+    description: str
+
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    type: ClassVar[str]
+
+    @abstractmethod
+    def samples(self) -> Iterator[tuple[str, Labels, float]]:
+        """The name, labels and value of every sample of this metric,
+        as they appear in the Prometheus text format."""
+
+
+@dataclass(frozen=True, kw_only=True)
+class Counter(Metric):
+    type = "counter"
+
+    values: dict[Labels, float] = field(default_factory=dict)
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = to_labels(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[tuple[str, Labels, float]]:
+        with self.lock:
+            values = list(self.values.items())
+        for labels, value in values:
+            yield self.name, labels, value
+
+
+@dataclass(frozen=True, kw_only=True)
+class Gauge(Metric):
+    type = "gauge"
+
+    values: dict[Labels, float] = field(default_factory=dict)
+
+    def set(self, value: float, **labels: str) -> None:
+        key = to_labels(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = to_labels(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[tuple[str, Labels, float]]:
+        with self.lock:
+            values = list(self.values.items())
+        for labels, value in values:
+            yield self.name, labels, value
+
+
+@dataclass(kw_only=True)
+class HistogramSeries:
+    # Number of observations in each bucket, not cumulative, with a
+    # final bucket for observations above the largest bound
+    counts: list[int]
+    sum: float = 0
+
+
+@dataclass(frozen=True, kw_only=True)
+class Histogram(Metric):
+    type = "histogram"
+
+    buckets: tuple[float, ...] = DEFAULT_BUCKETS
+
+    series: dict[Labels, HistogramSeries] = field(default_factory=dict)
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = to_labels(labels)
+        # Bucket bounds are inclusive
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = HistogramSeries(counts=[0] * (len(self.buckets) + 1))
+                self.series[key] = series
+            series.counts[bucket] += 1
+            series.sum += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the number of seconds spent in the ``with`` block,
+        whether or not it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterator[tuple[str, Labels, float]]:
+        with self.lock:
+            series = [
+                (labels, list(s.counts), s.sum) for labels, s in self.series.items()
+            ]
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                yield (
+                    f"{self.name}_bucket",
+                    to_labels({**dict(labels), "le": format_value(bound)}),
+                    cumulative,
+                )
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+M = TypeVar("M", bound=Metric)
+
+
+@dataclass(frozen=True, kw_only=True)
+class MetricsRegistry:
+    metrics: dict[str, Metric] = field(default_factory=dict)
+    metrics_lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def get_or_create(self, metric_type: type[M], name: str, description: str) -> M:
+        with self.metrics_lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = metric_type(name=name, description=description)
+                self.metrics[name] = metric
+        if not isinstance(metric, metric_type):
+            raise TypeError(f"Metric {name} is already registered as a {metric.type}.")
+        return metric
+
+    def counter(self, name: str, description: str) -> Counter:
+        return self.get_or_create(Counter, name, description)
+
+    def gauge(self, name: str, description: str) -> Gauge:
+        return self.get_or_create(Gauge, name, description)
+
+    def histogram(self, name: str, description: str) -> Histogram:
+        return self.get_or_create(Histogram, name, description)
+
+    def snapshot(self) -> dict[str, dict[Labels, float]]:
+        """The current value of every sample, by sample name and labels.
+
+        Histograms appear as their ``_bucket``, ``_sum`` and ``_count``
+        samples, as in the Prometheus text format.
+        """
+        snapshot: dict[str, dict[Labels, float]] = {}
+        with self.metrics_lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            for name, labels, value in metric.samples():
+                snapshot.setdefault(name, {})[labels] = value
+        return snapshot
+
+    def to_prometheus(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        lines = []
+        with self.metrics_lock:
+            metrics = sorted(self.metrics.values(), key=lambda metric: metric.name)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                if labels:
+                    label_text = ",".join(
+                        f'{label}="{escape_label_value(label_value)}"'
+                        for label, label_value in labels
+                    )
+                    name = f"{name}{{{label_text}}}"
+                lines.append(f"{name} {format_value(value)}")
+        return "".join(f"{line}\n" for line in lines)
+
+    def write_prometheus(self, path: Path | str) -> None:
+        """Write the metrics to ``path``, replacing it atomically so
+        that readers never see a partial file."""
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        os.replace(temporary_path, path)
+
+    def serve_prometheus(
+        self, port: int, host: str = "127.0.0.1"
+    ) -> "ThreadingHTTPServer":
+        """Serve the metrics over HTTP from a background thread. Call
+        ``shutdown`` and then ``server_close`` on the returned server to
+        stop serving."""
+        # Only imported when needed, since it is slow to import
+        # pylint: disable=C0415
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:  # pylint: disable=C0103
+                body = registry.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: object) -> None:
+                # pylint: disable=W0622
+                pass  # Scrapes are too frequent to be worth logging
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+default_registry = MetricsRegistry()
@@ -0,0 +1,243 @@
+"""Connection to an OzOptics optical delay line.
+
+The ODL speaks a line-based ASCII protocol: a command is a line of
+text ending in CR LF, and the ODL answers each command, in the order
+it received them, with its output followed by ``Done``. Answers carry
+no reference to their command, so ``OzOpticsConnection`` keeps the
+commands it has written in order and gives each ``Done``-terminated
+response to the oldest one still waiting. Writing a command does not
+wait for the answers to earlier ones, so a caller can start a move,
+do other work, and collect the result later. A command whose response
+is late stays in line, so that the responses after it still go to
+their own commands.
+
+Nothing received is discarded. Output that arrives while no command
+is waiting, such as a message printed after a reset, is kept as
+unsolicited output, to be read with ``read_unsolicited``.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+
+import structlog
+
+from ..errors import OdlCommandUnknownError
+from ..events import Event
+from ..transport import Transport
+
+# Ends every response
+DONE = b"Done"
+# Ends every line sent to and received from the ODL
+LINE_END = b"\r\n"
+# Most bytes taken from the transport in one read
+READ_SIZE = 4096
+
+
+@dataclass(frozen=True, kw_only=True)
+class OzOpticsResponse:
+    command: str
+    # Everything received for the command, up to and including Done
+    text: str
+
+    @property
+    def unknown(self) -> bool:
+        """Whether the ODL could not carry out the command, such as
+        when asked for its position before it was homed."""
+        return "UNKNOWN" in self.text
+
+
+@dataclass(kw_only=True)
+class ResponseParser:
+    """Splits the bytes received from the ODL into responses, however
+    they are broken up into reads."""
+
+    buffer: bytearray = field(default_factory=bytearray)
+    # Where to continue looking for Done, as everything before has
+    # been searched
+    search_start: int = 0
+    # Whether the line end after a Done may still arrive
+    after_done: bool = False
+
+    def feed(self, data: bytes) -> list[bytes]:
+        """Add received bytes, and return the responses they
+        complete."""
+        self.buffer.extend(data)
+        responses = []
+        while True:
+            if self.after_done:
+                # The line end after Done separates responses rather
+                # than belonging to the next one
+                if self.buffer[: len(LINE_END)] == LINE_END[: len(self.buffer)]:
+                    if len(self.buffer) < len(LINE_END):
+                        break
+                    del self.buffer[: len(LINE_END)]
+                self.after_done = False
+            index = self.buffer.find(DONE, self.search_start)
+            if index < 0:
+                self.search_start = max(0, len(self.buffer) - len(DONE) + 1)
+                break
+            end = index + len(DONE)
+            responses.append(bytes(self.buffer[:end]))
+            del self.buffer[:end]
+            self.search_start = 0
+            self.after_done = True
+        return responses
+
+    def take_partial(self) -> bytes:
+        """Remove and return the bytes of a response that has not been
+        completed."""
+        if self.after_done and self.buffer == LINE_END[: len(self.buffer)]:
+            # Only the rest of the line end after the last response
+            return b""
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        self.search_start = 0
+        return data
+
+
+@dataclass(frozen=True, kw_only=True)
+class PendingCommand:
+    command: str
+    future: Future[OzOpticsResponse]
+    sent: float
+
+
+@dataclass(frozen=True, kw_only=True)
+class OzOpticsConnection:
+    transport: Transport
+
+    # Seconds that command() waits for a response
+    timeout: float = 10
+
+    log = structlog.get_logger()
+
+    parser: ResponseParser = field(default_factory=ResponseParser)
+    # Commands written and waiting for their responses, oldest first
+    pending: deque[PendingCommand] = field(default_factory=deque)
+    # Output received while no command was waiting
+    unsolicited: bytearray = field(default_factory=bytearray)
+    # Guards the parser, pending commands and unsolicited output, and
+    # is notified when unsolicited output arrives
+    condition: threading.Condition = field(default_factory=threading.Condition)
+    # Held while writing, so that commands are queued in the order
+    # they are written
+    tx_lock: threading.Lock = field(default_factory=threading.Lock)
+
+    rx_thread: threading.Thread = field(init=False)
+    stop_event: threading.Event = field(default_factory=threading.Event)
+
+    def open(self) -> None:
+        self.transport.open()
+        object.__setattr__(
+            self,
+            "rx_thread",
+            threading.Thread(target=self.rx_receive, daemon=True),
+        )
+        self.rx_thread.start()
+
+    def close(self) -> None:
+        self.stop_event.set()
+        self.transport.close()
+        self.rx_thread.join()
+        self.fail_pending(ConnectionError("The connection to the ODL was closed."))
+
+    def rx_receive(self) -> None:
+        while not self.stop_event.is_set():
+            try:
+                # Everything received so far is taken in one read, so
+                # a long response costs a few reads rather than one
+                # per byte
+                data = self.transport.read_available(READ_SIZE)
+            except Exception as e:  # pylint: disable=W0718
+                if not self.stop_event.is_set():
+                    self.log.error(event=Event.UNCAUGHT_EXCEPTION, exc_info=e)
+                    self.fail_pending(e)
+                return
+            self.receive(data)
+
+    def receive(self, data: bytes) -> None:
+        with self.condition:
+            for response in self.parser.feed(data):
+                if not self.pending:
+                    self.add_unsolicited(response)
+                    continue
+                self.resolve(self.pending.popleft(), response.decode("iso-8859-1"))
+            if not self.pending:
+                # No command is waiting, so nothing received since its
+                # last response can be part of one
+                partial = self.parser.take_partial()
+                if partial:
+                    self.add_unsolicited(partial)
+
+    def resolve(self, pending: PendingCommand, text: str) -> None:
+        response = OzOpticsResponse(command=pending.command, text=text)
+        self.log.debug(
+            event=Event.ODL_RESPONSE_RECEIVED,
+            command=pending.command,
+            response=text,
+            elapsed_time=time.perf_counter() - pending.sent,
+        )
+        if response.unknown:
+            pending.future.set_exception(
+                OdlCommandUnknownError(
+                    f"The ODL answered {pending.command!r} with {text!r}."
+                )
+            )
+        else:
+            pending.future.set_result(response)
+
+    def add_unsolicited(self, data: bytes) -> None:
+        self.log.debug(event=Event.ODL_UNSOLICITED_OUTPUT, output=data)
+        self.unsolicited.extend(data)
+        self.condition.notify_all()
+
+    def fail_pending(self, error: Exception) -> None:
+        with self.condition:
+            while self.pending:
+                self.pending.popleft().future.set_exception(error)
+
+    def send(self, command: str) -> Future[OzOpticsResponse]:
+        """Write a command and return at once. The returned future
+        gets the response, or OdlCommandUnknownError if the ODL
+        answers UNKNOWN."""
+        future: Future[OzOpticsResponse] = Future()
+        pending = PendingCommand(
+            command=command, future=future, sent=time.perf_counter()
+        )
+        with self.tx_lock:
+            with self.condition:
+                self.pending.append(pending)
+            self.log.debug(event=Event.ODL_COMMAND_SENT, command=command)
+            try:
+                self.transport.write(command.encode("iso-8859-1") + LINE_END)
+            except Exception as e:
+                # The ODL will not answer a command it did not get, so
+                # the responses that follow belong to later commands
+                with self.condition:
+                    if pending in self.pending:
+                        self.pending.remove(pending)
+                future.set_exception(e)
+                raise
+        return future
+
+    def command(self, command: str, timeout: None | float = None) -> OzOpticsResponse:
+        """Write a command and wait for its response, for ``timeout``
+        seconds or the connection's ``timeout``. Raises TimeoutError
+        if it does not arrive in time."""
+        return self.send(command).result(
+            timeout=self.timeout if timeout is None else timeout
+        )
+
+    def read_unsolicited(self, timeout: None | float = None) -> bytes:
+        """Remove and return the unsolicited output received so far,
+        waiting up to ``timeout`` seconds for some if there is none."""
+        with self.condition:
+            self.condition.wait_for(lambda: bool(self.unsolicited), timeout)
+            data = bytes(self.unsolicited)
+            self.unsolicited.clear()
+            return data
@@ -0,0 +1,263 @@
+"""Simulated OzOptics optical delay line.
+
+``SimulatedOdlOzOptics`` answers the ODL-650 command set on the device
+side of a :py:class:`~pnpq.transport.Transport`, so
+:py:class:`~pnpq.devices.odl_ozoptics_650ml.OdlOzOptics` can be run
+and benchmarked without hardware. To present it as a serial port,
+give it a :py:class:`~pnpq.transport.PtyTransport` and open its
+``peer_path`` with a :py:class:`~pnpq.transport.SerialTransport`::
+
+    pty = PtyTransport()
+    simulator = SimulatedOdlOzOptics(transport=pty)
+    simulator.open()
+    odl = OdlOzOptics(
+        transport=SerialTransport(
+            port=pty.peer_path, baudrate=9600, rtscts=False, startup_delay=0
+        )
+    )
+
+Like the ODL, the simulator carries out commands one at a time, in
+the order they arrive, and ends each response with ``Done``. A move
+(``S``) or homing (``FH``) is answered once the stage arrives, at the
+stage's step rate, while ``GF`` and ``GR`` start a continuous move
+that runs until ``G0`` or the end of travel. The stage does not know
+its position until it is homed, so ``S`` and ``S?`` are answered with
+``UNKNOWN`` before then, as is any command it does not understand.
+Output is paced as if sent over a serial line at ``baudrate``.
+"""
+
+from __future__ import annotations
+
+import queue
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, ClassVar
+
+import structlog
+
+from ..apt.simulator import MoveKind, SimulatedMove
+from ..events import Event
+from .connection import DONE, LINE_END, READ_SIZE
+
+if TYPE_CHECKING:
+    from ..transport import Transport
+
+# Absolute move to a step position, such as S12000
+MOVE_COMMAND = re.compile(r"S(\d+)")
+# Bits on the serial line for each byte: start bit, 8 data bits, stop bit
+BITS_PER_BYTE = 10
+
+
+@dataclass(kw_only=True)
+class SimulatedStage:
+    position: float
+    homed: bool = False
+    move: None | SimulatedMove = None
+    # Whether each response starts with the command it answers
+    echo: bool = True
+
+    def current_position(self, now: float) -> float:
+        if self.move is None:
+            return self.position
+        return self.move.position(now)
+
+
+@dataclass(frozen=True, kw_only=True)
+class SimulatedOdlOzOptics:
+    """Device side of a connection to an OzOptics ODL-650."""
+
+    transport: Transport
+    serial_number: str = "ODL000000"
+    #: Reported by V1, as the model followed by the hardware version
+    version: str = "ODL650V1_0"
+    #: Reported by d?
+    manufacturing_date: str = "2020-01-01"
+    #: Position of the stage, in steps, when the simulator is opened
+    initial_position: int = 0
+    #: Multiplies the step rate, to shorten test runs
+    speedup: float = 1
+    #: Bits per second of the simulated serial line, or None to send
+    #: output without pacing
+    baudrate: None | int = 9600
+
+    #: Half a revolution of the motor, 2.54 mm of mirror travel, per
+    #: second
+    steps_per_second: ClassVar[float] = 16384
+    #: Limits of travel in steps: 97.4 mm, or 650 ps of delay for light
+    #: reflected back along the stage
+    position_limits: ClassVar[tuple[int, int]] = (0, 628479)
+
+    log = structlog.get_logger()
+
+    stage: SimulatedStage = field(init=False)
+    state_lock: threading.Lock = field(default_factory=threading.Lock)
+    closed: threading.Event = field(default_factory=threading.Event)
+    # Command lines received and not yet carried out, in order, each
+    # with the time its last byte would arrive over the serial line
+    commands: queue.Queue[None | tuple[float, str]] = field(default_factory=queue.Queue)
+
+    rx_thread: threading.Thread = field(init=False)
+    command_thread: threading.Thread = field(init=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(
+            self, "stage", SimulatedStage(position=self.initial_position)
+        )
+
+    def open(self) -> None:
+        self.transport.open()
+        object.__setattr__(
+            self,
+            "rx_thread",
+            threading.Thread(target=self.rx_handle, daemon=True),
+        )
+        object.__setattr__(
+            self,
+            "command_thread",
+            threading.Thread(target=self.run_commands, daemon=True),
+        )
+        self.rx_thread.start()
+        self.command_thread.start()
+
+    def close(self) -> None:
+        self.closed.set()
+        self.commands.put(None)
+        self.transport.close()
+        self.rx_thread.join()
+        self.command_thread.join()
+
+    def position(self) -> float:
+        """The current position of the stage, in steps."""
+        with self.state_lock:
+            return self.stage.current_position(time.monotonic())
+
+    # Receiving
+
+    def rx_handle(self) -> None:
+        buffer = bytearray()
+        arrival_time = 0.0
+        while not self.closed.is_set():
+            try:
+                buffer += self.transport.read_available(READ_SIZE)
+            except Exception as e:  # pylint: disable=W0718
+                self.log.debug(
+                    event="Shutting down simulator. Received expected error.",
+                    exc_info=e,
+                )
+                break
+            *lines, rest = re.split(rb"[\r\n]", bytes(buffer))
+            buffer[:] = rest
+            for line in lines:
+                # The LF after a CR ends an empty line
+                if line:
+                    # Commands arrive one after another at the line
+                    # rate, even while the ODL is busy with a move
+                    arrival_time = max(arrival_time, time.monotonic()) + (
+                        self.transmission_time(len(line) + len(LINE_END))
+                    )
+                    self.commands.put((arrival_time, line.decode("iso-8859-1")))
+
+    # Carrying out commands
+
+    def run_commands(self) -> None:
+        while (item := self.commands.get()) is not None:
+            arrival_time, command = item
+            self.closed.wait(arrival_time - time.monotonic())
+            self.log.debug(event=Event.SIMULATOR_RX_MESSAGE, message=command)
+            try:
+                output = self.handle_command(command)
+                self.respond(command, output)
+            except Exception as e:  # pylint: disable=W0718
+                if self.closed.is_set():
+                    break
+                self.log.error(event=Event.UNCAUGHT_EXCEPTION, exc_info=e)
+
+    def handle_command(self, command: str) -> list[str]:  # pylint: disable=R0911
+        """Carry out a command and return the lines of its output,
+        after the move it starts, if any, is done."""
+        if command == "S?":
+            with self.state_lock:
+                if not self.stage.homed:
+                    return ["UNKNOWN"]
+                return [f"Pos:{round(self.stage.current_position(time.monotonic()))}"]
+        if match := MOVE_COMMAND.fullmatch(command):
+            with self.state_lock:
+                if not self.stage.homed:
+                    return ["UNKNOWN"]
+            self.move_to(MoveKind.ABSOLUTE, self.clamp(int(match[1])))
+            return []
+        if command == "FH":
+            self.move_to(MoveKind.HOME, self.position_limits[0])
+            return []
+        if command in ("GF", "GR"):
+            low, high = self.position_limits
+            self.start_move(MoveKind.JOG, high if command == "GF" else low)
+            return []
+        if command == "G0":
+            self.stop_move()
+            return []
+        if command == "V1":
+            return [self.version]
+        if command == "V2":
+            return [self.serial_number]
+        if command == "d?":
+            return [self.manufacturing_date]
+        if command in ("e0", "e1"):
+            with self.state_lock:
+                self.stage.echo = command == "e1"
+            return []
+        return ["UNKNOWN"]
+
+    def clamp(self, position: float) -> float:
+        low, high = self.position_limits
+        return min(max(position, low), high)
+
+    def start_move(self, kind: MoveKind, target: float) -> SimulatedMove:
+        now = time.monotonic()
+        with self.state_lock:
+            move = SimulatedMove(
+                kind=kind,
+                start_time=now,
+                start_position=self.stage.current_position(now),
+                target=target,
+                velocity=self.steps_per_second * self.speedup,
+                acceleration=None,
+            )
+            self.stage.position = move.start_position
+            self.stage.move = move
+        return move
+
+    def move_to(self, kind: MoveKind, target: float) -> None:
+        """Move the stage and wait until it arrives. No other command
+        is carried out in the meantime."""
+        move = self.start_move(kind, target)
+        self.closed.wait(move.duration)
+        with self.state_lock:
+            self.stage.position = move.target
+            self.stage.move = None
+            if kind == MoveKind.HOME:
+                self.stage.homed = True
+
+    def stop_move(self) -> None:
+        with self.state_lock:
+            self.stage.position = self.stage.current_position(time.monotonic())
+            self.stage.move = None
+
+    # Sending
+
+    def respond(self, command: str, output: list[str]) -> None:
+        with self.state_lock:
+            first_line = command if self.stage.echo else ""
+        lines = [first_line, *output, DONE.decode()]
+        data = LINE_END.join(line.encode("iso-8859-1") for line in lines) + LINE_END
+        self.closed.wait(self.transmission_time(len(data)))
+        self.log.debug(event=Event.SIMULATOR_TX_MESSAGE, message=data)
+        self.transport.write(data)
+
+    def transmission_time(self, size: int) -> float:
+        """Seconds that ``size`` bytes take on the serial line."""
+        if self.baudrate is None:
+            return 0
+        return size * BITS_PER_BYTE / self.baudrate
@@ -0,0 +1,429 @@
+"""Byte-stream transports that connections to devices run on.
+
+A transport moves raw bytes and knows nothing about the protocol
+spoken over it. ``AptConnection`` reads and writes through a
+``Transport``, so the same dispatcher and sender threads work with a
+USB serial device, a device exported over the network by something
+like ser2net, a pseudo-terminal, or an in-process peer.
+"""
+
+import os
+import select
+import socket
+import threading
+import time
+import tty
+from abc import ABC, abstractmethod
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+import serial.tools.list_ports
+from serial import Serial, SerialException
+
+from .errors import TransportClosedError
+
+
+@dataclass(frozen=True, kw_only=True)
+class Transport(ABC):
+    """A bidirectional byte stream.
+
+    ``read`` blocks until exactly the requested number of bytes is
+    available, and ``read_available`` until at least one is. Closing a
+    transport from another thread must wake up a blocked ``read`` or
+    ``read_available``, which then raises ``TransportClosedError``;
+    the connection's dispatcher thread relies on this to shut down.
+    """
+
+    @abstractmethod
+    def open(self) -> None:
+        """Open the transport, blocking until it is ready for use."""
+
+    @abstractmethod
+    def close(self) -> None:
+        """Close the transport. Blocked reads raise ``TransportClosedError``."""
+
+    @abstractmethod
+    def read(self, size: int) -> bytes:
+        """Read exactly ``size`` bytes."""
+
+    def read_available(self, size: int) -> bytes:
+        """Read at least one and at most ``size`` bytes, returning as
+        many as have been received. Transports that can tell how much
+        input is waiting override this to read it all at once."""
+        if size < 1:
+            raise ValueError(f"Cannot read {size} bytes.")
+        return self.read(1)
+
+    @abstractmethod
+    def write(self, data: bytes) -> None:
+        """Write all of ``data``."""
+
+    def flush(self) -> None:
+        """Wait until all written data has been handed off."""
+
+    @abstractmethod
+    def reset_input_buffer(self) -> None:
+        """Discard any received data that has not been read yet."""
+
+    def reset_output_buffer(self) -> None:
+        """Discard any written data that has not been sent yet."""
+
+
+@dataclass(frozen=True, kw_only=True)
+class SerialTransport(Transport):
+    """A serial port, located either by the USB serial number of the
+    adapter or by its device path (for example, ``/dev/ttyUSB0``)."""
+
+    serial_number: None | str = None
+    port: None | str = None
+
+    # Serial connection parameters
+    baudrate: int = 115200
+    bytesize: int = serial.EIGHTBITS
+    exclusive: bool = True
+    parity: str = serial.PARITY_NONE
+    rtscts: bool = True
+    stopbits: int = serial.STOPBITS_ONE
+    timeout: None | int = (
+        None  # None means wait forever, until the requested number of bytes are received
+    )
+
+    # Seconds to wait before opening the port
+    startup_delay: float = 1
+    # Seconds to wait for input at a time in read_available, once a
+    # read has returned nothing because the port's timeout passed
+    poll_interval: float = 0.1
+
+    connection: Serial = field(init=False)
+
+    def __post_init__(self) -> None:
+        if (self.serial_number is None) == (self.port is None):
+            raise ValueError("Exactly one of serial_number or port must be given.")
+
+    def find_port(self) -> str:
+        if self.port is not None:
+            return self.port
+        for port in serial.tools.list_ports.comports():
+            if port.serial_number == self.serial_number:
+                device: str = port.device
+                return device
+        raise ValueError(
+            f"Serial number {self.serial_number} could not be found, failing intialization."
+        )
+
+    def open(self) -> None:
+        # These devices tend to take a few seconds to start up, and
+        # this library tends to be used as part of services that start
+        # automatically on computer boot. For safety, wait here before
+        # continuing initialization.
+        time.sleep(self.startup_delay)
+
+        # Initializing the connection by passing a port to the Serial
+        # constructor immediately opens the connection. It is not
+        # necessary to call open() separately.
+        object.__setattr__(
+            self,
+            "connection",
+            Serial(
+                baudrate=self.baudrate,
+                bytesize=self.bytesize,
+                exclusive=self.exclusive,
+                parity=self.parity,
+                port=self.find_port(),
+                rtscts=self.rtscts,
+                stopbits=self.stopbits,
+                timeout=self.timeout,
+            ),
+        )
+
+    def close(self) -> None:
+        self.connection.close()
+
+    @contextmanager
+    def closed_errors(self) -> Iterator[None]:
+        """Raise ``TransportClosedError`` in place of the errors pyserial
+        raises when the port is closed during a read."""
+        if not self.connection.is_open:
+            raise TransportClosedError("Serial port is closed.")
+        try:
+            yield
+        except (TypeError, SerialException, OSError) as e:
+            if self.connection.is_open:
+                raise
+            raise TransportClosedError("Serial port is closed.") from e
+
+    def read(self, size: int) -> bytes:
+        with self.closed_errors():
+            data: bytes = self.connection.read(size)
+        return data
+
+    def read_available(self, size: int) -> bytes:
+        if size < 1:
+            raise ValueError(f"Cannot read {size} bytes.")
+        with self.closed_errors():
+            # Block for the first byte, then take whatever else has
+            # arrived with it. With a timeout, the port returns nothing
+            # if no byte arrives in time, so wait for input before
+            # reading again rather than spinning on a timeout of 0.
+            data: bytes = self.connection.read(1)
+            while not data:
+                self.wait_readable()
+                data = self.connection.read(1)
+            waiting = min(self.connection.in_waiting, size - len(data))
+            if waiting > 0:
+                data += self.connection.read(waiting)
+        return data
+
+    def wait_readable(self) -> None:
+        """Wait up to ``poll_interval`` seconds for input. Closing the
+        port ends the wait early with an error, or is noticed by the
+        next read."""
+        if not self.connection.is_open:
+            raise TransportClosedError("Serial port is closed.")
+        # Ports on Windows have no descriptor to wait on
+        fileno = getattr(self.connection, "fileno", None)
+        if fileno is None:
+            time.sleep(self.poll_interval)
+            return
+        select.select([fileno()], [], [], self.poll_interval)
+
+    def write(self, data: bytes) -> None:
+        self.connection.write(data)
+
+    def flush(self) -> None:
+        self.connection.flush()
+
+    def reset_input_buffer(self) -> None:
+        self.connection.reset_input_buffer()
+
+    def reset_output_buffer(self) -> None:
+        self.connection.reset_output_buffer()
+
+
+@dataclass(frozen=True, kw_only=True)
+class _SelectableTransport(Transport):
+    """Shared logic for transports backed by a file descriptor that
+    can be waited on with ``select``.
+
+    A self-pipe wakes up a reader blocked in ``select`` when the
+    transport is closed, and ``read_lock`` keeps the descriptor from
+    being closed while a read is still using it.
+    """
+
+    closed: threading.Event = field(default_factory=threading.Event)
+    read_lock: threading.Lock = field(default_factory=threading.Lock)
+    wake_fds: tuple[int, int] = field(init=False)
+
+    def open(self) -> None:
+        object.__setattr__(self, "wake_fds", os.pipe())
+        # Opened again after a close, as when reconnecting
+        self.closed.clear()
+
+    @abstractmethod
+    def fileno(self) -> int:
+        """Descriptor to wait on for incoming data."""
+
+    @abstractmethod
+    def receive(self, size: int) -> bytes:
+        """Read at most ``size`` bytes that are known to be available."""
+
+    @abstractmethod
+    def release(self) -> None:
+        """Close the underlying descriptors."""
+
+    def wait_readable(self, wait: None | float) -> bool:
+        readable, _, _ = select.select([self.fileno(), self.wake_fds[0]], [], [], wait)
+        if self.closed.is_set():
+            raise TransportClosedError("Transport is closed.")
+        return bool(readable)
+
+    def read(self, size: int) -> bytes:
+        data = bytearray()
+        with self.read_lock:
+            while len(data) < size:
+                self.wait_readable(None)
+                chunk = self.receive(size - len(data))
+                if not chunk:
+                    raise TransportClosedError("Transport closed by peer.")
+                data += chunk
+        return bytes(data)
+
+    def read_available(self, size: int) -> bytes:
+        with self.read_lock:
+            self.wait_readable(None)
+            data = self.receive(size)
+            if not data:
+                raise TransportClosedError("Transport closed by peer.")
+            return data
+
+    def reset_input_buffer(self) -> None:
+        with self.read_lock:
+            while self.wait_readable(0):
+                if not self.receive(4096):
+                    break
+
+    def close(self) -> None:
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        os.write(self.wake_fds[1], b"\0")
+        with self.read_lock:
+            self.release()
+            for fd in self.wake_fds:
+                os.close(fd)
+
+
+@dataclass(frozen=True, kw_only=True)
+class TcpTransport(_SelectableTransport):
+    """A raw TCP connection, such as a serial port exported by ser2net
+    in raw mode."""
+
+    host: str
+    port: int
+    connect_timeout: None | float = 10
+
+    connection: socket.socket = field(init=False)
+
+    def open(self) -> None:
+        connection = socket.create_connection(
+            (self.host, self.port), timeout=self.connect_timeout
+        )
+        connection.settimeout(None)
+        # APT messages are small and latency-sensitive
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        object.__setattr__(self, "connection", connection)
+        super().open()
+
+    def fileno(self) -> int:
+        return self.connection.fileno()
+
+    def receive(self, size: int) -> bytes:
+        return self.connection.recv(size)
+
+    def release(self) -> None:
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass  # Already disconnected by the peer
+        self.connection.close()
+
+    def write(self, data: bytes) -> None:
+        if self.closed.is_set():
+            raise TransportClosedError("Transport is closed.")
+        self.connection.sendall(data)
+
+
+@dataclass(frozen=True, kw_only=True)
+class PtyTransport(_SelectableTransport):
+    """The controlling side of a new pseudo-terminal pair.
+
+    The other side is a regular serial device at ``peer_path``, which a
+    device simulator or any other program can open like a real port.
+    """
+
+    master_fd: int = field(init=False)
+    slave_fd: int = field(init=False)
+    peer_path: str = field(init=False)
+
+    def open(self) -> None:
+        master_fd, slave_fd = os.openpty()
+        # Pass bytes through unchanged: no echo, no line editing, no
+        # newline translation.
+        tty.setraw(slave_fd)
+        object.__setattr__(self, "master_fd", master_fd)
+        # Holding the slave side open keeps reads on the master from
+        # failing with EIO before the peer opens it.
+        object.__setattr__(self, "slave_fd", slave_fd)
+        object.__setattr__(self, "peer_path", os.ttyname(slave_fd))
+        super().open()
+
+    def fileno(self) -> int:
+        return self.master_fd
+
+    def receive(self, size: int) -> bytes:
+        return os.read(self.master_fd, size)
+
+    def release(self) -> None:
+        os.close(self.master_fd)
+        os.close(self.slave_fd)
+
+    def write(self, data: bytes) -> None:
+        if self.closed.is_set():
+            raise TransportClosedError("Transport is closed.")
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.master_fd, view) :]
+
+
+@dataclass(frozen=True, kw_only=True)
+class LoopbackTransport(Transport):
+    """One end of an in-memory byte stream. Create connected ends with
+    ``loopback_transport_pair``."""
+
+    buffer: bytearray = field(default_factory=bytearray)
+    condition: threading.Condition = field(default_factory=threading.Condition)
+    closed: threading.Event = field(default_factory=threading.Event)
+    peer: "LoopbackTransport" = field(init=False)
+
+    def open(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed.set()
+        # Wake up readers on both ends; the peer sees end of stream
+        # once it has read everything already written to it.
+        for end in (self, self.peer):
+            with end.condition:
+                end.condition.notify_all()
+
+    def read(self, size: int) -> bytes:
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.closed.is_set()
+                or self.peer.closed.is_set()
+                or len(self.buffer) >= size
+            )
+            if self.closed.is_set():
+                raise TransportClosedError("Transport is closed.")
+            if len(self.buffer) < size:
+                raise TransportClosedError("Transport closed by peer.")
+            data = bytes(self.buffer[:size])
+            del self.buffer[:size]
+            return data
+
+    def read_available(self, size: int) -> bytes:
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.closed.is_set()
+                or self.peer.closed.is_set()
+                or bool(self.buffer)
+            )
+            if self.closed.is_set():
+                raise TransportClosedError("Transport is closed.")
+            if not self.buffer:
+                raise TransportClosedError("Transport closed by peer.")
+            data = bytes(self.buffer[:size])
+            del self.buffer[:size]
+            return data
+
+    def write(self, data: bytes) -> None:
+        if self.closed.is_set() or self.peer.closed.is_set():
+            raise TransportClosedError("Transport is closed.")
+        with self.peer.condition:
+            self.peer.buffer.extend(data)
+            self.peer.condition.notify_all()
+
+    def reset_input_buffer(self) -> None:
+        with self.condition:
+            self.buffer.clear()
+
+
+def loopback_transport_pair() -> tuple[LoopbackTransport, LoopbackTransport]:
+    """Create two in-memory transports; bytes written to either end
+    can be read from the other."""
+    a = LoopbackTransport()
+    b = LoopbackTransport()
+    object.__setattr__(a, "peer", b)
+    object.__setattr__(b, "peer", a)
+    return a, b
@@ -1,60 +1,126 @@
-from typing import Any, cast
+"""Unit registry shared by all PnPQ devices.
 
-import pint
-from pint import Quantity, Unit
-from pint.facets.plain import PlainQuantity
+Importing pint and building the registry with the Thorlabs context
+takes a large share of the library's startup time, so neither happens
+when this module is imported. The registry is constructed the first
+time ``pnpq_ureg`` (or ``thorlabs_context``, or
+``mpc320_max_velocity``) is accessed, for example by ``from pnpq.units
+import pnpq_ureg``. Code inside the library that only needs units at
+call time should access ``units.pnpq_ureg`` there instead of importing
+the name at module level.
+"""
 
-pnpq_ureg = pint.UnitRegistry()
+from __future__ import annotations
 
-thorlabs_context = pint.Context("thorlabs_context")
+import threading
+from typing import TYPE_CHECKING, Any, cast
 
-# Custom unit definitions for devices
-pnpq_ureg.define("mpc320_step = [dimension_mpc320_step]")
-pnpq_ureg.define("k10cr1_step = [dimension_k10cr1_step]")
+if TYPE_CHECKING:
+    import pint
+    from pint import Quantity
+    from pint.facets.plain import PlainQuantity
+
+    pnpq_ureg: pint.UnitRegistry
+    thorlabs_context: pint.Context
+    mpc320_max_velocity: Quantity
+
+_registry_lock = threading.Lock()
+_registry: None | tuple[pint.UnitRegistry, pint.Context] = None  # pylint: disable=C0103
 
 
 # Transformation function for converting between mpc320_step and degrees
 def degree_to_mpc320_steps(
     ureg: pint.UnitRegistry, value: PlainQuantity[Quantity], **_: Any
 ) -> PlainQuantity[Any]:
-    return Quantity(round(value.magnitude * 1370 / 170), ureg.mpc320_step)
+    return ureg.Quantity(round(value.magnitude * 1370 / 170), ureg.mpc320_step)
 
 
 def mpc320_steps_to_degree(
     ureg: pint.UnitRegistry, value: PlainQuantity[Quantity], **_: Any
 ) -> PlainQuantity[Any]:
-    return Quantity(value.magnitude * 170 / 1370, ureg.degree)
+    return ureg.Quantity(value.magnitude * 170 / 1370, ureg.degree)
+
+
+# Microsteps in one revolution of the K10CR1. Angles are converted at
+# exactly this divided by 360, about 136533.33 steps per degree, so
+# that a turn of 360 degrees is a whole revolution.
+K10CR1_STEPS_PER_REVOLUTION = 49152000
+K10CR1_STEPS_PER_DEGREE = K10CR1_STEPS_PER_REVOLUTION / 360
 
 
 # Transformation function for converting between k10cr1_step and degrees
 def degree_to_k10cr1_steps(
     ureg: pint.UnitRegistry, value: PlainQuantity[Quantity], **_: Any
 ) -> PlainQuantity[Any]:
-    return Quantity(round(value.magnitude * 136533 / 1), ureg.k10cr1_step)
+    return ureg.Quantity(
+        round(value.magnitude * K10CR1_STEPS_PER_DEGREE), ureg.k10cr1_step
+    )
 
 
 def k10cr1_steps_to_degree(
     ureg: pint.UnitRegistry, value: PlainQuantity[Quantity], **_: Any
 ) -> PlainQuantity[Any]:
-    return Quantity(value.magnitude * 1 / 136533, ureg.degree)
+    return ureg.Quantity(value.magnitude / K10CR1_STEPS_PER_DEGREE, ureg.degree)
+
+
+# The K10CR1 takes velocities in encoder counts per 2048 servo cycles
+# of 102.4 microseconds, scaled by 65536, which the APT protocol
+# documentation gives as 7329109 per degree per second.
+def degree_per_second_to_k10cr1_velocity(
+    ureg: pint.UnitRegistry, value: PlainQuantity[Quantity], **_: Any
+) -> PlainQuantity[Any]:
+    degrees_per_second = value.to("degree / second").magnitude
+    return ureg.Quantity(round(degrees_per_second * 7329109), ureg.k10cr1_velocity)
+
+
+def k10cr1_velocity_to_degree_per_second(
+    ureg: pint.UnitRegistry, value: PlainQuantity[Quantity], **_: Any
+) -> PlainQuantity[Any]:
+    return ureg.Quantity(value.magnitude / 7329109, ureg("degree / second").units)
+
+
+# The DDS100 stage driven by the KBD101 has 2000 encoder counts per
+# millimeter. Light reflected back along the stage, as by a
+# retroreflector on its carriage, travels twice the distance moved, so
+# a picosecond of delay takes half the distance light travels in a
+# picosecond.
+KBD101_STEPS_PER_MM = 2000
+SPEED_OF_LIGHT_MM_PER_PS = 0.299792458
+
+
+def millimeter_to_kbd101_steps(
+    ureg: pint.UnitRegistry, value: PlainQuantity[Quantity], **_: Any
+) -> PlainQuantity[Any]:
+    millimeters = value.to("millimeter").magnitude
+    return ureg.Quantity(round(millimeters * KBD101_STEPS_PER_MM), ureg.kbd101_step)
+
+
+def kbd101_steps_to_millimeter(
+    ureg: pint.UnitRegistry, value: PlainQuantity[Quantity], **_: Any
+) -> PlainQuantity[Any]:
+    return ureg.Quantity(value.magnitude / KBD101_STEPS_PER_MM, ureg.millimeter)
+
+
+def picosecond_to_kbd101_steps(
+    ureg: pint.UnitRegistry, value: PlainQuantity[Quantity], **_: Any
+) -> PlainQuantity[Any]:
+    millimeters = value.to("picosecond").magnitude * SPEED_OF_LIGHT_MM_PER_PS / 2
+    return ureg.Quantity(round(millimeters * KBD101_STEPS_PER_MM), ureg.kbd101_step)
 
 
-thorlabs_context.add_transformation("degree", "mpc320_step", degree_to_mpc320_steps)
-thorlabs_context.add_transformation("mpc320_step", "degree", mpc320_steps_to_degree)
+def kbd101_steps_to_picosecond(
+    ureg: pint.UnitRegistry, value: PlainQuantity[Quantity], **_: Any
+) -> PlainQuantity[Any]:
+    millimeters = value.magnitude / KBD101_STEPS_PER_MM
+    return ureg.Quantity(millimeters * 2 / SPEED_OF_LIGHT_MM_PER_PS, ureg.picosecond)
 
-thorlabs_context.add_transformation("degree", "k10cr1_step", degree_to_k10cr1_steps)
-thorlabs_context.add_transformation("k10cr1_step", "degree", k10cr1_steps_to_degree)
 
 # According to the protocol, velocity is expressed as a percentage of the maximum speed, ranging from 10% to 100%.
 # The maximum velocity is defined as 400 degrees per second, so we store velocity as a dimensionless proportion of this value.
 # Thus, the unit for mpc_velocity will be set as dimensionless.
 # A transformation function (defined below) will convert other units, like degrees per second, into this proportional form.
-pnpq_ureg.define("mpc320_velocity = [dimension_mpc320_velocity]")
-
-
-mpc320_max_velocity: Quantity = cast(
-    Quantity, 400 * (pnpq_ureg.degree / pnpq_ureg.second)
-)
+def _mpc320_max_velocity(ureg: pint.UnitRegistry) -> Quantity:
+    return cast("Quantity", 400 * (ureg.degree / ureg.second))
 
 
 def to_mpc320_velocity(
@@ -64,10 +130,12 @@ def to_mpc320_velocity(
     Converts a given velocity to an mpc320 velocity percentage.
     Raises a ValueError if the rounded velocity is out of the range [10, 100].
     """
+    max_velocity = _mpc320_max_velocity(ureg)
+
     # Ensure velocity is in the same units as max velocity
-    velocity_in_degrees: Quantity = cast(Quantity, value.to(mpc320_max_velocity.units))
+    velocity_in_degrees: Quantity = cast("Quantity", value.to(max_velocity.units))
 
-    converted_velocity = (velocity_in_degrees / mpc320_max_velocity) * 100
+    converted_velocity = (velocity_in_degrees / max_velocity) * 100
     rounded_velocity: Quantity = (
         round(converted_velocity.magnitude) * ureg.mpc320_velocity
     )
@@ -86,25 +154,12 @@ def mpc320_velocity_to_pint_velocity(
     """
     Converts an mpc320 velocity percentage to a velocity in degrees per second.
     """
-    return Quantity(
-        (value.magnitude * mpc320_max_velocity) / 100,
-        cast(Unit, ureg("degree / second")),
+    return ureg.Quantity(
+        (value.magnitude * _mpc320_max_velocity(ureg)) / 100,
+        ureg("degree / second").units,
     )
 
 
-thorlabs_context.add_transformation(
-    "degree / second",
-    "mpc320_velocity",
-    to_mpc320_velocity,  # Convert value to percent
-)
-
-thorlabs_context.add_transformation(
-    "mpc320_velocity",
-    "degree / second",
-    mpc320_velocity_to_pint_velocity,
-)
-
-
 # Add transformations between mpc320_velocity and mpc320_step
 def mpc320_velocity_to_mpc320_step_velocity(
     ureg: pint.UnitRegistry, value: PlainQuantity[Quantity], **_: Any
@@ -114,7 +169,7 @@ def mpc320_velocity_to_mpc320_step_velocity(
     """
     degrees_per_second = value.to("degree / second").magnitude
     steps_per_second = degrees_per_second / 170 * 1370
-    return Quantity(steps_per_second, cast(Unit, ureg("mpc320_step / second")))
+    return ureg.Quantity(steps_per_second, ureg("mpc320_step / second").units)
 
 
 def mpc320_step_velocity_to_mpc320_velocity(
@@ -124,22 +179,90 @@ def mpc320_step_velocity_to_mpc320_velocity(
     Converts an mpc320 velocity percentage to a velocity in degrees per second.
     """
     degrees_per_second = value.magnitude / 1370 * 170 * ureg("degree / second")
-    new_velocity = degrees_per_second.to("mpc320_velocity")
-    return cast(Quantity, new_velocity)
+    new_velocity: Quantity = degrees_per_second.to("mpc320_velocity")
+    return new_velocity
+
+
+def _build_registry() -> tuple[pint.UnitRegistry, pint.Context]:
+    # pylint: disable=C0415
+    import pint
 
+    ureg = pint.UnitRegistry()
 
-thorlabs_context.add_transformation(
-    "mpc320_velocity",
-    "mpc320_step / second",
-    mpc320_velocity_to_mpc320_step_velocity,
-)
+    context = pint.Context("thorlabs_context")
 
-thorlabs_context.add_transformation(
-    "mpc320_step / second",
-    "mpc320_velocity",
-    mpc320_step_velocity_to_mpc320_velocity,
-)
+    # Custom unit definitions for devices
+    ureg.define("mpc320_step = [dimension_mpc320_step]")
+    ureg.define("k10cr1_step = [dimension_k10cr1_step]")
+    ureg.define("mpc320_velocity = [dimension_mpc320_velocity]")
+    ureg.define("k10cr1_velocity = [dimension_k10cr1_velocity]")
+    ureg.define("kbd101_step = [dimension_kbd101_step]")
+
+    context.add_transformation("degree", "mpc320_step", degree_to_mpc320_steps)
+    context.add_transformation("mpc320_step", "degree", mpc320_steps_to_degree)
+
+    context.add_transformation("degree", "k10cr1_step", degree_to_k10cr1_steps)
+    context.add_transformation("k10cr1_step", "degree", k10cr1_steps_to_degree)
+
+    context.add_transformation(
+        "degree / second", "k10cr1_velocity", degree_per_second_to_k10cr1_velocity
+    )
+    context.add_transformation(
+        "k10cr1_velocity", "degree / second", k10cr1_velocity_to_degree_per_second
+    )
+
+    context.add_transformation("millimeter", "kbd101_step", millimeter_to_kbd101_steps)
+    context.add_transformation("kbd101_step", "millimeter", kbd101_steps_to_millimeter)
+    context.add_transformation("picosecond", "kbd101_step", picosecond_to_kbd101_steps)
+    context.add_transformation("kbd101_step", "picosecond", kbd101_steps_to_picosecond)
+
+    context.add_transformation(
+        "degree / second",
+        "mpc320_velocity",
+        to_mpc320_velocity,  # Convert value to percent
+    )
+    context.add_transformation(
+        "mpc320_velocity",
+        "degree / second",
+        mpc320_velocity_to_pint_velocity,
+    )
+
+    context.add_transformation(
+        "mpc320_velocity",
+        "mpc320_step / second",
+        mpc320_velocity_to_mpc320_step_velocity,
+    )
+    context.add_transformation(
+        "mpc320_step / second",
+        "mpc320_velocity",
+        mpc320_step_velocity_to_mpc320_velocity,
+    )
 
-# Add and enable the context
-pnpq_ureg.add_context(thorlabs_context)
-pnpq_ureg.enable_contexts("thorlabs_context")
+    # Add and enable the context
+    ureg.add_context(context)
+    ureg.enable_contexts("thorlabs_context")
+    return ureg, context
+
+
+def _get_registry() -> tuple[pint.UnitRegistry, pint.Context]:
+    global _registry  # pylint: disable=W0603
+    registry = _registry
+    if registry is not None:
+        return registry
+    # Several threads (for example, the RX dispatcher decoding its
+    # first status message and a device driver converting a position)
+    # may race to build the registry; only one of them may win.
+    with _registry_lock:
+        if _registry is None:
+            _registry = _build_registry()
+        return _registry
+
+
+def __getattr__(name: str) -> Any:
+    if name == "pnpq_ureg":
+        return _get_registry()[0]
+    if name == "thorlabs_context":
+        return _get_registry()[1]
+    if name == "mpc320_max_velocity":
+        return _mpc320_max_velocity(_get_registry()[0])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,306 @@
+import math
+import time
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+
+from pnpq.apt.capture import (
+    CAPTURE_MAGIC,
+    RECORD_HEADER,
+    CaptureRecord,
+    CaptureWriter,
+    Direction,
+    ReplayTransport,
+    read_capture,
+)
+from pnpq.apt.connection import AptConnection
+from pnpq.apt.protocol import (
+    Address,
+    AptMessage,
+    AptMessage_MGMSG_HW_GET_INFO,
+    AptMessage_MGMSG_HW_REQ_INFO,
+    AptMessage_MGMSG_MOD_IDENTIFY,
+    AptMessage_MGMSG_MOT_GET_USTATUSUPDATE,
+    AptMessage_MGMSG_MOT_MOVE_HOMED,
+    AptMessage_MGMSG_MOT_REQ_USTATUSUPDATE,
+    ChanIdent,
+)
+from pnpq.apt.simulator import SimulatedMPC320
+from pnpq.events import Event
+from pnpq.transport import loopback_transport_pair
+
+REQ_INFO = AptMessage_MGMSG_HW_REQ_INFO(
+    destination=Address.GENERIC_USB,
+    source=Address.HOST_CONTROLLER,
+)
+
+
+def request_status(connection: AptConnection, chan_ident: ChanIdent) -> AptMessage:
+    return connection.send_message_expect_reply(
+        AptMessage_MGMSG_MOT_REQ_USTATUSUPDATE(
+            chan_ident=chan_ident,
+            destination=Address.GENERIC_USB,
+            source=Address.HOST_CONTROLLER,
+        ),
+        lambda message: isinstance(message, AptMessage_MGMSG_MOT_GET_USTATUSUPDATE)
+        and message.chan_ident == chan_ident,
+    )
+
+
+def request_info(connection: AptConnection) -> AptMessage:
+    return connection.send_message_expect_reply(
+        REQ_INFO,
+        lambda message: isinstance(message, AptMessage_MGMSG_HW_GET_INFO),
+    )
+
+
+@pytest.fixture(name="capture_path")
+def capture_path_fixture(tmp_path: Path) -> Iterator[Path]:
+    """A capture of a session with a simulated MPC320."""
+    path = tmp_path.joinpath("mpc320.capture")
+    writer = CaptureWriter(path=path)
+    writer.open()
+    host, device = loopback_transport_pair()
+    simulator = SimulatedMPC320(transport=device, serial_number=1234)
+    simulator.open()
+    connection = AptConnection(transport=host, capture=writer)
+    connection.open()
+    request_info(connection)
+    request_status(connection, ChanIdent.CHANNEL_2)
+    connection.close()
+    simulator.close()
+    writer.close()
+    yield path
+
+
+def write_capture(path: Path, records: list[CaptureRecord]) -> None:
+    with open(path, "wb") as f:
+        f.write(CAPTURE_MAGIC)
+        for record in records:
+            f.write(
+                RECORD_HEADER.pack(
+                    record.timestamp_ns,
+                    record.connection_id,
+                    record.direction,
+                    len(record.frame),
+                )
+            )
+            f.write(record.frame)
+
+
+def test_capture_records_traffic(capture_path: Path) -> None:
+    records = list(read_capture(capture_path))
+    assert {record.connection_id for record in records} == {1}
+    timestamps = [record.timestamp_ns for record in records]
+    assert timestamps == sorted(timestamps)
+
+    sent = [record.frame for record in records if record.direction == Direction.TX]
+    assert REQ_INFO.to_bytes() in sent
+    # AptConnection.open also requests the device information
+    received = [
+        AptMessage_MGMSG_HW_GET_INFO.from_bytes(record.frame)
+        for record in records
+        if record.direction == Direction.RX
+        and record.frame[:2]
+        == AptMessage_MGMSG_HW_GET_INFO.message_id.to_bytes(2, "little")
+    ]
+    assert [message.serial_number for message in received] == [1234, 1234]
+
+
+def test_read_truncated_capture(capture_path: Path, tmp_path: Path) -> None:
+    records = list(read_capture(capture_path))
+    truncated_path = tmp_path.joinpath("truncated.capture")
+    truncated_path.write_bytes(capture_path.read_bytes()[:-3])
+    assert list(read_capture(truncated_path)) == records[:-1]
+
+
+def test_read_invalid_capture(tmp_path: Path) -> None:
+    path = tmp_path.joinpath("invalid.capture")
+    path.write_bytes(b"not a capture")
+    with pytest.raises(ValueError):
+        list(read_capture(path))
+
+
+def test_replay(capture_path: Path) -> None:
+    transport = ReplayTransport(path=capture_path, speedup=math.inf)
+    connection = AptConnection(transport=transport)
+    connection.open()
+    info = request_info(connection)
+    assert isinstance(info, AptMessage_MGMSG_HW_GET_INFO)
+    assert info.serial_number == 1234
+    status = request_status(connection, ChanIdent.CHANNEL_2)
+    assert isinstance(status, AptMessage_MGMSG_MOT_GET_USTATUSUPDATE)
+    assert status.chan_ident == ChanIdent.CHANNEL_2
+    connection.close()
+
+
+def test_replay_timing(tmp_path: Path) -> None:
+    homed = AptMessage_MGMSG_MOT_MOVE_HOMED(
+        chan_ident=ChanIdent.CHANNEL_1,
+        destination=Address.HOST_CONTROLLER,
+        source=Address.GENERIC_USB,
+    ).to_bytes()
+    path = tmp_path.joinpath("timing.capture")
+    write_capture(
+        path,
+        [
+            CaptureRecord(
+                timestamp_ns=10**9 * second,
+                connection_id=1,
+                direction=Direction.RX,
+                frame=homed,
+            )
+            for second in range(3)
+        ],
+    )
+    transport = ReplayTransport(path=path, speedup=10)
+    start = time.monotonic()
+    transport.open()
+    arrivals = []
+    for _ in range(3):
+        assert transport.read(len(homed)) == homed
+        arrivals.append(time.monotonic() - start)
+    assert transport.finished.wait(1)
+    transport.close()
+    assert arrivals[0] < 0.1
+    assert 0.1 <= arrivals[1] < 0.2
+    assert 0.2 <= arrivals[2] < 0.3
+
+
+def test_replay_tx_mismatch(tmp_path: Path, caplog: pytest.LogCaptureFixture) -> None:
+    path = tmp_path.joinpath("mismatch.capture")
+    write_capture(
+        path,
+        [
+            CaptureRecord(
+                timestamp_ns=0,
+                connection_id=1,
+                direction=Direction.TX,
+                frame=REQ_INFO.to_bytes(),
+            ),
+        ],
+    )
+    transport = ReplayTransport(path=path, speedup=math.inf)
+    transport.open()
+    identify = AptMessage_MGMSG_MOD_IDENTIFY(
+        chan_ident=ChanIdent.CHANNEL_1,
+        destination=Address.GENERIC_USB,
+        source=Address.HOST_CONTROLLER,
+    ).to_bytes()
+    transport.write(identify)
+    assert transport.finished.wait(1)
+    transport.close()
+    mismatches = [
+        record.msg
+        for record in caplog.records
+        if isinstance(record.msg, dict)
+        and record.msg["event"] == Event.REPLAY_TX_MISMATCH
+    ]
+    assert mismatches == [
+        {
+            "event": Event.REPLAY_TX_MISMATCH,
+            "expected": REQ_INFO.to_bytes(),
+            "written": identify,
+        }
+    ]
+
+
+def test_replay_tx_beyond_capture(
+    tmp_path: Path, caplog: pytest.LogCaptureFixture
+) -> None:
+    path = tmp_path.joinpath("short.capture")
+    write_capture(
+        path,
+        [
+            CaptureRecord(
+                timestamp_ns=0,
+                connection_id=1,
+                direction=Direction.TX,
+                frame=REQ_INFO.to_bytes(),
+            ),
+        ],
+    )
+    transport = ReplayTransport(path=path, speedup=math.inf)
+    transport.open()
+    for _ in range(3):
+        transport.write(REQ_INFO.to_bytes())
+    assert transport.finished.wait(1)
+    transport.close()
+    # Writes the capture has no frames for are not kept
+    assert not transport.written
+    mismatches = [
+        record.msg
+        for record in caplog.records
+        if isinstance(record.msg, dict)
+        and record.msg["event"] == Event.REPLAY_TX_MISMATCH
+    ]
+    assert (
+        mismatches
+        == [
+            {
+                "event": Event.REPLAY_TX_MISMATCH,
+                "expected": None,
+                "written": REQ_INFO.to_bytes(),
+            }
+        ]
+        * 2
+    )
+
+
+def test_replay_extra_poll(tmp_path: Path, caplog: pytest.LogCaptureFixture) -> None:
+    identify = AptMessage_MGMSG_MOD_IDENTIFY(
+        chan_ident=ChanIdent.CHANNEL_1,
+        destination=Address.GENERIC_USB,
+        source=Address.HOST_CONTROLLER,
+    ).to_bytes()
+    poll = AptMessage_MGMSG_MOT_REQ_USTATUSUPDATE(
+        chan_ident=ChanIdent.CHANNEL_1,
+        destination=Address.GENERIC_USB,
+        source=Address.HOST_CONTROLLER,
+    ).to_bytes()
+    homed = AptMessage_MGMSG_MOT_MOVE_HOMED(
+        chan_ident=ChanIdent.CHANNEL_1,
+        destination=Address.HOST_CONTROLLER,
+        source=Address.GENERIC_USB,
+    ).to_bytes()
+    path = tmp_path.joinpath("poll.capture")
+    write_capture(
+        path,
+        [
+            CaptureRecord(
+                timestamp_ns=index,
+                connection_id=1,
+                direction=direction,
+                frame=frame,
+            )
+            for index, (direction, frame) in enumerate(
+                [
+                    (Direction.TX, REQ_INFO.to_bytes()),
+                    (Direction.TX, identify),
+                    (Direction.RX, homed),
+                ]
+            )
+        ],
+    )
+    transport = ReplayTransport(path=path, speedup=math.inf)
+    transport.open()
+    transport.write(REQ_INFO.to_bytes())
+    transport.write(poll)
+    # The poll does not stand in for the identify that the reply
+    # follows in the capture
+    assert not transport.finished.wait(0.2)
+    assert not transport.buffer
+    transport.write(identify)
+    assert transport.read(len(homed)) == homed
+    assert transport.finished.wait(1)
+    transport.close()
+    mismatches = [
+        record.msg
+        for record in caplog.records
+        if isinstance(record.msg, dict)
+        and record.msg["event"] == Event.REPLAY_TX_MISMATCH
+    ]
+    assert mismatches == [
+        {"event": Event.REPLAY_TX_MISMATCH, "expected": None, "written": poll}
+    ]
@@ -0,0 +1,174 @@
+import threading
+from collections.abc import Iterator
+
+import pytest
+
+from pnpq.apt.connection import AptConnection, Priority
+from pnpq.apt.protocol import (
+    Address,
+    AptMessage,
+    AptMessage_MGMSG_HW_REQ_INFO,
+    AptMessage_MGMSG_HW_STOP_UPDATEMSGS,
+    AptMessage_MGMSG_MOD_GET_CHANENABLESTATE,
+    AptMessage_MGMSG_MOD_IDENTIFY,
+    AptMessage_MGMSG_MOD_REQ_CHANENABLESTATE,
+    AptMessage_MGMSG_MOT_MOVE_HOMED,
+    AptMessage_MGMSG_MOT_MOVE_STOP,
+    ChanIdent,
+    EnableState,
+    StopMode,
+)
+from pnpq.transport import LoopbackTransport, loopback_transport_pair
+
+
+@pytest.fixture(name="connection")
+def connection_fixture() -> Iterator[tuple[AptConnection, LoopbackTransport]]:
+    transport, peer = loopback_transport_pair()
+    connection = AptConnection(transport=transport)
+    connection.open()
+    yield connection, peer
+    connection.close()
+
+
+def test_requires_serial_number_or_transport() -> None:
+    with pytest.raises(ValueError):
+        AptConnection()
+    with pytest.raises(ValueError):
+        AptConnection(serial_number="1234", transport=loopback_transport_pair()[0])
+
+
+def test_open_sends_initialization_messages(
+    connection: tuple[AptConnection, LoopbackTransport],
+) -> None:
+    _, peer = connection
+    assert AptMessage_MGMSG_HW_STOP_UPDATEMSGS.from_bytes(
+        peer.read(6)
+    ) == AptMessage_MGMSG_HW_STOP_UPDATEMSGS(
+        destination=Address.GENERIC_USB, source=Address.HOST_CONTROLLER
+    )
+    assert AptMessage_MGMSG_HW_REQ_INFO.from_bytes(
+        peer.read(6)
+    ) == AptMessage_MGMSG_HW_REQ_INFO(
+        destination=Address.GENERIC_USB, source=Address.HOST_CONTROLLER
+    )
+
+
+def test_rx_subscribe(connection: tuple[AptConnection, LoopbackTransport]) -> None:
+    apt_connection, peer = connection
+    message = AptMessage_MGMSG_MOT_MOVE_HOMED(
+        chan_ident=ChanIdent.CHANNEL_1,
+        destination=Address.HOST_CONTROLLER,
+        source=Address.GENERIC_USB,
+    )
+    with apt_connection.rx_subscribe() as queue:
+        # Unknown message IDs are skipped without losing framing
+        peer.write(b"\xff\xff\x00\x00\x01\x50")
+        peer.write(message.to_bytes())
+        assert queue.get(timeout=5) == message
+
+
+def test_send_message_expect_reply(
+    connection: tuple[AptConnection, LoopbackTransport],
+) -> None:
+    apt_connection, peer = connection
+    # Initialization messages
+    peer.read(12)
+
+    def device() -> None:
+        request = AptMessage_MGMSG_MOD_REQ_CHANENABLESTATE.from_bytes(peer.read(6))
+        peer.write(
+            AptMessage_MGMSG_MOD_GET_CHANENABLESTATE(
+                chan_ident=request.chan_ident,
+                enable_state=EnableState.CHANNEL_ENABLED,
+                destination=Address.HOST_CONTROLLER,
+                source=Address.GENERIC_USB,
+            ).to_bytes()
+        )
+
+    device_thread = threading.Thread(target=device)
+    device_thread.start()
+
+    def match_reply(message: AptMessage) -> bool:
+        return isinstance(message, AptMessage_MGMSG_MOD_GET_CHANENABLESTATE)
+
+    reply = apt_connection.send_message_expect_reply(
+        AptMessage_MGMSG_MOD_REQ_CHANENABLESTATE(
+            chan_ident=ChanIdent.CHANNEL_2,
+            destination=Address.GENERIC_USB,
+            source=Address.HOST_CONTROLLER,
+        ),
+        match_reply,
+    )
+    device_thread.join()
+    assert isinstance(reply, AptMessage_MGMSG_MOD_GET_CHANENABLESTATE)
+    assert reply.chan_ident == ChanIdent.CHANNEL_2
+    assert reply.enable_state == EnableState.CHANNEL_ENABLED
+
+
+def test_priority_lanes(connection: tuple[AptConnection, LoopbackTransport]) -> None:
+    apt_connection, peer = connection
+    # Initialization messages
+    peer.read(12)
+
+    # Hold up the sender with a request that is answered below
+    request_thread = threading.Thread(
+        target=apt_connection.send_message_expect_reply,
+        args=(
+            AptMessage_MGMSG_MOD_REQ_CHANENABLESTATE(
+                chan_ident=ChanIdent.CHANNEL_1,
+                destination=Address.GENERIC_USB,
+                source=Address.HOST_CONTROLLER,
+            ),
+            lambda message: isinstance(
+                message, AptMessage_MGMSG_MOD_GET_CHANENABLESTATE
+            ),
+        ),
+    )
+    request_thread.start()
+    AptMessage_MGMSG_MOD_REQ_CHANENABLESTATE.from_bytes(peer.read(6))
+
+    for chan_ident, priority in (
+        (ChanIdent.CHANNEL_1, Priority.BACKGROUND),
+        (ChanIdent.CHANNEL_2, Priority.CONTROL),
+        (ChanIdent.CHANNEL_3, Priority.BACKGROUND),
+        (ChanIdent.CHANNEL_4, Priority.CONTROL),
+    ):
+        apt_connection.send_message_no_reply(
+            AptMessage_MGMSG_MOD_IDENTIFY(
+                chan_ident=chan_ident,
+                destination=Address.GENERIC_USB,
+                source=Address.HOST_CONTROLLER,
+            ),
+            priority=priority,
+        )
+
+    # An emergency message does not wait for the reply
+    stop = AptMessage_MGMSG_MOT_MOVE_STOP(
+        chan_ident=ChanIdent.CHANNEL_1,
+        stop_mode=StopMode.IMMEDIATE,
+        destination=Address.GENERIC_USB,
+        source=Address.HOST_CONTROLLER,
+    )
+    apt_connection.send_message_no_reply(stop, priority=Priority.EMERGENCY)
+    assert AptMessage_MGMSG_MOT_MOVE_STOP.from_bytes(peer.read(6)) == stop
+
+    peer.write(
+        AptMessage_MGMSG_MOD_GET_CHANENABLESTATE(
+            chan_ident=ChanIdent.CHANNEL_1,
+            enable_state=EnableState.CHANNEL_ENABLED,
+            destination=Address.HOST_CONTROLLER,
+            source=Address.GENERIC_USB,
+        ).to_bytes()
+    )
+    request_thread.join()
+    # Control messages first, then background messages, each in the
+    # order they were sent
+    assert [
+        AptMessage_MGMSG_MOD_IDENTIFY.from_bytes(peer.read(6)).chan_ident
+        for _ in range(4)
+    ] == [
+        ChanIdent.CHANNEL_2,
+        ChanIdent.CHANNEL_4,
+        ChanIdent.CHANNEL_1,
+        ChanIdent.CHANNEL_3,
+    ]
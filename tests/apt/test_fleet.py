@@ -0,0 +1,120 @@
+import threading
+import time
+from collections.abc import Callable, Iterator
+
+from pnpq.apt.connection import AptConnection, open_connections
+from pnpq.apt.fleet import emergency_stop
+from pnpq.apt.protocol import AptMessage_MGMSG_MOT_MOVE_ABSOLUTE, ChanIdent, StopMode
+from pnpq.apt.simulator import (
+    SimulatedAptDevice,
+    SimulatedK10CR1,
+    SimulatedMPC320,
+    SimulatorFaults,
+)
+from pnpq.devices.polarization_controller_thorlabs_mpc import (
+    PolarizationControllerThorlabsMPC320,
+)
+from pnpq.devices.refactored_waveplate_thorlabs_k10cr1 import WaveplateThorlabsK10CR1
+from pnpq.errors import RequestCancelledError
+from pnpq.transport import loopback_transport_pair
+from pnpq.units import pnpq_ureg
+
+
+def connect(
+    simulator_class: type[SimulatedAptDevice], name: str
+) -> Iterator[AptConnection]:
+    host, device = loopback_transport_pair()
+    simulator = simulator_class(
+        transport=device, faults=SimulatorFaults(stall_moves=True)
+    )
+    simulator.open()
+    connection = AptConnection(transport=host, name=name)
+    connection.open()
+    yield connection
+    connection.close()
+    simulator.close()
+
+
+def start_move(
+    connection: AptConnection, move: Callable[[], None], errors: list[Exception]
+) -> threading.Thread:
+    def run() -> None:
+        try:
+            move()
+        except RequestCancelledError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    deadline = time.monotonic() + 5
+    while not (
+        (in_flight := connection.tx_ordered_sender_in_flight) is not None
+        and isinstance(in_flight.message, AptMessage_MGMSG_MOT_MOVE_ABSOLUTE)
+    ):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return thread
+
+
+def test_emergency_stop_halts_every_device() -> None:
+    mpc320_devices = connect(SimulatedMPC320, "mpc320")
+    k10cr1_devices = connect(SimulatedK10CR1, "k10cr1")
+    mpc320_connection = next(mpc320_devices)
+    k10cr1_connection = next(k10cr1_devices)
+    mpc320 = PolarizationControllerThorlabsMPC320(connection=mpc320_connection)
+    k10cr1 = WaveplateThorlabsK10CR1(connection=k10cr1_connection)
+
+    errors: list[Exception] = []
+    moves = [
+        start_move(
+            mpc320_connection,
+            lambda: mpc320.move_absolute(ChanIdent.CHANNEL_2, 100 * pnpq_ureg.degree),
+            errors,
+        ),
+        start_move(
+            k10cr1_connection,
+            lambda: k10cr1.move_absolute(45 * pnpq_ureg.degree),
+            errors,
+        ),
+    ]
+
+    result = emergency_stop()
+    for move in moves:
+        move.join(timeout=5)
+    assert result.confirmed
+    assert result.elapsed < 1
+    assert {r.connection: r.confirmed for r in result.connections} == {
+        "mpc320": mpc320.available_channels,
+        "k10cr1": frozenset({ChanIdent.CHANNEL_1}),
+    }
+    # Both moves were waiting for completion, and are cancelled
+    assert len(errors) == 2
+    assert not mpc320.get_status(ChanIdent.CHANNEL_2).status.ACTIVE
+
+    next(mpc320_devices, None)
+    next(k10cr1_devices, None)
+    # Closed connections are not stopped by later fleet stops
+    assert id(mpc320_connection) not in open_connections
+    assert id(k10cr1_connection) not in open_connections
+
+
+def test_emergency_stop_of_idle_connection() -> None:
+    devices = connect(SimulatedMPC320, "idle")
+    connection = next(devices)
+    # Without a driver, the connection is stopped as a single channel
+    # device, which confirms with its status
+    result = emergency_stop(StopMode.CONTROLLED, connections=[connection])
+    assert result.confirmed
+    assert result.connections[0].confirmed == {ChanIdent.CHANNEL_1}
+    next(devices, None)
+
+
+def test_emergency_stop_reports_unconfirmed_channels() -> None:
+    host, _ = loopback_transport_pair()
+    connection = AptConnection(transport=host, name="unresponsive")
+    connection.open()
+    result = emergency_stop(timeout=0.3, connections=[connection])
+    connection.close()
+    assert not result.confirmed
+    assert result.connections[0].unconfirmed == {ChanIdent.CHANNEL_1}
+    assert 0.3 <= result.elapsed < 1
@@ -3,7 +3,10 @@ import pytest
 from pint import DimensionalityError
 
 from pnpq.apt.protocol import (
+    APT_MESSAGE_CLASSES,
+    ATS,
     Address,
+    AptField,
     AptMessage,
     AptMessage_MGMSG_HW_DISCONNECT,
     AptMessage_MGMSG_HW_GET_INFO,
@@ -15,6 +18,7 @@ from pnpq.apt.protocol import (
     AptMessage_MGMSG_MOD_REQ_CHANENABLESTATE,
     AptMessage_MGMSG_MOD_SET_CHANENABLESTATE,
     AptMessage_MGMSG_MOT_ACK_USTATUSUPDATE,
+    AptMessage_MGMSG_MOT_GET_HOMEPARAMS,
     AptMessage_MGMSG_MOT_GET_POSCOUNTER,
     AptMessage_MGMSG_MOT_GET_STATUSUPDATE,
     AptMessage_MGMSG_MOT_GET_USTATUSUPDATE,
@@ -25,23 +29,29 @@ from pnpq.apt.protocol import (
     AptMessage_MGMSG_MOT_MOVE_HOME,
     AptMessage_MGMSG_MOT_MOVE_HOMED,
     AptMessage_MGMSG_MOT_MOVE_JOG,
+    AptMessage_MGMSG_MOT_MOVE_RELATIVE,
     AptMessage_MGMSG_MOT_MOVE_STOP,
     AptMessage_MGMSG_MOT_MOVE_STOPPED,
+    AptMessage_MGMSG_MOT_REQ_HOMEPARAMS,
     AptMessage_MGMSG_MOT_REQ_POSCOUNTER,
     AptMessage_MGMSG_MOT_REQ_STATUSUPDATE,
     AptMessage_MGMSG_MOT_REQ_USTATUSUPDATE,
     AptMessage_MGMSG_MOT_SET_EEPROMPARAMS,
+    AptMessage_MGMSG_MOT_SET_HOMEPARAMS,
     AptMessage_MGMSG_MOT_SET_POSCOUNTER,
     AptMessage_MGMSG_POL_GET_PARAMS,
     AptMessage_MGMSG_POL_REQ_PARAMS,
     AptMessage_MGMSG_POL_SET_PARAMS,
     AptMessage_MGMSG_RESTOREFACTORYSETTINGS,
+    AptMessageHeaderOnly,
     AptMessageId,
     ChanIdent,
     EnableState,
     FirmwareVersion,
     HardwareType,
+    HomeDirection,
     JogDirection,
+    LimitSwitch,
     Status,
     StopMode,
     UStatus,
@@ -433,6 +443,77 @@ def test_AptMessage_MGMSG_MOT_MOVE_ABSOLUTE_to_bytes() -> None:
     assert msg.to_bytes() == bytes.fromhex("5304 0600 A2 01 0100 400D0300")
 
 
+def test_AptMessage_MGMSG_MOT_MOVE_RELATIVE_from_bytes() -> None:
+    msg = AptMessage_MGMSG_MOT_MOVE_RELATIVE.from_bytes(
+        bytes.fromhex("4804 0600 D0 01 0100 C0F2FCFF")
+    )
+    assert msg.destination == 0x50
+    assert msg.message_id == 0x0448
+    assert msg.source == 0x01
+    assert msg.chan_ident == 0x01
+    assert msg.relative_distance == -200000
+
+
+def test_AptMessage_MGMSG_MOT_MOVE_RELATIVE_to_bytes() -> None:
+    msg = AptMessage_MGMSG_MOT_MOVE_RELATIVE(
+        destination=Address.GENERIC_USB,
+        source=Address.HOST_CONTROLLER,
+        chan_ident=ChanIdent.CHANNEL_1,
+        relative_distance=-200000,
+    )
+    assert msg.to_bytes() == bytes.fromhex("4804 0600 D0 01 0100 C0F2FCFF")
+
+
+def test_AptMessage_MGMSG_MOT_SET_HOMEPARAMS_from_bytes() -> None:
+    # The home parameters that the K10CR1 is sent before homing
+    msg = AptMessage_MGMSG_MOT_SET_HOMEPARAMS.from_bytes(
+        bytes.fromhex("4004 0e00 D0 01 0100 0200 0100 a4aabc08 00000000")
+    )
+    assert msg.destination == 0x50
+    assert msg.message_id == 0x0440
+    assert msg.source == 0x01
+    assert msg.chan_ident == 0x01
+    assert msg.home_direction == HomeDirection.REVERSE
+    assert msg.limit_switch == LimitSwitch.HARDWARE_REVERSE
+    assert msg.home_velocity == 0x08BCAAA4
+    assert msg.offset_distance == 0
+
+
+def test_AptMessage_MGMSG_MOT_SET_HOMEPARAMS_to_bytes() -> None:
+    msg = AptMessage_MGMSG_MOT_SET_HOMEPARAMS(
+        destination=Address.GENERIC_USB,
+        source=Address.HOST_CONTROLLER,
+        chan_ident=ChanIdent.CHANNEL_1,
+        home_direction=HomeDirection.REVERSE,
+        limit_switch=LimitSwitch.HARDWARE_REVERSE,
+        home_velocity=0x08BCAAA4,
+        offset_distance=0,
+    )
+    assert msg.to_bytes() == bytes.fromhex(
+        "4004 0e00 D0 01 0100 0200 0100 a4aabc08 00000000"
+    )
+
+
+def test_AptMessage_MGMSG_MOT_REQ_HOMEPARAMS_to_bytes() -> None:
+    msg = AptMessage_MGMSG_MOT_REQ_HOMEPARAMS(
+        chan_ident=ChanIdent.CHANNEL_1,
+        destination=Address.GENERIC_USB,
+        source=Address.HOST_CONTROLLER,
+    )
+    assert msg.to_bytes() == b"\x41\x04\x01\x00\x50\x01"
+
+
+def test_AptMessage_MGMSG_MOT_GET_HOMEPARAMS_from_bytes() -> None:
+    msg = AptMessage_MGMSG_MOT_GET_HOMEPARAMS.from_bytes(
+        bytes.fromhex("4204 0e00 81 50 0100 0100 0400 a4aabc08 40420f00")
+    )
+    assert msg.destination == 0x01
+    assert msg.source == 0x50
+    assert msg.home_direction == HomeDirection.FORWARD
+    assert msg.limit_switch == LimitSwitch.HARDWARE_FORWARD
+    assert msg.offset_distance == 1000000
+
+
 @pytest.mark.parametrize(
     "message_bytes, expected_length, expected_type",
     [
@@ -722,3 +803,78 @@ def test_AptMessage_MGMSG_MOT_SET_EEPROMPARAMS_to_bytes() -> None:
 def test_ChanIdent_init(chan_ident_int: int, expected_channel: ChanIdent) -> None:
     chan_ident = ChanIdent.from_linear(chan_ident_int)
     assert chan_ident == expected_channel
+
+
+def test_APT_MESSAGE_CLASSES_covers_all_message_ids() -> None:
+    for message_id in AptMessageId:
+        message_class = APT_MESSAGE_CLASSES[message_id]
+        assert message_class.__name__ == f"AptMessage_{message_id.name}"
+
+
+@pytest.mark.parametrize(
+    "message_class, expected_data_length",
+    [
+        (AptMessage_MGMSG_HW_GET_INFO, 84),
+        (AptMessage_MGMSG_HW_REQ_INFO, 0),
+        (AptMessage_MGMSG_MOT_GET_STATUSUPDATE, 14),
+        (AptMessage_MGMSG_MOT_GET_USTATUSUPDATE, 14),
+        (AptMessage_MGMSG_MOT_MOVE_ABSOLUTE, 6),
+        (AptMessage_MGMSG_MOT_MOVE_COMPLETED_6_BYTES, 0),
+        (AptMessage_MGMSG_MOT_MOVE_COMPLETED_20_BYTES, 14),
+        (AptMessage_MGMSG_MOT_SET_EEPROMPARAMS, 4),
+        (AptMessage_MGMSG_POL_GET_PARAMS, 12),
+    ],
+)
+def test_data_length_derived_from_layout(
+    message_class: type[AptMessage], expected_data_length: int
+) -> None:
+    assert message_class.data_length == expected_data_length
+    assert message_class.message_struct.size == expected_data_length + 6
+
+
+@pytest.mark.parametrize(
+    "message_class, raw, expected_error",
+    [
+        (
+            AptMessage_MGMSG_HW_REQ_INFO,
+            b"\x06\x00\x00\x00\x50\x01",
+            "Expected message ID 5, but received 6",
+        ),
+        (
+            AptMessage_MGMSG_MOT_MOVE_ABSOLUTE,
+            bytes.fromhex("5404 0600 A2 01 0100 400D0300"),
+            "Expected message ID 1107, but received 1108",
+        ),
+        (
+            AptMessage_MGMSG_MOT_MOVE_ABSOLUTE,
+            bytes.fromhex("5304 0700 A2 01 0100 400D0300"),
+            "Expected data packet length 6, but received 7",
+        ),
+        (
+            AptMessage_MGMSG_MOT_MOVE_ABSOLUTE,
+            bytes.fromhex("5304 0600 22 01 0100 400D0300"),
+            "Expected the destination's highest bit to be 1",
+        ),
+    ],
+)
+def test_from_bytes_invalid_header(
+    message_class: type[AptMessage], raw: bytes, expected_error: str
+) -> None:
+    with pytest.raises(ValueError, match=expected_error):
+        message_class.from_bytes(raw)
+
+
+def test_header_only_layout_must_be_two_bytes() -> None:
+    with pytest.raises(TypeError):
+
+        class AptMessage_INVALID(AptMessageHeaderOnly):  # pylint: disable=W0612
+            message_id = AptMessageId.MGMSG_HW_DISCONNECT
+            layout = (AptField(name="position", format=ATS.LONG),)
+
+
+def test_decoded_status_is_shared_between_messages() -> None:
+    raw = bytes.fromhex("9104 0e00 81 22 0100 00000001 0001 FFFF 07000000")
+    first = AptMessage_MGMSG_MOT_GET_USTATUSUPDATE.from_bytes(raw)
+    second = AptMessage_MGMSG_MOT_GET_USTATUSUPDATE.from_bytes(raw)
+    assert first == second
+    assert first.status is second.status
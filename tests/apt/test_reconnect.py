@@ -0,0 +1,239 @@
+import threading
+import time
+from dataclasses import dataclass, field
+from unittest.mock import Mock
+
+import pytest
+
+from pnpq.apt import session
+from pnpq.apt.connection import AptConnection
+from pnpq.apt.protocol import (
+    AptMessage_MGMSG_HW_START_UPDATEMSGS,
+    AptMessage_MGMSG_HW_STOP_UPDATEMSGS,
+    AptMessage_MGMSG_MOD_SET_CHANENABLESTATE,
+    AptMessage_MGMSG_MOT_MOVE_ABSOLUTE,
+    AptMessage_MGMSG_POL_SET_PARAMS,
+    ChanIdent,
+)
+from pnpq.apt.retry import RetryPolicy
+from pnpq.apt.session import RecoveryReport
+from pnpq.apt.simulator import (
+    SimulatedAptDevice,
+    SimulatedK10CR1,
+    SimulatedMPC320,
+    SimulatorFaults,
+)
+from pnpq.devices.polarization_controller_thorlabs_mpc import (
+    PolarizationControllerThorlabsMPC320,
+)
+from pnpq.devices.refactored_waveplate_thorlabs_k10cr1 import WaveplateThorlabsK10CR1
+from pnpq.errors import DeviceDisconnectedError, TransportClosedError
+from pnpq.events import Event
+from pnpq.transport import LoopbackTransport, Transport, loopback_transport_pair
+from pnpq.units import pnpq_ureg
+
+
+@dataclass(frozen=True, kw_only=True)
+class ReplugTransport(Transport):
+    """A port that a simulated device can be unplugged from. Every
+    open plugs in a new device, which starts with its default state,
+    like a power cycled controller."""
+
+    simulator_class: type[SimulatedAptDevice]
+    faults: SimulatorFaults = field(default_factory=SimulatorFaults)
+    # Faults of the devices plugged in after an unplug, if different
+    replug_faults: None | SimulatorFaults = None
+    # Opens that fail before the device is found, per unplug
+    failed_opens: int = 0
+
+    opens: list[int] = field(default_factory=lambda: [0])
+    host: list[LoopbackTransport] = field(default_factory=list)
+    simulators: list[SimulatedAptDevice] = field(default_factory=list)
+
+    @property
+    def simulator(self) -> SimulatedAptDevice:
+        return self.simulators[-1]
+
+    def open(self) -> None:
+        self.opens[0] += 1
+        if self.simulators and self.opens[0] <= self.failed_opens:
+            raise ValueError("Serial number could not be found.")
+        host, device = loopback_transport_pair()
+        faults = self.faults
+        if self.simulators and self.replug_faults is not None:
+            faults = self.replug_faults
+        simulator = self.simulator_class(transport=device, faults=faults)
+        simulator.open()
+        self.host.append(host)
+        self.simulators.append(simulator)
+
+    def unplug(self) -> None:
+        self.opens[0] = 0
+        self.simulator.close()
+
+    def close(self) -> None:
+        if self.host:
+            self.host[-1].close()
+
+    def read(self, size: int) -> bytes:
+        return self.host[-1].read(size)
+
+    def write(self, data: bytes) -> None:
+        if not self.host:
+            raise TransportClosedError("Transport is closed.")
+        self.host[-1].write(data)
+
+    def reset_input_buffer(self) -> None:
+        self.host[-1].reset_input_buffer()
+
+
+def wait_for_recovery(connection: AptConnection) -> RecoveryReport:
+    deadline = time.monotonic() + 10
+    while connection.last_recovery is None:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return connection.last_recovery
+
+
+def test_move_fails_fast_and_session_is_restored() -> None:
+    transport = ReplugTransport(
+        simulator_class=SimulatedMPC320,
+        faults=SimulatorFaults(stall_moves=True),
+        failed_opens=2,
+    )
+    reports: list[RecoveryReport] = []
+    connection = AptConnection(
+        transport=transport, reconnect=True, recovery_exporter=reports.append
+    )
+    connection.open()
+    controller = PolarizationControllerThorlabsMPC320(connection=connection)
+    controller.set_params(velocity=40 * pnpq_ureg.mpc320_velocity)
+
+    errors: list[Exception] = []
+
+    def move() -> None:
+        try:
+            controller.move_absolute(ChanIdent.CHANNEL_1, 100 * pnpq_ureg.degree)
+        except DeviceDisconnectedError as e:
+            errors.append(e)
+
+    move_thread = threading.Thread(target=move)
+    move_thread.start()
+    deadline = time.monotonic() + 5
+    while not (
+        (in_flight := connection.tx_ordered_sender_in_flight) is not None
+        and isinstance(in_flight.message, AptMessage_MGMSG_MOT_MOVE_ABSOLUTE)
+    ):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    start = time.perf_counter()
+    transport.unplug()
+    move_thread.join(timeout=5)
+    # The stalled move would otherwise wait for its reply for 10 seconds
+    assert time.perf_counter() - start < 1
+    assert len(errors) == 1
+
+    report = wait_for_recovery(connection)
+    assert reports == [report]
+    assert isinstance(report.error, TransportClosedError)
+    assert report.attempts == 3
+    assert report.info.model_number == SimulatedMPC320.model_number
+    assert [type(message) for message in report.restored] == [
+        AptMessage_MGMSG_HW_STOP_UPDATEMSGS,
+        AptMessage_MGMSG_POL_SET_PARAMS,
+        AptMessage_MGMSG_MOD_SET_CHANENABLESTATE,
+    ]
+    # The new device has the parameters set before it was unplugged
+    assert controller.get_params()["velocity"] == 40 * pnpq_ureg.mpc320_velocity
+    # Channel 1 was enabled for the move when the device was lost
+    assert controller.get_status(ChanIdent.CHANNEL_1).status.ENABLED
+    assert not controller.get_status(ChanIdent.CHANNEL_2).status.ENABLED
+    assert connection.metrics.snapshot()["pnpq_apt_reconnects_total"] == {
+        (("connection", connection.label),): 1
+    }
+
+    connection.close()
+    transport.simulator.close()
+
+
+def test_update_messages_are_restored() -> None:
+    transport = ReplugTransport(simulator_class=SimulatedK10CR1)
+    connection = AptConnection(transport=transport, reconnect=True)
+    connection.open()
+    WaveplateThorlabsK10CR1(connection=connection)
+    deadline = time.monotonic() + 5
+    while not transport.simulator.updates_enabled.is_set():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    transport.unplug()
+    report = wait_for_recovery(connection)
+    assert isinstance(report.restored[-1], AptMessage_MGMSG_HW_START_UPDATEMSGS)
+    assert transport.simulator.updates_enabled.is_set()
+    connection.close()
+    transport.simulator.close()
+
+
+def test_silent_device_fails_recovery(monkeypatch: pytest.MonkeyPatch) -> None:
+    transport = ReplugTransport(
+        simulator_class=SimulatedMPC320,
+        # The device is found again, but never replies
+        replug_faults=SimulatorFaults(drop_probability=1),
+    )
+    log = Mock()
+    monkeypatch.setattr(session, "log", log)
+    thread_errors: list[threading.ExceptHookArgs] = []
+    monkeypatch.setattr(threading, "excepthook", thread_errors.append)
+    connection = AptConnection(
+        transport=transport,
+        reconnect=True,
+        retry_policy=RetryPolicy(deadline=0.5),
+    )
+    connection.open()
+    transport.unplug()
+    deadline = time.monotonic() + 5
+    while connection.reconnect_thread is None:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    connection.reconnect_thread.join(timeout=5)
+    assert not connection.reconnect_thread.is_alive()
+    assert not thread_errors
+    assert connection.last_recovery is None
+    log.warning.assert_called_once()
+    assert log.warning.call_args.kwargs["event"] == Event.CONNECTION_RECOVERY_FAILED
+    assert "TimeoutException" in log.warning.call_args.kwargs["error"]
+    connection.close()
+    transport.simulator.close()
+
+
+def test_lost_device_without_reconnect() -> None:
+    host, device = loopback_transport_pair()
+    simulator = SimulatedMPC320(transport=device)
+    simulator.open()
+    connection = AptConnection(transport=host)
+    assert not connection.reconnect
+    connection.open()
+    controller = PolarizationControllerThorlabsMPC320(connection=connection)
+    controller.get_status(ChanIdent.CHANNEL_1)
+    simulator.close()
+    deadline = time.monotonic() + 5
+    while connection.connected.is_set():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    with pytest.raises(DeviceDisconnectedError):
+        controller.get_status(ChanIdent.CHANNEL_1)
+    with pytest.raises(DeviceDisconnectedError):
+        controller.stop(ChanIdent.CHANNEL_1)
+    connection.close()
+
+
+def test_close_while_reconnecting() -> None:
+    transport = ReplugTransport(simulator_class=SimulatedMPC320, failed_opens=1000)
+    connection = AptConnection(transport=transport, reconnect=True)
+    connection.open()
+    transport.unplug()
+    time.sleep(0.3)
+    start = time.perf_counter()
+    connection.close()
+    assert time.perf_counter() - start < 1
+    assert connection.last_recovery is None
@@ -0,0 +1,174 @@
+import math
+import time
+
+import pytest
+
+from pnpq.apt.connection import AptConnection
+from pnpq.apt.protocol import (
+    Address,
+    AptMessage,
+    AptMessage_MGMSG_HW_GET_INFO,
+    AptMessage_MGMSG_HW_REQ_INFO,
+    AptMessage_MGMSG_MOD_IDENTIFY,
+    AptMessageId,
+    ChanIdent,
+)
+from pnpq.apt.retry import (
+    RetransmissionSchedule,
+    RetransmitReason,
+    RetryPolicy,
+    RoundTripEstimator,
+    is_idempotent,
+)
+from pnpq.apt.simulator import SimulatedMPC320, SimulatorFaults
+from pnpq.devices.utils import TimeoutException
+from pnpq.transport import loopback_transport_pair
+
+REQ_INFO = AptMessage_MGMSG_HW_REQ_INFO(
+    destination=Address.GENERIC_USB,
+    source=Address.HOST_CONTROLLER,
+)
+
+
+def is_info(message: AptMessage) -> bool:
+    return isinstance(message, AptMessage_MGMSG_HW_GET_INFO)
+
+
+def test_is_idempotent() -> None:
+    assert is_idempotent(REQ_INFO)
+    assert not is_idempotent(
+        AptMessage_MGMSG_MOD_IDENTIFY(
+            chan_ident=ChanIdent.CHANNEL_1,
+            destination=Address.GENERIC_USB,
+            source=Address.HOST_CONTROLLER,
+        )
+    )
+
+
+def test_round_trip_estimator() -> None:
+    estimator = RoundTripEstimator(
+        policy=RetryPolicy(initial_timeout=1, min_timeout=0.1, max_timeout=2)
+    )
+    message_id = AptMessageId.MGMSG_HW_REQ_INFO
+    assert estimator.timeout(message_id) == 1
+    assert estimator.hedge_delay(message_id) == math.inf
+
+    estimator.observe(message_id, 0.02)
+    # 0.02 + 4 * 0.01, raised to the minimum
+    assert estimator.timeout(message_id) == 0.1
+    assert estimator.hedge_delay(message_id) == pytest.approx(0.03)
+
+    for _ in range(50):
+        estimator.observe(message_id, 0.3)
+    assert estimator.timeout(message_id) == pytest.approx(0.3, abs=0.05)
+
+    estimator.observe(message_id, 10)
+    assert estimator.timeout(message_id) == 2
+
+
+def test_retransmission_schedule() -> None:
+    estimator = RoundTripEstimator(policy=RetryPolicy(deadline=5, hedge=True))
+    schedule = RetransmissionSchedule.start(REQ_INFO, 100, estimator, 10)
+    # Without samples there is nothing to hedge against
+    assert schedule.deadline == 105
+    assert schedule.due(100.5) is None
+    assert schedule.wait_time(100.5) == pytest.approx(0.5)
+    assert schedule.due(101) == RetransmitReason.TIMEOUT
+    schedule.retransmitted(101, RetransmitReason.TIMEOUT)
+    # The timeout doubles after every retransmission
+    assert schedule.retransmit_at == 103
+
+    estimator.observe(REQ_INFO.message_id, 0.2)
+    schedule = RetransmissionSchedule.start(REQ_INFO, 100, estimator, 10)
+    assert schedule.hedge_at == pytest.approx(100.3)
+    assert schedule.retransmit_at == pytest.approx(100.6)
+    assert schedule.due(100.4) == RetransmitReason.HEDGE
+    schedule.retransmitted(100.4, RetransmitReason.HEDGE)
+    assert schedule.due(100.5) is None
+    assert schedule.retransmit_at == pytest.approx(100.6)
+
+
+def test_requests_that_are_not_retried() -> None:
+    estimator = RoundTripEstimator(policy=RetryPolicy())
+    identify = AptMessage_MGMSG_MOD_IDENTIFY(
+        chan_ident=ChanIdent.CHANNEL_1,
+        destination=Address.GENERIC_USB,
+        source=Address.HOST_CONTROLLER,
+    )
+    for schedule in (
+        RetransmissionSchedule.start(identify, 100, estimator, 10),
+        RetransmissionSchedule.start(REQ_INFO, 100, None, 10),
+    ):
+        assert schedule.deadline == 110
+        assert schedule.due(109) is None
+
+
+def lossy_connection(
+    drop_probability: float, retry_policy: None | RetryPolicy
+) -> tuple[AptConnection, SimulatedMPC320]:
+    host, device = loopback_transport_pair()
+    simulator = SimulatedMPC320(
+        transport=device, faults=SimulatorFaults(latency=0.01, seed=3)
+    )
+    simulator.open()
+    connection = AptConnection(transport=host, retry_policy=retry_policy)
+    connection.open()
+    # Learn the round-trip time before dropping replies
+    for _ in range(5):
+        connection.send_message_expect_reply(REQ_INFO, is_info)
+    simulator.set_faults(
+        SimulatorFaults(latency=0.01, drop_probability=drop_probability, seed=3)
+    )
+    return connection, simulator
+
+
+@pytest.mark.parametrize("hedge", [False, True])
+def test_lost_replies_are_retransmitted(hedge: bool) -> None:
+    connection, simulator = lossy_connection(
+        0.3, RetryPolicy(min_timeout=0.05, hedge=hedge)
+    )
+    durations = []
+    for _ in range(20):
+        start = time.perf_counter()
+        assert is_info(connection.send_message_expect_reply(REQ_INFO, is_info))
+        durations.append(time.perf_counter() - start)
+    connection.close()
+    simulator.close()
+    # Every request gets its reply long before the 10 second deadline
+    assert max(durations) < 1
+    retransmissions = connection.metrics.snapshot()[
+        "pnpq_apt_request_retransmissions_total"
+    ]
+    reasons = {
+        dict(labels)["reason"]
+        for labels in retransmissions
+        if dict(labels)["connection"] == connection.label
+    }
+    # Hedged requests are mostly sent again before they time out
+    assert (RetransmitReason.HEDGE if hedge else RetransmitReason.TIMEOUT) in reasons
+
+
+def test_deadline_fails_the_request() -> None:
+    connection, simulator = lossy_connection(
+        1, RetryPolicy(deadline=0.5, min_timeout=0.05)
+    )
+    start = time.perf_counter()
+    with pytest.raises(TimeoutException):
+        connection.send_message_expect_reply(REQ_INFO, is_info)
+    assert 0.5 <= time.perf_counter() - start < 1
+    # The sender thread keeps going
+    simulator.set_faults(SimulatorFaults())
+    assert is_info(connection.send_message_expect_reply(REQ_INFO, is_info))
+    connection.close()
+    simulator.close()
+
+
+def test_reply_timeout_fails_the_request() -> None:
+    connection, simulator = lossy_connection(1, None)
+    start = time.perf_counter()
+    with pytest.raises(TimeoutException):
+        connection.send_message_expect_reply(REQ_INFO, is_info, reply_timeout=0.3)
+    # Well before the default REPLY_TIMEOUT
+    assert 0.3 <= time.perf_counter() - start < 1
+    connection.close()
+    simulator.close()
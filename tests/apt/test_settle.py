@@ -0,0 +1,159 @@
+import time
+from collections.abc import Iterator
+
+import pytest
+
+from pnpq.apt.connection import AptConnection
+from pnpq.apt.protocol import (
+    Address,
+    AptMessage,
+    AptMessage_MGMSG_MOD_SET_CHANENABLESTATE,
+    AptMessage_MGMSG_MOT_GET_USTATUSUPDATE,
+    ChanIdent,
+    EnableState,
+    UStatus,
+    UStatusBits,
+)
+from pnpq.apt.settle import (
+    SettlePolicy,
+    SettleRule,
+    calibrate,
+    channel_enable_confirmed,
+)
+from pnpq.apt.simulator import SimulatedK10CR1, SimulatorFaults
+from pnpq.apt.tracing import RequestTrace
+from pnpq.devices.refactored_waveplate_thorlabs_k10cr1 import WaveplateThorlabsK10CR1
+from pnpq.transport import loopback_transport_pair
+from pnpq.units import pnpq_ureg
+
+
+def set_enable_state(chan_ident: ChanIdent) -> AptMessage:
+    return AptMessage_MGMSG_MOD_SET_CHANENABLESTATE(
+        chan_ident=chan_ident,
+        enable_state=EnableState.CHANNEL_ENABLED,
+        destination=Address.GENERIC_USB,
+        source=Address.HOST_CONTROLLER,
+    )
+
+
+def status(chan_ident: ChanIdent, enabled: bool) -> AptMessage:
+    return AptMessage_MGMSG_MOT_GET_USTATUSUPDATE(
+        chan_ident=chan_ident,
+        position=0,
+        velocity=0,
+        motor_current=0 * pnpq_ureg.milliamp,
+        status=UStatus.from_bits(UStatusBits.ENABLED if enabled else UStatusBits(0)),
+        destination=Address.HOST_CONTROLLER,
+        source=Address.GENERIC_USB,
+    )
+
+
+def test_channel_enable_confirmed() -> None:
+    enable = set_enable_state(ChanIdent.CHANNEL_1)
+    assert channel_enable_confirmed(enable, status(ChanIdent.CHANNEL_1, True))
+    assert not channel_enable_confirmed(enable, status(ChanIdent.CHANNEL_1, False))
+    # Enabling one channel disables the others
+    assert channel_enable_confirmed(enable, status(ChanIdent.CHANNEL_2, False))
+    disable = AptMessage_MGMSG_MOD_SET_CHANENABLESTATE(
+        chan_ident=ChanIdent.CHANNEL_1,
+        enable_state=EnableState.CHANNEL_DISABLED,
+        destination=Address.GENERIC_USB,
+        source=Address.HOST_CONTROLLER,
+    )
+    assert channel_enable_confirmed(disable, status(ChanIdent.CHANNEL_1, False))
+    # Disabling leaves the other channels as they were
+    assert not channel_enable_confirmed(disable, status(ChanIdent.CHANNEL_2, False))
+
+
+@pytest.fixture(name="k10cr1")
+def k10cr1_fixture() -> Iterator[tuple[AptConnection, WaveplateThorlabsK10CR1]]:
+    host, device = loopback_transport_pair()
+    simulator = SimulatedK10CR1(
+        transport=device, faults=SimulatorFaults(latency=0.01), speedup=100
+    )
+    simulator.open()
+    connection = AptConnection(transport=host)
+    connection.open()
+    yield connection, WaveplateThorlabsK10CR1(connection=connection)
+    connection.close()
+    simulator.close()
+
+
+def settle_duration(connection: AptConnection, confirmed: bool) -> float:
+    """Send a SET_CHANENABLESTATE message and return how long it held
+    the connection, checking whether its effect was confirmed."""
+    traces: list[RequestTrace] = []
+    object.__setattr__(connection, "trace_exporter", traces.append)
+    connection.send_message_no_reply(set_enable_state(ChanIdent.CHANNEL_1))
+    deadline = time.monotonic() + 5
+    while not traces:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    spans = {name: end - start for name, start, end in traces[0].spans()}
+    count = connection.metrics.snapshot()["pnpq_apt_settle_duration_seconds_count"]
+    labels = (
+        ("confirmed", str(confirmed).lower()),
+        ("connection", connection.label),
+        ("message", "MGMSG_MOD_SET_CHANENABLESTATE"),
+    )
+    assert count[labels] >= 1
+    return spans["settle"]
+
+
+def test_enable_state_is_confirmed_by_status(
+    k10cr1: tuple[AptConnection, WaveplateThorlabsK10CR1],
+) -> None:
+    connection, _ = k10cr1
+    duration = settle_duration(connection, confirmed=True)
+    # A round trip to the device, rather than the 0.2 second default
+    assert duration < 0.15
+
+
+def test_unconfirmed_message_waits_for_the_delay(
+    k10cr1: tuple[AptConnection, WaveplateThorlabsK10CR1],
+) -> None:
+    connection, _ = k10cr1
+    connection.settle_policy.rules[AptMessage_MGMSG_MOD_SET_CHANENABLESTATE] = (
+        SettleRule(
+            delay=0.3,
+            confirm=lambda message, received: False,
+            status_request=connection.settle_policy.rules[
+                AptMessage_MGMSG_MOD_SET_CHANENABLESTATE
+            ].status_request,
+        )
+    )
+    duration = settle_duration(connection, confirmed=False)
+    assert 0.3 <= duration < 0.5
+
+
+def test_confirmed_message_waits_for_the_minimum(
+    k10cr1: tuple[AptConnection, WaveplateThorlabsK10CR1],
+) -> None:
+    connection, _ = k10cr1
+    rules = connection.settle_policy.rules
+    rules[AptMessage_MGMSG_MOD_SET_CHANENABLESTATE] = SettleRule(
+        minimum=0.15,
+        confirm=channel_enable_confirmed,
+        confirm_filter=rules[AptMessage_MGMSG_MOD_SET_CHANENABLESTATE].confirm_filter,
+        status_request=rules[AptMessage_MGMSG_MOD_SET_CHANENABLESTATE].status_request,
+    )
+    duration = settle_duration(connection, confirmed=True)
+    assert 0.15 <= duration < 0.2
+
+
+def test_calibrate(k10cr1: tuple[AptConnection, WaveplateThorlabsK10CR1]) -> None:
+    connection, _ = k10cr1
+    rule = connection.settle_policy.rules[AptMessage_MGMSG_MOD_SET_CHANENABLESTATE]
+    calibration = calibrate(
+        connection,
+        [set_enable_state(ChanIdent.CHANNEL_1), set_enable_state(ChanIdent(0))],
+        rule,
+        repetitions=3,
+    )
+    assert len(calibration.samples) == 6
+    # At least the simulated latency of the status reply
+    assert min(calibration.samples) >= 0.01
+    assert calibration.minimum == max(calibration.samples) * 2
+    assert calibration.fixed_rule().confirm is None
+    # Without a rule, messages wait the default delay
+    assert SettlePolicy().rule(set_enable_state(ChanIdent.CHANNEL_1)).delay == 0.2
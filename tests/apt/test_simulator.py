@@ -0,0 +1,551 @@
+import threading
+import time
+from collections.abc import Iterator
+from queue import Empty
+
+import pytest
+from pint import Quantity
+
+from pnpq.apt.connection import AptConnection
+from pnpq.apt.protocol import (
+    Address,
+    AptMessage,
+    AptMessage_MGMSG_HW_GET_INFO,
+    AptMessage_MGMSG_HW_REQ_INFO,
+    AptMessage_MGMSG_MOT_GET_USTATUSUPDATE,
+    AptMessage_MGMSG_MOT_MOVE_ABSOLUTE,
+    AptMessage_MGMSG_MOT_SET_POSCOUNTER,
+    ChanIdent,
+    HomeDirection,
+    JogDirection,
+    LimitSwitch,
+)
+from pnpq.apt.simulator import (
+    MoveKind,
+    SimulatedAptDevice,
+    SimulatedK10CR1,
+    SimulatedKBD101,
+    SimulatedMove,
+    SimulatedMPC220,
+    SimulatedMPC320,
+    SimulatorFaults,
+)
+from pnpq.apt.tracing import RequestTrace
+from pnpq.devices.polarization_controller_thorlabs_mpc import (
+    PolarizationControllerThorlabsMPC220,
+    PolarizationControllerThorlabsMPC320,
+)
+from pnpq.devices.refactored_odl_thorlabs_kbd101 import OpticalDelayLineThorlabsKBD101
+from pnpq.devices.refactored_waveplate_thorlabs_k10cr1 import WaveplateThorlabsK10CR1
+from pnpq.devices.utils import TimeoutException
+from pnpq.errors import OdlMoveOutofRangeError, RequestCancelledError
+from pnpq.transport import PtyTransport, SerialTransport, loopback_transport_pair
+from pnpq.units import K10CR1_STEPS_PER_REVOLUTION, pnpq_ureg
+
+
+def connect(
+    simulator_class: type[SimulatedAptDevice], **kwargs: object
+) -> Iterator[tuple[AptConnection, SimulatedAptDevice]]:
+    host, device = loopback_transport_pair()
+    simulator = simulator_class(transport=device, **kwargs)  # type: ignore[arg-type]
+    simulator.open()
+    connection = AptConnection(transport=host)
+    connection.open()
+    yield connection, simulator
+    connection.close()
+    simulator.close()
+
+
+def k10cr1_steps(degrees: float) -> int:
+    """The position, in steps, that the K10CR1 driver converts an angle
+    to."""
+    return round((degrees * pnpq_ureg.degree).to("k10cr1_step").magnitude)
+
+
+def k10cr1_degrees(steps: int) -> Quantity:
+    """The angle that the K10CR1 driver reports for a position."""
+    return (steps * pnpq_ureg.k10cr1_step).to("degree")
+
+
+@pytest.fixture(name="mpc320")
+def mpc320_fixture() -> Iterator[tuple[AptConnection, SimulatedAptDevice]]:
+    yield from connect(SimulatedMPC320, speedup=10)
+
+
+@pytest.fixture(name="k10cr1")
+def k10cr1_fixture() -> Iterator[tuple[AptConnection, SimulatedAptDevice]]:
+    yield from connect(SimulatedK10CR1, speedup=100)
+
+
+def test_move_profile_constant_velocity() -> None:
+    move = SimulatedMove(
+        kind=MoveKind.ABSOLUTE,
+        start_time=10,
+        start_position=100,
+        target=0,
+        velocity=50,
+        acceleration=None,
+    )
+    assert move.duration == 2
+    assert move.position(10) == 100
+    assert move.position(11) == 50
+    assert move.position(13) == 0
+
+
+def test_move_profile_trapezoidal() -> None:
+    move = SimulatedMove(
+        kind=MoveKind.ABSOLUTE,
+        start_time=0,
+        start_position=0,
+        target=300,
+        velocity=100,
+        acceleration=100,
+    )
+    # 1 s accelerating over 50 steps, 2 s cruising over 200 steps,
+    # 1 s decelerating over 50 steps
+    assert move.duration == pytest.approx(4)
+    assert move.position(1) == pytest.approx(50)
+    assert move.position(2) == pytest.approx(150)
+    assert move.position(3) == pytest.approx(250)
+    assert move.position(4) == 300
+
+
+def test_move_profile_triangular() -> None:
+    move = SimulatedMove(
+        kind=MoveKind.ABSOLUTE,
+        start_time=0,
+        start_position=0,
+        target=100,
+        velocity=1000,
+        acceleration=100,
+    )
+    assert move.duration == pytest.approx(2)
+    assert move.position(1) == pytest.approx(50)
+
+
+def test_mpc320_move_absolute(
+    mpc320: tuple[AptConnection, SimulatedAptDevice],
+) -> None:
+    connection, simulator = mpc320
+    controller = PolarizationControllerThorlabsMPC320(connection=connection)
+    controller.move_absolute(ChanIdent.CHANNEL_2, 85 * pnpq_ureg.degree)
+    assert simulator.position(ChanIdent.CHANNEL_2) == 685
+    assert simulator.position(ChanIdent.CHANNEL_1) == 0
+    status = controller.get_status(ChanIdent.CHANNEL_2)
+    assert status.position == 685
+    assert not status.status.ENABLED
+    assert not status.status.ACTIVE
+
+
+def test_mpc320_home_and_jog(
+    mpc320: tuple[AptConnection, SimulatedAptDevice],
+) -> None:
+    connection, simulator = mpc320
+    controller = PolarizationControllerThorlabsMPC320(connection=connection)
+    controller.set_params(home_position=0 * pnpq_ureg.mpc320_step)
+    controller.home(ChanIdent.CHANNEL_1)
+    assert controller.get_status(ChanIdent.CHANNEL_1).status.HOMED
+    controller.jog(ChanIdent.CHANNEL_1, JogDirection.FORWARD)
+    controller.jog(ChanIdent.CHANNEL_1, JogDirection.FORWARD)
+    assert simulator.position(ChanIdent.CHANNEL_1) == 50
+    controller.jog(ChanIdent.CHANNEL_1, JogDirection.REVERSE)
+    assert simulator.position(ChanIdent.CHANNEL_1) == 25
+
+
+def test_mpc320_params(mpc320: tuple[AptConnection, SimulatedAptDevice]) -> None:
+    connection, _ = mpc320
+    controller = PolarizationControllerThorlabsMPC320(connection=connection)
+    controller.set_params(
+        velocity=100 * pnpq_ureg.mpc320_velocity,
+        jog_step_3=40 * pnpq_ureg.mpc320_step,
+    )
+    params = controller.get_params()
+    assert params["velocity"] == 100 * pnpq_ureg.mpc320_velocity
+    assert params["jog_step_3"] == 40 * pnpq_ureg.mpc320_step
+    assert params["jog_step_1"] == 25 * pnpq_ureg.mpc320_step
+
+
+def test_k10cr1_move_absolute(
+    k10cr1: tuple[AptConnection, SimulatedAptDevice],
+) -> None:
+    connection, simulator = k10cr1
+    controller = WaveplateThorlabsK10CR1(connection=connection)
+    controller.move_absolute(45 * pnpq_ureg.degree)
+    assert simulator.position(ChanIdent.CHANNEL_1) == K10CR1_STEPS_PER_REVOLUTION // 8
+    controller.move_absolute(10 * pnpq_ureg.degree)
+    assert simulator.position(ChanIdent.CHANNEL_1) == k10cr1_steps(10)
+
+
+def test_k10cr1_shortest_moves(
+    k10cr1: tuple[AptConnection, SimulatedAptDevice],
+) -> None:
+    connection, simulator = k10cr1
+    traces: list[RequestTrace] = []
+    object.__setattr__(connection, "trace_exporter", traces.append)
+    controller = WaveplateThorlabsK10CR1(connection=connection)
+    controller.move_absolute(350 * pnpq_ureg.degree, shortest_path=False)
+    turn = 360 * pnpq_ureg.degree
+    revolution = K10CR1_STEPS_PER_REVOLUTION
+
+    def sent(count: int) -> list[tuple[str, int]]:
+        """The moves and position counter resets sent, waiting for
+        ``count`` of them, as messages that get no reply are sent in
+        the background."""
+        deadline = time.monotonic() + 5
+        while True:
+            messages = []
+            for trace in traces.copy():
+                if isinstance(trace.message, AptMessage_MGMSG_MOT_MOVE_ABSOLUTE):
+                    messages.append(("move", trace.message.absolute_distance))
+                elif isinstance(trace.message, AptMessage_MGMSG_MOT_SET_POSCOUNTER):
+                    messages.append(("counter", trace.message.position))
+            if len(messages) >= count:
+                traces.clear()
+                return messages
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+    sent(1)
+    # Forward through 360 degrees, then back to the first turn
+    controller.move_absolute(10 * pnpq_ureg.degree, period=turn)
+    assert sent(2) == [
+        ("move", revolution + k10cr1_steps(10)),
+        ("counter", k10cr1_steps(10)),
+    ]
+    # A half-wave plate at 10 degrees is 15 degrees from 175 degrees
+    controller.move_absolute(175 * pnpq_ureg.degree, period=turn / 2)
+    half_wave = k10cr1_steps(175) - revolution // 2
+    assert sent(2) == [("move", half_wave), ("counter", revolution + half_wave)]
+    assert simulator.position(ChanIdent.CHANNEL_1) == revolution + half_wave
+    # Already there
+    controller.move_absolute(175 * pnpq_ureg.degree, period=turn / 2)
+    assert controller.get_status().position == revolution + half_wave
+    assert not sent(0)
+    # Across the wrap, to the angle as far behind zero as the start
+    # is ahead of it
+    controller.move_absolute(0.01 * pnpq_ureg.degree)
+    assert sent(2)[1] == ("counter", k10cr1_steps(0.01))
+    controller.move_absolute(359.99 * pnpq_ureg.degree)
+    assert sent(2) == [
+        ("move", -k10cr1_steps(0.01)),
+        ("counter", revolution - k10cr1_steps(0.01)),
+    ]
+
+
+def test_k10cr1_repeated_wraps(
+    k10cr1: tuple[AptConnection, SimulatedAptDevice],
+) -> None:
+    connection, simulator = k10cr1
+    controller = WaveplateThorlabsK10CR1(connection=connection)
+    # How far each reset moved the position counter away from the
+    # position the mount actually turned to
+    offsets: list[float] = []
+    handle_message = simulator.handle_message
+
+    def record_counter_resets(message: AptMessage) -> None:
+        if isinstance(message, AptMessage_MGMSG_MOT_SET_POSCOUNTER):
+            offsets.append(
+                simulator.channels[message.chan_ident].position - message.position
+            )
+        handle_message(message)
+
+    object.__setattr__(simulator, "handle_message", record_counter_resets)
+    sweeps = 20
+    for _ in range(sweeps):
+        for angle in (120, 240, 0):
+            controller.move_absolute(angle * pnpq_ureg.degree)
+    # Each sweep turned the mount forward once, and every reset took
+    # off exactly one revolution, so the counter still matches the
+    # angle of the mount
+    deadline = time.monotonic() + 5
+    while len(offsets) < sweeps:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert offsets == [K10CR1_STEPS_PER_REVOLUTION] * sweeps
+    assert simulator.position(ChanIdent.CHANNEL_1) == 0
+
+
+def test_k10cr1_sends_status_updates(
+    k10cr1: tuple[AptConnection, SimulatedAptDevice],
+) -> None:
+    connection, _ = k10cr1
+    with connection.rx_subscribe() as queue:
+        # The driver starts status updates on initialization
+        WaveplateThorlabsK10CR1(connection=connection)
+        while True:
+            message = queue.get(timeout=5)
+            if isinstance(message, AptMessage_MGMSG_MOT_GET_USTATUSUPDATE):
+                break
+    assert message.chan_ident == ChanIdent.CHANNEL_1
+
+
+def test_k10cr1_operations(
+    k10cr1: tuple[AptConnection, SimulatedAptDevice],
+) -> None:
+    connection, simulator = k10cr1
+    controller = WaveplateThorlabsK10CR1(connection=connection)
+    controller.identify()
+    controller.move_absolute(20 * pnpq_ureg.degree)
+    controller.move_relative(-30 * pnpq_ureg.degree)
+    position = k10cr1_steps(20) + k10cr1_steps(-30)
+    assert simulator.position(ChanIdent.CHANNEL_1) == position
+    controller.jog(JogDirection.FORWARD)
+    position += k10cr1_steps(5)
+    assert simulator.position(ChanIdent.CHANNEL_1) == position
+    # Taken from the status that followed the jog
+    assert controller.last_status is not None
+    assert controller.get_position() == k10cr1_degrees(position)
+    controller.home()
+    assert simulator.position(ChanIdent.CHANNEL_1) == 0
+
+    controller.set_home_params(
+        home_direction=HomeDirection.FORWARD,
+        home_velocity=20 * pnpq_ureg("degree / second"),
+    )
+    params = controller.get_home_params()
+    assert params["home_direction"] == HomeDirection.FORWARD
+    assert params["limit_switch"] == LimitSwitch.HARDWARE_REVERSE
+    assert params["home_velocity"].magnitude == 0x08BCAAA4
+    assert params["offset_distance"].magnitude == 0
+
+
+def test_k10cr1_position_without_recent_status(
+    k10cr1: tuple[AptConnection, SimulatedAptDevice],
+) -> None:
+    connection, _ = k10cr1
+    controller = WaveplateThorlabsK10CR1(connection=connection, status_max_age=0)
+    controller.move_absolute(30 * pnpq_ureg.degree)
+    assert controller.get_position() == k10cr1_degrees(k10cr1_steps(30))
+
+
+def test_k10cr1_stopped_move_disables_channel() -> None:
+    devices = connect(SimulatedK10CR1, faults=SimulatorFaults(stall_moves=True))
+    connection, _ = next(devices)
+    controller = WaveplateThorlabsK10CR1(connection=connection)
+    errors: list[Exception] = []
+
+    def move() -> None:
+        try:
+            controller.move_absolute(90 * pnpq_ureg.degree, shortest_path=False)
+        except RequestCancelledError as e:
+            errors.append(e)
+
+    move_thread = threading.Thread(target=move)
+    move_thread.start()
+    deadline = time.monotonic() + 5
+    while not (
+        (in_flight := connection.tx_ordered_sender_in_flight) is not None
+        and isinstance(in_flight.message, AptMessage_MGMSG_MOT_MOVE_ABSOLUTE)
+    ):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    controller.stop()
+    move_thread.join(timeout=5)
+    assert len(errors) == 1
+    # The channel is disabled after a move that did not complete, too
+    assert not controller.get_status().status.ENABLED
+    next(devices, None)
+
+
+@pytest.fixture(name="kbd101")
+def kbd101_fixture() -> Iterator[tuple[AptConnection, SimulatedAptDevice]]:
+    yield from connect(SimulatedKBD101, speedup=10)
+
+
+def test_kbd101_moves(kbd101: tuple[AptConnection, SimulatedAptDevice]) -> None:
+    connection, simulator = kbd101
+    controller = OpticalDelayLineThorlabsKBD101(connection=connection)
+    controller.identify()
+    start = time.perf_counter()
+    controller.move_absolute(50 * pnpq_ureg.millimeter)
+    # 50 mm at 100 mm/s, sped up 10 times, rather than a second or
+    # more of polling
+    assert time.perf_counter() - start < 0.5
+    assert simulator.position(ChanIdent.CHANNEL_1) == 100000
+    controller.move_relative(-10 * pnpq_ureg.picosecond)
+    assert simulator.position(ChanIdent.CHANNEL_1) == 100000 - 2998
+    assert controller.get_position().to("picosecond").magnitude == pytest.approx(
+        323.56, abs=0.01
+    )
+    with pytest.raises(OdlMoveOutofRangeError):
+        controller.move_relative(60 * pnpq_ureg.millimeter)
+    with pytest.raises(OdlMoveOutofRangeError):
+        controller.move_absolute(-1 * pnpq_ureg.millimeter)
+    controller.home()
+    assert controller.get_position() == 0 * pnpq_ureg.millimeter
+
+
+def test_kbd101_motion_timeout() -> None:
+    devices = connect(SimulatedKBD101, faults=SimulatorFaults(stall_moves=True))
+    connection, _ = next(devices)
+    controller = OpticalDelayLineThorlabsKBD101(
+        connection=connection, motion_timeout=0.5
+    )
+    start = time.perf_counter()
+    with pytest.raises(TimeoutException):
+        controller.move_absolute(50 * pnpq_ureg.millimeter)
+    # The move is given motion_timeout rather than the default
+    # REPLY_TIMEOUT
+    assert 0.5 <= time.perf_counter() - start < 2
+    next(devices, None)
+
+
+def test_mpc220_over_pty() -> None:
+    transport = PtyTransport()
+    simulator = SimulatedMPC220(transport=transport, speedup=10)
+    simulator.open()
+    connection = AptConnection(
+        transport=SerialTransport(port=transport.peer_path, startup_delay=0)
+    )
+    connection.open()
+    controller = PolarizationControllerThorlabsMPC220(connection=connection)
+    controller.move_absolute(ChanIdent.CHANNEL_1, 1000 * pnpq_ureg.mpc320_step)
+    assert simulator.position(ChanIdent.CHANNEL_1) == 1000
+    connection.close()
+    simulator.close()
+
+
+def request_info(connection: AptConnection) -> AptMessage:
+    return connection.send_message_expect_reply(
+        AptMessage_MGMSG_HW_REQ_INFO(
+            destination=Address.GENERIC_USB,
+            source=Address.HOST_CONTROLLER,
+        ),
+        lambda message: isinstance(message, AptMessage_MGMSG_HW_GET_INFO),
+    )
+
+
+def test_many_devices() -> None:
+    connections = [
+        connect(SimulatedMPC320, serial_number=serial_number)
+        for serial_number in range(8)
+    ]
+    for serial_number, devices in enumerate(connections):
+        connection, _ = next(devices)
+        info = request_info(connection)
+        assert isinstance(info, AptMessage_MGMSG_HW_GET_INFO)
+        assert info.serial_number == serial_number
+        assert info.model_number == "MPC320"
+        assert info.number_of_channels == 3
+    for devices in connections:
+        next(devices, None)
+
+
+def test_fault_injection() -> None:
+    devices = connect(
+        SimulatedMPC320,
+        faults=SimulatorFaults(
+            latency=0.05,
+            latency_jitter=0.05,
+            duplicate_probability=0.5,
+            unknown_message_probability=0.5,
+            seed=1,
+        ),
+    )
+    connection, simulator = next(devices)
+    for _ in range(5):
+        assert isinstance(request_info(connection), AptMessage_MGMSG_HW_GET_INFO)
+
+    simulator.set_faults(SimulatorFaults(drop_probability=1))
+    with connection.rx_subscribe() as queue:
+        connection.send_message_unordered(
+            AptMessage_MGMSG_HW_REQ_INFO(
+                destination=Address.GENERIC_USB,
+                source=Address.HOST_CONTROLLER,
+            )
+        )
+        with pytest.raises(Empty):
+            queue.get(timeout=0.5)
+    next(devices, None)
+
+
+def test_stalled_move() -> None:
+    devices = connect(SimulatedMPC320, faults=SimulatorFaults(stall_moves=True))
+    connection, simulator = next(devices)
+    controller = PolarizationControllerThorlabsMPC320(connection=connection)
+    controller.set_channel_enabled(ChanIdent.CHANNEL_1, True)
+    connection.send_message_no_reply(
+        AptMessage_MGMSG_MOT_MOVE_ABSOLUTE(
+            chan_ident=ChanIdent.CHANNEL_1,
+            absolute_distance=500,
+            destination=Address.GENERIC_USB,
+            source=Address.HOST_CONTROLLER,
+        )
+    )
+    time.sleep(0.5)
+    status = controller.get_status(ChanIdent.CHANNEL_1)
+    assert status.status.ACTIVE
+    assert status.position == 0
+    assert simulator.position(ChanIdent.CHANNEL_1) == 0
+    next(devices, None)
+
+
+def test_stop_cancels_move() -> None:
+    devices = connect(SimulatedMPC320, faults=SimulatorFaults(stall_moves=True))
+    connection, _ = next(devices)
+    controller = PolarizationControllerThorlabsMPC320(connection=connection)
+    errors: list[Exception] = []
+
+    def move() -> None:
+        try:
+            controller.move_absolute(ChanIdent.CHANNEL_1, 100 * pnpq_ureg.degree)
+        except RequestCancelledError as e:
+            errors.append(e)
+
+    move_thread = threading.Thread(target=move)
+    move_thread.start()
+    deadline = time.monotonic() + 5
+    while not (
+        (in_flight := connection.tx_ordered_sender_in_flight) is not None
+        and isinstance(in_flight.message, AptMessage_MGMSG_MOT_MOVE_ABSOLUTE)
+    ):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    start = time.perf_counter()
+    controller.stop(ChanIdent.CHANNEL_1)
+    move_thread.join(timeout=5)
+    # The stalled move would otherwise wait for its reply for 10 seconds
+    assert time.perf_counter() - start < 1
+    assert len(errors) == 1
+    assert not controller.get_status(ChanIdent.CHANNEL_1).status.ACTIVE
+    next(devices, None)
+
+
+def test_identical_moves_are_coalesced() -> None:
+    devices = connect(SimulatedMPC320, faults=SimulatorFaults(stall_moves=True))
+    connection, _ = next(devices)
+    controller = PolarizationControllerThorlabsMPC320(connection=connection)
+    errors: list[Exception] = []
+
+    def move() -> None:
+        try:
+            controller.move_absolute(ChanIdent.CHANNEL_1, 100 * pnpq_ureg.degree)
+        except RequestCancelledError as e:
+            errors.append(e)
+
+    move_threads = [threading.Thread(target=move) for _ in range(2)]
+    move_threads[0].start()
+    deadline = time.monotonic() + 5
+    while not (
+        (in_flight := connection.tx_ordered_sender_in_flight) is not None
+        and isinstance(in_flight.message, AptMessage_MGMSG_MOT_MOVE_ABSOLUTE)
+    ):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    move_threads[1].start()
+    time.sleep(0.1)
+
+    # Only one move was sent, and stopping it releases both callers
+    controller.stop(ChanIdent.CHANNEL_1)
+    for move_thread in move_threads:
+        move_thread.join(timeout=5)
+    assert len(errors) == 2
+    assert connection.metrics.snapshot()["pnpq_device_coalesced_operations_total"] == {
+        (
+            ("connection", connection.label),
+            ("device", "PolarizationControllerThorlabsMPC320"),
+            ("operation", "move_absolute"),
+        ): 1
+    }
+    next(devices, None)
@@ -0,0 +1,206 @@
+import threading
+from queue import Empty
+
+import pytest
+
+from pnpq.apt.connection import AptConnection
+from pnpq.apt.protocol import (
+    Address,
+    AptMessage,
+    AptMessage_MGMSG_MOT_GET_USTATUSUPDATE,
+    AptMessage_MGMSG_MOT_MOVE_HOMED,
+    ChanIdent,
+    UStatus,
+)
+from pnpq.apt.subscription import MessageFilter, OverflowPolicy, SubscriberQueue
+from pnpq.metrics import MetricsRegistry
+from pnpq.transport import loopback_transport_pair
+from pnpq.units import pnpq_ureg
+
+
+def status(chan_ident: ChanIdent, position: int) -> AptMessage:
+    return AptMessage_MGMSG_MOT_GET_USTATUSUPDATE(
+        chan_ident=chan_ident,
+        position=position,
+        velocity=0,
+        motor_current=0 * pnpq_ureg.milliamp,
+        status=UStatus(CONNECTED=True, ENABLED=True),
+        destination=Address.HOST_CONTROLLER,
+        source=Address.GENERIC_USB,
+    )
+
+
+def positions(queue: SubscriberQueue) -> list[tuple[ChanIdent, int]]:
+    items: list[tuple[ChanIdent, int]] = []
+    while True:
+        try:
+            message = queue.get_nowait()
+        except Empty:
+            return items
+        assert isinstance(message, AptMessage_MGMSG_MOT_GET_USTATUSUPDATE)
+        items.append((message.chan_ident, message.position))
+
+
+def test_requires_capacity() -> None:
+    with pytest.raises(ValueError):
+        SubscriberQueue(maxsize=0)
+
+
+def test_subscribe_requires_capacity() -> None:
+    host, _ = loopback_transport_pair()
+    connection = AptConnection(transport=host)
+    connection.open()
+    try:
+        # Not replaced by the connection's default
+        with pytest.raises(ValueError), connection.rx_subscribe(maxsize=0):
+            pass
+    finally:
+        connection.close()
+
+
+def test_drop_oldest() -> None:
+    queue = SubscriberQueue(maxsize=2, policy=OverflowPolicy.DROP_OLDEST)
+    assert [queue.offer(status(ChanIdent.CHANNEL_1, i)) for i in range(4)] == [
+        False,
+        False,
+        True,
+        True,
+    ]
+    assert queue.dropped == 2
+    assert positions(queue) == [(ChanIdent.CHANNEL_1, 2), (ChanIdent.CHANNEL_1, 3)]
+
+
+def test_drop_newest() -> None:
+    queue = SubscriberQueue(maxsize=2, policy=OverflowPolicy.DROP_NEWEST)
+    for i in range(4):
+        queue.offer(status(ChanIdent.CHANNEL_1, i))
+    assert queue.dropped == 2
+    assert positions(queue) == [(ChanIdent.CHANNEL_1, 0), (ChanIdent.CHANNEL_1, 1)]
+
+
+def test_keep_latest() -> None:
+    queue = SubscriberQueue(maxsize=3, policy=OverflowPolicy.KEEP_LATEST)
+    queue.offer(status(ChanIdent.CHANNEL_1, 0))
+    queue.offer(status(ChanIdent.CHANNEL_2, 0))
+    homed = AptMessage_MGMSG_MOT_MOVE_HOMED(
+        chan_ident=ChanIdent.CHANNEL_1,
+        destination=Address.HOST_CONTROLLER,
+        source=Address.GENERIC_USB,
+    )
+    queue.offer(homed)
+    for i in range(1, 4):
+        queue.offer(status(ChanIdent.CHANNEL_2, i))
+    # Only earlier updates of channel 2 were discarded
+    assert queue.dropped == 3
+    assert queue.get_nowait() == status(ChanIdent.CHANNEL_1, 0)
+    assert queue.get_nowait() == homed
+    assert positions(queue) == [(ChanIdent.CHANNEL_2, 3)]
+
+    # With no queued message of the same key, the oldest is discarded
+    queue.offer(status(ChanIdent.CHANNEL_1, 1))
+    queue.offer(homed)
+    queue.offer(status(ChanIdent.CHANNEL_2, 4))
+    queue.offer(status(ChanIdent.CHANNEL_3, 0))
+    assert queue.dropped == 4
+    assert queue.get_nowait() == homed
+
+
+def test_block_waits_for_room() -> None:
+    queue = SubscriberQueue(maxsize=1, policy=OverflowPolicy.BLOCK)
+    queue.offer(status(ChanIdent.CHANNEL_1, 0))
+    offered = threading.Event()
+
+    def offer() -> None:
+        queue.offer(status(ChanIdent.CHANNEL_1, 1))
+        offered.set()
+
+    thread = threading.Thread(target=offer)
+    thread.start()
+    assert not offered.wait(0.1)
+    assert positions(queue) == [(ChanIdent.CHANNEL_1, 0)]
+    thread.join(timeout=5)
+    assert offered.is_set()
+    assert queue.dropped == 0
+    assert positions(queue) == [(ChanIdent.CHANNEL_1, 1)]
+
+
+def test_close_releases_blocked_offer() -> None:
+    queue = SubscriberQueue(maxsize=1, policy=OverflowPolicy.BLOCK)
+    queue.offer(status(ChanIdent.CHANNEL_1, 0))
+    thread = threading.Thread(
+        target=queue.offer, args=(status(ChanIdent.CHANNEL_1, 1),)
+    )
+    thread.start()
+    queue.close()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert positions(queue) == [(ChanIdent.CHANNEL_1, 0)]
+
+
+def test_stalled_subscriber_is_bounded() -> None:
+    host, device = loopback_transport_pair()
+    metrics = MetricsRegistry()
+    connection = AptConnection(
+        transport=host, metrics=metrics, name="test", rx_subscriber_queue_size=10
+    )
+    connection.open()
+    try:
+        with (
+            connection.rx_subscribe() as stalled,
+            connection.rx_subscribe(
+                maxsize=100, overflow_policy=OverflowPolicy.DROP_NEWEST
+            ) as other,
+        ):
+            for i in range(50):
+                device.write(status(ChanIdent.CHANNEL_1, i).to_bytes())
+            # Every message reaches the subscriber with room for it
+            assert [other.get(timeout=5) for _ in range(50)][-1] == status(
+                ChanIdent.CHANNEL_1, 49
+            )
+            assert stalled.qsize() == 10
+            assert stalled.dropped == 40
+            assert positions(stalled)[0] == (ChanIdent.CHANNEL_1, 40)
+    finally:
+        connection.close()
+    assert metrics.snapshot()["pnpq_apt_rx_subscriber_dropped_total"] == {
+        (("connection", "test"), ("policy", "drop_oldest")): 40
+    }
+
+
+def test_message_filter() -> None:
+    homed = AptMessage_MGMSG_MOT_MOVE_HOMED(
+        chan_ident=ChanIdent.CHANNEL_2,
+        destination=Address.HOST_CONTROLLER,
+        source=Address.GENERIC_USB,
+    )
+    assert MessageFilter().matches(homed)
+    assert MessageFilter(message_types={AptMessage_MGMSG_MOT_MOVE_HOMED}).matches(homed)
+    assert not MessageFilter(
+        message_types={AptMessage_MGMSG_MOT_GET_USTATUSUPDATE}
+    ).matches(homed)
+    assert MessageFilter(
+        chan_idents={ChanIdent.CHANNEL_1, ChanIdent.CHANNEL_2},
+        sources={Address.GENERIC_USB},
+    ).matches(homed)
+    assert not MessageFilter(chan_idents={ChanIdent.CHANNEL_1}).matches(homed)
+    assert not MessageFilter(sources={Address.BAY_0}).matches(homed)
+
+
+def test_filtered_subscriber() -> None:
+    host, device = loopback_transport_pair()
+    connection = AptConnection(transport=host)
+    connection.open()
+    try:
+        with (
+            connection.rx_subscribe() as everything,
+            connection.rx_subscribe(
+                message_filter=MessageFilter(chan_idents={ChanIdent.CHANNEL_2})
+            ) as channel_2,
+        ):
+            for i in range(10):
+                device.write(status(ChanIdent.CHANNEL_1, i).to_bytes())
+                device.write(status(ChanIdent.CHANNEL_2, i).to_bytes())
+            assert len([everything.get(timeout=5) for _ in range(20)]) == 20
+            assert positions(channel_2) == [(ChanIdent.CHANNEL_2, i) for i in range(10)]
+    finally:
+        connection.close()
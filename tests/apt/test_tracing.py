@@ -0,0 +1,121 @@
+import itertools
+import time
+from collections.abc import Callable, Iterator
+
+import pytest
+
+from pnpq.apt.connection import AptConnection
+from pnpq.apt.protocol import (
+    Address,
+    AptMessage_MGMSG_HW_GET_INFO,
+    AptMessage_MGMSG_HW_REQ_INFO,
+    AptMessage_MGMSG_MOD_IDENTIFY,
+    AptMessage_MGMSG_MOT_GET_USTATUSUPDATE,
+    AptMessage_MGMSG_MOT_MOVE_ABSOLUTE,
+    ChanIdent,
+)
+from pnpq.apt.simulator import SimulatedMPC320
+from pnpq.apt.tracing import RequestTrace, log_trace
+from pnpq.devices.polarization_controller_thorlabs_mpc import (
+    PolarizationControllerThorlabsMPC320,
+)
+from pnpq.transport import loopback_transport_pair
+from pnpq.units import pnpq_ureg
+
+REQ_INFO = AptMessage_MGMSG_HW_REQ_INFO(
+    destination=Address.GENERIC_USB,
+    source=Address.HOST_CONTROLLER,
+)
+
+
+def is_info(message: object) -> bool:
+    return isinstance(message, AptMessage_MGMSG_HW_GET_INFO)
+
+
+def connect(
+    trace_exporter: None | Callable[[RequestTrace], None],
+) -> Iterator[AptConnection]:
+    host, device = loopback_transport_pair()
+    simulator = SimulatedMPC320(transport=device, speedup=10)
+    simulator.open()
+    connection = AptConnection(transport=host, trace_exporter=trace_exporter)
+    connection.open()
+    yield connection
+    connection.close()
+    simulator.close()
+
+
+@pytest.fixture(name="traces")
+def traces_fixture() -> Iterator[tuple[AptConnection, list[RequestTrace]]]:
+    traces: list[RequestTrace] = []
+    yield from ((connection, traces) for connection in connect(traces.append))
+
+
+def span_names(trace: RequestTrace) -> list[str]:
+    return [name for name, _, _ in trace.spans()]
+
+
+def assert_contiguous(trace: RequestTrace) -> None:
+    spans = trace.spans()
+    assert spans[0][1] == trace.queued
+    for (_, start, end), (_, next_start, _) in itertools.pairwise(spans):
+        assert start <= end == next_start
+
+
+def test_traced_request() -> None:
+    for connection in connect(None):
+        before = time.time()
+        reply, trace = connection.send_message_expect_reply_traced(REQ_INFO, is_info)
+        after = time.time()
+    assert trace.reply is reply
+    assert isinstance(reply, AptMessage_MGMSG_HW_GET_INFO)
+    assert trace.message is REQ_INFO
+    assert span_names(trace) == ["queue", "lock", "write", "reply"]
+    assert_contiguous(trace)
+    assert trace.replied is not None
+    assert (
+        before
+        <= trace.to_wall_time(trace.queued)
+        <= trace.to_wall_time(trace.replied)
+        <= after + 0.001
+    )
+
+
+def test_trace_exporter(traces: tuple[AptConnection, list[RequestTrace]]) -> None:
+    connection, exported = traces
+    controller = PolarizationControllerThorlabsMPC320(connection=connection)
+    controller.identify(ChanIdent.CHANNEL_1)
+    controller.move_absolute(ChanIdent.CHANNEL_1, 100 * pnpq_ureg.degree)
+
+    identify = next(
+        trace
+        for trace in exported
+        if isinstance(trace.message, AptMessage_MGMSG_MOD_IDENTIFY)
+    )
+    assert not identify.expects_reply
+    assert span_names(identify) == ["queue", "lock", "write", "settle"]
+
+    # The move is confirmed by a status update at the target
+    # position, after updates from earlier in the move
+    move = next(
+        trace
+        for trace in exported
+        if isinstance(trace.message, AptMessage_MGMSG_MOT_MOVE_ABSOLUTE)
+    )
+    assert isinstance(move.reply, AptMessage_MGMSG_MOT_GET_USTATUSUPDATE)
+    assert span_names(move) == ["queue", "lock", "write", "device", "confirmation"]
+    assert_contiguous(move)
+
+
+def test_trace_exporter_errors_are_contained() -> None:
+    def fail(trace: RequestTrace) -> None:
+        raise RuntimeError(f"Cannot export {trace}")
+
+    for connection in connect(fail):
+        for _ in range(2):
+            assert is_info(connection.send_message_expect_reply(REQ_INFO, is_info))
+
+
+def test_log_trace() -> None:
+    for connection in connect(log_trace):
+        assert is_info(connection.send_message_expect_reply(REQ_INFO, is_info))
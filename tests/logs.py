@@ -2,7 +2,7 @@ import logging
 from logging.handlers import RotatingFileHandler
 from pathlib import Path
 
-import structlog
+from pnpq.logs import StatusEventSampler, setup_logging
 
 
 def find_project_dir(path: Path) -> Path:
@@ -17,14 +17,6 @@ def setup_log(log_file_name: str) -> None:
     target_dir = find_project_dir(Path(__file__).resolve()).joinpath("target")
     target_dir.mkdir(exist_ok=True)
 
-    structlog.configure(
-        processors=[
-            structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
-        ],
-        logger_factory=structlog.stdlib.LoggerFactory(),
-        cache_logger_on_first_use=True,
-    )
-
     # Rotate the log file every 100MB and keep 3 backups
     handler = RotatingFileHandler(
         target_dir.joinpath(f"{log_file_name}.log"),
@@ -32,17 +24,4 @@ def setup_log(log_file_name: str) -> None:
         backupCount=3,
     )
 
-    formatter = structlog.stdlib.ProcessorFormatter(
-        processors=[
-            structlog.processors.add_log_level,
-            structlog.processors.StackInfoRenderer(),
-            structlog.dev.set_exc_info,
-            structlog.processors.dict_tracebacks,
-            structlog.processors.TimeStamper(fmt="iso", utc=True),
-            structlog.stdlib.ProcessorFormatter.remove_processors_meta,
-            structlog.processors.JSONRenderer(),
-        ]
-    )
-    handler.setFormatter(formatter)
-
-    logging.basicConfig(handlers=[handler], level=logging.DEBUG)
+    setup_logging(handler, level=logging.DEBUG, sampler=StatusEventSampler())
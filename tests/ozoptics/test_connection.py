@@ -0,0 +1,144 @@
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+
+import pytest
+
+from pnpq.errors import OdlCommandUnknownError
+from pnpq.ozoptics.connection import OzOpticsConnection, ResponseParser
+from pnpq.transport import LoopbackTransport, loopback_transport_pair
+
+
+@pytest.fixture(name="connection")
+def connection_fixture() -> Iterator[tuple[OzOpticsConnection, LoopbackTransport]]:
+    transport, peer = loopback_transport_pair()
+    connection = OzOpticsConnection(transport=transport, timeout=5)
+    connection.open()
+    yield connection, peer
+    connection.close()
+
+
+def read_line(peer: LoopbackTransport) -> bytes:
+    line = b""
+    while not line.endswith(b"\r\n"):
+        line += peer.read(1)
+    return line
+
+
+def read_unsolicited(connection: OzOpticsConnection, size: int) -> bytes:
+    # Unsolicited output may be delivered in several parts
+    data = b""
+    while len(data) < size:
+        data += connection.read_unsolicited(5)
+    return data
+
+
+def test_parser_responses_split_across_reads() -> None:
+    parser = ResponseParser()
+    assert not parser.feed(b"Pos:12\r\nDo")
+    assert parser.feed(b"ne\r") == [b"Pos:12\r\nDone"]
+    assert parser.feed(b"\nDoneUNKNOWN\r\nDone\r\n") == [
+        b"Done",
+        b"UNKNOWN\r\nDone",
+    ]
+    assert parser.take_partial() == b""
+
+
+def test_parser_take_partial() -> None:
+    parser = ResponseParser()
+    assert parser.feed(b"Done\r\nOZ Optics Ltd") == [b"Done"]
+    assert parser.take_partial() == b"OZ Optics Ltd"
+    assert parser.feed(b"Done") == [b"Done"]
+
+
+def test_responses_in_command_order(
+    connection: tuple[OzOpticsConnection, LoopbackTransport],
+) -> None:
+    ozoptics_connection, peer = connection
+    move = ozoptics_connection.send("S1000")
+    position = ozoptics_connection.send("S?")
+    assert read_line(peer) == b"S1000\r\n"
+    assert read_line(peer) == b"S?\r\n"
+    assert not move.done()
+
+    peer.write(b"Done\r\nPos:1000\r\nDone\r\n")
+    assert move.result(5).text == "Done"
+    assert move.result(5).command == "S1000"
+    assert position.result(5).text == "Pos:1000\r\nDone"
+
+
+def test_unknown_response(
+    connection: tuple[OzOpticsConnection, LoopbackTransport],
+) -> None:
+    ozoptics_connection, peer = connection
+    position = ozoptics_connection.send("S?")
+    version = ozoptics_connection.send("V2")
+    peer.write(b"UNKNOWN\r\nDone\r\n\r\n12345\r\nDone\r\n")
+    with pytest.raises(OdlCommandUnknownError):
+        position.result(5)
+    # The responses after it still go to their own commands
+    assert version.result(5).text == "\r\n12345\r\nDone"
+
+
+def test_unsolicited_output_is_kept(
+    connection: tuple[OzOpticsConnection, LoopbackTransport],
+) -> None:
+    ozoptics_connection, peer = connection
+    peer.write(b"OZ Optics Ltd\r\n")
+    assert read_unsolicited(ozoptics_connection, 15) == b"OZ Optics Ltd\r\n"
+    assert ozoptics_connection.read_unsolicited(0) == b""
+
+    # Output that arrives before a command was written is not taken
+    # as part of its response
+    peer.write(b"Ready")
+    assert read_unsolicited(ozoptics_connection, 5) == b"Ready"
+    position = ozoptics_connection.send("S?")
+    peer.write(b"Pos:0\r\nDone\r\n")
+    assert position.result(5).text == "Pos:0\r\nDone"
+
+
+def test_command_timeout(
+    connection: tuple[OzOpticsConnection, LoopbackTransport],
+) -> None:
+    ozoptics_connection, _ = connection
+    with pytest.raises(TimeoutError):
+        ozoptics_connection.command("S?", timeout=0.1)
+
+
+def test_close_fails_pending_commands() -> None:
+    transport, _ = loopback_transport_pair()
+    connection = OzOpticsConnection(transport=transport)
+    connection.open()
+    position = connection.send("S?")
+    connection.close()
+    with pytest.raises(ConnectionError):
+        position.result(5)
+
+
+@dataclass(frozen=True, kw_only=True)
+class FailingWriteTransport(LoopbackTransport):
+    """Fails the first ``failures`` writes."""
+
+    failures: list[int] = field(default_factory=lambda: [1])
+
+    def write(self, data: bytes) -> None:
+        if self.failures[0] > 0:
+            self.failures[0] -= 1
+            raise OSError("Write failed.")
+        super().write(data)
+
+
+def test_failed_write_is_not_pending() -> None:
+    transport = FailingWriteTransport()
+    peer = LoopbackTransport()
+    object.__setattr__(transport, "peer", peer)
+    object.__setattr__(peer, "peer", transport)
+    connection = OzOpticsConnection(transport=transport, timeout=5)
+    connection.open()
+    with pytest.raises(OSError):
+        connection.send("V2")
+    position = connection.send("d?")
+    assert read_line(peer) == b"d?\r\n"
+    peer.write(b"Pos:12\r\nDone\r\n")
+    # The response goes to the command that was written
+    assert position.result(5).text == "Pos:12\r\nDone"
+    connection.close()
@@ -0,0 +1,99 @@
+import time
+from collections.abc import Iterator
+
+import pytest
+
+from pnpq.devices.odl_ozoptics_650ml import OdlOzOptics
+from pnpq.errors import OdlCommandUnknownError, OdlGetPosNotCompleted
+from pnpq.ozoptics.simulator import SimulatedOdlOzOptics
+from pnpq.transport import PtyTransport, SerialTransport
+
+SPEEDUP = 100
+
+
+@pytest.fixture(name="odl")
+def odl_fixture() -> Iterator[tuple[OdlOzOptics, SimulatedOdlOzOptics]]:
+    pty = PtyTransport()
+    simulator = SimulatedOdlOzOptics(
+        transport=pty, initial_position=100000, speedup=SPEEDUP, baudrate=None
+    )
+    simulator.open()
+    odl = OdlOzOptics(
+        transport=SerialTransport(
+            port=pty.peer_path, baudrate=9600, rtscts=False, startup_delay=0
+        )
+    )
+    yield odl, simulator
+    odl.serial_close()
+    simulator.close()
+
+
+def test_device_information(odl: tuple[OdlOzOptics, SimulatedOdlOzOptics]) -> None:
+    ozoptics, _ = odl
+    assert ozoptics.get_device_info() == ("ODL650", "1")
+    assert ozoptics.get_serial() == "ODL000000"
+    assert ozoptics.get_mfg_date() == "2020-01-01"
+    assert ozoptics.echo(0) == "\r\nDone"
+    assert ozoptics.get_serial() == "ODL000000"
+    with pytest.raises(OdlCommandUnknownError):
+        ozoptics.serial_command("XYZ")
+
+
+def test_home_and_move(odl: tuple[OdlOzOptics, SimulatedOdlOzOptics]) -> None:
+    ozoptics, simulator = odl
+    with pytest.raises(OdlGetPosNotCompleted):
+        ozoptics.get_step()
+
+    start = time.perf_counter()
+    ozoptics.home()
+    # Homing from 100000 steps takes about 6.1 s at the stage's step rate
+    assert time.perf_counter() - start == pytest.approx(
+        100000 / SimulatedOdlOzOptics.steps_per_second / SPEEDUP, abs=0.03
+    )
+    assert ozoptics.get_step() == 0
+
+    ozoptics.move(10)
+    assert ozoptics.get_step() == int(10 * ozoptics.resolution)
+
+    # Commands sent during a move are answered after it
+    move = ozoptics.move_async(20)
+    assert ozoptics.get_step() == int(20 * ozoptics.resolution)
+    assert move.done()
+
+    # Beyond the end of travel the stage stops at the limit
+    ozoptics.move(150)
+    assert ozoptics.get_step() == simulator.position_limits[1]
+
+
+def test_continuous_motion(odl: tuple[OdlOzOptics, SimulatedOdlOzOptics]) -> None:
+    ozoptics, simulator = odl
+    ozoptics.home()
+    ozoptics.forward()
+    time.sleep(0.05)
+    ozoptics.stop()
+    position = ozoptics.get_step()
+    assert 0 < position < simulator.position_limits[1]
+    assert round(simulator.position()) == position
+
+    ozoptics.reverse()
+    time.sleep(0.05)
+    ozoptics.stop()
+    assert ozoptics.get_step() < position
+
+
+def test_serial_pacing() -> None:
+    pty = PtyTransport()
+    simulator = SimulatedOdlOzOptics(transport=pty, baudrate=9600)
+    simulator.open()
+    odl = OdlOzOptics(
+        transport=SerialTransport(
+            port=pty.peer_path, baudrate=9600, rtscts=False, startup_delay=0
+        )
+    )
+    start = time.perf_counter()
+    odl.get_serial()
+    elapsed_time = time.perf_counter() - start
+    odl.serial_close()
+    simulator.close()
+    # "V2\r\n" and "V2\r\nODL000000\r\nDone\r\n" are 27 bytes, 10 bits each
+    assert elapsed_time == pytest.approx(27 * 10 / 9600, abs=0.01)
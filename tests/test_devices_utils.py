@@ -1,4 +1,8 @@
+import threading
+import time
+
 from pnpq.devices import utils
+from pnpq.metrics import MetricsRegistry
 
 
 def test_get_available_port_no_available_ports() -> None:
@@ -7,3 +11,105 @@ def test_get_available_port_no_available_ports() -> None:
 
 def test_usb_hub_connected_no_hubs() -> None:
     assert not utils.check_usb_hub_connected()
+
+
+def test_single_flight_shares_concurrent_calls() -> None:
+    flight: utils.SingleFlight[str, int] = utils.SingleFlight()
+    release = threading.Event()
+    calls: list[str] = []
+
+    def call(key: str) -> int:
+        calls.append(key)
+        release.wait()
+        return len(calls)
+
+    results: list[tuple[int, bool]] = []
+    threads = [
+        threading.Thread(
+            target=lambda key=key: results.append(flight.do(key, lambda: call(key)))
+        )
+        for key in ("a", "a", "a", "b")
+    ]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert sorted(calls) == ["a", "b"]
+    assert sorted(shared for _, shared in results) == [False, False, True, True]
+    assert not flight.calls
+
+    # Later calls run again
+    assert flight.do("a", lambda: 0) == (0, False)
+
+
+def test_single_flight_shares_errors() -> None:
+    flight: utils.SingleFlight[str, None] = utils.SingleFlight()
+    release = threading.Event()
+    errors: list[Exception] = []
+
+    def fail() -> None:
+        release.wait()
+        raise RuntimeError("Device did not reply")
+
+    def run() -> None:
+        try:
+            flight.do("status", fail)
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert len(errors) == 2
+    assert errors[0] is errors[1]
+
+
+def test_device_operations_metrics() -> None:
+    metrics = MetricsRegistry()
+    operations = utils.DeviceOperations(
+        device="Rotator", connection="bench", metrics=metrics
+    )
+    release = threading.Event()
+
+    def home() -> str:
+        release.wait()
+        return "homed"
+
+    results: list[str] = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(operations.coalesce("home", None, home))
+        )
+        for _ in range(2)
+    ]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(timeout=5)
+    operations.observe("home", 0.5)
+    assert results == ["homed", "homed"]
+    labels = (("connection", "bench"), ("device", "Rotator"), ("operation", "home"))
+    snapshot = metrics.snapshot()
+    assert snapshot["pnpq_device_coalesced_operations_total"] == {labels: 1}
+    assert snapshot["pnpq_device_operation_duration_seconds_count"] == {labels: 1}
+
+
+def test_nearest_equivalent() -> None:
+    # From 359 to 1 degree, forward through 360
+    assert utils.nearest_equivalent(359, 1, 360) == 361
+    assert utils.nearest_equivalent(1, 359, 360) == -1
+    assert utils.nearest_equivalent(10, 100, 360) == 100
+    assert utils.nearest_equivalent(725, 0, 360) == 720
+    # A half-wave plate repeats every 180 degrees
+    assert utils.nearest_equivalent(10, 175, 180) == -5
+    # Half a period away either way goes forward
+    assert utils.nearest_equivalent(0, 180, 360) == 180
+    assert utils.nearest_equivalent(0, -180, 360) == 180
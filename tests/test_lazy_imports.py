@@ -0,0 +1,75 @@
+import subprocess
+import sys
+
+import pytest
+
+
+def run_python(code: str) -> str:
+    completed = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    return completed.stdout.strip()
+
+
+@pytest.mark.parametrize(
+    "module",
+    [
+        "pnpq",
+        "pnpq.apt.connection",
+        "pnpq.apt.fleet",
+        "pnpq.apt.protocol",
+        "pnpq.units",
+        "pnpq.devices",
+        "pnpq.devices.polarization_controller_thorlabs_mpc",
+        "pnpq.devices.refactored_odl_thorlabs_kbd101",
+        "pnpq.devices.refactored_waveplate_thorlabs_k10cr1",
+        "pnpq.ozoptics.connection",
+        "pnpq.ozoptics.simulator",
+    ],
+)
+def test_import_does_not_load_pint(module: str) -> None:
+    assert run_python(f"import sys, {module}; print('pint' in sys.modules)") == "False"
+
+
+def test_unit_registry_built_on_first_access() -> None:
+    output = run_python(
+        "import sys\n"
+        "from pnpq import units\n"
+        "print('pint' in sys.modules)\n"
+        "ureg = units.pnpq_ureg\n"
+        "print('pint' in sys.modules, ureg is units.pnpq_ureg)\n"
+        "print((1370 * ureg.mpc320_step).to('degree').magnitude)\n"
+    )
+    assert output.splitlines() == ["False", "True True", "170.0"]
+
+
+def test_devices_loaded_on_first_access() -> None:
+    output = run_python(
+        "import sys\n"
+        "import pnpq.devices\n"
+        "name = 'pnpq.devices.refactored_waveplate_thorlabs_k10cr1'\n"
+        "print(name in sys.modules)\n"
+        "cls = pnpq.devices.WaveplateThorlabsK10CR1\n"
+        "print(name in sys.modules, cls.__module__ == name)\n"
+    )
+    assert output.splitlines() == ["False", "True True"]
+
+
+def test_devices_unknown_attribute() -> None:
+    # pylint: disable=C0415
+    import pnpq.devices
+
+    with pytest.raises(AttributeError, match="no attribute 'NotADevice'"):
+        _ = pnpq.devices.NotADevice
+
+
+def test_devices_all() -> None:
+    # pylint: disable=C0415
+    import pnpq.devices
+
+    assert sorted(set(pnpq.devices.__all__)) == pnpq.devices.__all__
+    for name in pnpq.devices.__all__:
+        assert getattr(pnpq.devices, name).__name__ == name
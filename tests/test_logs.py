@@ -0,0 +1,224 @@
+import json
+import logging
+import threading
+import time
+from datetime import datetime
+from io import StringIO
+
+import pytest
+import structlog
+from structlog.typing import EventDict
+
+from pnpq.apt.protocol import (
+    Address,
+    AptMessage,
+    AptMessage_MGMSG_MOT_GET_USTATUSUPDATE,
+    AptMessage_MGMSG_MOT_MOVE_HOMED,
+    AptMessage_MGMSG_MOT_REQ_USTATUSUPDATE,
+    ChanIdent,
+    UStatus,
+)
+from pnpq.events import Event
+from pnpq.logs import QueueingHandler, StatusEventSampler, json_formatter
+from pnpq.units import pnpq_ureg
+
+
+class BlockingHandler(logging.StreamHandler[StringIO]):
+    """Writes records only after ``unblocked`` is set."""
+
+    def __init__(self) -> None:
+        super().__init__(StringIO())
+        self.unblocked = threading.Event()
+        self.setFormatter(json_formatter())
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.unblocked.wait()
+        super().emit(record)
+
+    def events(self) -> list[dict[str, object]]:
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+
+def structlog_record(event: str, **kwargs: object) -> logging.LogRecord:
+    """A record as produced by structlog.stdlib.ProcessorFormatter.wrap_for_formatter."""
+    return logging.makeLogRecord(
+        {
+            "levelno": logging.DEBUG,
+            "levelname": "DEBUG",
+            "msg": {"event": event, **kwargs},
+            "_logger": structlog.get_logger(),
+            "_name": "debug",
+        }
+    )
+
+
+def test_records_written_in_background() -> None:
+    handler = BlockingHandler()
+    queueing_handler = QueueingHandler(handler)
+    # emit returns even though the handler cannot write yet
+    queueing_handler.emit(structlog_record("first", value=1))
+    queueing_handler.emit(structlog_record("second", value=2))
+    assert not handler.events()
+    handler.unblocked.set()
+    queueing_handler.flush()
+    assert [(event["event"], event["value"]) for event in handler.events()] == [
+        ("first", 1),
+        ("second", 2),
+    ]
+    queueing_handler.close()
+
+
+def test_timestamp_is_event_time() -> None:
+    handler = BlockingHandler()
+    queueing_handler = QueueingHandler(handler)
+    before = time.time()
+    queueing_handler.emit(structlog_record("event"))
+    after = time.time()
+    # The worker is blocked, so the record is formatted well after it
+    # was logged
+    time.sleep(0.2)
+    handler.unblocked.set()
+    queueing_handler.close()
+    (event,) = handler.events()
+    timestamp = datetime.fromisoformat(str(event["timestamp"])).timestamp()
+    assert before <= timestamp <= after
+
+
+def test_full_queue_drops_records() -> None:
+    handler = BlockingHandler()
+    queueing_handler = QueueingHandler(handler, max_queue_size=2)
+    for i in range(10):
+        queueing_handler.emit(structlog_record("event", value=i))
+    # The worker thread may or may not have taken the first record
+    # off the queue before it blocked
+    assert queueing_handler.dropped in (7, 8)
+    handler.unblocked.set()
+    queueing_handler.close()
+
+    events = handler.events()
+    written = [event["value"] for event in events if event["event"] == "event"]
+    assert written == list(range(10 - queueing_handler.dropped))
+    assert [
+        event["total_dropped"]
+        for event in events
+        if event["event"] == Event.LOG_EVENTS_DROPPED
+    ] == [queueing_handler.dropped]
+
+
+def test_close_writes_queued_records() -> None:
+    handler = BlockingHandler()
+    queueing_handler = QueueingHandler(handler)
+    for i in range(100):
+        queueing_handler.emit(structlog_record("event", value=i))
+    handler.unblocked.set()
+    queueing_handler.close()
+    assert len(handler.events()) == 100
+    # Closing twice, as logging.shutdown may do, is harmless
+    queueing_handler.close()
+
+
+def ustatus_update(position: int, status: UStatus) -> AptMessage:
+    return AptMessage_MGMSG_MOT_GET_USTATUSUPDATE(
+        chan_ident=ChanIdent.CHANNEL_1,
+        position=position,
+        velocity=0,
+        motor_current=0 * pnpq_ureg.milliamp,
+        status=status,
+        destination=Address.HOST_CONTROLLER,
+        source=Address.GENERIC_USB,
+    )
+
+
+def sample(
+    sampler: StatusEventSampler, event: str, message: AptMessage
+) -> None | EventDict:
+    try:
+        return sampler(None, "debug", {"event": event, "message": message})
+    except structlog.DropEvent:
+        return None
+
+
+def test_sampler_passes_other_events() -> None:
+    sampler = StatusEventSampler()
+    message = AptMessage_MGMSG_MOT_MOVE_HOMED(
+        chan_ident=ChanIdent.CHANNEL_1,
+        destination=Address.HOST_CONTROLLER,
+        source=Address.GENERIC_USB,
+    )
+    for _ in range(3):
+        assert sample(sampler, Event.RX_MESSAGE_KNOWN, message) == {
+            "event": Event.RX_MESSAGE_KNOWN,
+            "message": message,
+        }
+    status_request = AptMessage_MGMSG_MOT_REQ_USTATUSUPDATE(
+        chan_ident=ChanIdent.CHANNEL_1,
+        destination=Address.GENERIC_USB,
+        source=Address.HOST_CONTROLLER,
+    )
+    for _ in range(3):
+        assert sample(sampler, Event.TX_MESSAGE_DROPPED, status_request) is not None
+
+
+def test_sampler_summarizes_repeated_requests(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    sampler = StatusEventSampler(intervals={Event.TX_MESSAGE_UNORDERED: 10})
+    requests = {
+        chan_ident: AptMessage_MGMSG_MOT_REQ_USTATUSUPDATE(
+            chan_ident=chan_ident,
+            destination=Address.GENERIC_USB,
+            source=Address.HOST_CONTROLLER,
+        )
+        for chan_ident in (ChanIdent.CHANNEL_1, ChanIdent.CHANNEL_2)
+    }
+    logged = []
+    for _ in range(12):
+        for request in requests.values():
+            logged.append(sample(sampler, Event.TX_MESSAGE_UNORDERED, request))
+        now[0] += 1
+    # One request per channel at the start and after 10 seconds
+    assert [event for event in logged if event is not None] == [
+        {"event": Event.TX_MESSAGE_UNORDERED, "message": requests[ChanIdent.CHANNEL_1]},
+        {"event": Event.TX_MESSAGE_UNORDERED, "message": requests[ChanIdent.CHANNEL_2]},
+        {
+            "event": Event.TX_MESSAGE_UNORDERED,
+            "message": requests[ChanIdent.CHANNEL_1],
+            "suppressed": 9,
+        },
+        {
+            "event": Event.TX_MESSAGE_UNORDERED,
+            "message": requests[ChanIdent.CHANNEL_2],
+            "suppressed": 9,
+        },
+    ]
+
+
+def test_sampler_logs_state_changes() -> None:
+    sampler = StatusEventSampler()
+    idle = UStatus(CONNECTED=True, ENABLED=True)
+    moving = UStatus(CONNECTED=True, ENABLED=True, ACTIVE=True)
+    assert sample(sampler, Event.RX_MESSAGE_KNOWN, ustatus_update(0, idle))
+    assert sample(sampler, Event.RX_MESSAGE_KNOWN, ustatus_update(0, idle)) is None
+    start_move = ustatus_update(0, moving)
+    assert sample(sampler, Event.RX_MESSAGE_KNOWN, start_move) == {
+        "event": Event.RX_MESSAGE_KNOWN,
+        "message": start_move,
+        "suppressed": 1,
+        "suppressed_min_position": 0,
+        "suppressed_max_position": 0,
+    }
+    for position in (300, 100, 200):
+        assert (
+            sample(sampler, Event.RX_MESSAGE_KNOWN, ustatus_update(position, moving))
+            is None
+        )
+    end_move = ustatus_update(400, idle)
+    assert sample(sampler, Event.RX_MESSAGE_KNOWN, end_move) == {
+        "event": Event.RX_MESSAGE_KNOWN,
+        "message": end_move,
+        "suppressed": 3,
+        "suppressed_min_position": 100,
+        "suppressed_max_position": 300,
+    }
@@ -0,0 +1,134 @@
+import urllib.request
+from pathlib import Path
+
+import pytest
+
+from pnpq.apt.connection import AptConnection
+from pnpq.apt.protocol import (
+    Address,
+    AptMessage_MGMSG_HW_GET_INFO,
+    AptMessage_MGMSG_HW_REQ_INFO,
+)
+from pnpq.apt.simulator import SimulatedMPC320
+from pnpq.metrics import MetricsRegistry
+from pnpq.transport import loopback_transport_pair
+
+
+def test_counter_and_gauge() -> None:
+    registry = MetricsRegistry()
+    counter = registry.counter("requests_total", "Requests")
+    counter.inc(device="a")
+    counter.inc(2, device="a")
+    counter.inc(device="b")
+    gauge = registry.gauge("depth", "Queue depth")
+    gauge.set(5)
+    gauge.inc(-2)
+    assert registry.snapshot() == {
+        "requests_total": {(("device", "a"),): 3, (("device", "b"),): 1},
+        "depth": {(): 3},
+    }
+    # Registering again returns the same metric
+    assert registry.counter("requests_total", "Requests") is counter
+    with pytest.raises(TypeError):
+        registry.gauge("requests_total", "Requests")
+
+
+def test_histogram() -> None:
+    registry = MetricsRegistry()
+    histogram = registry.histogram("latency_seconds", "Latency")
+    for value in (0.001, 0.003, 0.2, 100):
+        histogram.observe(value, operation="move")
+    snapshot = registry.snapshot()
+    buckets = {
+        dict(labels)["le"]: count
+        for labels, count in snapshot["latency_seconds_bucket"].items()
+    }
+    assert buckets["0.001"] == 1
+    assert buckets["0.0025"] == 1
+    assert buckets["0.005"] == 2
+    assert buckets["0.25"] == 3
+    assert buckets["60"] == 3
+    assert buckets["+Inf"] == 4
+    assert snapshot["latency_seconds_count"] == {(("operation", "move"),): 4}
+    assert snapshot["latency_seconds_sum"][(("operation", "move"),)] == pytest.approx(
+        100.204
+    )
+
+
+def test_prometheus_format(tmp_path: Path) -> None:
+    registry = MetricsRegistry()
+    registry.counter("messages_total", "Messages sent").inc(
+        connection='a "quoted" name'
+    )
+    registry.histogram("latency_seconds", "Latency").observe(0.5)
+    text = registry.to_prometheus()
+    lines = text.splitlines()
+    assert lines[:2] == [
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+    ]
+    assert 'latency_seconds_bucket{le="0.25"} 0' in lines
+    assert 'latency_seconds_bucket{le="0.5"} 1' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 1' in lines
+    assert "latency_seconds_sum 0.5" in lines
+    assert "latency_seconds_count 1" in lines
+    assert lines[-3:] == [
+        "# HELP messages_total Messages sent",
+        "# TYPE messages_total counter",
+        'messages_total{connection="a \\"quoted\\" name"} 1',
+    ]
+
+    path = tmp_path.joinpath("pnpq.prom")
+    registry.write_prometheus(path)
+    assert path.read_text(encoding="utf-8") == text
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_serve_prometheus() -> None:
+    registry = MetricsRegistry()
+    registry.gauge("depth", "Queue depth").set(7)
+    server = registry.serve_prometheus(0)
+    try:
+        port = server.server_address[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            body = response.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert body == registry.to_prometheus()
+
+
+def test_connection_metrics() -> None:
+    registry = MetricsRegistry()
+    host, device = loopback_transport_pair()
+    simulator = SimulatedMPC320(transport=device)
+    simulator.open()
+    connection = AptConnection(transport=host, metrics=registry, name="mpc320")
+    connection.open()
+    for _ in range(3):
+        connection.send_message_expect_reply(
+            AptMessage_MGMSG_HW_REQ_INFO(
+                destination=Address.GENERIC_USB,
+                source=Address.HOST_CONTROLLER,
+            ),
+            lambda message: isinstance(message, AptMessage_MGMSG_HW_GET_INFO),
+        )
+    connection.close()
+    simulator.close()
+
+    snapshot = registry.snapshot()
+    labels = (("connection", "mpc320"), ("message", "MGMSG_HW_REQ_INFO"))
+    # One more request is sent when the connection is opened
+    assert snapshot["pnpq_apt_tx_messages_total"][labels] == 4
+    assert snapshot["pnpq_apt_request_duration_seconds_count"][labels] == 3
+    assert (
+        snapshot["pnpq_apt_rx_messages_total"][
+            (("connection", "mpc320"), ("message", "MGMSG_HW_GET_INFO"))
+        ]
+        == 4
+    )
+    assert snapshot["pnpq_apt_tx_bytes_total"][(("connection", "mpc320"),)] >= 4 * 6
+    assert snapshot["pnpq_apt_rx_bytes_total"][(("connection", "mpc320"),)] == 4 * (
+        6 + AptMessage_MGMSG_HW_GET_INFO.data_length
+    )
+    assert snapshot["pnpq_apt_tx_queue_depth"][(("connection", "mpc320"),)] == 0
@@ -1,8 +1,148 @@
+import threading
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+
 import pytest
+import serial.tools.list_ports
+from serial import Serial
 
 from pnpq.devices.odl_ozoptics_650ml import OdlOzOptics
+from pnpq.errors import OdlGetPosNotCompleted
+from pnpq.ozoptics.simulator import SimulatedOdlOzOptics
+from pnpq.transport import LoopbackTransport, PtyTransport, loopback_transport_pair
 
 
 def test_disconnected_initialization() -> None:
     with pytest.raises(RuntimeError):
         OdlOzOptics("ABC", "DEF")
+
+
+def test_reconnect_by_serial_number(monkeypatch: pytest.MonkeyPatch) -> None:
+    pty = PtyTransport()
+    simulator = SimulatedOdlOzOptics(transport=pty, baudrate=None)
+    simulator.open()
+    port = SimpleNamespace(device=pty.peer_path, serial_number="ODL000000")
+    monkeypatch.setattr(serial.tools.list_ports, "comports", lambda: [port])
+    odl = OdlOzOptics(serial_number="ODL000000")
+    assert odl.get_serial() == "ODL000000"
+    odl.serial_close()
+    # A new transport is opened on the same port
+    odl.connect()
+    assert odl.get_serial() == "ODL000000"
+    odl.serial_close()
+    simulator.close()
+
+
+def test_reconnect_with_transport() -> None:
+    transport, _ = loopback_transport_pair()
+    odl = OdlOzOptics(transport=transport)
+    assert odl.name == "Optical Delay Line"
+    odl.serial_close()
+    with pytest.raises(RuntimeError, match="Cannot reconnect"):
+        odl.connect()
+
+
+@pytest.fixture(name="odl")
+def odl_fixture() -> Iterator[tuple[OdlOzOptics, LoopbackTransport]]:
+    transport, peer = loopback_transport_pair()
+    odl = OdlOzOptics(transport=transport)
+    yield odl, peer
+    odl.serial_close()
+
+
+def read_line(peer: LoopbackTransport) -> bytes:
+    line = b""
+    while not line.endswith(b"\r\n"):
+        line += peer.read(1)
+    return line
+
+
+def test_get_step_during_move(odl: tuple[OdlOzOptics, LoopbackTransport]) -> None:
+    ozoptics, peer = odl
+    move = ozoptics.move_async(10)
+    assert read_line(peer) == f"S{int(10 * ozoptics.resolution)}\r\n".encode()
+
+    def respond() -> None:
+        assert read_line(peer) == b"S?\r\n"
+        assert not move.done()
+        # The move finishes before the ODL answers the query
+        peer.write(b"Done\r\nPos:64503\r\nDone\r\n")
+
+    responder = threading.Thread(target=respond)
+    responder.start()
+    assert ozoptics.get_step() == 64503
+    responder.join()
+    assert move.result(5).text == "Done"
+
+
+def test_get_step_before_home(odl: tuple[OdlOzOptics, LoopbackTransport]) -> None:
+    ozoptics, peer = odl
+    peer.write(b"UNKNOWN\r\nDone\r\n")
+    with pytest.raises(OdlGetPosNotCompleted):
+        ozoptics.get_step()
+
+
+def test_readall(odl: tuple[OdlOzOptics, LoopbackTransport]) -> None:
+    ozoptics, peer = odl
+    peer.write(b"OZ Optics Ltd\r\n")
+    output = ""
+    while len(output) < 15:
+        ok, msg = ozoptics.readall()
+        assert ok
+        output += msg
+    assert output == "OZ Optics Ltd\r\n"
+
+
+def test_read_key(odl: tuple[OdlOzOptics, LoopbackTransport]) -> None:
+    ozoptics, peer = odl
+    peer.write(b"OZ Optics Ltd\r\nRe")
+    threading.Timer(0.01, lambda: peer.write(b"ady\r\n")).start()
+    assert ozoptics.read_key("Ready", retries=100) == "OZ Optics Ltd\r\nReady\r\n"
+    assert ozoptics.read_key("Ready", retries=1) == ""
+
+
+@dataclass(frozen=True, kw_only=True)
+class CountingPtyTransport(PtyTransport):
+    reads: list[int] = field(default_factory=list)
+
+    def receive(self, size: int) -> bytes:
+        data = super().receive(size)
+        self.reads.append(len(data))
+        return data
+
+
+# A device information dump as long as a full parameter listing
+INFO_DUMP = b"".join(f"Parameter {i:03}: {i * 37:08}\r\n".encode() for i in range(200))
+
+
+def respond_to_info(peer: Serial, count: int) -> None:
+    """Answer ``count`` V1 commands with a long dump, as an ODL would,
+    then print it once more without being asked."""
+    for _ in range(count):
+        assert peer.read_until(b"\r\n") == b"V1\r\n"
+        peer.write(b"\r\nODL650V1_0\r\n" + INFO_DUMP + b"Done\r\n")
+    peer.write(INFO_DUMP + b"Ready\r\n")
+
+
+def test_long_output_bulk_reads() -> None:
+    transport = CountingPtyTransport()
+    ozoptics = OdlOzOptics(transport=transport)
+    count = 20
+    with Serial(port=transport.peer_path, timeout=5) as peer:
+        responder = threading.Thread(target=respond_to_info, args=(peer, count))
+        responder.start()
+        start = time.perf_counter()
+        for _ in range(count):
+            assert ozoptics.get_device_info() == ("ODL650", "1")
+        output = ozoptics.read_key("Ready", retries=100)
+        elapsed_time = time.perf_counter() - start
+        responder.join()
+    ozoptics.serial_close()
+
+    assert output == (INFO_DUMP + b"Ready\r\n").decode()
+    size = (count + 1) * len(INFO_DUMP)
+    # Reading byte by byte would take one read per byte
+    assert len(transport.reads) < size / 100
+    assert elapsed_time < 2
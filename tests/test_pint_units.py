@@ -41,9 +41,9 @@ def test_angle_to_mpc320_step_conversion(
 @pytest.mark.parametrize(
     "test_k10cr1_step, expected_angle",
     [
-        (-136533, -1),
+        (-6144000, -45),
         (0, 0),
-        (136533, 1),
+        (49152000, 360),
     ],
 )
 def test_k10cr1_step_to_angle_conversion(
@@ -72,6 +72,46 @@ def test_angle_to_k10cr1_step_conversion(
     assert isinstance(k10cr1_step, int)
 
 
+@pytest.mark.parametrize(
+    "angular_velocity, k10cr1_velocity",
+    [
+        (20 * pnpq_ureg("degree / second"), 146582180),
+        (0.349065850399 * pnpq_ureg("radian / second"), 146582180),
+        (1 * pnpq_ureg("degree / second"), 7329109),
+    ],
+)
+def test_to_k10cr1_velocity_conversion(
+    angular_velocity: Quantity, k10cr1_velocity: int
+) -> None:
+    assert angular_velocity.to("k10cr1_velocity").magnitude == k10cr1_velocity
+    assert (k10cr1_velocity * pnpq_ureg.k10cr1_velocity).to(
+        "degree / second"
+    ).magnitude == pytest.approx(angular_velocity.to("degree / second").magnitude)
+
+
+@pytest.mark.parametrize(
+    "position, kbd101_step",
+    [
+        (1 * pnpq_ureg.millimeter, 2000),
+        (1 * pnpq_ureg.centimeter, 20000),
+        # Light reflected back along the stage is delayed by twice the
+        # distance moved
+        (1 * pnpq_ureg.picosecond, 300),
+        (1 * pnpq_ureg.nanosecond, 299792),
+    ],
+)
+def test_to_kbd101_step_conversion(position: Quantity, kbd101_step: int) -> None:
+    converted = position.to("kbd101_step").magnitude
+    assert converted == kbd101_step
+    assert isinstance(converted, int)
+
+
+def test_from_kbd101_step_conversion() -> None:
+    position = 200000 * pnpq_ureg.kbd101_step
+    assert position.to("millimeter").magnitude == 100
+    assert position.to("picosecond").magnitude == pytest.approx(667.128, abs=1e-3)
+
+
 # Test that [angle] / second quantities accurately convert into mpc320_velocity quantities
 @pytest.mark.parametrize(
     "angular_velocity, mpc320_velocity",
@@ -11,9 +11,11 @@ from pnpq.apt.protocol import (
     UStatus,
     UStatusBits,
 )
+from pnpq.apt.subscription import MessageFilter
 from pnpq.devices.polarization_controller_thorlabs_mpc import (
     PolarizationControllerThorlabsMPC320,
 )
+from pnpq.metrics import MetricsRegistry
 from pnpq.units import pnpq_ureg
 
 
@@ -29,6 +31,7 @@ def test_move_absolute() -> None:
             ],
             bool,
         ],
+        reply_filter: None | MessageFilter = None,
     ) -> None:
         if isinstance(sent_message, AptMessage_MGMSG_MOT_MOVE_ABSOLUTE):
 
@@ -47,10 +50,17 @@ def test_move_absolute() -> None:
             )
 
             assert match_reply_callback(reply_message)
+            assert reply_filter is not None
+            assert reply_filter.matches(reply_message)
 
     connection.send_message_expect_reply.side_effect = mock_send_message_expect_reply
     connection.tx_ordered_sender_awaiting_reply = Mock()
     connection.tx_ordered_sender_awaiting_reply.is_set = Mock(return_value=True)
+    # Instance fields, which autospec does not see
+    connection.stop_event = Mock()
+    connection.metrics = MetricsRegistry()
+    connection.label = "test"
+    connection.motor_channels = set()
 
     controller = PolarizationControllerThorlabsMPC320(connection=connection)
 
@@ -58,3 +68,13 @@ def test_move_absolute() -> None:
 
     # Two calls for enabling and disabling the channel, one call for moving the motor
     assert connection.send_message_expect_reply.call_count == 3
+
+    assert connection.metrics.snapshot()[
+        "pnpq_device_operation_duration_seconds_count"
+    ] == {
+        (
+            ("connection", "test"),
+            ("device", "PolarizationControllerThorlabsMPC320"),
+            ("operation", "move_absolute"),
+        ): 1
+    }
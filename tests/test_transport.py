@@ -0,0 +1,260 @@
+import socket
+import threading
+import time
+from collections.abc import Iterator
+from unittest.mock import Mock, patch
+
+import pytest
+from serial import Serial, SerialException
+
+from pnpq.errors import TransportClosedError
+from pnpq.transport import (
+    PtyTransport,
+    SerialTransport,
+    TcpTransport,
+    Transport,
+    loopback_transport_pair,
+)
+
+
+def assert_read_unblocked_by_close(transport: Transport, delay: float = 0) -> None:
+    errors: list[Exception] = []
+
+    def reader() -> None:
+        try:
+            transport.read(6)
+        except TransportClosedError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    # Give the reader time to block first
+    time.sleep(delay)
+    transport.close()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert len(errors) == 1
+
+
+def test_loopback_round_trip() -> None:
+    a, b = loopback_transport_pair()
+    a.open()
+    b.open()
+    a.write(b"\x01\x02\x03")
+    a.write(b"\x04")
+    assert b.read(2) == b"\x01\x02"
+    assert b.read(2) == b"\x03\x04"
+    b.write(b"\x05")
+    assert a.read(1) == b"\x05"
+
+
+def test_loopback_read_available() -> None:
+    a, b = loopback_transport_pair()
+    a.write(b"\x01\x02")
+    a.write(b"\x03")
+    assert b.read_available(2) == b"\x01\x02"
+    assert b.read_available(4096) == b"\x03"
+    a.close()
+    with pytest.raises(TransportClosedError):
+        b.read_available(1)
+
+
+def test_loopback_reset_input_buffer() -> None:
+    a, b = loopback_transport_pair()
+    a.write(b"stale")
+    b.reset_input_buffer()
+    a.write(b"new")
+    assert b.read(3) == b"new"
+
+
+def test_loopback_close_unblocks_read() -> None:
+    a, _ = loopback_transport_pair()
+    assert_read_unblocked_by_close(a)
+
+
+def test_loopback_peer_close() -> None:
+    a, b = loopback_transport_pair()
+    a.write(b"\x01")
+    a.close()
+    with pytest.raises(TransportClosedError):
+        b.read(2)
+    with pytest.raises(TransportClosedError):
+        b.write(b"\x02")
+
+
+@pytest.fixture(name="tcp_pair")
+def tcp_pair_fixture() -> Iterator[tuple[TcpTransport, socket.socket]]:
+    with socket.create_server(("127.0.0.1", 0)) as server:
+        transport = TcpTransport(host="127.0.0.1", port=server.getsockname()[1])
+        transport.open()
+        peer, _ = server.accept()
+        with peer:
+            yield transport, peer
+
+
+def test_tcp_round_trip(tcp_pair: tuple[TcpTransport, socket.socket]) -> None:
+    transport, peer = tcp_pair
+    transport.write(b"\x11\x22")
+    assert peer.recv(2) == b"\x11\x22"
+    peer.sendall(b"\x33")
+    peer.sendall(b"\x44\x55")
+    assert transport.read(3) == b"\x33\x44\x55"
+    transport.close()
+
+
+def test_tcp_read_available(tcp_pair: tuple[TcpTransport, socket.socket]) -> None:
+    transport, peer = tcp_pair
+    peer.sendall(b"\x33\x44\x55")
+    transport.wait_readable(5)
+    assert transport.read_available(2) == b"\x33\x44"
+    assert transport.read_available(4096) == b"\x55"
+    transport.close()
+
+
+def test_tcp_reset_input_buffer(tcp_pair: tuple[TcpTransport, socket.socket]) -> None:
+    transport, peer = tcp_pair
+    peer.sendall(b"stale")
+    # Make sure the data has arrived before discarding it
+    transport.wait_readable(5)
+    transport.reset_input_buffer()
+    peer.sendall(b"new")
+    assert transport.read(3) == b"new"
+    transport.close()
+
+
+def test_tcp_close_unblocks_read(tcp_pair: tuple[TcpTransport, socket.socket]) -> None:
+    transport, _ = tcp_pair
+    assert_read_unblocked_by_close(transport)
+
+
+def test_tcp_peer_close(tcp_pair: tuple[TcpTransport, socket.socket]) -> None:
+    transport, peer = tcp_pair
+    peer.close()
+    with pytest.raises(TransportClosedError):
+        transport.read(1)
+    transport.close()
+
+
+def test_tcp_reopen() -> None:
+    with socket.create_server(("127.0.0.1", 0)) as server:
+        transport = TcpTransport(host="127.0.0.1", port=server.getsockname()[1])
+        transport.open()
+        peer, _ = server.accept()
+        peer.close()
+        transport.close()
+        transport.open()
+        peer, _ = server.accept()
+        with peer:
+            peer.sendall(b"\x33")
+            assert transport.read(1) == b"\x33"
+            transport.write(b"\x11")
+            assert peer.recv(1) == b"\x11"
+        transport.close()
+
+
+def test_pty_round_trip() -> None:
+    transport = PtyTransport()
+    transport.open()
+    with Serial(port=transport.peer_path, timeout=5) as peer:
+        transport.write(b"\x00\x0a\x0d\xff")
+        assert peer.read(4) == b"\x00\x0a\x0d\xff"
+        peer.write(b"\x0d\x0a\x03")
+        assert transport.read(3) == b"\x0d\x0a\x03"
+    transport.close()
+
+
+def test_pty_close_unblocks_read() -> None:
+    transport = PtyTransport()
+    transport.open()
+    assert_read_unblocked_by_close(transport)
+
+
+def test_serial_close_unblocks_read() -> None:
+    pty = PtyTransport()
+    pty.open()
+    transport = SerialTransport(port=pty.peer_path, startup_delay=0)
+    transport.open()
+    assert_read_unblocked_by_close(transport, delay=0.1)
+    pty.close()
+
+
+def test_serial_read_errors_after_close() -> None:
+    transport = SerialTransport(port="/dev/ttyUSB0")
+    connection = Mock(is_open=True)
+    connection.read.side_effect = SerialException("device reports readiness")
+    object.__setattr__(transport, "connection", connection)
+    # Errors while the port is open are not hidden
+    with pytest.raises(SerialException):
+        transport.read(1)
+
+    def close_during_read(_: int) -> bytes:
+        connection.is_open = False
+        raise TypeError("'NoneType' object cannot be interpreted as an integer")
+
+    connection.read.side_effect = close_during_read
+    with pytest.raises(TransportClosedError):
+        transport.read(1)
+
+
+def test_serial_requires_serial_number_or_port() -> None:
+    with pytest.raises(ValueError):
+        SerialTransport()
+    with pytest.raises(ValueError):
+        SerialTransport(serial_number="1234", port="/dev/ttyUSB0")
+
+
+def test_serial_find_port_by_serial_number() -> None:
+    other_port = Mock(serial_number="5678", device="/dev/ttyUSB0")
+    port = Mock(serial_number="1234", device="/dev/ttyUSB1")
+    with patch("serial.tools.list_ports.comports", return_value=[other_port, port]):
+        assert SerialTransport(serial_number="1234").find_port() == "/dev/ttyUSB1"
+        with pytest.raises(ValueError, match="could not be found"):
+            SerialTransport(serial_number="9999").find_port()
+
+
+def test_serial_read_available() -> None:
+    transport = SerialTransport(port="/dev/ttyUSB0")
+    connection = Mock(is_open=True, in_waiting=5)
+    connection.read.side_effect = [b"\x01", b"\x02\x03\x04"]
+    object.__setattr__(transport, "connection", connection)
+    # Everything waiting after the first byte, up to the size asked for
+    assert transport.read_available(4) == b"\x01\x02\x03\x04"
+    assert [c.args for c in connection.read.call_args_list] == [(1,), (3,)]
+
+
+def test_read_available_of_nothing() -> None:
+    transport = SerialTransport(port="/dev/ttyUSB0")
+    with pytest.raises(ValueError):
+        transport.read_available(0)
+
+
+def test_serial_read_available_with_timeout() -> None:
+    pty = PtyTransport()
+    pty.open()
+    transport = SerialTransport(port=pty.peer_path, timeout=0, startup_delay=0)
+    transport.open()
+    reads = Mock(wraps=transport.connection.read)
+    transport.connection.read = reads  # type: ignore[method-assign]
+    try:
+        # The port's timeout passes several times before data arrives
+        threading.Timer(0.3, lambda: pty.write(b"\x01\x02")).start()
+        data = transport.read_available(4)
+        assert data and b"\x01\x02".startswith(data)
+        # It waits for input between reads instead of spinning
+        assert reads.call_count < 10
+    finally:
+        transport.close()
+        pty.close()
+
+
+def test_serial_close_wakes_read_available_with_timeout() -> None:
+    pty = PtyTransport()
+    pty.open()
+    transport = SerialTransport(port=pty.peer_path, timeout=0, startup_delay=0)
+    transport.open()
+    try:
+        threading.Timer(0.2, transport.close).start()
+        with pytest.raises(TransportClosedError):
+            transport.read_available(4)
+    finally:
+        pty.close()
@@ -1,7 +1,7 @@
 from typing import Callable
 from unittest.mock import Mock, create_autospec
 
-from pnpq.apt.connection import AptConnection
+from pnpq.apt.connection import REPLY_TIMEOUT, AptConnection
 from pnpq.apt.protocol import (
     Address,
     AptMessage,
@@ -10,7 +10,10 @@ from pnpq.apt.protocol import (
     ChanIdent,
     UStatus,
 )
+from pnpq.apt.settle import SettlePolicy
+from pnpq.apt.subscription import MessageFilter
 from pnpq.devices.refactored_waveplate_thorlabs_k10cr1 import WaveplateThorlabsK10CR1
+from pnpq.metrics import MetricsRegistry
 from pnpq.units import pnpq_ureg
 
 
@@ -25,8 +28,12 @@ def test_move_absolute() -> None:
             ],
             bool,
         ],
+        reply_filter: None | MessageFilter = None,
+        reply_timeout: float = REPLY_TIMEOUT,
     ) -> None:
         if isinstance(sent_message, AptMessage_MGMSG_MOT_MOVE_ABSOLUTE):
+            # Moves may take longer than other requests
+            assert reply_timeout > REPLY_TIMEOUT
 
             assert sent_message.absolute_distance == 10
             assert sent_message.chan_ident == ChanIdent(1)
@@ -43,14 +50,33 @@ def test_move_absolute() -> None:
             )
 
             assert match_reply_callback(reply_message)
+            assert reply_filter is not None
+            assert reply_filter.matches(reply_message)
 
     connection.send_message_expect_reply.side_effect = mock_send_message_expect_reply
     connection.tx_ordered_sender_awaiting_reply = Mock()
     connection.tx_ordered_sender_awaiting_reply.is_set = Mock(return_value=True)
+    # Instance fields, which autospec does not see
+    connection.stop_event = Mock()
+    connection.metrics = MetricsRegistry()
+    connection.label = "test"
+    connection.motor_channels = set()
+    connection.settle_policy = SettlePolicy()
 
     controller = WaveplateThorlabsK10CR1(connection=connection)
 
-    controller.move_absolute(10 * pnpq_ureg.k10cr1_step)
+    # Straight to the position, without first reading the current one
+    controller.move_absolute(10 * pnpq_ureg.k10cr1_step, shortest_path=False)
 
     # One call for moving the motor. Enabling and disabling the channel doesn't use an expect reply in K10CR1
     assert connection.send_message_expect_reply.call_count == 1
+
+    assert connection.metrics.snapshot()[
+        "pnpq_device_operation_duration_seconds_count"
+    ] == {
+        (
+            ("connection", "test"),
+            ("device", "WaveplateThorlabsK10CR1"),
+            ("operation", "move_absolute"),
+        ): 1
+    }
@@ -1,9 +1,59 @@
+import time
+
 import pytest
 
+from pnpq.apt.protocol import ChanIdent
+from pnpq.apt.simulator import SimulatedK10CR1
 from pnpq.devices.waveplate_thorlabs_kb10crm import Waveplate
-from pnpq.errors import DevicePortNotFoundError
+from pnpq.errors import (
+    DeviceDisconnectedError,
+    DevicePortNotFoundError,
+    WaveplateInvalidDegreeError,
+)
+from pnpq.transport import PtyTransport
 
 
 def test_disconnected_initialization() -> None:
     with pytest.raises(DevicePortNotFoundError):
         Waveplate("ABC", "DEF")
+
+
+def test_commands_over_pty() -> None:
+    transport = PtyTransport()
+    simulator = SimulatedK10CR1(transport=transport, speedup=100)
+    simulator.open()
+    waveplate = Waveplate(serial_port=transport.peer_path)
+    with pytest.raises(DeviceDisconnectedError):
+        waveplate.rotate(10)
+    start = time.perf_counter()
+    waveplate.connect()
+    # Without waiting for the device to start up
+    assert time.perf_counter() - start < 1
+    waveplate.enable_channel(0)
+    # Commands are sent in order, so updates were stopped by now
+    assert not simulator.updates_enabled.is_set()
+    waveplate.auto_update_start()
+    waveplate.getpos()
+    assert simulator.updates_enabled.is_set()
+    waveplate.auto_update_stop()
+    waveplate.getpos()
+    assert not simulator.updates_enabled.is_set()
+    waveplate.rotate(45)
+    assert waveplate.getpos() == 45 * 136533
+    # Moves leave the channel enabled
+    assert simulator.channels[ChanIdent.CHANNEL_1].enabled
+    waveplate.step_backward(136533)
+    waveplate.rotate_relative(10)
+    assert simulator.position(ChanIdent.CHANNEL_1) == 54 * 136533
+    with pytest.raises(WaveplateInvalidDegreeError):
+        waveplate.rotate(400)
+    waveplate.custom_home(30)
+    waveplate.custom_rotate(5)
+    assert waveplate.getpos() == 35 * 136533
+    waveplate.disable_channel(0)
+    # Commands are sent in order, so the channel is disabled by the
+    # time the position is read
+    waveplate.getpos()
+    assert not simulator.channels[ChanIdent.CHANNEL_1].enabled
+    waveplate.disconnect()
+    simulator.close()